@@ -0,0 +1,293 @@
+"""
+Archive Store Module
+Append-only, deduplicating archive for old clips.
+
+Layout under ``<data_path>/archive``:
+- ``packs/YYYY-MM-DD.pack``: concatenated clip segments recorded that day
+- ``index.jsonl``: one JSON line per archived file with its pack, offset,
+  length and SHA-256
+
+Archiving only touches clips that are not in the index yet, so a run costs
+time in proportion to the new footage. Archived clips keep their catalog row,
+whose file column is repointed to ``archive:<key>`` (see ``archive_ref``). Segments with a hash already present
+are not stored twice, and any single clip can be read back directly from its
+pack using the offset and length in the index.
+
+Deleting an archived clip (retention) appends a ``removed`` line for its key;
+a pack is deleted once none of the segments left in the index use it. The API
+never exposes the ``archive:`` value itself: ``playable_path`` turns it into
+the URL that streams the clip from its pack.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional, Set
+
+logger = logging.getLogger('archive_store')
+
+PACKS_DIR_NAME = "packs"
+INDEX_NAME = "index.jsonl"
+READ_BUFFER_SIZE = 4 * 1024 * 1024
+# Prefijo de las rutas del catálogo que apuntan a un segmento archivado
+ARCHIVE_REF_PREFIX = "archive:"
+# URL con la que la API expone un clip archivado (redirige a /api/storage/archive/clips)
+ARCHIVE_URL_PREFIX = "/api/videos/archive"
+
+
+def archive_ref(key: str) -> str:
+    """Value stored in a video_clips file column once the file lives in the archive"""
+    return f"{ARCHIVE_REF_PREFIX}{key}"
+
+
+def is_archive_ref(file_path: Optional[str]) -> bool:
+    return bool(file_path) and file_path.startswith(ARCHIVE_REF_PREFIX)
+
+
+def archive_key(file_path: str) -> str:
+    """Archive key (``clip:<id>:<kind>``) of a catalog value written by ``archive_ref``"""
+    return file_path[len(ARCHIVE_REF_PREFIX):]
+
+
+def playable_path(file_path: Optional[str]) -> Optional[str]:
+    """
+    Value of a video_clips file column as returned by the API: archived clips
+    become ``/api/videos/archive/<clip_id>/<kind>``, other paths are unchanged.
+    """
+    if not is_archive_ref(file_path):
+        return file_path
+    _, clip_id, kind = archive_key(file_path).split(":")
+    return f"{ARCHIVE_URL_PREFIX}/{clip_id}/{kind}"
+
+
+def with_playable_files(video: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of a clip dict whose road/interior files are playable paths"""
+    if not any(is_archive_ref(video.get(column)) for column in ('road_video_file', 'interior_video_file')):
+        return video
+    video = dict(video)
+    for column in ('road_video_file', 'interior_video_file'):
+        video[column] = playable_path(video.get(column))
+    video['archived'] = True
+    return video
+
+
+class ArchiveSegment:
+    """Location of an archived file inside a day pack"""
+
+    __slots__ = ('key', 'clip_id', 'pack', 'offset', 'length', 'sha256',
+                 'original_size', 'source_path', 'archived_at')
+
+    def __init__(self, record: Dict[str, Any]):
+        self.key = record["key"]
+        self.clip_id = record.get("clip_id")
+        self.pack = record["pack"]
+        self.offset = record["offset"]
+        self.length = record["length"]
+        self.sha256 = record["sha256"]
+        self.original_size = record.get("original_size", self.length)
+        self.source_path = record.get("source_path")
+        self.archived_at = record.get("archived_at")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class ArchiveStore:
+    """
+    Per-day segment packs plus an append-only index.
+
+    A segment is appended to the end of its pack and fsynced before its index
+    line is written, so a crash can at most leave unreferenced bytes at the end
+    of a pack, never an index entry pointing at missing data.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.packs_path = os.path.join(root, PACKS_DIR_NAME)
+        self.index_path = os.path.join(root, INDEX_NAME)
+        os.makedirs(self.packs_path, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.segments: Dict[str, ArchiveSegment] = {}
+        self._by_hash: Dict[str, ArchiveSegment] = {}
+        self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        if record.get("removed"):
+                            self.segments.pop(record["key"], None)
+                            continue
+                        segment = ArchiveSegment(record)
+                    except (ValueError, KeyError):
+                        # Última línea cortada por un apagado a mitad de escritura
+                        continue
+                    self.segments[segment.key] = segment
+        except FileNotFoundError:
+            pass
+        self._rebuild_hashes()
+
+    def _rebuild_hashes(self):
+        self._by_hash = {}
+        for segment in self.segments.values():
+            self._by_hash.setdefault(segment.sha256, segment)
+
+    def _append_index(self, *records: Dict[str, Any]):
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            f.write("".join(json.dumps(record, separators=(',', ':')) + "\n" for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def contains(self, key: str) -> bool:
+        return key in self.segments
+
+    def get(self, key: str) -> Optional[ArchiveSegment]:
+        return self.segments.get(key)
+
+    def pack_file(self, segment: ArchiveSegment) -> str:
+        return os.path.join(self.packs_path, segment.pack)
+
+    def add(self, key: str, payload_path: str, day: str, clip_id: Optional[int] = None,
+            original_size: Optional[int] = None, source_path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Append a file to the pack of ``day`` (YYYY-MM-DD).
+
+        The payload is hashed while it is appended; if the hash is already in
+        the archive the pack is truncated back and the existing segment is
+        reused. Returns {"segment", "stored", "deduplicated"} where ``stored``
+        is the number of new bytes written to the pack.
+        """
+        with self._lock:
+            existing = self.segments.get(key)
+            if existing is not None:
+                return {"segment": existing, "stored": 0, "deduplicated": False}
+
+            pack_name = f"{day}.pack"
+            pack_path = os.path.join(self.packs_path, pack_name)
+            digest = hashlib.sha256()
+
+            with open(pack_path, 'ab') as pack, open(payload_path, 'rb') as src:
+                offset = pack.seek(0, os.SEEK_END)
+                while True:
+                    chunk = src.read(READ_BUFFER_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    pack.write(chunk)
+                length = pack.tell() - offset
+
+                sha256 = digest.hexdigest()
+                duplicate = self._by_hash.get(sha256)
+                if duplicate is not None:
+                    pack.truncate(offset)
+                else:
+                    pack.flush()
+                    os.fsync(pack.fileno())
+
+            if duplicate is not None:
+                record = {"pack": duplicate.pack, "offset": duplicate.offset, "length": duplicate.length}
+            else:
+                record = {"pack": pack_name, "offset": offset, "length": length}
+
+            record.update(
+                key=key,
+                clip_id=clip_id,
+                sha256=sha256,
+                original_size=original_size if original_size is not None else length,
+                source_path=source_path,
+                archived_at=datetime.now().isoformat()
+            )
+            segment = ArchiveSegment(record)
+            self._append_index(segment.to_dict())
+            self.segments[key] = segment
+            self._by_hash.setdefault(sha256, segment)
+
+            return {
+                "segment": segment,
+                "stored": 0 if duplicate is not None else length,
+                "deduplicated": duplicate is not None
+            }
+
+    def reclaimable_size(self, key: str) -> int:
+        """Pack bytes that only this segment uses (0 for a deduplicated copy of another one)"""
+        with self._lock:
+            segment = self.segments.get(key)
+            if segment is None:
+                return 0
+            shared = any(other.key != key and other.pack == segment.pack and other.offset == segment.offset
+                         for other in self.segments.values())
+            return 0 if shared else segment.length
+
+    def remove(self, keys) -> int:
+        """
+        Drop segments from the index and delete the packs no remaining segment
+        uses. Returns the bytes freed on disk (whole packs only: a pack is never
+        rewritten, so the bytes of a removed segment are released with its day).
+        """
+        with self._lock:
+            removed = [self.segments[key] for key in dict.fromkeys(keys) if key in self.segments]
+            if not removed:
+                return 0
+            # Primero el índice: un corte después deja como mucho un pack sin referencias
+            self._append_index(*({"key": segment.key, "removed": True} for segment in removed))
+            for segment in removed:
+                del self.segments[segment.key]
+            self._rebuild_hashes()
+
+            in_use = {segment.pack for segment in self.segments.values()}
+            freed = 0
+            for pack_name in {segment.pack for segment in removed} - in_use:
+                pack_path = os.path.join(self.packs_path, pack_name)
+                try:
+                    size = os.path.getsize(pack_path)
+                    os.remove(pack_path)
+                    freed += size
+                except FileNotFoundError:
+                    pass
+            return freed
+
+    def iter_segment(self, key: str, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+        """Stream a single archived file straight from its pack"""
+        segment = self.segments.get(key)
+        if segment is None:
+            raise KeyError(key)
+
+        remaining = segment.length
+        with open(self.pack_file(segment), 'rb') as pack:
+            pack.seek(segment.offset)
+            while remaining > 0:
+                chunk = pack.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise IOError(f"Pack truncado: {segment.pack}")
+                remaining -= len(chunk)
+                yield chunk
+
+    def clip_ids_with_source(self, *fragments: str) -> Set[int]:
+        """Clip IDs of segments whose original path contains any of ``fragments``"""
+        with self._lock:
+            return {segment.clip_id for segment in self.segments.values()
+                    if segment.clip_id is not None and segment.source_path
+                    and any(fragment in segment.source_path for fragment in fragments)}
+
+    def get_stats(self) -> Dict[str, Any]:
+        packs = {}
+        for segment in list(self.segments.values()):
+            packs.setdefault(segment.pack, 0)
+        for pack_name in packs:
+            try:
+                packs[pack_name] = os.path.getsize(os.path.join(self.packs_path, pack_name))
+            except OSError:
+                packs[pack_name] = 0
+        return {
+            "segments": len(self.segments),
+            "uniqueSegments": len(self._by_hash),
+            "packs": len(packs),
+            "packedSize": sum(packs.values()),
+            "originalSize": sum(s.original_size for s in self.segments.values())
+        }
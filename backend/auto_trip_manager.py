@@ -22,6 +22,8 @@ class AutoTripManager:
         self.camera_manager = None
         self.gps_reader = None
         self.audio_notifier = None
+        # Optional: loads the offline gazetteer pack of the active planned trip
+        self.reverse_geocoding_service = None
         
         # Active trip info
         self.active_planned_trip_id = None
@@ -86,6 +88,7 @@ class AutoTripManager:
             # Set active trip info
             self.active_planned_trip_id = trip.id
             self.is_active = True
+            self._load_trip_geodata(trip.id)
             
             # Update global recording state
             if self.set_recording_state_callback:
@@ -120,6 +123,7 @@ class AutoTripManager:
                 # Load landmarks for this planned trip
                 if self.landmark_checker:
                     self.landmark_checker.set_active_trip_id(planned_trip_id)
+                self._load_trip_geodata(planned_trip_id)
             
             # Start recording
             self.camera_manager.start_recording()
@@ -164,6 +168,7 @@ class AutoTripManager:
             self.active_trip_id = None
             self.active_planned_trip_id = None
             self.is_active = False
+            self._load_trip_geodata(None)
             
             # Update global recording state
             if self.set_recording_state_callback:
@@ -179,6 +184,11 @@ class AutoTripManager:
             logger.error(f"Error ending trip: {str(e)}")
             return False
             
+    def _load_trip_geodata(self, planned_trip_id):
+        """Load (or unload with None) the offline gazetteer pack of the planned trip"""
+        if self.reverse_geocoding_service:
+            self.reverse_geocoding_service.set_active_trip(planned_trip_id)
+            
     def get_active_trip_info(self):
         """Get information about the active trip"""
         if not self.is_active:
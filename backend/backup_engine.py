@@ -0,0 +1,439 @@
+"""
+Backup Engine Module
+Copies dashcam videos to an external USB HDD with:
+- A persistent manifest on the destination drive (clip key, size, mtime, hash
+  and a sampled hash of the file ends), so an interrupted or cancelled backup
+  resumes where it stopped without trusting stale or damaged copies
+- Large-buffer copies with streaming SHA-256 (or copy_file_range when hashing is
+  disabled), written to a .part file and renamed atomically
+- Optional read-back verification of the destination
+- A small worker pool (USB HDDs thrash with more than a couple of writers)
+- Throughput reporting in MB/s
+"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger('backup_engine')
+
+BACKUP_DIR_NAME = "dashcam_backup"
+MANIFEST_NAME = "manifest.jsonl"
+COPY_BUFFER_SIZE = 4 * 1024 * 1024  # 4 MiB: secuencial y amable con discos USB
+SAMPLE_SIZE = 64 * 1024  # Bytes leídos del principio y del final para la huella rápida
+DEST_MTIME_TOLERANCE = 2  # FAT/exFAT guardan la fecha con resolución de 2 s
+
+
+class BackupCancelled(Exception):
+    """Raised inside a worker when the user cancels the backup"""
+
+
+class BackupItem:
+    """
+    A single file to back up. An item can also be a byte range of a larger
+    file (``offset``, ``size``), such as a clip segment inside an archive pack;
+    then ``mtime_ns`` must be given because the pack's own mtime changes
+    whenever another segment is appended.
+    """
+
+    __slots__ = ('key', 'clip_id', 'source_path', 'rel_path', 'offset', 'size', 'mtime', 'mtime_ns')
+
+    def __init__(self, key: str, clip_id: Optional[int], source_path: str, rel_path: str,
+                 offset: int = 0, size: Optional[int] = None, mtime_ns: Optional[int] = None):
+        self.key = key
+        self.clip_id = clip_id
+        self.source_path = source_path
+        self.rel_path = rel_path
+        self.offset = offset
+        stat_info = os.stat(source_path)
+        self.size = stat_info.st_size if size is None else size
+        self.mtime_ns = stat_info.st_mtime_ns if mtime_ns is None else mtime_ns
+        self.mtime = self.mtime_ns // 1_000_000_000
+
+
+def sample_digest(path: str, size: int, offset: int = 0) -> str:
+    """SHA-256 of the size plus the first and last SAMPLE_SIZE bytes of a file (or of a range of it)"""
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        digest.update(f.read(min(SAMPLE_SIZE, size)))
+        if size > SAMPLE_SIZE:
+            f.seek(offset + max(SAMPLE_SIZE, size - SAMPLE_SIZE))
+            digest.update(f.read(min(SAMPLE_SIZE, size - max(SAMPLE_SIZE, size - SAMPLE_SIZE))))
+    return digest.hexdigest()
+
+
+class BackupManifest:
+    """
+    Append-only JSON lines manifest stored on the destination drive.
+
+    The first line is a header with the backup id; every following line records
+    one completed file. Appending a line per file keeps the manifest valid even if
+    the drive is unplugged mid-copy (a torn last line is simply ignored).
+    """
+
+    def __init__(self, backup_root: str):
+        self.backup_root = backup_root
+        self.path = os.path.join(backup_root, MANIFEST_NAME)
+        self.backup_id: Optional[str] = None
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Ignoring corrupt manifest line in {self.path}")
+                    continue
+                if record.get("type") == "header":
+                    self.backup_id = record.get("backup_id")
+                elif record.get("key"):
+                    self.entries[record["key"]] = record
+
+    def ensure_header(self):
+        if self.backup_id:
+            return
+        os.makedirs(self.backup_root, exist_ok=True)
+        self.backup_id = uuid.uuid4().hex
+        self._append({
+            "type": "header",
+            "backup_id": self.backup_id,
+            "created": datetime.now().isoformat()
+        })
+
+    def _append(self, record: Dict[str, Any]):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, separators=(',', ':')) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def is_complete(self, item: BackupItem) -> bool:
+        """
+        True if the item is already on the drive: same size and modification
+        time as recorded, and the sampled hash of both the source and the
+        destination still matches the one recorded when it was copied.
+        """
+        entry = self.entries.get(item.key)
+        if not entry or entry.get("size") != item.size:
+            return False
+        # Las entradas antiguas solo tienen mtime en segundos y no tienen huella
+        if entry.get("mtime_ns") is not None:
+            if entry["mtime_ns"] != item.mtime_ns:
+                return False
+        elif entry.get("mtime") != item.mtime:
+            return False
+
+        dest_path = os.path.join(self.backup_root, entry["dest"])
+        try:
+            dest_stat = os.stat(dest_path)
+            if dest_stat.st_size != item.size or abs(dest_stat.st_mtime - item.mtime) > DEST_MTIME_TOLERANCE:
+                return False
+            sample = entry.get("sample_sha256")
+            if sample is None:
+                return True
+            return sample_digest(item.source_path, item.size, item.offset) == sample and \
+                sample_digest(dest_path, item.size) == sample
+        except OSError:
+            return False
+
+    def record(self, item: BackupItem, sha256: Optional[str], sample_sha256: Optional[str] = None):
+        record = {
+            "key": item.key,
+            "clip_id": item.clip_id,
+            "dest": item.rel_path,
+            "size": item.size,
+            "mtime": item.mtime,
+            "mtime_ns": item.mtime_ns,
+            "sha256": sha256,
+            "sample_sha256": sample_sha256,
+            "copied_at": datetime.now().isoformat()
+        }
+        with self._lock:
+            self._append(record)
+            self.entries[item.key] = record
+
+
+class ThroughputMeter:
+    """Thread-safe byte counter with a sliding window MB/s estimate"""
+
+    def __init__(self, window: float = 5.0):
+        self.window = window
+        self.total_bytes = 0
+        self._samples: deque = deque()
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+
+    def add(self, nbytes: int):
+        now = time.monotonic()
+        with self._lock:
+            self.total_bytes += nbytes
+            self._samples.append((now, nbytes))
+            cutoff = now - self.window
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+
+    def current_mbps(self) -> float:
+        with self._lock:
+            if not self._samples:
+                return 0.0
+            span = max(time.monotonic() - self._samples[0][0], 0.001)
+            return sum(n for _, n in self._samples) / span / (1024 * 1024)
+
+    def average_mbps(self) -> float:
+        elapsed = max(time.monotonic() - self.started, 0.001)
+        return self.total_bytes / elapsed / (1024 * 1024)
+
+
+class BackupEngine:
+    """Runs one backup of a list of items into a destination drive"""
+
+    def __init__(self,
+                 destination: str,
+                 workers: int = 2,
+                 verify: bool = True,
+                 cancel_check: Optional[Callable[[], bool]] = None,
+                 progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """
+        Args:
+            destination: Mount point (or folder) of the external drive
+            workers: Concurrent file copies
+            verify: Hash while copying and re-read the destination to compare
+            cancel_check: Callable returning True when the backup must stop
+            progress_callback: Called with a stats dict as bytes are copied
+        """
+        self.backup_root = os.path.join(destination, BACKUP_DIR_NAME)
+        self.workers = max(1, workers)
+        self.verify = verify
+        self.cancel_check = cancel_check or (lambda: False)
+        self.progress_callback = progress_callback
+        self.manifest = BackupManifest(self.backup_root)
+        self.meter = ThroughputMeter()
+        self._last_report = 0.0
+
+        self.stats = {
+            "total_files": 0,
+            "copied_files": 0,
+            "skipped_files": 0,
+            "failed_files": 0,
+            "total_size": 0,
+            "copied_size": 0,
+            "throughput_mbps": 0.0,
+            "average_mbps": 0.0,
+            "current_file": None
+        }
+        self._stats_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Copia de un archivo
+    # ------------------------------------------------------------------
+    def _check_cancel(self):
+        if self.cancel_check():
+            raise BackupCancelled()
+
+    def _on_bytes(self, nbytes: int):
+        self.meter.add(nbytes)
+        with self._stats_lock:
+            self.stats["copied_size"] += nbytes
+        now = time.monotonic()
+        if now - self._last_report >= 0.5:
+            self._last_report = now
+            self._report()
+
+    def _report(self):
+        with self._stats_lock:
+            self.stats["throughput_mbps"] = round(self.meter.current_mbps(), 2)
+            self.stats["average_mbps"] = round(self.meter.average_mbps(), 2)
+            snapshot = dict(self.stats)
+        if self.progress_callback:
+            try:
+                self.progress_callback(snapshot)
+            except Exception as e:
+                logger.error(f"Error in backup progress callback: {e}")
+
+    def _copy_hashing(self, src, dst, size: int) -> str:
+        """Buffered copy of ``size`` bytes from the current position, computing SHA-256 in the same pass"""
+        digest = hashlib.sha256()
+        buffer = bytearray(COPY_BUFFER_SIZE)
+        view = memoryview(buffer)
+        remaining = size
+        while remaining > 0:
+            self._check_cancel()
+            n = src.readinto(view[:min(COPY_BUFFER_SIZE, remaining)])
+            if not n:
+                break
+            chunk = view[:n]
+            digest.update(chunk)
+            dst.write(chunk)
+            remaining -= n
+            self._on_bytes(n)
+        return digest.hexdigest()
+
+    def _copy_kernel(self, src, dst, start: int, size: int):
+        """Kernel-side copy (copy_file_range) without passing data through Python"""
+        offset = 0
+        while offset < size:
+            self._check_cancel()
+            try:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), min(COPY_BUFFER_SIZE, size - offset))
+            except OSError:
+                # Distinto sistema de archivos en kernels antiguos, FUSE (ntfs-3g/exfat)...
+                src.seek(start + offset)
+                dst.seek(offset)
+                self._copy_hashing(src, dst, size - offset)
+                return
+            if copied == 0:
+                break
+            offset += copied
+            self._on_bytes(copied)
+
+    @staticmethod
+    def _hash_file(path: str, cancel: Callable[[], None]) -> str:
+        digest = hashlib.sha256()
+        buffer = bytearray(COPY_BUFFER_SIZE)
+        view = memoryview(buffer)
+        with open(path, 'rb') as f:
+            while True:
+                cancel()
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                digest.update(view[:n])
+        return digest.hexdigest()
+
+    def copy_item(self, item: BackupItem) -> Optional[str]:
+        """Copy one item atomically and return its SHA-256 (None if not hashed)"""
+        dest_path = os.path.join(self.backup_root, item.rel_path)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        part_path = dest_path + ".part"
+        with self._stats_lock:
+            self.stats["current_file"] = item.rel_path
+
+        sha256 = None
+        try:
+            with open(item.source_path, 'rb') as src, open(part_path, 'wb') as dst:
+                if item.offset:
+                    src.seek(item.offset)
+                if self.verify:
+                    sha256 = self._copy_hashing(src, dst, item.size)
+                elif hasattr(os, 'copy_file_range'):
+                    self._copy_kernel(src, dst, item.offset, item.size)
+                else:
+                    self._copy_hashing(src, dst, item.size)
+                dst.flush()
+                os.fsync(dst.fileno())
+
+            if self.verify:
+                written = self._hash_file(part_path, self._check_cancel)
+                if written != sha256:
+                    raise IOError(f"Checksum mismatch for {item.rel_path}")
+
+            os.replace(part_path, dest_path)
+            try:
+                os.utime(dest_path, ns=(item.mtime_ns, item.mtime_ns))
+            except OSError:
+                pass
+            return sha256
+        except BaseException:
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            raise
+
+    # ------------------------------------------------------------------
+    # Ejecución
+    # ------------------------------------------------------------------
+    def run(self, items: Iterable[BackupItem]) -> Dict[str, Any]:
+        """
+        Back up every item not yet in the manifest.
+
+        Returns the stats dict with an extra "status" key: completed,
+        cancelled or error (some files failed).
+        """
+        self.manifest.ensure_header()
+
+        pending = []
+        for item in items:
+            self.stats["total_files"] += 1
+            self.stats["total_size"] += item.size
+            if self.manifest.is_complete(item):
+                self.stats["skipped_files"] += 1
+            else:
+                pending.append(item)
+
+        # Los archivos ya copiados en ejecuciones anteriores cuentan como progreso
+        already = self.stats["total_size"] - sum(i.size for i in pending)
+        self.stats["copied_size"] = already
+        logger.info(f"Backup to {self.backup_root}: {len(pending)} pending, "
+                    f"{self.stats['skipped_files']} already in manifest")
+        self._report()
+
+        cancelled = False
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="backup") as pool:
+            futures = {pool.submit(self.copy_item, item): item for item in pending}
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    sha256 = future.result()
+                    self.manifest.record(item, sha256, sample_digest(item.source_path, item.size, item.offset))
+                    with self._stats_lock:
+                        self.stats["copied_files"] += 1
+                except BackupCancelled:
+                    cancelled = True
+                except Exception as e:
+                    logger.error(f"Error backing up {item.source_path}: {e}")
+                    with self._stats_lock:
+                        self.stats["failed_files"] += 1
+                if self.cancel_check():
+                    cancelled = True
+                    for other in futures:
+                        other.cancel()
+                self._report()
+
+        if cancelled:
+            self.stats["status"] = "cancelled"
+        elif self.stats["failed_files"]:
+            self.stats["status"] = "error"
+        else:
+            self.stats["status"] = "completed"
+        self.stats["backup_id"] = self.manifest.backup_id
+        self.stats["average_mbps"] = round(self.meter.average_mbps(), 2)
+        return self.stats
+
+    def backed_up_clip_ids(self) -> Dict[int, set]:
+        """Clip IDs present in the manifest mapped to the set of their backed-up keys"""
+        clips: Dict[int, set] = {}
+        for key, entry in self.manifest.entries.items():
+            clip_id = entry.get("clip_id")
+            if clip_id is not None and key.startswith("clip:"):
+                clips.setdefault(clip_id, set()).add(key)
+        return clips
+
+
+def find_manifest_backup_id(mount_point: str) -> Optional[str]:
+    """Return the backup id stored on a drive, or None if it has no manifest"""
+    manifest_path = os.path.join(mount_point, BACKUP_DIR_NAME, MANIFEST_NAME)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header.get("type") == "header":
+                return header.get("backup_id")
+    except (OSError, ValueError):
+        pass
+    return None
@@ -9,6 +9,7 @@ from datetime import datetime, timedelta
 # Change from relative imports to absolute imports
 from cameras import RoadCamera, InteriorCamera, VideoRecorder, CameraSettings
 from video_metadata_injector import VideoMetadataInjector
+from retention_engine import PRIORITY_LANDMARK_CATEGORIES
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -43,6 +44,9 @@ class CameraManager:
         self.gps_reader = None  # GPS reader instance
         self.landmark_checker = None  # Landmark checker instance
         
+        # Callbacks invocados cuando un clip se guarda en la base de datos
+        self.clip_listeners = []
+        
         # Video metadata injector
         self.metadata_injector = VideoMetadataInjector()
         
@@ -290,6 +294,7 @@ class CameraManager:
             # Guardar en la base de datos
             result = self.trip_logger.add_video_clips(self.current_trip_id, [clip_info])
             logger.info(f"Clip {clip_info['sequence']} añadido a la base de datos en tiempo real: {result}")
+            self._notify_clip_listeners(clip_info)
             
             # Verificar que se guardó correctamente usando Trip Logger
             try:
@@ -417,6 +422,17 @@ class CameraManager:
         self.trip_logger = trip_logger
         logger.info("TripLogger configurado en CameraManager")
         
+    def add_clip_listener(self, callback):
+        """Registrar un callback(clip_info) que se invoca al guardar cada clip"""
+        self.clip_listeners.append(callback)
+    
+    def _notify_clip_listeners(self, clip_info):
+        for callback in self.clip_listeners:
+            try:
+                callback(clip_info)
+            except Exception as e:
+                logger.error(f"Error en listener de clips: {str(e)}")
+    
     def set_dependencies(self, trip_logger, gps_reader=None, landmark_checker=None, reverse_geocoding_service=None):
         """Configure dependencies for GPS logging and landmark checking"""
         self.trip_logger = trip_logger
@@ -527,12 +543,7 @@ class CameraManager:
             
     def _is_priority_landmark_category(self, category):
         """Determine if a landmark category should trigger priority recording"""
-        priority_categories = [
-            'tourist_attraction', 'tourism', 'monument', 'museum', 'castle', 
-            'viewpoint', 'attraction', 'trip_point', 'manual_waypoint',
-            'heritage', 'archaeological_site', 'historic'
-        ]
-        return category in priority_categories
+        return category in PRIORITY_LANDMARK_CATEGORIES
     
     def _should_upgrade_recording_quality(self, landmark_data):
         """Determine if we should upgrade recording quality for this landmark"""
@@ -40,6 +40,14 @@ class Config:
         self.reverse_geocoding_batch_size = int(os.environ.get('REVERSE_GEOCODING_BATCH_SIZE', '10'))
         self.reverse_geocoding_batch_delay = int(os.environ.get('REVERSE_GEOCODING_BATCH_DELAY', '30'))
         
+        # Offline map tiles: upstream server for the tile proxy and offline-only mode
+        self.map_tile_url = os.environ.get('MAP_TILE_URL', 'https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png')
+        self.map_tiles_offline_only = os.environ.get('MAP_TILES_OFFLINE_ONLY', 'false').lower() == 'true'
+        
+        # Map file (MWM) downloads: global bandwidth cap in KB/s (0 = unlimited) and connections per file
+        self.map_download_rate_kbps = int(os.environ.get('MAP_DOWNLOAD_RATE_KBPS', '0'))
+        self.map_download_connections = int(os.environ.get('MAP_DOWNLOAD_CONNECTIONS', '1'))
+        
         # External storage config
         self.default_mount_point = "/mnt/dashcam_storage" if self.is_raspberry_pi else os.path.join(os.getcwd(), "mnt")
         
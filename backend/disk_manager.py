@@ -7,6 +7,7 @@ import time
 import sys
 from datetime import datetime, timedelta
 import subprocess
+import tempfile
 from pathlib import Path
 from typing import Dict, Any, List, Optional
 
@@ -17,6 +18,9 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from trip_logger_package.services.trip_manager import TripManager
 from trip_logger_package.database.repository import VideoRepository
 from trip_logger_package.database.connection import get_database_manager
+from trip_logger_package.models.db_models import VideoClip as VideoClipModel
+from retention_engine import RetentionEngine, DEFAULT_RETENTION_SETTINGS
+from archive_store import ArchiveStore, archive_ref, is_archive_ref
 
 # Configure logging
 logging.basicConfig(
@@ -63,17 +67,36 @@ class DiskManager:
                 "mountPoint": "/mnt/dashcam_storage",
                 "autoDetectDrives": True  # Auto-detect drives by default
             }
+            self.settings.update(self._missing_retention_settings())
             self.save_settings()
         else:
             self.load_settings()
             # Ensure new settings exist
-            if "autoDetectDrives" not in self.settings:
-                self.settings["autoDetectDrives"] = True
+            missing = self._missing_retention_settings()
+            if "autoDetectDrives" not in self.settings or missing:
+                self.settings.setdefault("autoDetectDrives", True)
+                self.settings.update(missing)
                 self.save_settings()
         
         # Initialize database manager and trip manager for database operations
         self.db_manager = get_database_manager()
         self.trip_manager = TripManager()
+        
+        # Retention engine: deletes clips by catalog priority to keep free space
+        # above the watermark. Started from main.py.
+        self.retention_engine = RetentionEngine(
+            data_path=self.data_path,
+            db_path=self.db_path,
+            settings_provider=lambda: self.settings,
+            archive_store_provider=self.existing_archive_store
+        )
+        
+        # Append-only archive of old clips (see archive_videos)
+        self.archive_store = None
+
+    def _missing_retention_settings(self) -> Dict[str, Any]:
+        """Retention settings not yet present in the settings file"""
+        return {k: v for k, v in DEFAULT_RETENTION_SETTINGS.items() if k not in self.settings}
 
     def load_settings(self):
         """Load storage settings from file"""
@@ -132,6 +155,13 @@ class DiskManager:
                 settings_changed = True
                 logger.info(f"Auto-clean days set to {settings['autoCleanDays']} days")
                 
+            # Update retention engine settings if provided
+            for key in ("autoCleanTargetThreshold", "minFreeSpaceMB", "retentionDeleteRateMB"):
+                if key in settings and settings[key] != self.settings.get(key):
+                    self.settings[key] = settings[key]
+                    settings_changed = True
+                    logger.info(f"{key} set to {settings[key]}")
+                
             # Update auto-detect drives if provided
             if "autoDetectDrives" in settings and settings["autoDetectDrives"] != self.settings.get("autoDetectDrives"):
                 self.settings["autoDetectDrives"] = settings["autoDetectDrives"]
@@ -644,52 +674,13 @@ class DiskManager:
             }
     
     def clean_old_videos(self, days=30):
-        """Delete videos older than specified days using Trip Manager"""
+        """Delete videos older than specified days (files and catalog rows)"""
         try:
-            # Calculate cutoff date
-            cutoff_date = datetime.now() - timedelta(days=days)
-            
-            deleted_count = 0
-            freed_space = 0
-            
-            # Get all trips and their videos
-            all_trips = self.trip_manager.get_all_trips()
-            
-            for trip in all_trips:
-                trip_videos = self.trip_manager.get_trip_videos(trip.id) if hasattr(trip, 'id') else []
-                
-                for video in trip_videos:
-                    # Check if video is older than cutoff
-                    video_start_time = video.get('start_time') if isinstance(video, dict) else getattr(video, 'start_time', None)
-                    
-                    if video_start_time:
-                        # Convert to datetime if it's a string
-                        if isinstance(video_start_time, str):
-                            try:
-                                video_date = datetime.fromisoformat(video_start_time.replace('Z', '+00:00'))
-                            except:
-                                continue
-                        else:
-                            video_date = video_start_time
-                        
-                        if video_date < cutoff_date:
-                            # Delete the physical file
-                            file_path = video.get('file_path') if isinstance(video, dict) else getattr(video, 'file_path', None)
-                            if file_path:
-                                full_path = os.path.join(self.data_path, file_path)
-                                if os.path.exists(full_path):
-                                    file_size = video.get('file_size', 0) if isinstance(video, dict) else getattr(video, 'file_size', 0) or 0
-                                    os.remove(full_path)
-                                    freed_space += file_size
-                                    deleted_count += 1
-                                    
-                                    # Note: For now we're just deleting files, not database records
-                                    # The trip manager would need a delete method for that
-            
-            logger.info(f"Cleaned {deleted_count} videos, freed {freed_space} bytes")
+            result = self.retention_engine.purge_older_than(days)
+            logger.info(f"Cleaned {result['deleted']} videos, freed {result['freedSpace']} bytes")
             return {
-                "deleted": deleted_count, 
-                "freedSpace": freed_space,
+                "deleted": result["deleted"],
+                "freedSpace": result["freedSpace"],
                 "using_new_system": True
             }
             
@@ -747,104 +738,148 @@ class DiskManager:
                 "error": str(e)
             }
     
+    def get_archive_store(self) -> ArchiveStore:
+        """Archive store under <data_path>/archive (created on first use)"""
+        if self.archive_store is None:
+            self.archive_store = ArchiveStore(os.path.join(self.data_path, "archive"))
+        return self.archive_store
+    
+    def existing_archive_store(self) -> Optional[ArchiveStore]:
+        """Archive store if anything was ever archived (retention does not create it)"""
+        if self.archive_store is None and not os.path.isdir(os.path.join(self.data_path, "archive")):
+            return None
+        return self.get_archive_store()
+    
+    def _compress_for_archive(self, source_path: str, archive_type: str) -> Optional[str]:
+        """Re-encode a clip with ffmpeg; returns the temp file or None if it did not help"""
+        crf = "28" if archive_type == "standard" else "32"
+        fd, tmp_path = tempfile.mkstemp(prefix=".encode_", suffix=".mp4", dir=self.get_archive_store().root)
+        os.close(fd)
+        
+        result = subprocess.run([
+            "ffmpeg", "-i", source_path,
+            "-c:v", "libx264", "-crf", crf,
+            "-preset", "medium",
+            "-c:a", "aac", "-b:a", "128k",
+            "-y", tmp_path
+        ], capture_output=True)
+        
+        if result.returncode == 0 and os.path.exists(tmp_path):
+            if os.path.getsize(tmp_path) < os.path.getsize(source_path):
+                return tmp_path
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    
     def archive_videos(self, archive_type="standard"):
-        """Compress old videos to save space using Trip Manager"""
+        """
+        Move clips older than 60 days into the append-only archive store.
+        
+        Clips already in the archive index are skipped without touching their
+        files, so each run only processes new footage. Each file is compressed
+        (unless archive_type is "store") and appended to the pack of its
+        recording day; once its index entry is durable the catalog row is
+        repointed at the archive and only then the original is removed. A file
+        that fails is left in place and the run continues with the next one.
+        """
         try:
-            # Get videos older than 60 days
             cutoff_date = datetime.now() - timedelta(days=60)
-            
-            archive_count = 0
-            saved_space = 0
-            
-            # Get all trips and their videos
-            all_trips = self.trip_manager.get_all_trips()
-            
-            # Filter videos to archive (older than 60 days and not already archived)
-            videos_to_archive = []
-            
-            for trip in all_trips:
-                trip_videos = self.trip_manager.get_trip_videos(trip.id) if hasattr(trip, 'id') else []
-                
-                for video in trip_videos:
-                    archived = video.get('archived', False) if isinstance(video, dict) else getattr(video, 'archived', False)
-                    start_time = video.get('start_time') if isinstance(video, dict) else getattr(video, 'start_time', None)
-                    
-                    if start_time and not archived:
-                        # Convert string timestamp to datetime if needed
-                        if isinstance(start_time, str):
-                            try:
-                                video_date = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                            except:
-                                continue
-                        else:
-                            video_date = start_time
-                        
-                        if video_date < cutoff_date:
-                            videos_to_archive.append(video)
-            
-            if not videos_to_archive:
-                return {"archived": 0, "savedSpace": 0}
-            
-            for video in videos_to_archive:
-                video_id = video.get('id') if isinstance(video, dict) else getattr(video, 'id', None)
-                file_path = video.get('file_path') if isinstance(video, dict) else getattr(video, 'file_path', None)
-                original_size = video.get('file_size', 0) if isinstance(video, dict) else getattr(video, 'file_size', 0) or 0
-                
-                if not file_path:
-                    continue
-                    
-                full_path = os.path.join(self.data_path, file_path)
-                if not os.path.exists(full_path):
-                    continue
-                    
-                # Create archive filename
-                archive_path = full_path + ".tmp"
-                
-                # Determine compression quality based on archive type
-                crf = "28" if archive_type == "standard" else "32"
-                
-                # Compress the video using ffmpeg
-                result = subprocess.run([
-                    "ffmpeg", "-i", full_path, 
-                    "-c:v", "libx264", "-crf", crf, 
-                    "-preset", "medium", 
-                    "-c:a", "aac", "-b:a", "128k",
-                    "-y", archive_path
-                ], capture_output=True)
-                
-                if result.returncode == 0 and os.path.exists(archive_path):
-                    # Get new file size
-                    new_size = os.path.getsize(archive_path)
-                    
-                    # If archive is smaller, replace the original
-                    if new_size < original_size:
-                        os.remove(full_path)
-                        os.rename(archive_path, full_path)
-                        
-                        # Update the database using Trip Manager (if method available)
-                        space_saved = original_size - new_size
-                        # Note: We'd need an update method in trip manager for this
-                        # For now just count the success
-                        archive_count += 1
-                        saved_space += space_saved
-                    else:
-                        # Archive not smaller, delete it
-                        os.remove(archive_path)
-            
-            logger.info(f"Archived {archive_count} videos, saved {saved_space} bytes")
-            return {
-                "archived": archive_count, 
-                "savedSpace": saved_space,
-                "using_new_system": True
-            }
-            
-        except Exception as e:
-            logger.error(f"Error archiving videos: {str(e)}")
-            return {"archived": 0, "savedSpace": 0, "error": str(e)}
-            
+            store = self.get_archive_store()
+            
+            with self.db_manager.session_scope() as session:
+                clips = session.query(
+                    VideoClipModel.id,
+                    VideoClipModel.start_time,
+                    VideoClipModel.road_video_file,
+                    VideoClipModel.interior_video_file
+                ).filter(VideoClipModel.start_time < cutoff_date).order_by(VideoClipModel.start_time).all()
         except Exception as e:
             logger.error(f"Error archiving videos: {str(e)}")
             return {"archived": 0, "savedSpace": 0, "error": str(e)}
+        
+        archive_count = 0
+        saved_space = 0
+        skipped = 0
+        deduplicated = 0
+        failed = 0
+        
+        for clip in clips:
+            day = clip.start_time.strftime("%Y-%m-%d")
+            for kind, file_path in (("road", clip.road_video_file), ("interior", clip.interior_video_file)):
+                if not file_path or is_archive_ref(file_path):
+                    continue
+                key = f"clip:{clip.id}:{kind}"
+                try:
+                    result = self._archive_clip_file(store, clip.id, kind, key, file_path, day, archive_type)
+                except Exception as e:
+                    logger.error(f"Error archiving {file_path}: {str(e)}")
+                    failed += 1
+                    continue
+                
+                if result is None:
+                    continue
+                if result.get("already_archived"):
+                    skipped += 1
+                    continue
+                archive_count += 1
+                saved_space += result["original_size"] - result["stored"]
+                if result["deduplicated"]:
+                    deduplicated += 1
+        
+        logger.info(f"Archived {archive_count} videos ({skipped} already archived, "
+                    f"{deduplicated} deduplicated, {failed} failed), saved {saved_space} bytes")
+        return {
+            "archived": archive_count,
+            "savedSpace": saved_space,
+            "skipped": skipped,
+            "deduplicated": deduplicated,
+            "failed": failed
+        }
+    
+    def _archive_clip_file(self, store: ArchiveStore, clip_id: int, kind: str, key: str,
+                           file_path: str, day: str, archive_type: str) -> Optional[Dict[str, Any]]:
+        """Archive one clip file, repoint its catalog row and remove the original"""
+        full_path = self.retention_engine.resolve_path(file_path)
+        already_archived = store.contains(key)
+        
+        result = {"stored": 0, "deduplicated": False, "original_size": 0, "already_archived": already_archived}
+        if not already_archived:
+            if not full_path:
+                return None
+            result["original_size"] = os.path.getsize(full_path)
+            payload_path = None
+            if archive_type != "store":
+                payload_path = self._compress_for_archive(full_path, archive_type)
+            try:
+                added = store.add(
+                    key, payload_path or full_path, day,
+                    clip_id=clip_id,
+                    original_size=result["original_size"],
+                    source_path=file_path
+                )
+            finally:
+                if payload_path and os.path.exists(payload_path):
+                    os.remove(payload_path)
+            result["stored"] = added["stored"]
+            result["deduplicated"] = added["deduplicated"]
+        
+        # El archivo original solo se borra cuando la fila ya apunta al archivo
+        # (también si una ejecución anterior se cortó entre los dos pasos)
+        column = VideoClipModel.road_video_file if kind == "road" else VideoClipModel.interior_video_file
+        with self.db_manager.session_scope() as session:
+            repointed = session.query(VideoClipModel).filter(
+                VideoClipModel.id == clip_id, column == file_path
+            ).update({column: archive_ref(key)}, synchronize_session=False)
+        if not repointed:
+            logger.warning(f"Clip {clip_id} changed while archiving, keeping {file_path}")
+            return result
+        
+        if full_path:
+            try:
+                os.remove(full_path)
+            except FileNotFoundError:
+                pass
+        return result
     
     def check_storage_status(self):
         """Check storage status and perform cleanup if needed"""
@@ -856,19 +891,10 @@ class DiskManager:
             self.mount_drive()
             return False
             
-        # Check if auto-clean is enabled
-        if not self.settings.get("autoCleanEnabled", False):
-            return True
-            
-        # Check if storage usage exceeds threshold
-        threshold = self.settings.get("autoCleanThreshold", 90)
-        if disk_info["percent"] >= threshold:
-            logger.warning(f"Storage usage ({disk_info['percent']}%) exceeds threshold ({threshold}%)")
-            
-            # Perform auto cleanup
-            days = self.settings.get("autoCleanDays", 30)
-            result = self.clean_old_videos(days)
-            
+        # Run a retention pass: with auto-clean enabled it expires old clips and
+        # keeps the free space above the configured watermark
+        result = self.retention_engine.enforce()
+        if result["deleted"]:
             logger.info(f"Auto cleanup: deleted {result['deleted']} videos, freed {result['freedSpace']} bytes")
             
         return True
@@ -881,7 +907,10 @@ class DiskManager:
             "autoCleanDays": self.settings.get("autoCleanDays", 30),
             "mainDrive": self.settings.get("mainDrive", "/dev/sda1"),
             "mountPoint": self.settings.get("mountPoint", "/mnt/dashcam_storage"),
-            "autoDetectDrives": self.settings.get("autoDetectDrives", True)
+            "autoDetectDrives": self.settings.get("autoDetectDrives", True),
+            "autoCleanTargetThreshold": self.settings.get("autoCleanTargetThreshold", DEFAULT_RETENTION_SETTINGS["autoCleanTargetThreshold"]),
+            "minFreeSpaceMB": self.settings.get("minFreeSpaceMB", DEFAULT_RETENTION_SETTINGS["minFreeSpaceMB"]),
+            "retentionDeleteRateMB": self.settings.get("retentionDeleteRateMB", DEFAULT_RETENTION_SETTINGS["retentionDeleteRateMB"])
         }
     
     def update_storage_settings(self, settings):
@@ -897,6 +926,12 @@ class DiskManager:
         """Clean up resources properly before shutdown"""
         logger.info("Cleaning up DiskManager resources")
         
+        # Stop the retention engine before touching the drive
+        try:
+            self.retention_engine.stop()
+        except Exception as e:
+            logger.error(f"Error stopping retention engine: {str(e)}")
+        
         # Save any pending settings
         try:
             self.save_settings()
@@ -19,7 +19,7 @@ Module Structure:
 from .services.reverse_geocoding_service import ReverseGeocodingService
 from .workers.reverse_geocoding_worker import ReverseGeocodingWorker
 from .downloader.geodata_downloader import GeodataDownloader
-from .downloader.nominatim_api import fetch_reverse_geocoding_from_nominatim
+from .downloader.nominatim_api import fetch_reverse_geocoding_from_nominatim, get_nominatim_client
 from .utils.coverage_calculator import calculate_trip_route_coverage
 from .utils.grid_generator import generate_comprehensive_grid_coverage, generate_grid_around_point
 from .utils.db_storage import store_geodata_in_db
@@ -29,6 +29,7 @@ __all__ = [
     'ReverseGeocodingWorker',
     'GeodataDownloader',
     'fetch_reverse_geocoding_from_nominatim',
+    'get_nominatim_client',
     'calculate_trip_route_coverage',
     'generate_comprehensive_grid_coverage',
     'generate_grid_around_point',
@@ -1,9 +1,11 @@
 """Geodata downloader module"""
 
 from .geodata_downloader import GeodataDownloader
-from .nominatim_api import fetch_reverse_geocoding_from_nominatim
+from .nominatim_api import NominatimHTTPClient, fetch_reverse_geocoding_from_nominatim, get_nominatim_client
 
 __all__ = [
     'GeodataDownloader',
-    'fetch_reverse_geocoding_from_nominatim'
+    'NominatimHTTPClient',
+    'fetch_reverse_geocoding_from_nominatim',
+    'get_nominatim_client'
 ]
@@ -0,0 +1,386 @@
+"""
+Download job engine for geodata grids.
+
+A job is a list of grid points to reverse geocode. Points are fetched by a
+bounded number of concurrent workers, all of them drawing from a token bucket
+shared by every job so the total request rate to Nominatim stays within its
+usage policy. Results are handed to the store in batches, and each point is
+checkpointed in SQLite once its result is stored, so a paused, cancelled or
+interrupted job continues where it stopped.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter usable from any event loop or thread.
+
+    Tokens are reserved under a plain lock (the balance may go negative), and
+    the caller then sleeps until its reservation is due. Callers are therefore
+    served in arrival order without holding a lock while they wait.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waiting = 0
+
+    def _reserve(self, tokens: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return max(0.0, -self._tokens / self.rate)
+
+    async def acquire(self, tokens: float = 1.0) -> float:
+        """Wait for ``tokens``; returns the time spent waiting"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            self.waiting += 1
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self.waiting -= 1
+        return wait
+
+
+# Límite compartido por todos los trabajos: la política de uso de Nominatim es 1 petición/s
+nominatim_rate_limiter = TokenBucket(rate=1.0, capacity=1.0)
+
+
+class DownloadPoint:
+    """A grid point to reverse geocode"""
+
+    __slots__ = ('lat', 'lon', 'point_type', 'radius_km', 'group', 'label')
+
+    def __init__(self, lat: float, lon: float, point_type: str = "grid_point",
+                 radius_km: float = 0.0, group: int = 0, label: str = ""):
+        self.lat = lat
+        self.lon = lon
+        self.point_type = point_type
+        self.radius_km = radius_km
+        self.group = group
+        self.label = label
+
+    @property
+    def key(self) -> str:
+        return f"{self.lat:.6f},{self.lon:.6f}"
+
+
+class DownloadCheckpointStore:
+    """Persistent job and per-point state in a small SQLite database"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS download_jobs (
+                job_id TEXT PRIMARY KEY,
+                trip_id TEXT,
+                params TEXT,
+                status TEXT NOT NULL,
+                total_points INTEGER DEFAULT 0,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS download_job_points (
+                job_id TEXT NOT NULL,
+                point_key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                PRIMARY KEY (job_id, point_key)
+            ) WITHOUT ROWID
+        """)
+        self._conn.commit()
+
+    def save_job(self, job_id: str, trip_id: Optional[str], params: Dict[str, Any],
+                 total_points: int, status: str):
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO download_jobs (job_id, trip_id, params, status, total_points, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(job_id) DO UPDATE SET
+                    status = excluded.status,
+                    total_points = excluded.total_points,
+                    updated_at = excluded.updated_at
+            """, (job_id, trip_id, json.dumps(params), status, total_points, now, now))
+            self._conn.commit()
+
+    def set_status(self, job_id: str, status: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE download_jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+                (status, datetime.now().isoformat(), job_id)
+            )
+            self._conn.commit()
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, trip_id, params, status, total_points, created_at, updated_at "
+                "FROM download_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            done = self._conn.execute(
+                "SELECT COUNT(*) FROM download_job_points WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+        return {
+            "job_id": row[0], "trip_id": row[1], "params": json.loads(row[2] or "{}"),
+            "status": row[3], "total_points": row[4], "completed_points": done,
+            "created_at": row[5], "updated_at": row[6]
+        }
+
+    def completed_points(self, job_id: str) -> Set[str]:
+        with self._lock:
+            return {row[0] for row in self._conn.execute(
+                "SELECT point_key FROM download_job_points WHERE job_id = ?", (job_id,)
+            )}
+
+    def mark_points(self, job_id: str, point_keys: Iterable[str], status: str = "done"):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO download_job_points (job_id, point_key, status) VALUES (?, ?, ?)",
+                [(job_id, key, status) for key in point_keys]
+            )
+            self._conn.commit()
+
+    def clear(self, job_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM download_job_points WHERE job_id = ?", (job_id,))
+            self._conn.execute("DELETE FROM download_jobs WHERE job_id = ?", (job_id,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# fetch(lat, lon) -> dict con la respuesta, {} si no hay lugar en ese punto, None si falló
+FetchFunction = Callable[[float, float], Awaitable[Optional[Dict]]]
+
+
+class GeodataDownloadJob:
+    """
+    Reverse geocode a list of points with bounded concurrency.
+
+    ``build_record(point, data)`` turns a response into the record passed to
+    ``store_batch(records)`` (a blocking function, run in a thread). Points
+    whose fetch failed are not checkpointed and are retried on the next run.
+    """
+
+    def __init__(self,
+                 job_id: str,
+                 points: List[DownloadPoint],
+                 fetch: FetchFunction,
+                 build_record: Callable[[DownloadPoint, Dict], Dict],
+                 store_batch: Callable[[List[Dict]], Any],
+                 checkpoint: Optional[DownloadCheckpointStore] = None,
+                 rate_limiter: Optional[TokenBucket] = None,
+                 concurrency: int = 4,
+                 batch_size: int = 50,
+                 progress_callback: Optional[Callable[["GeodataDownloadJob"], None]] = None):
+        self.job_id = job_id
+        self.points = points
+        self.fetch = fetch
+        self.build_record = build_record
+        self.store_batch = store_batch
+        self.checkpoint = checkpoint
+        self.rate_limiter = rate_limiter or nominatim_rate_limiter
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.progress_callback = progress_callback
+
+        self.status = "pending"
+        self.cancelled = False
+        self._run_event = asyncio.Event()
+        self._run_event.set()
+        self._buffer: List[tuple] = []
+        self._flush_lock = asyncio.Lock()
+        self.started_at: Optional[float] = None
+
+        self.stats = {
+            "total_points": len(points),
+            "completed_points": 0,
+            "resumed_points": 0,
+            "successful": 0,
+            "empty": 0,
+            "failed": 0,
+            "stored_records": 0
+        }
+        # Puntos completados por grupo (waypoint) para el progreso detallado
+        self.group_totals: Dict[int, int] = {}
+        self.group_completed: Dict[int, int] = {}
+        for point in points:
+            self.group_totals[point.group] = self.group_totals.get(point.group, 0) + 1
+
+    @property
+    def progress(self) -> float:
+        total = self.stats["total_points"]
+        return (self.stats["completed_points"] / total) * 100 if total else 100.0
+
+    @property
+    def rate_limited(self) -> bool:
+        return self.rate_limiter.waiting > 0
+
+    def estimated_time_remaining(self) -> Optional[float]:
+        """Seconds left, from this run's throughput"""
+        done_now = self.stats["completed_points"] - self.stats["resumed_points"]
+        if not self.started_at or done_now <= 0:
+            return None
+        elapsed = time.monotonic() - self.started_at
+        remaining = self.stats["total_points"] - self.stats["completed_points"]
+        return elapsed / done_now * remaining
+
+    def pause(self):
+        # También antes de run(): el job arrancará ya pausado
+        if self.status in ("pending", "running"):
+            self.status = "paused"
+            self._run_event.clear()
+            self._set_checkpoint_status()
+
+    def resume(self):
+        self._run_event.set()
+        if self.status == "paused":
+            self.status = "running"
+            self._set_checkpoint_status()
+
+    def cancel(self):
+        self.cancelled = True
+        self.status = "cancelled"
+        self._run_event.set()
+
+    def _set_checkpoint_status(self):
+        if self.checkpoint:
+            try:
+                self.checkpoint.set_status(self.job_id, self.status)
+            except Exception as e:
+                logger.debug(f"Could not persist job status: {e}")
+
+    def _report(self):
+        if self.progress_callback:
+            try:
+                self.progress_callback(self)
+            except Exception as e:
+                logger.debug(f"Error in download progress callback: {e}")
+
+    def _complete_point(self, point: DownloadPoint):
+        self.stats["completed_points"] += 1
+        self.group_completed[point.group] = self.group_completed.get(point.group, 0) + 1
+
+    async def _flush(self):
+        """Store buffered records, then checkpoint their points"""
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            batch, self._buffer = self._buffer, []
+            records = [record for _, record in batch if record is not None]
+            if records:
+                await asyncio.to_thread(self.store_batch, records)
+                self.stats["stored_records"] += len(records)
+            if self.checkpoint:
+                await asyncio.to_thread(self.checkpoint.mark_points, self.job_id,
+                                        [point.key for point, _ in batch])
+
+    async def _worker(self, queue: "asyncio.Queue[DownloadPoint]"):
+        while not self.cancelled:
+            if not self._run_event.is_set():
+                # Al pausar, dejar lo ya descargado guardado y marcado
+                await self._flush()
+                await self._run_event.wait()
+                continue
+
+            try:
+                point = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            await self.rate_limiter.acquire()
+            if self.cancelled:
+                return
+
+            try:
+                data = await self.fetch(point.lat, point.lon)
+            except Exception as e:
+                logger.debug(f"Fetch failed for {point.key}: {e}")
+                data = None
+
+            if data is None:
+                self.stats["failed"] += 1
+            elif data:
+                self.stats["successful"] += 1
+                self._buffer.append((point, self.build_record(point, data)))
+            else:
+                # Sin lugar en ese punto (mar, montaña): se marca para no repetirlo
+                self.stats["empty"] += 1
+                self._buffer.append((point, None))
+
+            self._complete_point(point)
+            if len(self._buffer) >= self.batch_size:
+                await self._flush()
+            self._report()
+
+    async def run(self) -> Dict[str, Any]:
+        """Run (or resume) the job until every point is processed or it is cancelled"""
+        self.started_at = time.monotonic()
+        # Cancelado antes de arrancar: no se descarga nada
+        if self.cancelled:
+            self.status = "cancelled"
+            self._set_checkpoint_status()
+            self._report()
+            return {"status": self.status, **self.stats}
+
+        # Pausado antes de arrancar: sigue pausado hasta resume()
+        self.status = "running" if self._run_event.is_set() else "paused"
+
+        done = set()
+        if self.checkpoint:
+            done = await asyncio.to_thread(self.checkpoint.completed_points, self.job_id)
+
+        queue: "asyncio.Queue[DownloadPoint]" = asyncio.Queue()
+        for point in self.points:
+            if point.key in done:
+                self._complete_point(point)
+                self.stats["resumed_points"] += 1
+            else:
+                queue.put_nowait(point)
+
+        if self.stats["resumed_points"]:
+            logger.info(f"Job {self.job_id}: resuming, {self.stats['resumed_points']}/"
+                        f"{len(self.points)} points already downloaded")
+        self._report()
+
+        try:
+            workers = [asyncio.create_task(self._worker(queue))
+                       for _ in range(min(self.concurrency, queue.qsize()))]
+            await asyncio.gather(*workers)
+            await self._flush()
+        except Exception:
+            self.status = "error"
+            self._set_checkpoint_status()
+            raise
+
+        self.status = "cancelled" if self.cancelled else "completed"
+        self._set_checkpoint_status()
+        self._report()
+        return {"status": self.status, **self.stats}
@@ -1,39 +1,285 @@
-"""Nominatim API wrapper for reverse geocoding."""
+"""
+Shared async HTTP client for the Nominatim API.
 
+Every Nominatim caller (reverse geocoding service, geodata downloads,
+/api/geocode and trip planner place search) goes through one client:
+  - one pooled aiohttp session per event loop, with HTTP keep-alive
+  - the global token bucket (nominatim_rate_limiter), also for retries
+  - retries only on 429/5xx, timeouts and connection errors, with jittered
+    exponential backoff, Retry-After support and a retry budget
+  - latency and error histograms (get_stats)
+"""
+
+import asyncio
 import logging
-from typing import Dict, Optional
-import requests
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+from .download_jobs import TokenBucket, nominatim_rate_limiter
 
 logger = logging.getLogger(__name__)
 
+NOMINATIM_BASE_URL = "https://nominatim.openstreetmap.org"
+NOMINATIM_USER_AGENT = "DashcamV2/1.0 (trip planner & offline geocoding)"
 
-async def fetch_reverse_geocoding_from_nominatim(lat: float, lon: float) -> Optional[Dict]:
-    """Fetch reverse geocoding data from OpenStreetMap Nominatim API"""
-    try:
-        url = "https://nominatim.openstreetmap.org/reverse"
-        params = {
-            "lat": lat,
-            "lon": lon,
-            "format": "json",
-            "addressdetails": 1,
-            "extratags": 1,
-            "namedetails": 1,
-            "zoom": 18  # High detail level
-        }
-        
-        headers = {
-            "User-Agent": "DashCam-TripPlanner/1.0 (offline geocoding preparation)"
+# Límites superiores de los cubos del histograma de latencia (ms)
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+DEFAULT_MAX_RETRIES = 2
+RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of the traffic.
+
+    Each request deposits ``ratio`` tokens (up to ``capacity``) and each
+    retry spends one, so during an outage retries stop once the budget is
+    spent instead of multiplying the load on Nominatim.
+    """
+
+    def __init__(self, ratio: float = 0.2, capacity: float = 10.0):
+        self.ratio = ratio
+        self.capacity = capacity
+        self._tokens = capacity
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+    @property
+    def tokens(self) -> float:
+        return self._tokens
+
+
+class NominatimHTTPClient:
+    """Pooled, rate limited and retrying Nominatim client usable from any event loop"""
+
+    def __init__(self,
+                 base_url: str = NOMINATIM_BASE_URL,
+                 user_agent: str = NOMINATIM_USER_AGENT,
+                 rate_limiter: Optional[TokenBucket] = None,
+                 max_connections: int = 4,
+                 timeout: float = 10.0,
+                 keepalive_timeout: float = 30.0,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 backoff_base: float = 0.5,
+                 backoff_max: float = 8.0,
+                 max_retry_after: float = 30.0,
+                 retry_budget: Optional[RetryBudget] = None):
+        self.base_url = base_url.rstrip("/")
+        self.user_agent = user_agent
+        self.rate_limiter = rate_limiter or nominatim_rate_limiter
+        self.max_connections = max(1, max_connections)
+        self.timeout = timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.retry_budget = retry_budget or RetryBudget()
+
+        # Las sesiones de aiohttp están ligadas a su event loop (CameraManager usa el suyo)
+        self._sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "requests": 0,
+            "attempts": 0,
+            "successful": 0,
+            "failed": 0,
+            "retries": 0,
+            "retry_budget_exhausted": 0,
+            "sessions_created": 0
         }
-        
-        # Make request with timeout
-        response = requests.get(url, params=params, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        return response.json()
-        
-    except requests.exceptions.RequestException as e:
-        logger.debug(f"HTTP error fetching reverse geocoding for ({lat:.4f}, {lon:.4f}): {str(e)}")
-        return None
-    except Exception as e:
-        logger.debug(f"Error fetching reverse geocoding for ({lat:.4f}, {lon:.4f}): {str(e)}")
+        self._latency_counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self._latency_total_ms = 0.0
+        self._errors: Dict[str, int] = {}
+
+    def _session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            session = self._sessions.get(loop)
+            if session is None or session.closed:
+                for other in [l for l in self._sessions if l.is_closed()]:
+                    del self._sessions[other]
+                session = aiohttp.ClientSession(
+                    headers={"User-Agent": self.user_agent},
+                    timeout=aiohttp.ClientTimeout(total=self.timeout),
+                    connector=aiohttp.TCPConnector(limit=self.max_connections,
+                                                   keepalive_timeout=self.keepalive_timeout)
+                )
+                self._sessions[loop] = session
+                self.stats["sessions_created"] += 1
+            return session
+
+    def _url(self, path: str) -> str:
+        if path.startswith(("http://", "https://")):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def _record(self, elapsed_ms: float, error: Optional[str] = None):
+        bucket = len(LATENCY_BUCKETS_MS)
+        for index, limit in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= limit:
+                bucket = index
+                break
+        with self._lock:
+            self.stats["attempts"] += 1
+            self._latency_counts[bucket] += 1
+            self._latency_total_ms += elapsed_ms
+            if error:
+                self._errors[error] = self._errors.get(error, 0) + 1
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        # Full jitter: evita que los reintentos de varios llamantes vayan sincronizados
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    @staticmethod
+    def _retry_after(response: aiohttp.ClientResponse) -> Optional[float]:
+        value = response.headers.get("Retry-After")
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return None
+
+    async def get_json(self, path: str, params: Optional[Dict[str, Any]] = None,
+                       acquire: bool = True, retries: Optional[int] = None) -> Optional[Any]:
+        """
+        GET ``path`` (relative to base_url, or an absolute URL) and parse the JSON body.
+
+        Returns None when the request failed. With ``acquire=False`` the
+        caller already took a rate limiter token for the first attempt;
+        retries always go through the rate limiter.
+        """
+        url = self._url(path)
+        max_retries = self.max_retries if retries is None else retries
+        with self._lock:
+            self.stats["requests"] += 1
+        self.retry_budget.deposit()
+
+        attempt = 0
+        while True:
+            if acquire or attempt > 0:
+                await self.rate_limiter.acquire()
+
+            retry_after = None
+            error = None
+            started = time.perf_counter()
+            try:
+                async with self._session().get(url, params=params) as response:
+                    if response.status == 200:
+                        data = await response.json(content_type=None)
+                        self._record((time.perf_counter() - started) * 1000)
+                        with self._lock:
+                            self.stats["successful"] += 1
+                        return data
+                    error = f"http_{response.status}"
+                    retryable = response.status in RETRYABLE_STATUS
+                    if response.status == 429:
+                        retry_after = self._retry_after(response)
+            except asyncio.TimeoutError:
+                error, retryable = "timeout", True
+            except aiohttp.ContentTypeError:
+                error, retryable = "invalid_response", False
+            except ValueError:
+                error, retryable = "invalid_json", False
+            except aiohttp.ClientError as e:
+                error, retryable = type(e).__name__, True
+            self._record((time.perf_counter() - started) * 1000, error)
+
+            if retryable and retry_after is not None and retry_after > self.max_retry_after:
+                retryable = False
+            if not retryable or attempt >= max_retries:
+                break
+            if not self.retry_budget.withdraw():
+                with self._lock:
+                    self.stats["retry_budget_exhausted"] += 1
+                break
+
+            delay = self._backoff(attempt, retry_after)
+            attempt += 1
+            with self._lock:
+                self.stats["retries"] += 1
+            logger.debug(f"Nominatim {error} for {url}, retry {attempt}/{max_retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+        with self._lock:
+            self.stats["failed"] += 1
+        logger.warning(f"Nominatim request failed ({error}) after {attempt + 1} attempt(s): {url}")
         return None
+
+    async def reverse(self, lat: float, lon: float, acquire: bool = True,
+                      retries: Optional[int] = None, **params) -> Optional[Dict]:
+        """Reverse geocode a point; extra Nominatim parameters via ``params``"""
+        query = {"lat": f"{lat:.7f}", "lon": f"{lon:.7f}", "format": "json", **params}
+        return await self.get_json("reverse", query, acquire=acquire, retries=retries)
+
+    async def search(self, query: str, limit: int = 10, **params) -> Optional[list]:
+        """Free-form place search"""
+        return await self.get_json("search", {"q": query, "format": "json", "limit": limit, **params})
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            attempts = self.stats["attempts"]
+            latency = {f"le_{limit}ms": count
+                       for limit, count in zip(LATENCY_BUCKETS_MS, self._latency_counts)}
+            latency["gt_{}ms".format(LATENCY_BUCKETS_MS[-1])] = self._latency_counts[-1]
+            return {
+                **self.stats,
+                "open_sessions": sum(1 for s in self._sessions.values() if not s.closed),
+                "retry_budget_tokens": round(self.retry_budget.tokens, 2),
+                "avg_latency_ms": round(self._latency_total_ms / attempts, 2) if attempts else 0.0,
+                "latency_histogram": latency,
+                "error_histogram": dict(self._errors)
+            }
+
+    async def close(self):
+        """Close the sessions; those of other running loops are closed on their loop"""
+        current = asyncio.get_running_loop()
+        with self._lock:
+            sessions = list(self._sessions.items())
+            self._sessions.clear()
+        for loop, session in sessions:
+            if session.closed:
+                continue
+            if loop is current:
+                await session.close()
+            elif loop.is_running():
+                asyncio.run_coroutine_threadsafe(session.close(), loop)
+
+
+_shared_client: Optional[NominatimHTTPClient] = None
+_shared_lock = threading.Lock()
+
+
+def get_nominatim_client() -> NominatimHTTPClient:
+    """Client shared by the whole process (global Nominatim rate limit)"""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = NominatimHTTPClient()
+        return _shared_client
+
+
+async def fetch_reverse_geocoding_from_nominatim(lat: float, lon: float) -> Optional[Dict]:
+    """Fetch reverse geocoding data from OpenStreetMap Nominatim API"""
+    return await get_nominatim_client().reverse(lat, lon, addressdetails=1, extratags=1,
+                                                namedetails=1, zoom=18)
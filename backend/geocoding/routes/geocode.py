@@ -1,9 +1,10 @@
 from fastapi import APIRouter, HTTPException
-import requests
 import logging
 from typing import Optional
 from pydantic import BaseModel
 
+from ..downloader.nominatim_api import get_nominatim_client
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,32 +23,19 @@ class ProcessClipRequest(BaseModel):
 async def reverse_geocode(lat: float, lon: float):
     """Get location name from coordinates using OpenStreetMap Nominatim API"""
     try:
-        # Use Nominatim API for reverse geocoding
-        reverse_url = "https://nominatim.openstreetmap.org/reverse"
-        
-        params = {
-            "lat": lat,
-            "lon": lon,
-            "format": "json",
-            "zoom": 14,  # Choose appropriate zoom level for neighborhood-level results
-            "addressdetails": 1
-        }
-        
-        # Add user-agent to comply with Nominatim usage policy
-        headers = {
-            "User-Agent": "DashcamV2/1.0"
-        }
-        
         logger.info(f"Reverse geocoding request for coordinates: {lat}, {lon}")
         
-        response = requests.get(reverse_url, params=params, headers=headers)
-        response.raise_for_status()
+        # zoom 14: nivel de barrio
+        result = await get_nominatim_client().reverse(lat, lon, zoom=14, addressdetails=1)
+        if result is None:
+            raise HTTPException(status_code=502, detail="Failed to reverse geocode: Nominatim unavailable")
         
-        result = response.json()
         logger.info(f"Reverse geocoding full result: {result}")
         logger.info(f"Reverse geocoding display_name: {result.get('display_name', 'Unknown location')}")
         
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in reverse geocoding: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to reverse geocode: {str(e)}")
@@ -204,7 +192,8 @@ async def get_service_stats():
         stats = reverse_geocoding_service.get_stats()
         return {
             "status": "success",
-            "stats": stats
+            "stats": stats,
+            "nominatim": get_nominatim_client().get_stats()
         }
         
     except Exception as e:
@@ -10,10 +10,10 @@ import time
 from datetime import datetime
 from pydantic import BaseModel
 from sse_starlette.sse import EventSourceResponse
-import requests
 
 # Import geocoding components
 from ..downloader.geodata_downloader import GeodataDownloader
+from ..downloader.nominatim_api import get_nominatim_client
 from ..utils.db_storage import DBStorage
 from ..utils.grid_generator import generate_comprehensive_grid_coverage
 
@@ -52,21 +52,11 @@ active_test = {
 @router.get("/connectivity")
 async def check_connectivity():
     """Check if online geocoding services are available"""
-    try:
-        # Test Nominatim connectivity
-        response = requests.get(
-            "https://nominatim.openstreetmap.org/reverse",
-            params={
-                "lat": 40.7589,
-                "lon": -73.9851,
-                "format": "json"
-            },
-            timeout=5
-        )
-        online_available = response.status_code == 200
-    except Exception as e:
-        logger.warning(f"Online connectivity test failed: {str(e)}")
-        online_available = False
+    # Test Nominatim connectivity (sin reintentos: solo interesa si responde ahora)
+    result = await get_nominatim_client().reverse(40.7589, -73.9851, retries=0)
+    online_available = result is not None
+    if not online_available:
+        logger.warning("Online connectivity test failed")
     
     return {
         "online": online_available,
@@ -445,6 +435,8 @@ async def test_online_geocoding(test_points, config):
                 stats["errors"] += 1
                 continue
         
+        await geocoding_downloader.close()
+        
         # Calculate call rate
         elapsed_time = time.time() - start_time
         if elapsed_time > 0:
@@ -2,17 +2,23 @@
 API routes for trip planner geodata management
 """
 from fastapi import APIRouter, HTTPException, BackgroundTasks, Request
+from fastapi.responses import FileResponse
 from typing import List, Dict, Any, Optional
 import asyncio
+import functools
+import hashlib
 import logging
 import json
+import os
 from datetime import datetime
 from pydantic import BaseModel
 from sse_starlette.sse import EventSourceResponse
 
 # Import geocoding components
-from ..downloader.geodata_downloader import GeodataDownloader
-from ..utils.db_storage import store_geodata_in_db
+from ..downloader.download_jobs import DownloadCheckpointStore
+from ..downloader.geodata_downloader import GeodataDownloader, build_corridor_points
+from ..utils.db_storage import DEFAULT_GEOCODING_DB_PATH, store_geodata_batch
+from ..utils.gazetteer_pack import GazetteerPackStore
 
 logger = logging.getLogger(__name__)
 
@@ -55,6 +61,15 @@ class WaypointGeoProgress(BaseModel):
 # Global storage for active downloads - will be replaced with proper state management
 active_geodata_downloads = {}
 
+# Running download jobs by trip, used by pause/resume/cancel
+active_geodata_jobs = {}
+
+# Per-point checkpoints of download jobs, created on first use
+_checkpoint_store: Optional[DownloadCheckpointStore] = None
+
+# Exportable gazetteer packs built from the downloaded geodata
+_gazetteer_store: Optional[GazetteerPackStore] = None
+
 # Dependencies that will be injected
 planned_trips = []
 audio_notifier = None
@@ -83,7 +98,8 @@ async def download_waypoint_geodata(
         raise HTTPException(status_code=404, detail="Planned trip not found")
     
     # Check if there's already an active download for this trip
-    if trip_id in active_geodata_downloads:
+    existing = active_geodata_downloads.get(trip_id)
+    if existing is not None and existing.get("status") not in ("complete", "error"):
         return {
             "status": "in_progress",
             "message": "Waypoint geodata download already in progress"
@@ -148,8 +164,12 @@ async def cancel_waypoint_geodata_download(trip_id: str):
         return {"status": "not_found", "message": "No download in progress for this trip"}
     
     try:
-        # Remove from active downloads to signal cancellation
+        # Remove from active downloads and stop the job; its checkpoints are kept,
+        # so starting the same download again continues where it stopped
         del active_geodata_downloads[trip_id]
+        job = active_geodata_jobs.get(trip_id)
+        if job is not None:
+            job.cancel()
         
         logger.info(f"[GEODATA_DOWNLOAD] Download cancelled for trip {trip_id}")
         
@@ -170,6 +190,9 @@ async def pause_geodata_download(trip_id: str):
     
     try:
         active_geodata_downloads[trip_id]["status"] = "paused"
+        job = active_geodata_jobs.get(trip_id)
+        if job is not None:
+            job.pause()
         logger.info(f"[GEODATA_DOWNLOAD] Download paused for trip {trip_id}")
         
         return {
@@ -189,6 +212,9 @@ async def resume_geodata_download(trip_id: str):
     
     try:
         active_geodata_downloads[trip_id]["status"] = "downloading"
+        job = active_geodata_jobs.get(trip_id)
+        if job is not None:
+            job.resume()
         logger.info(f"[GEODATA_DOWNLOAD] Download resumed for trip {trip_id}")
         
         return {
@@ -286,398 +312,248 @@ async def get_waypoint_geodata_download_stream(request: Request, trip_id: str):
     
     return EventSourceResponse(event_generator())
 
+@router.post("/{trip_id}/gazetteer-pack")
+async def build_trip_gazetteer_pack(trip_id: str, full: bool = False):
+    """Build (incrementally, unless full) the offline gazetteer pack of a trip"""
+    if not os.path.exists(DEFAULT_GEOCODING_DB_PATH):
+        raise HTTPException(status_code=404, detail="No offline geodata downloaded yet")
+    try:
+        result = await asyncio.to_thread(_get_gazetteer_store().build_trip_pack, trip_id, full)
+    except Exception as e:
+        logger.error(f"Error building gazetteer pack for trip {trip_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to build gazetteer pack: {str(e)}")
+    return {"status": "success", "trip_id": trip_id, **result}
+
+@router.get("/{trip_id}/gazetteer-pack")
+async def download_trip_gazetteer_pack(trip_id: str):
+    """Download the gazetteer pack of a trip (build it first with POST)"""
+    path = _get_gazetteer_store().trip_pack_path(trip_id)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Gazetteer pack not built for this trip")
+    return FileResponse(path, media_type="application/octet-stream", filename=os.path.basename(path))
+
+def _collect_trip_waypoints(trip) -> List[Dict[str, Any]]:
+    """Start location, waypoints and end location of a planned trip"""
+    all_waypoints = [{
+        "lat": trip.start_location["lat"],
+        "lon": trip.start_location["lon"],
+        "name": trip.origin_name or "Start Location",
+        "type": "start"
+    }]
+    
+    if trip.waypoints:
+        for i, wp in enumerate(trip.waypoints):
+            all_waypoints.append({
+                "lat": wp.lat,
+                "lon": wp.lon,
+                "name": wp.name or f"Waypoint {i+1}",
+                "type": "waypoint"
+            })
+    
+    all_waypoints.append({
+        "lat": trip.end_location["lat"],
+        "lon": trip.end_location["lon"],
+        "name": trip.destination_name or "Destination",
+        "type": "end"
+    })
+    return all_waypoints
+
+def _format_eta(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "Calculando..."
+    if seconds < 60:
+        return f"{int(seconds)}s"
+    if seconds < 3600:
+        return f"{int(seconds / 60)}m {int(seconds % 60)}s"
+    return f"{int(seconds / 3600)}h {int((seconds % 3600) / 60)}m"
+
+def _get_checkpoint_store() -> DownloadCheckpointStore:
+    global _checkpoint_store
+    if _checkpoint_store is None:
+        _checkpoint_store = DownloadCheckpointStore(
+            os.path.join(os.path.dirname(DEFAULT_GEOCODING_DB_PATH), "geodata_download_jobs.db")
+        )
+    return _checkpoint_store
+
+def _get_gazetteer_store() -> GazetteerPackStore:
+    global _gazetteer_store
+    if _gazetteer_store is None:
+        _gazetteer_store = GazetteerPackStore(DEFAULT_GEOCODING_DB_PATH)
+    return _gazetteer_store
+
+def _coverage_db_paths() -> tuple:
+    """Databases whose stored places and cache entries count as coverage"""
+    paths = [DEFAULT_GEOCODING_DB_PATH]
+    try:
+        from config import config
+        paths.append(config.geocoding_db_path)
+    except ImportError:
+        pass
+    unique = []
+    for path in paths:
+        if os.path.exists(path) and os.path.abspath(path) not in map(os.path.abspath, unique):
+            unique.append(path)
+    return tuple(unique)
+
+def _download_job_id(trip_id: str, params: Dict[str, Any]) -> str:
+    """Same trip and parameters -> same job, so a new request resumes the checkpoints"""
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+    return f"{trip_id}:{digest}"
+
 # Background function for downloading geodata with pause support and granular progress
 async def download_waypoint_geodata_background(trip, radius_km: float, format: str, trip_id: str, 
                                              use_single_center: bool = False, center_lat: float = None, center_lon: float = None):
     """Background task to download waypoint geodata with progress tracking and pause support"""
     global active_geodata_downloads
     
+    geocoding_downloader = GeodataDownloader()
+    job = None
+    
     try:
-        # Create a progress callback for the downloader
-        def update_waypoint_progress(progress_percent: float, detail: str, grid_processed: int = 0, grid_total: int = 0, 
-                                   successful_calls: int = 0, failed_calls: int = 0, rate_limit_wait: bool = False):
-            """Update progress for current waypoint grid processing"""
-            if trip_id in active_geodata_downloads:
-                active_geodata_downloads[trip_id].update({
-                    "current_waypoint_progress": progress_percent,
-                    "current_waypoint_grid_processed": grid_processed,
-                    "current_waypoint_grid_total": grid_total,
-                    "successful_api_calls": successful_calls,
-                    "failed_api_calls": failed_calls,
-                    "api_rate_limit_wait": rate_limit_wait,
-                    "grid_detail": detail
-                })
-        
-        # Initialize geocoding components with progress callback
-        geocoding_downloader = GeodataDownloader(progress_callback=update_waypoint_progress)
+        all_waypoints = _collect_trip_waypoints(trip)
+        optimized = use_single_center and center_lat is not None and center_lon is not None
         
-        # Collect all waypoints including start and end locations FIRST
-        all_waypoints = []
-        
-        # Add start location
-        all_waypoints.append({
-            "lat": trip.start_location["lat"],
-            "lon": trip.start_location["lon"],
-            "name": trip.origin_name or "Start Location",
-            "type": "start"
-        })
-        
-        # Add waypoints
-        if trip.waypoints:
-            for i, wp in enumerate(trip.waypoints):
-                all_waypoints.append({
-                    "lat": wp.lat,
-                    "lon": wp.lon,
-                    "name": wp.name or f"Waypoint {i+1}",
-                    "type": "waypoint"
-                })
-        
-        # Add end location
-        all_waypoints.append({
-            "lat": trip.end_location["lat"],
-            "lon": trip.end_location["lon"],
-            "name": trip.destination_name or "Destination",
-            "type": "end"
-        })
-        
-        # Determine the appropriate radius for different approaches
-        optimized_radius = radius_km  # This is the optimized radius from frontend
-        traditional_waypoint_radius = 10.0  # Default radius for individual waypoints
-        waypoint_radii = None
-        adaptation_stats = {}
-        
-        # If using single center optimization, use the optimized radius
-        # Otherwise, calculate adaptive radii for traditional approach
-        if use_single_center:
-            effective_radius = optimized_radius
-            waypoint_radii = None  # Not used in single center approach
-            adaptation_stats = None
+        # Corredor alrededor de la ruta completa (o círculo del centro optimizado),
+        # sin las celdas que ya tienen datos en la BD offline o en la caché
+        if optimized:
+            center_name = f"Centro optimizado del viaje {trip.name}"
+            groups = [{"name": center_name, "type": "center"}]
+            polyline = [(center_lat, center_lon)]
+            logger.info(f"[GEODATA_DOWNLOAD] Using optimized single-center approach: center=({center_lat:.4f}, {center_lon:.4f}), radius={radius_km:.1f}km")
         else:
-            # Import the adaptive radius calculator
-            from ..utils.adaptive_radius_calculator import calculate_adaptive_radii_for_waypoints
-            
-            # Calculate adaptive radii for each waypoint
-            waypoint_radii, adaptation_stats = calculate_adaptive_radii_for_waypoints(all_waypoints)
-            effective_radius = traditional_waypoint_radius  # Fallback, will be overridden per waypoint
-            
-            logger.info(f"[GEODATA_DOWNLOAD] Adaptive radii calculated: "
-                       f"avg={adaptation_stats['avg_radius_km']:.1f}km, "
-                       f"range={adaptation_stats['min_radius_km']:.1f}-{adaptation_stats['max_radius_km']:.1f}km, "
-                       f"efficiency_gain={adaptation_stats['estimated_efficiency_gain']:.1f}%")
+            # El grupo de cada celda es el tramo de la ruta, que empieza en el waypoint del mismo índice
+            groups = all_waypoints
+            polyline = [(waypoint['lat'], waypoint['lon']) for waypoint in all_waypoints]
         
-        logger.info(f"[GEODATA_DOWNLOAD] Radius settings - Optimized: {optimized_radius:.1f}km, "
-                   f"Using: {'single_center' if use_single_center else 'adaptive_per_waypoint'} "
-                   f"(single_center: {use_single_center})")
+        points, corridor_plan = await asyncio.to_thread(
+            build_corridor_points, polyline, radius_km, _coverage_db_paths()
+        )
+        logger.info(f"[GEODATA_DOWNLOAD] Corridor for trip {trip_id}: {corridor_plan['total_cells']} cells, "
+                   f"{corridor_plan['covered_cells']} already covered, {len(points)} to download")
         
-        total_waypoints = len(all_waypoints)
-        processed_waypoints = 0
-        start_time = datetime.now()
+        total_waypoints = len(groups)
+        params = {
+            "radius_km": radius_km,
+            "use_single_center": optimized,
+            "center_lat": center_lat if optimized else None,
+            "center_lon": center_lon if optimized else None
+        }
+        checkpoint = _get_checkpoint_store()
+        job_id = _download_job_id(trip_id, params)
         
-        # Initialize progress only if download is still active
-        if trip_id in active_geodata_downloads:
-            optimization_info = ""
-            if use_single_center and center_lat is not None and center_lon is not None:
-                optimization_info = " (usando optimización de centro único)"
+        def report(current_job):
+            state = active_geodata_downloads.get(trip_id)
+            if state is None:
+                return
+            
+            # Primer waypoint con puntos pendientes
+            waypoints_done = 0
+            current_index = None
+            for index in range(total_waypoints):
+                if current_job.group_completed.get(index, 0) >= current_job.group_totals.get(index, 0):
+                    waypoints_done += 1
+                elif current_index is None:
+                    current_index = index
+            if current_index is None:
+                current_index = total_waypoints - 1
+            grid_total = current_job.group_totals.get(current_index, 0)
+            grid_processed = current_job.group_completed.get(current_index, 0)
+            current_name = groups[current_index]["name"]
             
-            active_geodata_downloads[trip_id].update({
+            state.update({
+                "progress": current_job.progress,
+                "detail": f"Procesando {current_name} - {current_job.stats['completed_points']}/{len(points)} puntos",
+                "waypoints_processed": waypoints_done,
                 "total_waypoints": total_waypoints,
-                "waypoints_processed": 0,
-                "progress": 0,
-                "detail": f"Inicializando descarga de geodatos{optimization_info}...",
-                "status": "downloading",
-                "current_phase": "initializing",
-                "successful_api_calls": 0,
-                "failed_api_calls": 0,
-                "estimated_time_remaining": "Calculando...",
-                "optimization_used": use_single_center
+                "current_waypoint_index": current_index,
+                "current_waypoint_name": current_name,
+                "current_waypoint_radius": radius_km,
+                "current_waypoint_progress": (grid_processed / grid_total) * 100 if grid_total else 100,
+                "current_waypoint_grid_processed": grid_processed,
+                "current_waypoint_grid_total": grid_total,
+                "successful_api_calls": current_job.stats["successful"],
+                "failed_api_calls": current_job.stats["failed"],
+                "api_rate_limit_wait": current_job.rate_limited,
+                "db_records": current_job.stats["stored_records"],
+                "estimated_time_remaining": _format_eta(current_job.estimated_time_remaining()),
+                "current_phase": "downloading_optimized" if optimized else "downloading_waypoint",
+                "status": "paused" if current_job.status == "paused" else "downloading"
             })
-        else:
-            # Download was cancelled before starting
+        
+        job = geocoding_downloader.create_job(
+            job_id,
+            points,
+            functools.partial(store_geodata_batch, trip_id=trip_id),
+            checkpoint=checkpoint,
+            progress_callback=report
+        )
+        
+        # Cancelled before starting
+        if trip_id not in active_geodata_downloads:
             logger.info(f"[GEODATA_DOWNLOAD] Download cancelled for trip {trip_id} before starting")
             return
         
-        logger.info(f"[GEODATA_DOWNLOAD] Starting geodata download for trip {trip_id} with {total_waypoints} waypoints")
+        active_geodata_jobs[trip_id] = job
+        if active_geodata_downloads[trip_id].get("status") == "paused":
+            job.pause()
         
-        # Check if we should use optimized single-center approach
-        if use_single_center and center_lat is not None and center_lon is not None:
-            logger.info(f"[GEODATA_DOWNLOAD] Using optimized single-center approach: center=({center_lat:.4f}, {center_lon:.4f}), radius={optimized_radius:.1f}km")
-            
-            # Update progress to indicate optimized approach
-            if trip_id in active_geodata_downloads:
-                active_geodata_downloads[trip_id].update({
-                    "progress": 10,
-                    "detail": f"Descargando geodatos desde centro optimizado ({center_lat:.4f}, {center_lon:.4f})...",
-                    "current_phase": "downloading_optimized",
-                    "optimization_center": {"lat": center_lat, "lon": center_lon}
-                })
-            
-            try:
-                # Download geodata for the optimized center point
-                center_name = f"Centro optimizado del viaje {trip.name}"
-                logger.info(f"[GEODATA_DOWNLOAD] Downloading geodata for optimized center: {center_name}")
-                
-                geodata_results = await geocoding_downloader.download_geodata_for_location(
-                    center_lat, center_lon, optimized_radius, center_name
-                )
-                
-                # Update progress to saving phase
-                if trip_id in active_geodata_downloads:
-                    active_geodata_downloads[trip_id].update({
-                        "progress": 80,
-                        "detail": f"Guardando {len(geodata_results) if geodata_results else 0} registros desde descarga optimizada...",
-                        "current_phase": "saving_data"
-                    })
-                
-                saved_count = 0
-                if geodata_results:
-                    logger.info(f"[GEODATA_DOWNLOAD] Saving {len(geodata_results)} records from optimized download")
-                    
-                    for geodata_record in geodata_results:
-                        try:
-                            # Create waypoint dict for storage function
-                            waypoint_data = {
-                                'lat': geodata_record['lat'],
-                                'lon': geodata_record['lon']
-                            }
-                            
-                            # Use the enhanced store_geodata_in_db function
-                            await store_geodata_in_db(geodata_record, trip_id, waypoint_data)
-                            saved_count += 1
-                        except Exception as save_error:
-                            logger.warning(f"Error saving optimized geodata record: {save_error}")
-                
-                # Mark as complete
-                if trip_id in active_geodata_downloads:
-                    completion_message = f"Descarga optimizada completada: {saved_count} registros guardados desde centro único"
-                    
-                    active_geodata_downloads[trip_id] = {
-                        "progress": 100,
-                        "detail": completion_message,
-                        "status": "complete",
-                        "waypoints_processed": 1,  # Single optimized center
-                        "total_waypoints": 1,
-                        "current_phase": "complete",
-                        "successful_api_calls": 1,
-                        "failed_api_calls": 0,
-                        "csv_records": 0,  # Not used in optimized approach
-                        "db_records": saved_count,
-                        "estimated_time_remaining": "Completado",
-                        "optimization_used": True,
-                        "optimization_center": {"lat": center_lat, "lon": center_lon},
-                        "optimization_radius_km": optimized_radius
-                    }
-                    
-                    logger.info(f"[GEODATA_DOWNLOAD] Optimized geodata download completed for trip {trip_id}: {saved_count} records")
-                
-                # Notify user of optimized completion
-                if audio_notifier:
-                    audio_notifier.announce(
-                        f"Descarga optimizada de geodatos completada para el viaje {trip.name} con {saved_count} registros"
-                    )
-                
-                return  # Exit here for optimized approach
-                
-            except Exception as e:
-                logger.error(f"[GEODATA_DOWNLOAD] Error in optimized geodata download: {str(e)}")
-                # Fall back to traditional approach if optimized fails
-                if trip_id in active_geodata_downloads:
-                    active_geodata_downloads[trip_id].update({
-                        "detail": f"Error en descarga optimizada, cambiando a método tradicional: {str(e)}",
-                        "optimization_used": False
-                    })
-                logger.info(f"[GEODATA_DOWNLOAD] Falling back to traditional waypoint-by-waypoint approach")
-                # Continue with traditional approach below
+        optimization_info = " (usando optimización de centro único)" if optimized else ""
+        active_geodata_downloads[trip_id].update({
+            "total_waypoints": total_waypoints,
+            "waypoints_processed": 0,
+            "progress": 0,
+            "detail": f"Inicializando descarga de geodatos{optimization_info}...",
+            "current_phase": "initializing",
+            "successful_api_calls": 0,
+            "failed_api_calls": 0,
+            "estimated_time_remaining": "Calculando...",
+            "optimization_used": optimized,
+            "optimization_center": {"lat": center_lat, "lon": center_lon} if optimized else None,
+            "optimization_radius_km": radius_km if optimized else None
+        })
         
-        # Traditional waypoint-by-waypoint approach
-        approach_description = "adaptive radii" if waypoint_radii else f"{effective_radius:.1f}km radius"
-        logger.info(f"[GEODATA_DOWNLOAD] Using traditional waypoint-by-waypoint approach with {approach_description} per waypoint")
+        await asyncio.to_thread(checkpoint.save_job, job_id, trip_id, params, len(points), "running")
+        logger.info(f"[GEODATA_DOWNLOAD] Starting geodata download for trip {trip_id}: "
+                   f"{total_waypoints} waypoints, {len(points)} points (job {job_id})")
         
-        # Process each waypoint
-        for i, waypoint in enumerate(all_waypoints):
-            # Check if download was paused
-            if trip_id in active_geodata_downloads and active_geodata_downloads[trip_id].get('status') == 'paused':
-                logger.info(f"[GEODATA_DOWNLOAD] Download paused for trip {trip_id} at waypoint {i+1}")
-                return
-            
-            # Calculate estimated time remaining
-            if i > 0:
-                elapsed_time = (datetime.now() - start_time).total_seconds()
-                avg_time_per_waypoint = elapsed_time / i
-                remaining_waypoints = total_waypoints - i
-                estimated_remaining_seconds = avg_time_per_waypoint * remaining_waypoints
-                
-                if estimated_remaining_seconds < 60:
-                    estimated_time = f"{int(estimated_remaining_seconds)}s"
-                elif estimated_remaining_seconds < 3600:
-                    estimated_time = f"{int(estimated_remaining_seconds / 60)}m {int(estimated_remaining_seconds % 60)}s"
-                else:
-                    hours = int(estimated_remaining_seconds / 3600)
-                    minutes = int((estimated_remaining_seconds % 3600) / 60)
-                    estimated_time = f"{hours}h {minutes}m"
-            else:
-                estimated_time = "Calculando..."
-            
-            # Update progress only if download is still active
-            if trip_id in active_geodata_downloads:
-                waypoint_radius = waypoint_radii[i] if waypoint_radii else effective_radius
-                progress = (i / total_waypoints) * 100
-                active_geodata_downloads[trip_id].update({
-                    "progress": progress,
-                    "detail": f"Procesando {waypoint['name']} ({waypoint['type']}) - Radio: {waypoint_radius:.1f}km...",
-                    "waypoints_processed": i,
-                    "current_waypoint_index": i,
-                    "current_waypoint_name": waypoint['name'],
-                    "current_waypoint_radius": waypoint_radius,
-                    "current_phase": "downloading_waypoint",
-                    "current_waypoint_progress": 0,
-                    "current_waypoint_grid_processed": 0,
-                    "current_waypoint_grid_total": 0,
-                    "estimated_time_remaining": estimated_time,
-                    "status": "downloading"
-                })
-            else:
-                # Download was cancelled, stop processing
-                logger.info(f"[GEODATA_DOWNLOAD] Download cancelled for trip {trip_id} - stopping")
-                return
-            
-            logger.info(f"[GEODATA_DOWNLOAD] Processing waypoint {i+1}/{total_waypoints}: {waypoint['name']}")
-            
-            try:
-                # Determine the radius for this specific waypoint
-                waypoint_radius = waypoint_radii[i] if waypoint_radii else effective_radius
-                
-                # Use the geocoding downloader to download geodata for this waypoint
-                logger.info(f"[GEODATA_DOWNLOAD] Iniciando descarga de geodatos para waypoint {i+1}/{total_waypoints}: {waypoint['name']} (radio: {waypoint_radius:.1f}km)")
-                
-                # Update phase to downloading
-                if trip_id in active_geodata_downloads:
-                    active_geodata_downloads[trip_id]["current_phase"] = "downloading_waypoint"
-                
-                geodata_results = await geocoding_downloader.download_geodata_for_location(
-                    waypoint['lat'], waypoint['lon'], waypoint_radius, waypoint['name']
-                )
-                
-                # Update phase to saving data
-                if trip_id in active_geodata_downloads:
-                    active_geodata_downloads[trip_id]["current_phase"] = "saving_data"
-                    active_geodata_downloads[trip_id]["detail"] = f"Guardando datos para {waypoint['name']}..."
-                
-                if geodata_results:
-                    # Save to database using enhanced storage system
-                    logger.info(f"[GEODATA_DOWNLOAD] Guardando {len(geodata_results)} registros en BD para {waypoint['name']}")
-                    
-                    saved_count = 0
-                    for geodata_record in geodata_results:
-                        try:
-                            # Create waypoint dict for storage function
-                            waypoint_data = {
-                                'lat': geodata_record['lat'],
-                                'lon': geodata_record['lon']
-                            }
-                            
-                            # Use the enhanced store_geodata_in_db function
-                            await store_geodata_in_db(geodata_record, trip_id, waypoint_data)
-                            saved_count += 1
-                        except Exception as save_error:
-                            logger.warning(f"Error saving geodata record for {waypoint['name']}: {save_error}")
-                    
-                    # Update DB records count
-                    if trip_id in active_geodata_downloads:
-                        current_db = active_geodata_downloads[trip_id].get("db_records", 0)
-                        active_geodata_downloads[trip_id]["db_records"] = current_db + saved_count
-                    
-                    logger.info(f"[GEODATA_DOWNLOAD] Successfully saved {saved_count}/{len(geodata_results)} records for {waypoint['name']}")
-                
-                processed_waypoints += 1
-                
-                # Update total successful API calls
-                if trip_id in active_geodata_downloads:
-                    current_successful = active_geodata_downloads[trip_id].get("successful_api_calls", 0)
-                    current_failed = active_geodata_downloads[trip_id].get("failed_api_calls", 0)
-                    
-                    # Add the successful calls from this waypoint
-                    grid_successful = active_geodata_downloads[trip_id].get("current_waypoint_grid_processed", 0)
-                    total_successful = current_successful + grid_successful
-                    
-                    active_geodata_downloads[trip_id]["successful_api_calls"] = total_successful
-                
-                # Update progress after completing waypoint only if download is still active
-                if trip_id in active_geodata_downloads:
-                    progress = (processed_waypoints / total_waypoints) * 100
-                    active_geodata_downloads[trip_id].update({
-                        "progress": progress,
-                        "waypoints_processed": processed_waypoints,
-                        "current_phase": "completing_waypoint",
-                        "detail": f"Completado {waypoint['name']} ({processed_waypoints}/{total_waypoints})",
-                        "current_waypoint_progress": 100
-                    })
-                else:
-                    # Download was cancelled, stop processing
-                    logger.info(f"[GEODATA_DOWNLOAD] Download cancelled for trip {trip_id} after waypoint completion - stopping")
-                    return
-                
-                # Brief pause between waypoints
-                await asyncio.sleep(0.5)
-                
-            except Exception as e:
-                logger.error(f"[GEODATA_DOWNLOAD] Error processing waypoint {waypoint['name']}: {str(e)}")
-                
-                # Update failed API calls count
-                if trip_id in active_geodata_downloads:
-                    current_failed = active_geodata_downloads[trip_id].get("failed_api_calls", 0)
-                    active_geodata_downloads[trip_id]["failed_api_calls"] = current_failed + 1
-                    active_geodata_downloads[trip_id]["detail"] = f"Error en {waypoint['name']}: {str(e)}"
-                
-                continue
+        result = await job.run()
         
-        # Check if download was paused before completion
-        if trip_id in active_geodata_downloads and active_geodata_downloads[trip_id].get('status') == 'paused':
-            logger.info(f"[GEODATA_DOWNLOAD] Download paused for trip {trip_id} before completion")
+        if result["status"] == "cancelled":
+            logger.info(f"[GEODATA_DOWNLOAD] Download was cancelled for trip {trip_id} - "
+                       f"{result['completed_points']}/{len(points)} points kept for resuming")
             return
         
-        # Mark as complete only if download is still active
+        total_db_records = result["stored_records"]
+        completion_message = f"Geodatos descargados para {total_waypoints} waypoints"
+        if result["resumed_points"]:
+            completion_message += f" ({result['resumed_points']} puntos reanudados de una descarga anterior)"
+        completion_message += f" - {total_db_records} registros BD"
+        completion_message += f" - {result['successful']} llamadas exitosas, {result['failed']} fallos"
+        
+        if corridor_plan["covered_cells"]:
+            completion_message += f" - {corridor_plan['covered_cells']} celdas ya disponibles sin descargar"
+        
         if trip_id in active_geodata_downloads:
-            total_successful_calls = active_geodata_downloads[trip_id].get("successful_api_calls", 0)
-            total_failed_calls = active_geodata_downloads[trip_id].get("failed_api_calls", 0)
-            total_csv_records = active_geodata_downloads[trip_id].get("csv_records", 0)
-            total_db_records = active_geodata_downloads[trip_id].get("db_records", 0)
-            
-            completion_message = f"Geodatos descargados para {processed_waypoints} waypoints"
-            if total_csv_records > 0 or total_db_records > 0:
-                completion_message += f" - {total_csv_records} registros CSV, {total_db_records} registros BD"
-            completion_message += f" - {total_successful_calls} llamadas exitosas, {total_failed_calls} fallos"
-            
-            # Add adaptive radius statistics if used
-            adaptive_stats = {}
-            if waypoint_radii:
-                adaptive_stats = {
-                    "adaptive_radii_used": True,
-                    "avg_radius_km": sum(waypoint_radii) / len(waypoint_radii),
-                    "min_radius_km": min(waypoint_radii),
-                    "max_radius_km": max(waypoint_radii),
-                    "efficiency_gain_percent": adaptation_stats.get('estimated_efficiency_gain', 0)
-                }
-                completion_message += f" - Radio adaptativo promedio: {adaptive_stats['avg_radius_km']:.1f}km"
-            
             active_geodata_downloads[trip_id] = {
                 "progress": 100,
                 "detail": completion_message,
                 "status": "complete",
-                "waypoints_processed": processed_waypoints,
+                "waypoints_processed": total_waypoints,
                 "total_waypoints": total_waypoints,
                 "current_phase": "complete",
-                "successful_api_calls": total_successful_calls,
-                "failed_api_calls": total_failed_calls,
-                "csv_records": total_csv_records,
+                "successful_api_calls": result["successful"],
+                "failed_api_calls": result["failed"],
+                "csv_records": 0,
                 "db_records": total_db_records,
                 "estimated_time_remaining": "Completado",
-                "optimization_used": use_single_center,
-                **adaptive_stats
+                "optimization_used": optimized,
+                "optimization_center": {"lat": center_lat, "lon": center_lon} if optimized else None,
+                "optimization_radius_km": radius_km if optimized else None,
+                "corridor_cells": corridor_plan["total_cells"],
+                "covered_cells": corridor_plan["covered_cells"]
             }
-            
-            logger.info(f"[GEODATA_DOWNLOAD] Geodata download completed for trip {trip_id}")
-        else:
-            logger.info(f"[GEODATA_DOWNLOAD] Download was cancelled for trip {trip_id} - not marking as complete")
+        
+        logger.info(f"[GEODATA_DOWNLOAD] Geodata download completed for trip {trip_id}: {completion_message}")
         
         # Notify user
         if audio_notifier:
@@ -702,3 +578,7 @@ async def download_waypoint_geodata_background(trip, radius_km: float, format: s
                 )
         else:
             logger.info(f"[GEODATA_DOWNLOAD] Download was cancelled for trip {trip_id} - not reporting error")
+    finally:
+        if job is not None and active_geodata_jobs.get(trip_id) is job:
+            del active_geodata_jobs[trip_id]
+        await geocoding_downloader.close()
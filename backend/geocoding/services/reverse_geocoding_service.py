@@ -5,18 +5,22 @@ Proporciona funcionalidad de reverse geocoding online (Nominatim) y offline.
 """
 
 import asyncio
-import aiohttp
+import concurrent.futures
 import sqlite3
 import json
 import logging
 import os
 import time
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional, Dict, List, Tuple, Union
-from urllib.parse import urlencode
 from dataclasses import dataclass, asdict
 from pathlib import Path
 
+from geocoding.downloader.nominatim_api import NominatimHTTPClient, get_nominatim_client
+from geocoding.utils import geohash
+
 logger = logging.getLogger(__name__)
 
 @dataclass
@@ -86,172 +90,268 @@ class LocationInfo:
         return ', '.join(parts) if parts else 'Ubicación desconocida'
 
 class ReverseGeocodingCache:
-    """Cache para resultados de reverse geocoding"""
+    """
+    Cache de dos niveles para resultados de reverse geocoding.
+    
+    Las coordenadas se cuantizan a una celda geohash. El primer nivel es un LRU
+    en memoria con TTL; el segundo, la tabla geocoding_cache en SQLite, a la que
+    se accede por celda con una única conexión de larga duración. Las entradas
+    caducadas se descartan al leerlas (expiración perezosa).
+    """
     
-    def __init__(self, db_path: str, max_age_hours: int = 24 * 7):  # 1 semana por defecto
+    def __init__(self, db_path: str, max_age_hours: int = 24 * 7,  # 1 semana por defecto
+                 cell_precision: int = geohash.DEFAULT_CELL_PRECISION,
+                 memory_size: int = 4096):
         self.db_path = db_path
         self.max_age_hours = max_age_hours
+        self.cell_precision = cell_precision
+        self.memory_size = memory_size
+        
+        # Nivel 1: {celda: (LocationInfo, caduca_en)}
+        self._memory: "OrderedDict[str, Tuple[LocationInfo, float]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        
+        self.stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'expired': 0}
         self._init_cache_db()
     
+    @property
+    def max_age_seconds(self) -> float:
+        return self.max_age_hours * 3600
+    
+    def cell_for(self, lat: float, lon: float) -> str:
+        """Celda de caché para unas coordenadas"""
+        return geohash.encode(lat, lon, self.cell_precision)
+    
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        return self._conn
+    
     def _init_cache_db(self):
         """Inicializar la base de datos de cache"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS geocoding_cache (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                lat REAL NOT NULL,
-                lon REAL NOT NULL,
-                location_info TEXT NOT NULL,
-                timestamp TIMESTAMP NOT NULL,
-                source TEXT NOT NULL DEFAULT 'nominatim'
-            )
-            ''')
-            
-            # Crear índice para búsquedas rápidas por coordenadas
-            cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_geocoding_coords 
-            ON geocoding_cache (lat, lon)
-            ''')
-            
-            conn.commit()
-            conn.close()
+            with self._lock:
+                conn = self._connection()
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                CREATE TABLE IF NOT EXISTS geocoding_cache (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    lat REAL NOT NULL,
+                    lon REAL NOT NULL,
+                    location_info TEXT NOT NULL,
+                    timestamp TIMESTAMP NOT NULL,
+                    source TEXT NOT NULL DEFAULT 'nominatim',
+                    cell TEXT
+                )
+                ''')
+                
+                # Crear índice para búsquedas rápidas por coordenadas
+                cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_geocoding_coords 
+                ON geocoding_cache (lat, lon)
+                ''')
+                
+                # Bases de datos anteriores no tienen la columna de celda: añadirla y rellenarla
+                columns = {row[1] for row in cursor.execute("PRAGMA table_info(geocoding_cache)")}
+                if 'cell' not in columns:
+                    cursor.execute("ALTER TABLE geocoding_cache ADD COLUMN cell TEXT")
+                rows = cursor.execute(
+                    "SELECT id, lat, lon FROM geocoding_cache WHERE cell IS NULL"
+                ).fetchall()
+                if rows:
+                    cursor.executemany(
+                        "UPDATE geocoding_cache SET cell = ? WHERE id = ?",
+                        [(self.cell_for(lat, lon), row_id) for row_id, lat, lon in rows]
+                    )
+                    logger.info(f"Cache de geocoding: {len(rows)} entradas asignadas a celdas")
+                
+                cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_geocoding_cell
+                ON geocoding_cache (cell, timestamp)
+                ''')
+                
+                conn.commit()
             logger.info("Cache de reverse geocoding inicializado")
         except Exception as e:
             logger.error(f"Error inicializando cache de geocoding: {e}")
             raise
     
-    def get(self, lat: float, lon: float, precision: float = 0.01) -> Optional[LocationInfo]:
-        """Obtener resultado del cache"""
+    def _remember(self, cell: str, location_info: LocationInfo, expires_at: float):
+        self._memory[cell] = (location_info, expires_at)
+        self._memory.move_to_end(cell)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+    
+    def _nearest_in_neighbourhood(self, lat: float, lon: float, cell: str):
+        """
+        Búsqueda secundaria para puntos junto al borde de una celda: entrada
+        más cercana a menos de un tamaño de celda (usa idx_geocoding_coords),
+        como (location_info, timestamp, celda)
+        """
+        min_lat, min_lon, max_lat, max_lon = geohash.decode_bbox(cell)
+        half_lat = (max_lat - min_lat) / 2
+        half_lon = (max_lon - min_lon) / 2
+        cutoff = (datetime.now() - timedelta(hours=self.max_age_hours)).isoformat()
+        
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Buscar en un área alrededor de las coordenadas
-            cursor.execute('''
-            SELECT location_info, timestamp FROM geocoding_cache
-            WHERE lat BETWEEN ? AND ? 
+            rows = self._connection().execute('''
+            SELECT location_info, timestamp, cell, lat, lon FROM geocoding_cache
+            WHERE lat BETWEEN ? AND ?
             AND lon BETWEEN ? AND ?
-            AND datetime(timestamp) > datetime('now', '-{} hours')
-            ORDER BY 
-                (ABS(lat - ?) + ABS(lon - ?)) ASC
-            LIMIT 1
-            '''.format(self.max_age_hours), (
-                lat - precision, lat + precision,
-                lon - precision, lon + precision,
-                lat, lon
-            ))
-            
-            result = cursor.fetchone()
-            conn.close()
-            
-            if result:
-                location_info_dict = json.loads(result[0])
-                return LocationInfo(**location_info_dict)
-            
-            return None
+            ''', (lat - half_lat, lat + half_lat, lon - half_lon, lon + half_lon)).fetchall()
         except Exception as e:
             logger.error(f"Error obteniendo del cache: {e}")
             return None
+        
+        if not rows:
+            return None
+        # Se prefieren las entradas vigentes; si todas han caducado se devuelve la
+        # más cercana para que get() la elimine
+        fresh = [r for r in rows if r[1] and r[1] > cutoff]
+        return min(fresh or rows, key=lambda r: abs(r[3] - lat) + abs(r[4] - lon))[:3]
     
-    def set(self, lat: float, lon: float, location_info: LocationInfo, source: str = 'nominatim'):
-        """Guardar resultado en el cache"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+    def get(self, lat: float, lon: float) -> Optional[LocationInfo]:
+        """Obtener resultado del cache"""
+        cell = self.cell_for(lat, lon)
+        now = time.time()
+        
+        with self._lock:
+            entry = self._memory.get(cell)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(cell)
+                    self.stats['memory_hits'] += 1
+                    return entry[0]
+                del self._memory[cell]
             
-            cursor.execute('''
-            INSERT INTO geocoding_cache (lat, lon, location_info, timestamp, source)
-            VALUES (?, ?, ?, ?, ?)
-            ''', (
-                lat, lon,
-                json.dumps(location_info.to_dict()),
-                datetime.now().isoformat(),
-                source
-            ))
+            try:
+                row = self._connection().execute('''
+                SELECT location_info, timestamp, cell FROM geocoding_cache
+                WHERE cell = ?
+                ORDER BY timestamp DESC
+                LIMIT 1
+                ''', (cell,)).fetchone()
+            except Exception as e:
+                logger.error(f"Error obteniendo del cache: {e}")
+                return None
             
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            logger.error(f"Error guardando en cache: {e}")
+            if row is None:
+                row = self._nearest_in_neighbourhood(lat, lon, cell)
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            
+            try:
+                expires_at = datetime.fromisoformat(row[1]).timestamp() + self.max_age_seconds
+            except (TypeError, ValueError):
+                expires_at = 0
+            
+            if expires_at <= now:
+                # Expiración perezosa: se borra la entrada que respondió (que puede ser
+                # de una celda vecina) junto con las anteriores de su celda
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                try:
+                    self._connection().execute(
+                        "DELETE FROM geocoding_cache WHERE cell = ? AND timestamp <= ?",
+                        (row[2], row[1])
+                    )
+                    self._connection().commit()
+                except Exception as e:
+                    logger.debug(f"Error eliminando entrada caducada del cache: {e}")
+                return None
+            
+            location_info = LocationInfo(**json.loads(row[0]))
+            self._remember(cell, location_info, expires_at)
+            self.stats['db_hits'] += 1
+            return location_info
+    
+    def set(self, lat: float, lon: float, location_info: LocationInfo, source: str = 'nominatim'):
+        """Guardar resultado en el cache"""
+        cell = self.cell_for(lat, lon)
+        now = datetime.now()
+        
+        with self._lock:
+            self._remember(cell, location_info, now.timestamp() + self.max_age_seconds)
+            try:
+                conn = self._connection()
+                conn.execute('''
+                INSERT INTO geocoding_cache (lat, lon, location_info, timestamp, source, cell)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ''', (
+                    lat, lon,
+                    json.dumps(location_info.to_dict()),
+                    now.isoformat(),
+                    source,
+                    cell
+                ))
+                conn.commit()
+            except Exception as e:
+                logger.error(f"Error guardando en cache: {e}")
     
     def cleanup_old_entries(self):
         """Limpiar entradas antiguas del cache"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cutoff_time = datetime.now() - timedelta(hours=self.max_age_hours)
-            cursor.execute(
-                "DELETE FROM geocoding_cache WHERE datetime(timestamp) < ?",
-                (cutoff_time.isoformat(),)
-            )
-            
-            deleted_count = cursor.rowcount
-            conn.commit()
-            conn.close()
+        cutoff_time = datetime.now() - timedelta(hours=self.max_age_hours)
+        
+        with self._lock:
+            now = time.time()
+            for cell in [c for c, (_, expires_at) in self._memory.items() if expires_at <= now]:
+                del self._memory[cell]
             
-            if deleted_count > 0:
-                logger.info(f"Limpieza de cache: {deleted_count} entradas eliminadas")
-        except Exception as e:
-            logger.error(f"Error limpiando cache: {e}")
+            try:
+                conn = self._connection()
+                # Los timestamps ISO se comparan como texto, sin datetime() sobre cada fila
+                cursor = conn.execute(
+                    "DELETE FROM geocoding_cache WHERE timestamp < ?",
+                    (cutoff_time.isoformat(),)
+                )
+                deleted_count = cursor.rowcount
+                conn.commit()
+                
+                if deleted_count > 0:
+                    logger.info(f"Limpieza de cache: {deleted_count} entradas eliminadas")
+            except Exception as e:
+                logger.error(f"Error limpiando cache: {e}")
+    
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {**self.stats, 'memory_entries': len(self._memory)}
+    
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
 
 
 
 class NominatimClient:
     """Cliente simplificado para el servicio Nominatim de OpenStreetMap"""
     
-    def __init__(self, rate_limit: float = 1.0, user_agent: str = "DashcamSystem/1.0"):
-        self.rate_limit = rate_limit
-        self.user_agent = user_agent
-        self.last_request_time = 0
+    def __init__(self, http_client: Optional[NominatimHTTPClient] = None):
+        # Cliente HTTP compartido: sesión persistente y límite global de peticiones
+        self.http = http_client or get_nominatim_client()
     
     async def reverse_geocode(self, lat: float, lon: float) -> Optional[LocationInfo]:
         """Realizar reverse geocoding usando Nominatim"""
-        await self._rate_limit_wait()
-        
-        try:
-            params = {
-                'lat': lat,
-                'lon': lon,
-                'format': 'json',
-                'addressdetails': 1,
-                'zoom': 18
-            }
-            
-            url = f"https://nominatim.openstreetmap.org/reverse?{urlencode(params)}"
-            
-            async with aiohttp.ClientSession() as session:
-                headers = {'User-Agent': self.user_agent}
-                
-                async with session.get(url, headers=headers, timeout=10) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return self._parse_nominatim_response(data)
-                    else:
-                        logger.warning(f"Nominatim returned status {response.status}")
-                        return None
-                        
-        except asyncio.TimeoutError:
-            logger.warning("Timeout en request a Nominatim")
-            return None
-        except Exception as e:
-            logger.error(f"Error en reverse geocoding: {e}")
-            return None
+        result, _ = await self.lookup(lat, lon)
+        return result
+
+    async def lookup(self, lat: float, lon: float) -> Tuple[Optional[LocationInfo], bool]:
+        """
+        Como reverse_geocode, pero indica además si Nominatim respondió.
+        (None, True) es un "no hay nada aquí" definitivo (mar, sin datos);
+        (None, False) es un fallo transitorio (timeout, 429, sin red).
+        """
+        data = await self.http.reverse(lat, lon, addressdetails=1, zoom=18)
+        if not isinstance(data, dict):
+            return None, False
+        return self._parse_nominatim_response(data), True
 
-    async def _rate_limit_wait(self):
-        """Esperar para respetar el rate limit"""
-        current_time = time.time()
-        time_since_last = current_time - self.last_request_time
-        
-        if time_since_last < self.rate_limit:
-            wait_time = self.rate_limit - time_since_last
-            await asyncio.sleep(wait_time)
-        
-        self.last_request_time = time.time()
-    
     def _parse_nominatim_response(self, data: Dict) -> Optional[LocationInfo]:
         """Parsear respuesta de Nominatim"""
         try:
@@ -281,58 +381,213 @@ class NominatimClient:
             return None
 
 class ReverseGeocodingService:
-    """Servicio principal de reverse geocoding simplificado"""
+    """
+    Servicio principal de reverse geocoding simplificado.
+    
+    Las consultas concurrentes a la misma celda de caché (enriquecimiento de
+    clips en CameraManager, worker en segundo plano, rutas /api/geocode) se
+    agrupan: solo la primera resuelve y el resto espera su resultado, aunque
+    llamen desde otro hilo o event loop. Las celdas para las que Nominatim
+    contestó que no hay nada se recuerdan durante ``negative_ttl`` segundos
+    (caché negativa); los fallos transitorios no se recuerdan.
+    """
     
     def __init__(self, 
                  cache_db_path: str,
                  enable_online: bool = True,
-                 rate_limit: float = 1.0):
+                 negative_ttl: float = 300.0):
         self.enable_online = enable_online
         self.cache = ReverseGeocodingCache(cache_db_path)
-        self.nominatim = NominatimClient(rate_limit=rate_limit)
+        self.nominatim = NominatimClient()
+        self.negative_ttl = negative_ttl
+        
+        # Consultas en curso por (celda, force_online) y celdas sin resultado {celda: caduca_en}
+        self._inflight: Dict[Tuple[str, bool], concurrent.futures.Future] = {}
+        self._negative: "OrderedDict[str, float]" = OrderedDict()
+        self._inflight_lock = threading.Lock()
         
         # Initialize DBStorage for offline lookup
         try:
             from geocoding.utils.db_storage import DBStorage
             self.db_storage = DBStorage(geocoding_db_path=cache_db_path)
+            # Resolver el esquema y construir el índice espacial sin bloquear el arranque
+            threading.Thread(target=self.db_storage.prepare, name="OfflineGeocodingPrepare",
+                             daemon=True).start()
         except ImportError:
             self.db_storage = None
             logger.warning("DBStorage not available for offline geocoding")
         
+        # Packs de gazetteer (solo lectura, mmap) del viaje activo; ver set_active_trip
+        try:
+            from geocoding.utils.db_storage import DEFAULT_GEOCODING_DB_PATH
+            from geocoding.utils.gazetteer_pack import GazetteerPackStore
+            self.gazetteer_packs = GazetteerPackStore(DEFAULT_GEOCODING_DB_PATH)
+        except ImportError:
+            self.gazetteer_packs = None
+            logger.warning("Gazetteer packs not available for offline geocoding")
+        # Las activaciones se hacen de una en una y solo la última pedida se aplica
+        self._pack_lock = threading.Lock()
+        self._pack_generation = 0
+        
         # Statistics tracking
         self.stats = {
             'total_requests': 0,
             'cache_hits': 0,
             'offline_hits': 0,
+            'pack_hits': 0,
             'online_hits': 0,
+            'coalesced_hits': 0,
+            'negative_hits': 0,
             'failed_requests': 0
         }
     
+    def set_active_trip(self, trip_id: Optional[str]):
+        """
+        Cargar el pack de gazetteer del viaje (actualizándolo antes con los
+        geodatos descargados desde la última vez), o descargarlo con None.
+        Se hace en un hilo para no bloquear el inicio del viaje; si llegan
+        varias activaciones seguidas, las que ya quedaron viejas no se aplican.
+        """
+        if not self.gazetteer_packs:
+            return
+        
+        with self._inflight_lock:
+            self._pack_generation += 1
+            generation = self._pack_generation
+        
+        def activate():
+            with self._pack_lock:
+                with self._inflight_lock:
+                    if generation != self._pack_generation:
+                        return
+                self._activate_trip_pack(trip_id)
+        
+        threading.Thread(target=activate, name="GazetteerPackLoad", daemon=True).start()
+    
+    def _activate_trip_pack(self, trip_id: Optional[str]):
+        try:
+            result = self.gazetteer_packs.activate_trip(trip_id)
+            if trip_id is not None:
+                logger.info(f"Gazetteer pack for trip {trip_id} loaded: {result}")
+            # Celdas sin resultado antes de cargar el pack pueden resolverse ahora
+            with self._inflight_lock:
+                self._negative.clear()
+        except Exception as e:
+            logger.error(f"Error loading gazetteer pack for trip {trip_id}: {e}")
+    
+    def _is_negative(self, cell: str) -> bool:
+        with self._inflight_lock:
+            expires_at = self._negative.get(cell)
+            if expires_at is None:
+                return False
+            if expires_at > time.time():
+                return True
+            del self._negative[cell]
+            return False
+    
+    def _set_negative(self, cell: str, unresolved: bool):
+        with self._inflight_lock:
+            if not unresolved:
+                self._negative.pop(cell, None)
+                return
+            self._negative[cell] = time.time() + self.negative_ttl
+            self._negative.move_to_end(cell)
+            while len(self._negative) > self.cache.memory_size:
+                self._negative.popitem(last=False)
+    
     async def get_location(self, lat: float, lon: float, 
                           force_online: bool = False) -> Optional[LocationInfo]:
         """Obtener información de ubicación para unas coordenadas"""
         self.stats['total_requests'] += 1
+        cell = self.cache.cell_for(lat, lon)
+        
+        # Celda que no se pudo resolver hace poco (force_online la ignora)
+        if not force_online and self.negative_ttl > 0 and self._is_negative(cell):
+            self.stats['negative_hits'] += 1
+            self.stats['failed_requests'] += 1
+            return None
         
+        key = (cell, force_online)
+        coalesced = False
+        while True:
+            with self._inflight_lock:
+                future = self._inflight.get(key)
+                # Un futuro cancelado es de un líder que se canceló: se toma el relevo
+                leader = future is None or future.cancelled()
+                if leader:
+                    future = concurrent.futures.Future()
+                    self._inflight[key] = future
+            if leader:
+                break
+            
+            # Otra llamada ya resuelve esta celda: compartir su resultado.
+            # asyncio.wait no cancela el futuro compartido si se cancela a este
+            # llamante, y si el que se cancela es el líder se vuelve a intentar
+            if not coalesced:
+                self.stats['coalesced_hits'] += 1
+                coalesced = True
+            shared = asyncio.wrap_future(future)
+            await asyncio.wait({shared})
+            if shared.cancelled():
+                continue
+            result = shared.result()
+            if result is None:
+                self.stats['failed_requests'] += 1
+            return result
+        
+        result = None
+        try:
+            result, definitive = await self._resolve_location(lat, lon, force_online)
+            if self.negative_ttl > 0 and (result is not None or definitive):
+                self._set_negative(cell, result is None)
+            return result
+        except asyncio.CancelledError:
+            # Los que esperan no reciben None: uno de ellos repite la consulta
+            future.cancel()
+            raise
+        finally:
+            with self._inflight_lock:
+                # Tras una cancelación la celda puede tener ya otro líder
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+            if not future.done():
+                future.set_result(result)
+    
+    async def _resolve_location(self, lat: float, lon: float,
+                                force_online: bool) -> Tuple[Optional[LocationInfo], bool]:
+        """
+        Cache, base de datos offline y Nominatim, en ese orden.
+
+        Devuelve (resultado, definitivo): sin resultado, definitivo solo si
+        Nominatim respondió sin dirección y la búsqueda offline no falló.
+        """
+        offline_failed = False
         # 1. Intentar cache primero (si no se fuerza online)
         if not force_online:
             cached_result = self.cache.get(lat, lon)
             if cached_result:
                 self.stats['cache_hits'] += 1
                 logger.debug(f"Cache hit para {lat}, {lon}")
-                logger.info(f"CACHE RAW RESPONSE for {lat}, {lon}: {json.dumps(cached_result.to_dict(), indent=2, ensure_ascii=False)}")
                 # Asegurar que tiene información de fuente
                 if cached_result.source is None:
                     cached_result.source = "cache"
-                return cached_result
+                return cached_result, True
         
-        # 2. Intentar base de datos offline
-        if not force_online and self.db_storage:
+        # 2. Intentar pack del viaje activo y base de datos offline
+        if not force_online and (self.db_storage or self.gazetteer_packs):
             try:
-                offline_result = await self.db_storage.reverse_geocode(lat, lon, radius_km=2.0)
+                offline_result = None
+                if self.gazetteer_packs:
+                    offline_result = self.gazetteer_packs.lookup_nearest(lat, lon, radius_km=2.0)
+                    if offline_result:
+                        self.stats['pack_hits'] += 1
+                if not offline_result and self.db_storage:
+                    offline_result = await self.db_storage.reverse_geocode(lat, lon, radius_km=2.0)
                 if offline_result:
                     self.stats['offline_hits'] += 1
                     logger.debug(f"Offline DB hit para {lat}, {lon}: {offline_result['name']}")
-                    logger.info(f"OFFLINE DB RAW RESPONSE for {lat}, {lon}: {json.dumps(offline_result, indent=2, ensure_ascii=False)}")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"OFFLINE DB RAW RESPONSE for {lat}, {lon}: {json.dumps(offline_result, indent=2, ensure_ascii=False)}")
                     
                     # Convert to LocationInfo - using individual fields from repaired database
                     location_info = LocationInfo(
@@ -351,18 +606,21 @@ class ReverseGeocodingService:
                     
                     # Guardar en cache para futuras consultas
                     self.cache.set(lat, lon, location_info, source='offline')
-                    return location_info
+                    return location_info, True
             except Exception as e:
+                offline_failed = True
                 logger.warning(f"Error en búsqueda offline: {e}")
         
         # 3. Intentar servicio online (Nominatim)
+        answered = False
         if self.enable_online or force_online:
             try:
-                online_result = await self.nominatim.reverse_geocode(lat, lon)
+                online_result, answered = await self.nominatim.lookup(lat, lon)
                 if online_result:
                     self.stats['online_hits'] += 1
                     logger.debug(f"Online geocoding exitoso para {lat}, {lon}")
-                    logger.info(f"NOMINATIM RAW RESPONSE for {lat}, {lon}: {json.dumps(online_result.raw_response, indent=2, ensure_ascii=False)}")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"NOMINATIM RAW RESPONSE for {lat}, {lon}: {json.dumps(online_result.raw_response, indent=2, ensure_ascii=False)}")
                     # Asegurar que el resultado tiene marcada la fuente como online
                     if online_result.source is None:
                         online_result.source = "online"
@@ -403,14 +661,15 @@ class ReverseGeocodingService:
                     except Exception as store_error:
                         logger.warning(f"Could not store online result in offline DB: {store_error}")
                     
-                    return online_result
+                    return online_result, True
             except Exception as e:
+                answered = False
                 logger.error(f"Error en geocoding online: {e}")
         
         # 4. No se pudo obtener información
         self.stats['failed_requests'] += 1
         logger.warning(f"No se pudo obtener ubicación para {lat}, {lon}")
-        return None
+        return None, answered and not offline_failed
     
     def get_stats(self) -> Dict:
         """Get service statistics"""
@@ -418,20 +677,32 @@ class ReverseGeocodingService:
         if total == 0:
             return {
                 **self.stats,
+                'cache': self.cache.get_stats(),
+                'negative_cache_entries': len(self._negative),
+                'gazetteer_pack_trip': self.gazetteer_packs.active_trip_id if self.gazetteer_packs else None,
                 'cache_hit_rate': 0.0,
                 'offline_hit_rate': 0.0,
                 'online_hit_rate': 0.0,
+                'coalesced_hit_rate': 0.0,
                 'success_rate': 0.0
             }
         
         return {
             **self.stats,
+            'cache': self.cache.get_stats(),
+            'negative_cache_entries': len(self._negative),
+            'gazetteer_pack_trip': self.gazetteer_packs.active_trip_id if self.gazetteer_packs else None,
             'cache_hit_rate': round((self.stats['cache_hits'] / total) * 100, 2),
             'offline_hit_rate': round((self.stats['offline_hits'] / total) * 100, 2),
             'online_hit_rate': round((self.stats['online_hits'] / total) * 100, 2),
+            'coalesced_hit_rate': round((self.stats['coalesced_hits'] / total) * 100, 2),
             'success_rate': round(((total - self.stats['failed_requests']) / total) * 100, 2)
         }
     
     def cleanup_cache(self):
         """Limpiar cache antiguo"""
         self.cache.cleanup_old_entries()
+        with self._inflight_lock:
+            now = time.time()
+            for cell in [c for c, expires_at in self._negative.items() if expires_at <= now]:
+                del self._negative[cell]
@@ -1,12 +1,16 @@
 """Geocoding utilities module"""
 
 from .grid_generator import generate_comprehensive_grid_coverage, generate_grid_around_point
+from .corridor_planner import plan_corridor_cells
 from .db_storage import DBStorage
 from .coverage_calculator import CoverageCalculator
+from .gazetteer_pack import GazetteerPackStore
 
 __all__ = [
     'generate_comprehensive_grid_coverage', 
     'generate_grid_around_point',
+    'plan_corridor_cells',
     'DBStorage',
-    'CoverageCalculator'
+    'CoverageCalculator',
+    'GazetteerPackStore'
 ]
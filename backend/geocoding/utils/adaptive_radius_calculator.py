@@ -6,8 +6,15 @@ por waypoint en el enfoque tradicional.
 import math
 import logging
 from typing import List, Dict, Tuple
+
+import numpy as np
 from geopy.distance import geodesic
 
+from utils.spatial_index import GeoPointIndex, geodesic_km
+
+# Holgura del prefiltro esférico frente a la distancia geodésica (< 0.5%)
+GEODESIC_SLACK = 1.01
+
 logger = logging.getLogger(__name__)
 
 class AdaptiveRadiusCalculator:
@@ -17,8 +24,14 @@ class AdaptiveRadiusCalculator:
     - Tipo de área (urbana/rural)
     - Minimización de superposición
     - Patrones de viaje
+
+    calculate_optimized_radii resuelve todos los waypoints a la vez sobre un
+    índice espacial (O(n log n)); los métodos por waypoint se mantienen para
+    consultas sueltas.
     """
     
+    DENSITY_SEARCH_RADIUS_KM = 50.0
+    
     def __init__(self, min_radius: float = 3.0, max_radius: float = 20.0):
         self.min_radius = min_radius
         self.max_radius = max_radius
@@ -91,50 +104,90 @@ class AdaptiveRadiusCalculator:
         
         return reduction_factor
     
+    @staticmethod
+    def _base_radii(lats: np.ndarray) -> np.ndarray:
+        """Radio base por tipo de área (misma heurística que detect_area_type)"""
+        lat_abs = np.abs(lats)
+        urban = (lat_abs >= 30) & (lat_abs <= 60)
+        suburban = ~urban & (((lat_abs >= 20) & (lat_abs <= 30)) | ((lat_abs >= 60) & (lat_abs <= 70)))
+        return np.where(urban, 6.0, np.where(suburban, 10.0, 15.0))
+    
+    def _neighbor_pairs(self, waypoints: List[Dict], lats: np.ndarray, lons: np.ndarray,
+                        radius_km: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Pares (i, j, distancia) de waypoints distintos a menos de radius_km.
+        Igual que en los métodos por waypoint, se excluyen los waypoints
+        iguales al propio (mismo dict), no solo el índice i == j. El índice
+        esférico solo preselecciona (con holgura); la distancia es la
+        geodésica WGS84, como en calculate_distance.
+        """
+        index = GeoPointIndex(lats, lons, radius_km * GEODESIC_SLACK)
+        rows, cols, dists = [], [], []
+        for query, point, _ in index.pairs(lats, lons):
+            dist = geodesic_km(lats[query], lons[query], lats[point], lons[point])
+            keep = (query != point) & (dist <= radius_km)
+            for k in np.nonzero(keep & (dist == 0))[0]:
+                keep[k] = waypoints[query[k]] != waypoints[point[k]]
+            rows.append(query[keep])
+            cols.append(point[keep])
+            dists.append(dist[keep])
+        if not rows:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0)
+        return np.concatenate(rows), np.concatenate(cols), np.concatenate(dists)
+    
     def calculate_optimized_radii(self, waypoints: List[Dict]) -> List[float]:
         """
         Calcula radios optimizados para todos los waypoints
         """
         logger.info(f"Calculating optimized radii for {len(waypoints)} waypoints")
         
-        optimized_radii = []
-        
-        for i, waypoint in enumerate(waypoints):
-            # 1. Radio base según tipo de área
-            area_type = self.detect_area_type(waypoint['lat'], waypoint['lon'])
-            
-            if area_type == "urban":
-                base_radius = 6.0
-            elif area_type == "suburban":
-                base_radius = 10.0
-            else:  # rural
-                base_radius = 15.0
-            
-            # 2. Ajuste por densidad de waypoints
-            density_factor = self.calculate_density_factor(waypoint, waypoints)
-            radius_after_density = base_radius * density_factor
-            
-            # 3. Ajuste para minimizar superposición
-            overlap_factor = self.calculate_overlap_reduction_factor(waypoint, waypoints, radius_after_density)
-            final_radius = radius_after_density * overlap_factor
-            
-            # 4. Aplicar límites mínimos y máximos
-            final_radius = max(self.min_radius, min(self.max_radius, final_radius))
-            
-            optimized_radii.append(final_radius)
-            
-            logger.debug(f"Waypoint {i+1} ({waypoint.get('name', 'Unknown')}): "
-                        f"area={area_type}, base={base_radius:.1f}km, "
-                        f"density_factor={density_factor:.2f}, overlap_factor={overlap_factor:.2f}, "
-                        f"final={final_radius:.1f}km")
+        if not waypoints:
+            return []
+        
+        n = len(waypoints)
+        lats = np.fromiter((wp['lat'] for wp in waypoints), dtype=np.float64, count=n)
+        lons = np.fromiter((wp['lon'] for wp in waypoints), dtype=np.float64, count=n)
+        
+        # 1. Radio base según tipo de área
+        base_radii = self._base_radii(lats)
+        
+        # Vecinos a menos de 50 km; el radio de superposición (1.2 * 6..15 * 1.5)
+        # siempre queda por debajo, así que basta un único índice
+        rows, _, dists = self._neighbor_pairs(waypoints, lats, lons, self.DENSITY_SEARCH_RADIUS_KM)
+        
+        # 2. Ajuste por densidad de waypoints
+        nearby_count = np.bincount(rows, minlength=n)
+        total_distance = np.bincount(rows, weights=dists, minlength=n)
+        avg_distance = np.divide(total_distance, nearby_count, out=np.zeros(n), where=nearby_count > 0)
+        density_factors = np.where(nearby_count > 0, np.clip(avg_distance / 25.0, 0.5, 1.5), 1.0)
+        radii_after_density = base_radii * density_factors
+        
+        # 3. Ajuste para minimizar superposición
+        overlap_limit = radii_after_density[rows] * 1.2
+        overlapping = dists < overlap_limit
+        overlap_penalty = np.bincount(
+            rows[overlapping],
+            weights=(overlap_limit[overlapping] - dists[overlapping]) / overlap_limit[overlapping],
+            minlength=n
+        )
+        overlap_factors = np.maximum(0.6, 1.0 - overlap_penalty * 0.3)
+        
+        # 4. Aplicar límites mínimos y máximos
+        final_radii = np.clip(radii_after_density * overlap_factors, self.min_radius, self.max_radius)
+        optimized_radii = final_radii.tolist()
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, waypoint in enumerate(waypoints):
+                logger.debug(f"Waypoint {i+1} ({waypoint.get('name', 'Unknown')}): "
+                            f"area={self.detect_area_type(waypoint['lat'], waypoint['lon'])}, "
+                            f"base={base_radii[i]:.1f}km, "
+                            f"density_factor={density_factors[i]:.2f}, overlap_factor={overlap_factors[i]:.2f}, "
+                            f"final={final_radii[i]:.1f}km")
         
         # 5. Estadísticas finales
-        avg_radius = sum(optimized_radii) / len(optimized_radii)
-        min_radius_used = min(optimized_radii)
-        max_radius_used = max(optimized_radii)
-        
-        logger.info(f"Optimized radii calculated: avg={avg_radius:.1f}km, "
-                   f"range={min_radius_used:.1f}-{max_radius_used:.1f}km")
+        logger.info(f"Optimized radii calculated: avg={final_radii.mean():.1f}km, "
+                   f"range={final_radii.min():.1f}-{final_radii.max():.1f}km")
         
         return optimized_radii
     
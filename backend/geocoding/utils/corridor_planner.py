@@ -0,0 +1,266 @@
+"""
+Corridor planner for geodata downloads.
+
+Instead of a dense lattice around every waypoint, the trip polyline is covered
+by the geohash cells whose centers lie within ``corridor_km`` of it. Cells are
+computed with NumPy per segment, deduplicated as integer geohash codes, and
+cells that already have data in the offline store or the reverse geocoding
+cache are subtracted before anything is queued. One request per cell (at its
+center) is enough, since lookups and the cache are keyed by cell as well.
+"""
+
+import logging
+import math
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .geohash import DEFAULT_CELL_PRECISION
+
+logger = logging.getLogger(__name__)
+
+_BASE32 = np.array(list("0123456789bcdefghjkmnpqrstuvwxyz"))
+KM_PER_DEG_LAT = 110.574
+KM_PER_DEG_LON = 111.320
+
+
+def corridor_precision(corridor_km: float) -> int:
+    """
+    Cell precision for a corridor half-width.
+
+    Cells finer than the reverse geocoding cache cells would not add cache
+    hits, so the cache precision is used unless the corridor is very wide.
+    """
+    if corridor_km <= 25:
+        return DEFAULT_CELL_PRECISION  # ~1.2 x 0.6 km
+    return DEFAULT_CELL_PRECISION - 1  # ~4.9 km
+
+
+def cell_bits(precision: int) -> Tuple[int, int]:
+    """(lat_bits, lon_bits) of a geohash precision; longitude takes the odd bit"""
+    total = 5 * precision
+    return total // 2, (total + 1) // 2
+
+
+def cell_size_deg(precision: int) -> Tuple[float, float]:
+    """(height, width) in degrees of the cells of a geohash precision"""
+    lat_bits, lon_bits = cell_bits(precision)
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def _interleave(lat_idx: np.ndarray, lon_idx: np.ndarray, precision: int) -> np.ndarray:
+    """Integer geohash codes from cell row/column indices"""
+    lat_bits, lon_bits = cell_bits(precision)
+    codes = np.zeros(lat_idx.shape, dtype=np.int64)
+    lat_pos, lon_pos = lat_bits - 1, lon_bits - 1
+    for bit in range(5 * precision):
+        if bit % 2 == 0:
+            codes = (codes << 1) | ((lon_idx >> lon_pos) & 1)
+            lon_pos -= 1
+        else:
+            codes = (codes << 1) | ((lat_idx >> lat_pos) & 1)
+            lat_pos -= 1
+    return codes
+
+
+def cell_codes(lats: np.ndarray, lons: np.ndarray, precision: int) -> np.ndarray:
+    """Integer geohash codes of many coordinates at once"""
+    cell_h, cell_w = cell_size_deg(precision)
+    lat_bits, lon_bits = cell_bits(precision)
+    lat_idx = np.clip(((np.asarray(lats, dtype=np.float64) + 90.0) // cell_h).astype(np.int64),
+                      0, (1 << lat_bits) - 1)
+    lon_idx = np.clip(((np.asarray(lons, dtype=np.float64) + 180.0) // cell_w).astype(np.int64),
+                      0, (1 << lon_bits) - 1)
+    return _interleave(lat_idx, lon_idx, precision)
+
+
+def codes_to_geohashes(codes: np.ndarray, precision: int) -> List[str]:
+    """Geohash strings of integer codes"""
+    if len(codes) == 0:
+        return []
+    shifts = np.arange(precision - 1, -1, -1, dtype=np.int64) * 5
+    chars = _BASE32[(np.asarray(codes, dtype=np.int64)[:, None] >> shifts) & 31]
+    return ["".join(row) for row in chars]
+
+
+def code_centers(codes: np.ndarray, precision: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(lats, lons) of the centers of cells given by code"""
+    lat_bits, lon_bits = cell_bits(precision)
+    cell_h, cell_w = cell_size_deg(precision)
+    codes = np.asarray(codes, dtype=np.int64)
+    lat_idx = np.zeros(codes.shape, dtype=np.int64)
+    lon_idx = np.zeros(codes.shape, dtype=np.int64)
+    for bit in range(5 * precision):
+        value = (codes >> (5 * precision - 1 - bit)) & 1
+        if bit % 2 == 0:
+            lon_idx = (lon_idx << 1) | value
+        else:
+            lat_idx = (lat_idx << 1) | value
+    return -90.0 + (lat_idx + 0.5) * cell_h, -180.0 + (lon_idx + 0.5) * cell_w
+
+
+def _segment_cells(a: Tuple[float, float], b: Tuple[float, float], reach_km: float,
+                   precision: int) -> np.ndarray:
+    """Codes of cells whose center is within ``reach_km`` of segment a-b"""
+    cell_h, cell_w = cell_size_deg(precision)
+    lat_bits, lon_bits = cell_bits(precision)
+
+    max_abs_lat = min(89.0, max(abs(a[0]), abs(b[0])) + reach_km / KM_PER_DEG_LAT)
+    dlat = reach_km / KM_PER_DEG_LAT
+    dlon = reach_km / (KM_PER_DEG_LON * math.cos(math.radians(max_abs_lat)))
+
+    i0 = max(0, int((min(a[0], b[0]) - dlat + 90.0) // cell_h))
+    i1 = min((1 << lat_bits) - 1, int((max(a[0], b[0]) + dlat + 90.0) // cell_h))
+    j0 = max(0, int((min(a[1], b[1]) - dlon + 180.0) // cell_w))
+    j1 = min((1 << lon_bits) - 1, int((max(a[1], b[1]) + dlon + 180.0) // cell_w))
+
+    lat_idx, lon_idx = np.meshgrid(np.arange(i0, i1 + 1, dtype=np.int64),
+                                   np.arange(j0, j1 + 1, dtype=np.int64), indexing="ij")
+    lat_idx = lat_idx.ravel()
+    lon_idx = lon_idx.ravel()
+    lats = -90.0 + (lat_idx + 0.5) * cell_h
+    lons = -180.0 + (lon_idx + 0.5) * cell_w
+
+    # Proyección equirectangular local centrada en el segmento
+    kx = KM_PER_DEG_LON * math.cos(math.radians((a[0] + b[0]) / 2))
+    px = (lons - a[1]) * kx
+    py = (lats - a[0]) * KM_PER_DEG_LAT
+    sx = (b[1] - a[1]) * kx
+    sy = (b[0] - a[0]) * KM_PER_DEG_LAT
+    length_sq = sx * sx + sy * sy
+    if length_sq > 0:
+        t = np.clip((px * sx + py * sy) / length_sq, 0.0, 1.0)
+    else:
+        t = np.zeros_like(px)
+    mask = (px - t * sx) ** 2 + (py - t * sy) ** 2 <= reach_km * reach_km
+
+    return _interleave(lat_idx[mask], lon_idx[mask], precision)
+
+
+def corridor_cell_codes(polyline: Sequence[Tuple[float, float]], corridor_km: float,
+                        precision: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Unique cell codes covering the corridor around ``polyline``.
+
+    Returns (codes, segment_index) where segment_index is the first segment
+    (0 for a single point) whose corridor contains each cell.
+    """
+    if not polyline:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # Una celda atravesada por la ruta tiene el centro a menos de media diagonal
+    cell_h, cell_w = cell_size_deg(precision)
+    mid_lat = math.radians(sum(p[0] for p in polyline) / len(polyline))
+    half_diagonal_km = 0.5 * math.hypot(cell_h * KM_PER_DEG_LAT, cell_w * KM_PER_DEG_LON * math.cos(mid_lat))
+    reach_km = max(corridor_km, half_diagonal_km)
+
+    segments = list(zip(polyline[:-1], polyline[1:])) or [(polyline[0], polyline[0])]
+    codes = []
+    owners = []
+    for index, (a, b) in enumerate(segments):
+        segment_codes = _segment_cells(a, b, reach_km, precision)
+        codes.append(segment_codes)
+        owners.append(np.full(segment_codes.shape, index, dtype=np.int64))
+
+    all_codes = np.concatenate(codes)
+    all_owners = np.concatenate(owners)
+    unique_codes, first = np.unique(all_codes, return_index=True)
+    return unique_codes, all_owners[first]
+
+
+def _polyline_bbox(polyline: Sequence[Tuple[float, float]], margin_km: float) -> Tuple[float, float, float, float]:
+    lats = [p[0] for p in polyline]
+    lons = [p[1] for p in polyline]
+    dlat = margin_km / KM_PER_DEG_LAT
+    max_abs_lat = min(89.0, max(abs(v) for v in lats) + dlat)
+    dlon = margin_km / (KM_PER_DEG_LON * math.cos(math.radians(max_abs_lat)))
+    return min(lats) - dlat, min(lons) - dlon, max(lats) + dlat, max(lons) + dlon
+
+
+def load_covered_codes(db_paths: Iterable[str], precision: int,
+                       bbox: Tuple[float, float, float, float],
+                       cache_max_age_hours: float = 24 * 7) -> np.ndarray:
+    """
+    Cell codes that already have data inside ``bbox``.
+
+    Reads stored places (detailed_geocoding) and fresh reverse geocoding cache
+    entries (geocoding_cache) from each database that has those tables.
+    """
+    min_lat, min_lon, max_lat, max_lon = bbox
+    cutoff = (datetime.now() - timedelta(hours=cache_max_age_hours)).isoformat()
+    queries = {
+        "detailed_geocoding": (
+            "SELECT lat, lon FROM detailed_geocoding WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?",
+            (min_lat, max_lat, min_lon, max_lon)
+        ),
+        "geocoding_cache": (
+            "SELECT lat, lon FROM geocoding_cache WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ? "
+            "AND timestamp >= ?",
+            (min_lat, max_lat, min_lon, max_lon, cutoff)
+        )
+    }
+
+    found = []
+    for db_path in db_paths:
+        try:
+            with sqlite3.connect(f"file:{db_path}?mode=ro", uri=True) as conn:
+                tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+                for table, (query, params) in queries.items():
+                    if table not in tables:
+                        continue
+                    rows = conn.execute(query, params).fetchall()
+                    if rows:
+                        coords = np.asarray(rows, dtype=np.float64)
+                        found.append(cell_codes(coords[:, 0], coords[:, 1], precision))
+        except sqlite3.Error as e:
+            logger.debug(f"Could not read covered cells from {db_path}: {e}")
+
+    if not found:
+        return np.zeros(0, dtype=np.int64)
+    return np.unique(np.concatenate(found))
+
+
+def plan_corridor_cells(polyline: Sequence[Tuple[float, float]],
+                        corridor_km: float,
+                        precision: Optional[int] = None,
+                        db_paths: Iterable[str] = (),
+                        exclude_codes: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    """
+    Cells to download for the corridor around ``polyline``.
+
+    Cells already covered in ``db_paths`` (or listed in ``exclude_codes``) are
+    subtracted. Returns {"precision", "cells", "total_cells", "covered_cells"}
+    where ``cells`` is a list of {"cell", "lat", "lon", "segment"} in route order.
+    """
+    precision = precision or corridor_precision(corridor_km)
+    codes, segments = corridor_cell_codes(polyline, corridor_km, precision)
+    total = len(codes)
+
+    covered = load_covered_codes(db_paths, precision, _polyline_bbox(polyline, corridor_km + 1)) \
+        if db_paths and total else np.zeros(0, dtype=np.int64)
+    if exclude_codes is not None and len(exclude_codes):
+        covered = np.union1d(covered, exclude_codes)
+    if len(covered):
+        keep = ~np.isin(codes, covered)
+        codes, segments = codes[keep], segments[keep]
+
+    # Orden de la ruta: por segmento y, dentro de él, por código (celdas vecinas juntas)
+    order = np.lexsort((codes, segments))
+    codes, segments = codes[order], segments[order]
+    lats, lons = code_centers(codes, precision)
+    names = codes_to_geohashes(codes, precision)
+
+    logger.info(f"Corridor plan: {total} cells at precision {precision} for {len(polyline)} route points, "
+                f"{total - len(codes)} already covered, {len(codes)} to download")
+
+    return {
+        "precision": precision,
+        "cells": [
+            {"cell": name, "lat": float(lat), "lon": float(lon), "segment": int(segment)}
+            for name, lat, lon, segment in zip(names, lats, lons, segments)
+        ],
+        "total_cells": total,
+        "covered_cells": total - len(codes)
+    }
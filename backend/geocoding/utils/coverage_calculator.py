@@ -4,6 +4,10 @@ import logging
 import math
 from typing import Dict, List, Tuple
 
+import numpy as np
+
+from utils.spatial_index import GeoPointIndex
+
 logger = logging.getLogger(__name__)
 
 
@@ -15,59 +19,122 @@ class CoverageCalculator:
         return calculate_trip_route_coverage(waypoints, geodata_points, radius_km)
 
 
+def _route_samples(waypoints: List[Dict]):
+    """
+    Points along the route, one per km (intermediate points of each segment).
+
+    Returns (lats, lons, segment index, km from route start, segment lengths,
+    segment start km).
+    """
+    lats = np.array([wp["lat"] for wp in waypoints], dtype=np.float64)
+    lons = np.array([wp["lon"] for wp in waypoints], dtype=np.float64)
+    if len(lats) < 2:
+        empty = np.zeros(0)
+        return empty, empty, np.zeros(0, dtype=np.int64), empty, empty, empty
+
+    # Haversine vectorizado entre waypoints consecutivos
+    lat1, lat2 = np.radians(lats[:-1]), np.radians(lats[1:])
+    dlat = lat2 - lat1
+    dlon = np.radians(lons[1:] - lons[:-1])
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    segment_km = 2 * 6371 * np.arcsin(np.sqrt(a))
+    segment_start_km = np.concatenate(([0.0], np.cumsum(segment_km)[:-1]))
+
+    # Mismo muestreo que antes: i/n para i en 1..n-1, con n = max(1, int(km))
+    steps = np.maximum(1, segment_km.astype(np.int64))
+    per_segment = steps - 1
+    segments = np.repeat(np.arange(len(steps)), per_segment)
+    first = np.concatenate(([0], np.cumsum(per_segment)[:-1]))
+    fractions = (np.arange(len(segments)) - first[segments] + 1) / steps[segments]
+
+    sample_lats = lats[segments] + (lats[segments + 1] - lats[segments]) * fractions
+    sample_lons = lons[segments] + (lons[segments + 1] - lons[segments]) * fractions
+    sample_km = segment_start_km[segments] + segment_km[segments] * fractions
+    return sample_lats, sample_lons, segments, sample_km, segment_km, segment_start_km
+
+
+def _coverage_gaps(covered: np.ndarray, segments: np.ndarray, sample_km: np.ndarray,
+                   sample_lats: np.ndarray, sample_lons: np.ndarray,
+                   segment_km: np.ndarray, segment_start_km: np.ndarray) -> List[Dict]:
+    """Uncovered stretches: runs of uncovered samples within each segment"""
+    uncovered = ~covered
+    if not uncovered.any():
+        return []
+
+    # Una racha empieza donde cambia el estado o el tramo
+    padded = np.concatenate(([False], uncovered, [False]))
+    boundary = np.concatenate(([True], segments[1:] != segments[:-1], [True]))
+    starts = np.nonzero(padded[1:-1] & (~padded[:-2] | boundary[:-1]))[0]
+    ends = np.nonzero(padded[1:-1] & (~padded[2:] | boundary[1:]))[0]
+
+    gaps = []
+    for first, last in zip(starts, ends):
+        segment = int(segments[first])
+        spacing = segment_km[segment] / max(1, int(segment_km[segment]))
+        seg_start = segment_start_km[segment]
+        seg_end = seg_start + segment_km[segment]
+        start_km = max(seg_start, sample_km[first] - spacing / 2)
+        end_km = min(seg_end, sample_km[last] + spacing / 2)
+        gaps.append({
+            "segment_index": segment,
+            "start_km": round(float(start_km), 2),
+            "end_km": round(float(end_km), 2),
+            "length_km": round(float(end_km - start_km), 2),
+            "start": {"lat": float(sample_lats[first]), "lon": float(sample_lons[first])},
+            "end": {"lat": float(sample_lats[last]), "lon": float(sample_lons[last])},
+            "route_points": int(last - first + 1)
+        })
+    return gaps
+
+
 def calculate_trip_route_coverage(waypoints: List[Dict], geodata_points: List[Dict], radius_km: float) -> Dict:
-    """Calculate how well the downloaded geodata covers the trip route"""
+    """
+    Calculate how well the downloaded geodata covers the trip route.
+
+    Route points are checked against a grid-bucket index of the geodata points
+    (see spatial_index.GeoPointIndex). Besides the totals, the result lists
+    per-segment coverage and the uncovered stretches ("coverage_gaps").
+    """
     try:
-        # Calculate approximate route length and generate route points
-        route_points = []
-        total_route_distance = 0
+        sample_lats, sample_lons, segments, sample_km, segment_km, segment_start_km = _route_samples(waypoints)
+        
+        if geodata_points and len(sample_lats):
+            geo_lats = np.fromiter((p["lat"] for p in geodata_points), dtype=np.float64, count=len(geodata_points))
+            geo_lons = np.fromiter((p["lon"] for p in geodata_points), dtype=np.float64, count=len(geodata_points))
+            covered = GeoPointIndex(geo_lats, geo_lons, radius_km).any_within(sample_lats, sample_lons)
+        else:
+            covered = np.zeros(len(sample_lats), dtype=bool)
         
-        # Generate points along the route between waypoints
-        for i in range(len(waypoints) - 1):
-            start_wp = waypoints[i]
-            end_wp = waypoints[i + 1]
-            
-            # Calculate distance between waypoints
-            distance_km = calculate_distance_km(
-                start_wp["lat"], start_wp["lon"],
-                end_wp["lat"], end_wp["lon"]
-            )
-            total_route_distance += distance_km
-            
-            # Generate intermediate points along this segment
-            segment_points = generate_route_segment_points(
-                start_wp["lat"], start_wp["lon"],
-                end_wp["lat"], end_wp["lon"],
-                max(1, int(distance_km))  # One point per km minimum
-            )
-            route_points.extend(segment_points)
+        covered_points = int(covered.sum())
+        coverage_percentage = (covered_points / len(sample_lats)) * 100 if len(sample_lats) else 0
         
-        # Check coverage for each route point
-        covered_points = 0
-        for route_point in route_points:
-            is_covered = False
-            for geo_point in geodata_points:
-                distance = calculate_distance_km(
-                    route_point[0], route_point[1],
-                    geo_point["lat"], geo_point["lon"]
-                )
-                if distance <= radius_km:
-                    is_covered = True
-                    break
-            
-            if is_covered:
-                covered_points += 1
+        # Cobertura por tramo entre waypoints
+        samples_per_segment = np.bincount(segments, minlength=len(segment_km))
+        covered_per_segment = np.bincount(segments, weights=covered, minlength=len(segment_km))
+        segment_coverage = []
+        for index in range(len(segment_km)):
+            total = int(samples_per_segment[index])
+            segment_coverage.append({
+                "segment_index": index,
+                "distance_km": round(float(segment_km[index]), 2),
+                "route_points": total,
+                "covered_route_points": int(covered_per_segment[index]),
+                "coverage_percentage": round(float(covered_per_segment[index]) / total * 100, 2) if total else 0
+            })
         
-        # Calculate coverage percentage
-        coverage_percentage = (covered_points / len(route_points)) * 100 if route_points else 0
+        gaps = _coverage_gaps(covered, segments, sample_km, sample_lats, sample_lons,
+                              segment_km, segment_start_km)
         
         return {
-            "total_route_distance_km": round(total_route_distance, 2),
-            "total_route_points": len(route_points),
+            "total_route_distance_km": round(float(segment_km.sum()), 2),
+            "total_route_points": int(len(sample_lats)),
             "covered_route_points": covered_points,
             "coverage_percentage": round(coverage_percentage, 2),
             "geodata_points_count": len(geodata_points),
-            "coverage_radius_km": radius_km
+            "coverage_radius_km": radius_km,
+            "segments": segment_coverage,
+            "coverage_gaps": gaps,
+            "uncovered_distance_km": round(sum(gap["length_km"] for gap in gaps), 2)
         }
         
     except Exception as e:
@@ -79,6 +146,8 @@ def calculate_trip_route_coverage(waypoints: List[Dict], geodata_points: List[Di
             "coverage_percentage": 0,
             "geodata_points_count": len(geodata_points),
             "coverage_radius_km": radius_km,
+            "segments": [],
+            "coverage_gaps": [],
             "error": str(e)
         }
 
@@ -1,16 +1,255 @@
 """Database storage utilities for geodata."""
 
+import asyncio
+import json
 import logging
-from typing import Dict, Optional
+from contextlib import closing
+from typing import Dict, List, Optional, Sequence, Tuple
 import sqlite3
 import os
+import sys
+import threading
+import time
 from math import cos, radians
 
 logger = logging.getLogger(__name__)
 
 
+DETAILED_GEOCODING_DDL = """
+CREATE TABLE IF NOT EXISTS detailed_geocoding (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    trip_id TEXT,
+    place_id INTEGER,
+    osm_type TEXT,
+    osm_id INTEGER,
+    class TEXT,
+    type TEXT,
+    place_rank INTEGER,
+    importance REAL,
+    addresstype TEXT,
+    name TEXT,
+    display_name TEXT,
+    road TEXT,
+    house_number TEXT,
+    neighbourhood TEXT,
+    suburb TEXT,
+    village TEXT,
+    town TEXT,
+    city TEXT,
+    municipality TEXT,
+    county TEXT,
+    state_district TEXT,
+    state TEXT,
+    region TEXT,
+    province TEXT,
+    postcode TEXT,
+    country TEXT,
+    country_code TEXT,
+    ISO3166_2_lvl4 TEXT,
+    ISO3166_2_lvl6 TEXT,
+    boundingbox_south REAL,
+    boundingbox_north REAL,
+    boundingbox_west REAL,
+    boundingbox_east REAL,
+    source TEXT,
+    raw_response TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(lat, lon, trip_id) ON CONFLICT REPLACE
+)
+"""
+
+# Tablas de lugares soportadas, en orden de preferencia:
+# (tabla, columna de latitud, columna de longitud, columnas devueltas)
+# Columnas UNIQUE de las tablas que se escriben con INSERT OR REPLACE
+REPLACE_KEYS = {"detailed_geocoding": ("lat", "lon", "trip_id")}
+
+PLACE_SOURCES = (
+    ("detailed_geocoding", "lat", "lon",
+     "road, state, country, country_code, display_name, house_number, neighbourhood, "
+     "suburb, county, province, postcode, COALESCE(city, village, town, name), village, town, city"),
+    ("cities", "lat", "lon", "name, admin1, admin2, cc"),
+    ("locations", "latitude", "longitude", "display_name, state, country, country_code"),
+    ("geocoding_data", "lat", "lon", "city, state, country, country_code"),
+)
+
+# Cada cuánto se comprueba si el esquema cambió (p. ej. se creó detailed_geocoding)
+SCHEMA_CHECK_INTERVAL = 30.0
+
+
+class PlaceSource:
+    """Tabla de lugares resuelta, con su consulta de vecino más cercano ya construida"""
+    
+    def __init__(self, table: str, lat_col: str, lon_col: str, columns: str, spatial_index: str):
+        self.table = table
+        self.detailed = table == "detailed_geocoding"
+        self.spatial_index = spatial_index
+        
+        distance = f"ABS(t.{lat_col} - ?) + ABS(t.{lon_col} - ?)"
+        select = ", ".join(f"t.{c.strip()}" if c.strip().isidentifier() else c.strip()
+                           for c in _split_columns(columns))
+        if spatial_index == "rtree":
+            self.query = f"""
+            SELECT {select}, {distance} AS distance_approx
+            FROM {table}_rtree r JOIN {table} t ON t.rowid = r.id
+            WHERE r.max_lat >= ? AND r.min_lat <= ?
+            AND r.max_lon >= ? AND r.min_lon <= ?
+            ORDER BY distance_approx LIMIT 1
+            """
+        else:
+            self.query = f"""
+            SELECT {select}, {distance} AS distance_approx
+            FROM {table} t
+            WHERE t.{lat_col} BETWEEN ? AND ?
+            AND t.{lon_col} BETWEEN ? AND ?
+            ORDER BY distance_approx LIMIT 1
+            """
+    
+    def to_result(self, row) -> Dict:
+        if self.detailed:
+            city = row[11] or ""
+            return {
+                "road": row[0] or "",
+                "state": row[1] or "",
+                "country": row[2] or "",
+                "country_code": row[3] or "",
+                "distance": row[15],
+                "display_name": row[4] or "",
+                "house_number": row[5] or "",
+                "neighbourhood": row[6] or "",
+                "suburb": row[7] or "",
+                "county": row[8] or "",
+                "province": row[9] or "",
+                "postcode": row[10] or "",
+                "city": city,
+                "village": row[12] or "",
+                "town": row[13] or "",
+                "source": "offline_database_detailed",
+                # Legacy fields for backward compatibility
+                "name": city or "Unknown",
+                "admin1": row[1] or "",
+                "admin2": row[2] or "",
+                "cc": row[3] or ""
+            }
+        return {
+            "name": row[0] or "Unknown",
+            "admin1": row[1] or "",
+            "admin2": row[2] or "",
+            "cc": row[3] or "",
+            "distance": row[4],
+            "source": "offline_database"
+        }
+
+
+def _split_columns(columns: str):
+    """Divide una lista de columnas SQL respetando los paréntesis de funciones"""
+    parts, depth, current = [], 0, ""
+    for char in columns:
+        if char == "," and depth == 0:
+            parts.append(current)
+            current = ""
+            continue
+        depth += char == "("
+        depth -= char == ")"
+        current += char
+    parts.append(current)
+    return parts
+
+
+def existing_spatial_index(conn: sqlite3.Connection, table: str, lat_col: str, lon_col: str) -> Optional[str]:
+    """Spatial index already built for a table ("rtree" or "btree"), without creating anything"""
+    names = {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE name IN (?, ?)", (f"{table}_rtree", f"idx_{table}_lat_lon")
+    )}
+    if f"{table}_rtree" in names:
+        return "rtree"
+    if f"idx_{table}_lat_lon" in names:
+        return "btree"
+    return None
+
+
+def ensure_spatial_index(conn: sqlite3.Connection, table: str, lat_col: str, lon_col: str,
+                         replace_key: Optional[Sequence[str]] = None) -> str:
+    """
+    Crea (una sola vez) un índice R*Tree sobre los puntos de una tabla, mantenido
+    por triggers. Si el módulo rtree no está disponible o la base de datos es de
+    solo lectura, recurre a un índice B-tree (lat, lon). Devuelve "rtree" o "btree".
+    
+    ``replace_key`` son las columnas UNIQUE de una tabla que se escribe con
+    INSERT OR REPLACE: la fila sustituida no dispara el trigger de borrado
+    (sin recursive_triggers), así que se quita su entrada antes de insertar.
+    """
+    rtree = f"{table}_rtree"
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (rtree,)
+        ).fetchone()
+        if not exists:
+            conn.execute(f"CREATE VIRTUAL TABLE {rtree} USING rtree(id, min_lat, max_lat, min_lon, max_lon)")
+            conn.execute(f"""
+                INSERT INTO {rtree}
+                SELECT rowid, {lat_col}, {lat_col}, {lon_col}, {lon_col} FROM {table}
+                WHERE {lat_col} IS NOT NULL AND {lon_col} IS NOT NULL
+            """)
+        if replace_key:
+            has_trigger = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='trigger' AND name=?", (f"{rtree}_bi",)
+            ).fetchone()
+            if not has_trigger:
+                # Entradas huérfanas de sustituciones anteriores a este trigger
+                conn.execute(f"DELETE FROM {rtree} WHERE id NOT IN (SELECT rowid FROM {table})")
+                # "=" y no "IS": UNIQUE no considera iguales los NULL, así que esas filas no se sustituyen
+                match = " AND ".join(f"{column} = NEW.{column}" for column in replace_key)
+                conn.execute(f"""
+                    CREATE TRIGGER {rtree}_bi BEFORE INSERT ON {table} BEGIN
+                        DELETE FROM {rtree} WHERE id IN (SELECT rowid FROM {table} WHERE {match});
+                    END
+                """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {rtree}_ai AFTER INSERT ON {table}
+            WHEN NEW.{lat_col} IS NOT NULL AND NEW.{lon_col} IS NOT NULL BEGIN
+                INSERT OR REPLACE INTO {rtree} VALUES (NEW.rowid, NEW.{lat_col}, NEW.{lat_col}, NEW.{lon_col}, NEW.{lon_col});
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {rtree}_au AFTER UPDATE OF {lat_col}, {lon_col} ON {table}
+            WHEN NEW.{lat_col} IS NOT NULL AND NEW.{lon_col} IS NOT NULL BEGIN
+                INSERT OR REPLACE INTO {rtree} VALUES (NEW.rowid, NEW.{lat_col}, NEW.{lat_col}, NEW.{lon_col}, NEW.{lon_col});
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {rtree}_ad AFTER DELETE ON {table} BEGIN
+                DELETE FROM {rtree} WHERE id = OLD.rowid;
+            END
+        """)
+        conn.commit()
+        return "rtree"
+    except sqlite3.Error as e:
+        conn.rollback()
+        logger.warning(f"R*Tree index not available for {table} ({e}), using B-tree index")
+
+    try:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_lat_lon ON {table} ({lat_col}, {lon_col})")
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.warning(f"Could not create spatial index for {table}: {e}")
+    return "btree"
+
+
 class DBStorage:
-    """Database storage utilities for geodata."""
+    """
+    Database storage utilities for geodata.
+    
+    The offline database schema is resolved once (which place tables exist and
+    have coordinates) and each one gets a spatial index. Lookups then run one
+    nearest-place query per source on a long-lived connection, whose statement
+    cache keeps the queries prepared.
+    
+    Missing indexes are built by ``prepare`` on its own connection, without the
+    lookup lock; lookups keep using the sources that already have an index and
+    the new ones are swapped in when the build finishes.
+    """
     
     def __init__(self, geocoding_db_path: str = None):
         # Use provided path or fallback to default location
@@ -24,385 +263,356 @@ class DBStorage:
             except ImportError:
                 # Fallback to hardcoded path if config not available
                 self.db_path = os.path.join(os.path.dirname(__file__), "../../../data/geocoding_offline.db")
+        
+        self._lock = threading.Lock()
+        self._prepare_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._sources: Optional[List[PlaceSource]] = None
+        self._schema_version = None
+        self._schema_checked_at = 0.0
+        self._missing_indexes = False
+    
+    def prepare(self):
+        """
+        Resolve the schema and build missing spatial indexes. Building an R*Tree
+        over millions of rows takes a while, so it runs on a separate connection
+        (the service calls this from a background thread at startup) and only
+        the swap of the resolved sources takes the lookup lock.
+        """
+        if not self._prepare_lock.acquire(blocking=False):
+            return
+        try:
+            if not os.path.exists(self.db_path):
+                return
+            with closing(sqlite3.connect(self.db_path, check_same_thread=False)) as conn:
+                sources, _ = self._resolve_schema(conn, build_indexes=True)
+                schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+            with self._lock:
+                self._sources = sources
+                self._schema_version = schema_version
+                self._schema_checked_at = time.monotonic()
+                self._missing_indexes = False
+        except Exception as e:
+            logger.error(f"Error preparing offline geocoding database: {str(e)}")
+        finally:
+            self._prepare_lock.release()
+    
+    def _prepare_in_background(self):
+        if self._prepare_lock.locked():
+            return
+        threading.Thread(target=self.prepare, name="OfflineGeocodingPrepare", daemon=True).start()
     
     async def store_geodata_in_db(self, geodata: Dict, trip_id: str, waypoint: Dict):
         """Store geodata in the offline geocoding database"""
         return await store_geodata_in_db(geodata, trip_id, waypoint)
     
+    def _resolve_schema(self, conn: sqlite3.Connection,
+                        build_indexes: bool = False) -> Tuple[List[PlaceSource], bool]:
+        """
+        Find the place tables present in the database. With ``build_indexes``
+        missing spatial indexes are created; otherwise tables without one are
+        left out. Returns the sources and whether any table lacks an index.
+        """
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        sources = []
+        missing = False
+        
+        for table, lat_col, lon_col, columns in PLACE_SOURCES:
+            if table not in tables:
+                continue
+            table_columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if lat_col not in table_columns or lon_col not in table_columns:
+                continue
+            
+            if build_indexes:
+                spatial_index = ensure_spatial_index(conn, table, lat_col, lon_col, REPLACE_KEYS.get(table))
+            else:
+                spatial_index = existing_spatial_index(conn, table, lat_col, lon_col)
+                if spatial_index is None:
+                    missing = True
+                    continue
+            source = PlaceSource(table, lat_col, lon_col, columns, spatial_index)
+            try:
+                # Validar la consulta una sola vez (columnas de la lista de selección)
+                conn.execute(f"EXPLAIN {source.query}", (0,) * 6).fetchall()
+            except sqlite3.Error as e:
+                logger.debug(f"Skipping offline source {table}: {e}")
+                continue
+            sources.append(source)
+        
+        logger.info(f"Offline geocoding sources: "
+                    f"{[(s.table, s.spatial_index) for s in sources] or 'none'}"
+                    f"{' (indexes pending)' if missing else ''}")
+        return sources, missing
+    
+    def _get_sources(self) -> List[PlaceSource]:
+        """
+        Resolved sources (caller holds the lock); re-resolved only when the
+        database schema changes. Never builds indexes: tables without one are
+        indexed by a background ``prepare``.
+        """
+        if self._conn is None:
+            if not os.path.exists(self.db_path):
+                return []
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        
+        now = time.monotonic()
+        if self._sources is None or now - self._schema_checked_at > SCHEMA_CHECK_INTERVAL:
+            self._schema_checked_at = now
+            schema_version = self._conn.execute("PRAGMA schema_version").fetchone()[0]
+            if self._sources is None or schema_version != self._schema_version:
+                self._sources, self._missing_indexes = self._resolve_schema(self._conn)
+                self._schema_version = schema_version
+        if self._missing_indexes:
+            self._prepare_in_background()
+        return self._sources
+    
+    def _has_sources(self) -> bool:
+        with self._lock:
+            return bool(self._get_sources())
+    
     async def is_available(self) -> bool:
         """Check if the offline database is available"""
         try:
-            # Check if database file exists
-            if not os.path.exists(self.db_path):
-                logger.warning(f"Database file not found: {self.db_path}")
-                return False
-            
-            # Try to connect and check if it has tables
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-                tables = cursor.fetchall()
-                return len(tables) > 0
-                
+            return await asyncio.to_thread(self._has_sources)
         except Exception as e:
             logger.error(f"Error checking database availability: {str(e)}")
             return False
     
+    def _count_records(self) -> int:
+        with closing(sqlite3.connect(self.db_path)) as conn:
+            cursor = conn.cursor()
+            # Try common table names for geocoding data
+            for table_name in ['cities', 'locations', 'geocoding_data', 'places']:
+                try:
+                    cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+                    count = cursor.fetchone()[0]
+                    if count > 0:
+                        return count
+                except sqlite3.OperationalError:
+                    continue
+            
+            # If no specific table found, count all tables
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+            tables = cursor.fetchall()
+            total_count = 0
+            for (table_name,) in tables:
+                if table_name.endswith("_rtree") or "_rtree_" in table_name:
+                    continue
+                try:
+                    cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+                    count = cursor.fetchone()[0]
+                    total_count += count
+                except sqlite3.OperationalError:
+                    continue
+            
+            return total_count
+    
     async def get_record_count(self) -> int:
         """Get the total number of records in the offline database"""
         try:
             if not await self.is_available():
                 return 0
-                
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                # Try common table names for geocoding data
-                for table_name in ['cities', 'locations', 'geocoding_data', 'places']:
-                    try:
-                        cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-                        count = cursor.fetchone()[0]
-                        if count > 0:
-                            return count
-                    except sqlite3.OperationalError:
-                        continue
-                
-                # If no specific table found, count all tables
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-                tables = cursor.fetchall()
-                total_count = 0
-                for (table_name,) in tables:
-                    try:
-                        cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-                        count = cursor.fetchone()[0]
-                        total_count += count
-                    except sqlite3.OperationalError:
-                        continue
-                
-                return total_count
-                
+            return await asyncio.to_thread(self._count_records)
         except Exception as e:
             logger.error(f"Error getting record count: {str(e)}")
             return 0
     
+    def lookup_nearest(self, lat: float, lon: float, radius_km: float = 1.0) -> Optional[Dict]:
+        """Nearest place within radius_km in the first source that has one (blocking)"""
+        # Calculate approximate distance bounds
+        lat_range = radius_km / 111.32  # Approximate km per degree latitude
+        lon_range = radius_km / (111.32 * max(abs(cos(radians(lat))), 0.01))  # Adjust for longitude
+        params = (lat, lon, lat - lat_range, lat + lat_range, lon - lon_range, lon + lon_range)
+        
+        with self._lock:
+            sources = self._get_sources()
+            for source in sources:
+                try:
+                    row = self._conn.execute(source.query, params).fetchone()
+                except sqlite3.Error as e:
+                    logger.debug(f"Query on {source.table} failed: {str(e)}")
+                    continue
+                if row and row[0]:
+                    return source.to_result(row)
+        
+        logger.debug(f"No offline results found for {lat:.6f}, {lon:.6f}")
+        return None
+    
     async def reverse_geocode(self, lat: float, lon: float, radius_km: float = 1.0) -> Optional[Dict]:
-        """Perform reverse geocoding using offline database"""
+        """Perform reverse geocoding using offline database (in a worker thread)"""
+        return await asyncio.to_thread(self._reverse_geocode_blocking, lat, lon, radius_km)
+    
+    def _reverse_geocode_blocking(self, lat: float, lon: float, radius_km: float) -> Optional[Dict]:
         try:
-            if not await self.is_available():
-                return None
+            # Try to use the offline geo manager if the application has loaded it
+            main_module = sys.modules.get('main')
+            offline_geo_manager = getattr(main_module, 'offline_geo_manager', None)
+            if offline_geo_manager and hasattr(offline_geo_manager, 'offline_db'):
+                result = offline_geo_manager.offline_db.get_location(lat, lon)
+                if result:
+                    return {
+                        "name": result.city or "Unknown",
+                        "admin1": result.state or "",
+                        "admin2": result.country or "",
+                        "cc": result.country_code or "",
+                        "distance": 0,  # Distance not available from this method
+                        "source": "offline_database"
+                    }
             
-            # Try to use the offline geo manager if available
-            try:
-                from main import offline_geo_manager
-                if offline_geo_manager and hasattr(offline_geo_manager, 'offline_db'):
-                    result = offline_geo_manager.offline_db.get_location(lat, lon)
-                    if result:
-                        return {
-                            "name": result.city or "Unknown",
-                            "admin1": result.state or "",
-                            "admin2": result.country or "",
-                            "cc": result.country_code or "",
-                            "distance": 0,  # Distance not available from this method
-                            "source": "offline_database"
-                        }
-            except ImportError:
-                logger.debug("Offline geo manager not available")
-            
-            # Fallback: direct database query
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Calculate approximate distance bounds
-                lat_range = radius_km / 111.32  # Approximate km per degree latitude
-                lon_range = radius_km / (111.32 * abs(cos(radians(lat))))  # Adjust for longitude
-                
-                # Get table names to know what we're working with
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-                tables = [row[0] for row in cursor.fetchall()]
-                logger.debug(f"Available tables in offline DB: {tables}")
-                
-                # Try different possible table structures based on what exists
-                queries_to_try = []
-                
-                # First try our detailed_geocoding table if it exists
-                if 'detailed_geocoding' in tables:
-                    queries_to_try.append({
-                        'query': """
-                        SELECT 
-                            road,
-                            state, 
-                            country, 
-                            country_code,
-                            ABS(lat - ?) + ABS(lon - ?) as distance_approx,
-                            display_name,
-                            house_number,
-                            neighbourhood,
-                            suburb,
-                            county,
-                            province,
-                            postcode,
-                            COALESCE(city, village, town, name) as city_name,
-                            village,
-                            town,
-                            city
-                        FROM detailed_geocoding 
-                        WHERE lat BETWEEN ? AND ? 
-                        AND lon BETWEEN ? AND ?
-                        ORDER BY distance_approx LIMIT 1
-                        """,
-                        'params': (lat, lon, lat - lat_range, lat + lat_range, lon - lon_range, lon + lon_range)
-                    })
-                
-                if 'cities' in tables:
-                    # Check columns in cities table
-                    cursor.execute("PRAGMA table_info(cities)")
-                    city_columns = [col[1] for col in cursor.fetchall()]
-                    logger.debug(f"Cities table columns: {city_columns}")
-                    
-                    if 'lat' in city_columns and 'lon' in city_columns:
-                        queries_to_try.append({
-                            'query': """
-                            SELECT name, admin1, admin2, cc, 
-                                   ABS(lat - ?) + ABS(lon - ?) as distance_approx
-                            FROM cities 
-                            WHERE lat BETWEEN ? AND ? 
-                            AND lon BETWEEN ? AND ?
-                            ORDER BY distance_approx LIMIT 1
-                            """,
-                            'params': (lat, lon, lat - lat_range, lat + lat_range, lon - lon_range, lon + lon_range)
-                        })
-                
-                if 'locations' in tables:
-                    # Check columns in locations table
-                    cursor.execute("PRAGMA table_info(locations)")
-                    location_columns = [col[1] for col in cursor.fetchall()]
-                    logger.debug(f"Locations table columns: {location_columns}")
-                    
-                    if 'latitude' in location_columns and 'longitude' in location_columns:
-                        queries_to_try.append({
-                            'query': """
-                            SELECT display_name, state, country, country_code,
-                                   ABS(latitude - ?) + ABS(longitude - ?) as distance_approx
-                            FROM locations
-                            WHERE latitude BETWEEN ? AND ? 
-                            AND longitude BETWEEN ? AND ?
-                            ORDER BY distance_approx LIMIT 1
-                            """,
-                            'params': (lat, lon, lat - lat_range, lat + lat_range, lon - lon_range, lon + lon_range)
-                        })
-                
-                # Try geocoding_data table if it exists
-                if 'geocoding_data' in tables:
-                    cursor.execute("PRAGMA table_info(geocoding_data)")
-                    geocoding_columns = [col[1] for col in cursor.fetchall()]
-                    logger.debug(f"Geocoding_data table columns: {geocoding_columns}")
-                    
-                    if 'lat' in geocoding_columns and 'lon' in geocoding_columns:
-                        queries_to_try.append({
-                            'query': """
-                            SELECT city, state, country, country_code,
-                                   ABS(lat - ?) + ABS(lon - ?) as distance_approx
-                            FROM geocoding_data
-                            WHERE lat BETWEEN ? AND ? 
-                            AND lon BETWEEN ? AND ?
-                            ORDER BY distance_approx LIMIT 1
-                            """,
-                            'params': (lat, lon, lat - lat_range, lat + lat_range, lon - lon_range, lon + lon_range)
-                        })
-                
-                # Execute queries until we find a result
-                for i, query_info in enumerate(queries_to_try):
-                    try:
-                        cursor.execute(query_info['query'], query_info['params'])
-                        result = cursor.fetchone()
-                        
-                        if result and result[0]:  # Make sure we have a valid result
-                            logger.debug(f"Found offline result: {result}")
-                            
-                            # Handle detailed_geocoding table result (more fields)
-                            if i == 0 and 'detailed_geocoding' in tables:
-                                return {
-                                    "road": result[0] if result[0] else "",
-                                    "state": result[1] if result[1] else "",
-                                    "country": result[2] if result[2] else "",
-                                    "country_code": result[3] if result[3] else "",
-                                    "distance": result[4] if len(result) > 4 else 0,
-                                    "display_name": result[5] if len(result) > 5 and result[5] else "",
-                                    "house_number": result[6] if len(result) > 6 and result[6] else "",
-                                    "neighbourhood": result[7] if len(result) > 7 and result[7] else "",
-                                    "suburb": result[8] if len(result) > 8 and result[8] else "",
-                                    "county": result[9] if len(result) > 9 and result[9] else "",
-                                    "province": result[10] if len(result) > 10 and result[10] else "",
-                                    "postcode": result[11] if len(result) > 11 and result[11] else "",
-                                    "city": result[12] if len(result) > 12 and result[12] else "",  # city_name
-                                    "village": result[13] if len(result) > 13 and result[13] else "",
-                                    "town": result[14] if len(result) > 14 and result[14] else "",
-                                    "source": "offline_database_detailed",
-                                    # Legacy fields for backward compatibility
-                                    "name": result[12] if len(result) > 12 and result[12] else "Unknown",
-                                    "admin1": result[1] if result[1] else "",
-                                    "admin2": result[2] if result[2] else "",
-                                    "cc": result[3] if result[3] else ""
-                                }
-                            else:
-                                # Handle other table formats (basic format)
-                                return {
-                                    "name": result[0] or "Unknown",
-                                    "admin1": result[1] or "" if len(result) > 1 else "",
-                                    "admin2": result[2] or "" if len(result) > 2 else "",
-                                    "cc": result[3] or "" if len(result) > 3 else "",
-                                    "distance": result[4] if len(result) > 4 else 0,
-                                    "source": "offline_database"
-                                }
-                    except sqlite3.OperationalError as e:
-                        logger.debug(f"Query failed: {str(e)}")
-                        continue
-                    except Exception as e:
-                        logger.warning(f"Error executing query: {str(e)}")
-                        continue
-                
-                logger.debug(f"No offline results found for {lat:.6f}, {lon:.6f}")
-                return None
+            return self.lookup_nearest(lat, lon, radius_km)
                 
         except Exception as e:
             logger.error(f"Error in offline reverse geocoding: {str(e)}")
             return None
+    
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                self._sources = None
+
+
+
+DEFAULT_GEOCODING_DB_PATH = os.path.join(os.path.dirname(__file__), "../../../data/geocoding_offline.db")
+
+DETAILED_GEOCODING_INSERT = """
+    INSERT OR REPLACE INTO detailed_geocoding (
+        lat, lon, trip_id, place_id, osm_type, osm_id, class, type,
+        place_rank, importance, addresstype, name, display_name,
+        road, house_number, neighbourhood, suburb, village, town, city,
+        municipality, county, state_district, state, region, province,
+        postcode, country, country_code, ISO3166_2_lvl4, ISO3166_2_lvl6,
+        boundingbox_south, boundingbox_north, boundingbox_west, boundingbox_east,
+        source, raw_response
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+OFFLINE_GEOCODING_INSERT = """
+    INSERT OR REPLACE INTO offline_geocoding (
+        lat_min, lat_max, lon_min, lon_max, city, state, country, country_code, level
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _geodata_rows(geodata: Dict, trip_id: str, waypoint: Dict):
+    """Rows for detailed_geocoding and the simplified offline_geocoding table"""
+    raw_response = geodata.get("raw_response", "")
+    
+    # Downloader records carry the full Nominatim response instead of "address"
+    address = geodata.get("address")
+    if not address and isinstance(raw_response, dict):
+        address = raw_response.get("address")
+    address = address or {}
+    source_data = raw_response if isinstance(raw_response, dict) else geodata
+    
+    # Extract bounding box
+    boundingbox = geodata.get("boundingbox") or source_data.get("boundingbox") or []
+    bbox_south = float(boundingbox[0]) if len(boundingbox) > 0 else None
+    bbox_north = float(boundingbox[1]) if len(boundingbox) > 1 else None
+    bbox_west = float(boundingbox[2]) if len(boundingbox) > 2 else None
+    bbox_east = float(boundingbox[3]) if len(boundingbox) > 3 else None
+    
+    lat = geodata.get("lat", waypoint.get("latitude", 0))
+    lon = geodata.get("lon", waypoint.get("longitude", 0))
+    
+    if isinstance(raw_response, dict):
+        raw_text = json.dumps(raw_response)
+    else:
+        raw_text = str(raw_response) if raw_response else None
+    
+    detailed = (
+        lat,
+        lon,
+        trip_id,
+        geodata.get("place_id", source_data.get("place_id")),
+        geodata.get("osm_type", source_data.get("osm_type")),
+        geodata.get("osm_id", source_data.get("osm_id")),
+        geodata.get("class", source_data.get("class")),
+        geodata.get("type", source_data.get("type")),
+        geodata.get("place_rank", source_data.get("place_rank")),
+        geodata.get("importance", source_data.get("importance")),
+        geodata.get("addresstype", source_data.get("addresstype")),
+        geodata.get("name"),
+        geodata.get("display_name", source_data.get("display_name")),
+        address.get("road"),
+        address.get("house_number"),
+        address.get("neighbourhood"),
+        address.get("suburb"),
+        address.get("village"),
+        address.get("town"),
+        address.get("city"),
+        address.get("municipality"),
+        address.get("county"),
+        address.get("state_district"),
+        address.get("state"),
+        address.get("region"),
+        address.get("province"),
+        address.get("postcode"),
+        address.get("country"),
+        address.get("country_code"),
+        address.get("ISO3166-2-lvl4"),
+        address.get("ISO3166-2-lvl6"),
+        bbox_south,
+        bbox_north,
+        bbox_west,
+        bbox_east,
+        geodata.get("source", "online"),
+        raw_text
+    )
+    
+    simplified = (
+        lat - 0.001,
+        lat + 0.001,
+        lon - 0.001,
+        lon + 0.001,
+        address.get("city") or address.get("village") or address.get("town") or geodata.get("name", ""),
+        address.get("state") or address.get("region"),
+        address.get("country"),
+        address.get("country_code"),
+        1
+    )
+    return detailed, simplified
+
+
+def store_geodata_batch(records: List[Dict], trip_id: str, db_path: Optional[str] = None) -> int:
+    """
+    Store many geodata records in one transaction (executemany).
+    
+    Each record is a geodata dict with "lat"/"lon". Rows for the simplified
+    offline_geocoding table are only written when that table exists. Returns
+    the number of records written.
+    """
+    if not records:
+        return 0
+    
+    rows = [_geodata_rows(record, trip_id, {"latitude": record.get("lat"), "longitude": record.get("lon")})
+            for record in records]
+    
+    # "with conn" solo cierra la transacción; closing() cierra la conexión
+    with closing(sqlite3.connect(db_path or DEFAULT_GEOCODING_DB_PATH)) as conn, conn:
+        conn.execute(DETAILED_GEOCODING_DDL)
+        conn.executemany(DETAILED_GEOCODING_INSERT, [detailed for detailed, _ in rows])
+        
+        has_offline_table = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='offline_geocoding'"
+        ).fetchone()
+        if has_offline_table:
+            conn.executemany(OFFLINE_GEOCODING_INSERT, [simplified for _, simplified in rows])
+    
+    logger.debug(f"Stored {len(rows)} geodata records for trip {trip_id}")
+    return len(rows)
 
 
 async def store_geodata_in_db(geodata: Dict, trip_id: str, waypoint: Dict):
     """Store geodata in the offline geocoding database"""
     try:
-        db_path = os.path.join(os.path.dirname(__file__), "../../../data/geocoding_offline.db")
-        
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Create detailed geocoding table if it doesn't exist
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS detailed_geocoding (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    lat REAL NOT NULL,
-                    lon REAL NOT NULL,
-                    trip_id TEXT,
-                    place_id INTEGER,
-                    osm_type TEXT,
-                    osm_id INTEGER,
-                    class TEXT,
-                    type TEXT,
-                    place_rank INTEGER,
-                    importance REAL,
-                    addresstype TEXT,
-                    name TEXT,
-                    display_name TEXT,
-                    road TEXT,
-                    house_number TEXT,
-                    neighbourhood TEXT,
-                    suburb TEXT,
-                    village TEXT,
-                    town TEXT,
-                    city TEXT,
-                    municipality TEXT,
-                    county TEXT,
-                    state_district TEXT,
-                    state TEXT,
-                    region TEXT,
-                    province TEXT,
-                    postcode TEXT,
-                    country TEXT,
-                    country_code TEXT,
-                    ISO3166_2_lvl4 TEXT,
-                    ISO3166_2_lvl6 TEXT,
-                    boundingbox_south REAL,
-                    boundingbox_north REAL,
-                    boundingbox_west REAL,
-                    boundingbox_east REAL,
-                    source TEXT,
-                    raw_response TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(lat, lon, trip_id) ON CONFLICT REPLACE
-                )
-            """)
-            
-            # Extract address information safely
-            address = geodata.get("address", {}) or {}
-            raw_response = geodata.get("raw_response", "")
-            
-            # Extract bounding box
-            boundingbox = geodata.get("boundingbox", [])
-            bbox_south = float(boundingbox[0]) if len(boundingbox) > 0 else None
-            bbox_north = float(boundingbox[1]) if len(boundingbox) > 1 else None
-            bbox_west = float(boundingbox[2]) if len(boundingbox) > 2 else None
-            bbox_east = float(boundingbox[3]) if len(boundingbox) > 3 else None
-            
-            # Insert detailed geocoding data
-            cursor.execute("""
-                INSERT OR REPLACE INTO detailed_geocoding (
-                    lat, lon, trip_id, place_id, osm_type, osm_id, class, type,
-                    place_rank, importance, addresstype, name, display_name,
-                    road, house_number, neighbourhood, suburb, village, town, city,
-                    municipality, county, state_district, state, region, province,
-                    postcode, country, country_code, ISO3166_2_lvl4, ISO3166_2_lvl6,
-                    boundingbox_south, boundingbox_north, boundingbox_west, boundingbox_east,
-                    source, raw_response
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                geodata.get("lat", waypoint.get("latitude", 0)),
-                geodata.get("lon", waypoint.get("longitude", 0)),
-                trip_id,
-                geodata.get("place_id"),
-                geodata.get("osm_type"),
-                geodata.get("osm_id"),
-                geodata.get("class"),
-                geodata.get("type"),
-                geodata.get("place_rank"),
-                geodata.get("importance"),
-                geodata.get("addresstype"),
-                geodata.get("name"),
-                geodata.get("display_name"),
-                address.get("road"),
-                address.get("house_number"),
-                address.get("neighbourhood"),
-                address.get("suburb"),
-                address.get("village"),
-                address.get("town"),
-                address.get("city"),
-                address.get("municipality"),
-                address.get("county"),
-                address.get("state_district"),
-                address.get("state"),
-                address.get("region"),
-                address.get("province"),
-                address.get("postcode"),
-                address.get("country"),
-                address.get("country_code"),
-                address.get("ISO3166-2-lvl4"),
-                address.get("ISO3166-2-lvl6"),
-                bbox_south,
-                bbox_north,
-                bbox_west,
-                bbox_east,
-                geodata.get("source", "online"),
-                str(raw_response) if raw_response else None
-            ))
-            
-            # Also store in the simplified format for backward compatibility
-            cursor.execute("""
-                INSERT OR REPLACE INTO offline_geocoding (
-                    lat_min, lat_max, lon_min, lon_max, city, state, country, country_code, level
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                geodata.get("lat", waypoint.get("latitude", 0)) - 0.001,
-                geodata.get("lat", waypoint.get("latitude", 0)) + 0.001,
-                geodata.get("lon", waypoint.get("longitude", 0)) - 0.001,
-                geodata.get("lon", waypoint.get("longitude", 0)) + 0.001,
-                address.get("city") or address.get("village") or address.get("town") or geodata.get("name", ""),
-                address.get("state") or address.get("region"),
-                address.get("country"),
-                address.get("country_code"),
-                1
-            ))
-            
-            conn.commit()
-            logger.info(f"Stored detailed geocoding data for {geodata.get('lat')}, {geodata.get('lon')} in trip {trip_id}")
+        record = dict(geodata)
+        record.setdefault("lat", waypoint.get("latitude", waypoint.get("lat", 0)))
+        record.setdefault("lon", waypoint.get("longitude", waypoint.get("lon", 0)))
+        store_geodata_batch([record], trip_id)
+        logger.info(f"Stored detailed geocoding data for {geodata.get('lat')}, {geodata.get('lon')} in trip {trip_id}")
             
     except Exception as e:
         logger.error(f"Error storing geodata in database: {e}")
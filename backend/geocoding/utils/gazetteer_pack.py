@@ -0,0 +1,430 @@
+"""
+Read-only gazetteer packs for offline reverse geocoding.
+
+A pack holds the places of one trip (or one region) from detailed_geocoding
+without the raw Nominatim JSON. Places are sorted by integer geohash cell,
+address components are interned in a string table and every record has a
+fixed size, so the file is used in place through mmap: a lookup is a few
+``bisect`` calls on the cell keys plus unpacking the nearby records.
+
+Layout (little endian, sections aligned to 8 bytes):
+    header   magic, version, precision, counts and section offsets
+    keys     uint64 cell code per record, ascending
+    records  lat, lon (float64) + one uint32 string id per PACK_FIELDS entry
+    strings  uint32 offsets (string_count + 1) followed by UTF-8 data
+    metadata JSON (source database, filters, last detailed_geocoding id)
+
+Packs are rebuilt incrementally: only detailed_geocoding rows with an id
+above the one recorded in the pack are read and merged into it, and places
+whose coordinates are no longer in the database are dropped.
+"""
+
+import json
+import logging
+import mmap
+import os
+import re
+import sqlite3
+import struct
+import tempfile
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from math import cos, radians
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .corridor_planner import cell_bits, cell_size_deg, cell_codes
+from .geohash import DEFAULT_CELL_PRECISION
+
+logger = logging.getLogger(__name__)
+
+PACK_MAGIC = b"DCGZPACK"
+PACK_VERSION = 1
+PACK_EXTENSION = ".gzpack"
+
+# Campos de dirección guardados por registro, en el orden de PlaceSource.to_result
+PACK_FIELDS = (
+    "road", "house_number", "neighbourhood", "suburb", "city", "village", "town",
+    "county", "province", "state", "postcode", "country", "country_code", "display_name"
+)
+
+_HEADER = struct.Struct("<8sHBxIIIQQQQQ")
+_RECORD = struct.Struct("<dd" + "I" * len(PACK_FIELDS))
+_COORDS = struct.Struct("<dd")
+
+_SOURCE_QUERY = """
+SELECT id, lat, lon, road, house_number, neighbourhood, suburb,
+       COALESCE(city, village, town, name), village, town, county, province,
+       state, postcode, country, country_code, display_name
+FROM detailed_geocoding
+WHERE id > ? AND lat IS NOT NULL AND lon IS NOT NULL
+"""
+_SOURCE_KEYS_QUERY = """
+SELECT DISTINCT lat, lon FROM detailed_geocoding
+WHERE lat IS NOT NULL AND lon IS NOT NULL
+"""
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _spread_bits(value: int) -> int:
+    """Insert a zero bit between the bits of a 32-bit integer (Morton order)"""
+    value = (value | (value << 16)) & 0x0000FFFF0000FFFF
+    value = (value | (value << 8)) & 0x00FF00FF00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value << 2)) & 0x3333333333333333
+    return (value | (value << 1)) & 0x5555555555555555
+
+
+class GazetteerPack:
+    """Memory-mapped pack opened read-only"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Fichero vacío: no se puede mapear
+            self._file.close()
+            raise ValueError(f"Empty gazetteer pack: {path}")
+
+        (magic, version, self.precision, self.record_count, self.string_count, meta_len,
+         keys_off, self._records_off, strings_off, data_off, meta_off) = _HEADER.unpack_from(self._mm, 0)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            self.close()
+            raise ValueError(f"Not a gazetteer pack (v{PACK_VERSION}): {path}")
+
+        view = memoryview(self._mm)
+        self._keys = view[keys_off:keys_off + 8 * self.record_count].cast("Q")
+        self._string_offsets = view[strings_off:strings_off + 4 * (self.string_count + 1)].cast("I")
+        self._data_off = data_off
+        self.metadata = json.loads(bytes(view[meta_off:meta_off + meta_len]).decode("utf-8"))
+        view.release()
+
+        self._strings: Dict[int, str] = {}
+        self._cell_h, self._cell_w = cell_size_deg(self.precision)
+        self._lat_bits, self._lon_bits = cell_bits(self.precision)
+
+    def _string(self, string_id: int) -> str:
+        value = self._strings.get(string_id)
+        if value is None:
+            start = self._data_off + self._string_offsets[string_id]
+            end = self._data_off + self._string_offsets[string_id + 1]
+            value = self._mm[start:end].decode("utf-8")
+            self._strings[string_id] = value
+        return value
+
+    def _candidate_ranges(self, min_lat: float, max_lat: float, min_lon: float,
+                          max_lon: float) -> List[Tuple[int, int]]:
+        """
+        Cells overlapping a bounding box as sorted (first, last) code ranges;
+        neighbouring cells are often consecutive in geohash order, which saves
+        bisect calls.
+        """
+        i0 = max(0, int((min_lat + 90.0) // self._cell_h))
+        i1 = min((1 << self._lat_bits) - 1, int((max_lat + 90.0) // self._cell_h))
+        j0 = max(0, int((min_lon + 180.0) // self._cell_w))
+        j1 = min((1 << self._lon_bits) - 1, int((max_lon + 180.0) // self._cell_w))
+        # El bit más significativo es de longitud: con un total par de bits la
+        # longitud ocupa las posiciones impares, con uno impar las pares
+        lon_shift, lat_shift = (1, 0) if (self._lat_bits + self._lon_bits) % 2 == 0 else (0, 1)
+        lons = [_spread_bits(j) << lon_shift for j in range(j0, j1 + 1)]
+        codes = sorted((_spread_bits(i) << lat_shift) | lon for i in range(i0, i1 + 1) for lon in lons)
+        ranges = []
+        first = last = codes[0]
+        for code in codes[1:]:
+            if code != last + 1:
+                ranges.append((first, last))
+                first = code
+            last = code
+        ranges.append((first, last))
+        return ranges
+
+    def record(self, index: int) -> Dict:
+        """Record ``index`` as a dict with lat, lon and the PACK_FIELDS"""
+        values = _RECORD.unpack_from(self._mm, self._records_off + index * _RECORD.size)
+        result = {"lat": values[0], "lon": values[1]}
+        for field, string_id in zip(PACK_FIELDS, values[2:]):
+            result[field] = self._string(string_id)
+        return result
+
+    def records(self):
+        """All records, in cell order"""
+        for index in range(self.record_count):
+            yield self.record(index)
+
+    def lookup_nearest(self, lat: float, lon: float, radius_km: float = 1.0) -> Optional[Dict]:
+        """
+        Nearest place within the same bounding box and distance (Manhattan, in
+        degrees) as DBStorage.lookup_nearest, in the same result format.
+        """
+        if self.record_count == 0:
+            return None
+        lat_range = radius_km / 111.32
+        lon_range = radius_km / (111.32 * max(abs(cos(radians(lat))), 0.01))
+        min_lat, max_lat = lat - lat_range, lat + lat_range
+        min_lon, max_lon = lon - lon_range, lon + lon_range
+
+        keys = self._keys
+        unpack = _COORDS.unpack_from
+        best_index, best_distance = None, None
+        start = 0
+        for first, last in self._candidate_ranges(min_lat, max_lat, min_lon, max_lon):
+            start = bisect_left(keys, first, start)
+            end = bisect_right(keys, last, start)
+            for index in range(start, end):
+                place_lat, place_lon = unpack(self._mm, self._records_off + index * _RECORD.size)
+                if not (min_lat <= place_lat <= max_lat and min_lon <= place_lon <= max_lon):
+                    continue
+                distance = abs(place_lat - lat) + abs(place_lon - lon)
+                if best_distance is None or distance < best_distance:
+                    best_index, best_distance = index, distance
+
+        if best_index is None:
+            return None
+        place = self.record(best_index)
+        city = place["city"]
+        return {
+            "road": place["road"],
+            "state": place["state"],
+            "country": place["country"],
+            "country_code": place["country_code"],
+            "distance": best_distance,
+            "display_name": place["display_name"],
+            "house_number": place["house_number"],
+            "neighbourhood": place["neighbourhood"],
+            "suburb": place["suburb"],
+            "county": place["county"],
+            "province": place["province"],
+            "postcode": place["postcode"],
+            "city": city,
+            "village": place["village"],
+            "town": place["town"],
+            "source": "offline_gazetteer_pack",
+            # Legacy fields for backward compatibility
+            "name": city or "Unknown",
+            "admin1": place["state"],
+            "admin2": place["country"],
+            "cc": place["country_code"]
+        }
+
+    def close(self):
+        for view in ("_keys", "_string_offsets"):
+            if getattr(self, view, None) is not None:
+                getattr(self, view).release()
+                setattr(self, view, None)
+        if getattr(self, "_mm", None) is not None:
+            self._mm.close()
+            self._mm = None
+        self._file.close()
+
+
+def write_pack(path: str, places: List[Dict], metadata: Dict,
+               precision: int = DEFAULT_CELL_PRECISION):
+    """
+    Write ``places`` (dicts with lat, lon and the PACK_FIELDS) as a pack.
+    The file is written to a temporary file next to ``path`` and renamed
+    over it, so readers never see a partial pack.
+    """
+    lats = np.fromiter((p["lat"] for p in places), dtype=np.float64, count=len(places))
+    lons = np.fromiter((p["lon"] for p in places), dtype=np.float64, count=len(places))
+    codes = cell_codes(lats, lons, precision) if places else np.zeros(0, dtype=np.int64)
+    order = np.lexsort((lons, lats, codes))
+
+    # Tabla de cadenas: el id 0 es la cadena vacía
+    string_ids = {"": 0}
+    strings = [b""]
+    records = bytearray()
+    for index in order.tolist():
+        place = places[index]
+        ids = []
+        for field in PACK_FIELDS:
+            value = place.get(field) or ""
+            string_id = string_ids.get(value)
+            if string_id is None:
+                string_id = string_ids[value] = len(strings)
+                strings.append(value.encode("utf-8"))
+            ids.append(string_id)
+        records += _RECORD.pack(place["lat"], place["lon"], *ids)
+
+    offsets = np.zeros(len(strings) + 1, dtype="<u4")
+    offsets[1:] = np.cumsum([len(s) for s in strings])
+    meta = json.dumps(metadata, sort_keys=True).encode("utf-8")
+
+    keys_off = _align(_HEADER.size)
+    records_off = _align(keys_off + 8 * len(places))
+    strings_off = _align(records_off + len(records))
+    data_off = strings_off + offsets.nbytes
+    meta_off = _align(data_off + int(offsets[-1]))
+
+    # Nombre temporal único: dos stores pueden escribir el mismo pack a la vez
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                    prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(PACK_MAGIC, PACK_VERSION, precision, len(places), len(strings), len(meta),
+                                 keys_off, records_off, strings_off, data_off, meta_off))
+            f.write(b"\0" * (keys_off - f.tell()))
+            f.write(codes[order].astype("<u8").tobytes())
+            f.write(b"\0" * (records_off - f.tell()))
+            f.write(records)
+            f.write(b"\0" * (strings_off - f.tell()))
+            f.write(offsets.tobytes())
+            f.write(b"".join(strings))
+            f.write(b"\0" * (meta_off - f.tell()))
+            f.write(meta)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def build_pack(db_path: str, pack_path: str, trip_id: Optional[str] = None,
+               bbox: Optional[Tuple[float, float, float, float]] = None,
+               precision: int = DEFAULT_CELL_PRECISION, full: bool = False) -> Dict:
+    """
+    Build or update the pack at ``pack_path`` from detailed_geocoding.
+
+    ``trip_id`` limits the pack to one trip and ``bbox`` (min_lat, min_lon,
+    max_lat, max_lon) to a region. An existing pack built with the same
+    source and filters is updated with the rows added since it was built;
+    otherwise (or with ``full``) it is rebuilt. Rows replaced in the database
+    get a new id, so they are picked up too and win over the packed copy;
+    places deleted from the database are dropped from the pack. Returns
+    build statistics.
+    """
+    filters = {
+        "source_db": os.path.abspath(db_path),
+        "trip_id": trip_id,
+        "bbox": list(bbox) if bbox else None,
+        "precision": precision
+    }
+    places: Dict[Tuple[float, float], Dict] = {}
+    last_id = 0
+
+    if not full and os.path.exists(pack_path):
+        try:
+            pack = GazetteerPack(pack_path)
+            try:
+                if all(pack.metadata.get(key) == value for key, value in filters.items()):
+                    last_id = pack.metadata.get("last_id", 0)
+                    places = {(p["lat"], p["lon"]): p for p in pack.records()}
+            finally:
+                pack.close()
+        except (OSError, ValueError) as e:
+            logger.warning(f"Rebuilding unreadable gazetteer pack {pack_path}: {e}")
+
+    where = ""
+    filter_params: List = []
+    if trip_id is not None:
+        where += " AND trip_id = ?"
+        filter_params.append(trip_id)
+    if bbox:
+        where += " AND lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?"
+        filter_params.extend((bbox[0], bbox[2], bbox[1], bbox[3]))
+
+    removed = 0
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        max_id = conn.execute("SELECT MAX(id) FROM detailed_geocoding").fetchone()[0] or 0
+        if max_id < last_id:
+            # La base de datos se recreó: los ids del pack no valen
+            places, last_id = {}, 0
+        if places:
+            # Lugares borrados de la base de datos desde que se construyó el pack
+            existing = set(conn.execute(_SOURCE_KEYS_QUERY + where, filter_params).fetchall())
+            for key in [key for key in places if key not in existing]:
+                del places[key]
+                removed += 1
+        rows = conn.execute(_SOURCE_QUERY + where + " ORDER BY id", [last_id] + filter_params).fetchall()
+    finally:
+        conn.close()
+
+    if not rows and not removed and last_id and os.path.exists(pack_path):
+        return {"path": pack_path, "updated": False, "records": len(places), "added": 0, "removed": 0}
+
+    for row in rows:
+        places[(row[1], row[2])] = {"lat": row[1], "lon": row[2], **dict(zip(PACK_FIELDS, row[3:]))}
+
+    metadata = {
+        **filters,
+        "last_id": max([last_id] + [row[0] for row in rows[-1:]]),
+        "built_at": datetime.now().isoformat(),
+        "records": len(places)
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(pack_path)), exist_ok=True)
+    write_pack(pack_path, list(places.values()), metadata, precision)
+
+    logger.info(f"Gazetteer pack {pack_path}: {len(places)} places ({len(rows)} rows read)")
+    return {"path": pack_path, "updated": True, "records": len(places), "added": len(rows),
+            "removed": removed, "size_bytes": os.path.getsize(pack_path)}
+
+
+def _safe_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", str(name))
+
+
+class GazetteerPackStore:
+    """
+    Packs kept in a directory next to the geocoding database, one per trip
+    (``trip_<id>.gzpack``) or region (``region_<name>.gzpack``). Holds the
+    pack of the active trip open for lookups.
+    """
+
+    def __init__(self, db_path: str, pack_dir: Optional[str] = None):
+        self.db_path = db_path
+        self.pack_dir = pack_dir or os.path.join(os.path.dirname(os.path.abspath(db_path)), "gazetteer_packs")
+        self._lock = threading.Lock()
+        self.active_trip_id: Optional[str] = None
+        self.active_pack: Optional[GazetteerPack] = None
+
+    def trip_pack_path(self, trip_id: str) -> str:
+        return os.path.join(self.pack_dir, f"trip_{_safe_name(trip_id)}{PACK_EXTENSION}")
+
+    def region_pack_path(self, name: str) -> str:
+        return os.path.join(self.pack_dir, f"region_{_safe_name(name)}{PACK_EXTENSION}")
+
+    def build_trip_pack(self, trip_id: str, full: bool = False) -> Dict:
+        return build_pack(self.db_path, self.trip_pack_path(trip_id), trip_id=trip_id, full=full)
+
+    def build_region_pack(self, name: str, bbox: Tuple[float, float, float, float], full: bool = False) -> Dict:
+        return build_pack(self.db_path, self.region_pack_path(name), bbox=bbox, full=full)
+
+    def activate_trip(self, trip_id: Optional[str]) -> Optional[Dict]:
+        """
+        Update (incrementally) and open the pack of ``trip_id``, replacing the
+        active one. ``None`` just closes the active pack. Blocking.
+        """
+        result = None
+        pack = None
+        if trip_id is not None:
+            if os.path.exists(self.db_path):
+                try:
+                    result = self.build_trip_pack(trip_id)
+                except sqlite3.Error as e:
+                    logger.warning(f"Could not update gazetteer pack for trip {trip_id}: {e}")
+            path = self.trip_pack_path(trip_id)
+            if os.path.exists(path):
+                pack = GazetteerPack(path)
+
+        with self._lock:
+            previous, self.active_pack = self.active_pack, pack
+            self.active_trip_id = trip_id
+        if previous is not None:
+            previous.close()
+        return result
+
+    def lookup_nearest(self, lat: float, lon: float, radius_km: float = 1.0) -> Optional[Dict]:
+        with self._lock:
+            if self.active_pack is None:
+                return None
+            return self.active_pack.lookup_nearest(lat, lon, radius_km)
+
+    def close(self):
+        self.activate_trip(None)
@@ -0,0 +1,86 @@
+"""
+Geohash encoding used to quantize coordinates into cache cells.
+
+Precision reference (cell size at the equator):
+- 5 -> 4.9 km x 4.9 km
+- 6 -> 1.2 km x 0.6 km
+- 7 -> 153 m x 153 m
+"""
+
+from typing import Tuple
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_DECODE_MAP = {c: i for i, c in enumerate(_BASE32)}
+
+# Precisión por defecto de las celdas de caché (~1 km, similar al antiguo radio de 0.01°)
+DEFAULT_CELL_PRECISION = 6
+
+
+def encode(lat: float, lon: float, precision: int = DEFAULT_CELL_PRECISION) -> str:
+    """Encode coordinates as a geohash of ``precision`` characters"""
+    lat_min, lat_max = -90.0, 90.0
+    lon_min, lon_max = -180.0, 180.0
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(chars) < precision:
+        if even:
+            mid = (lon_min + lon_max) / 2
+            if lon >= mid:
+                bits = (bits << 1) | 1
+                lon_min = mid
+            else:
+                bits <<= 1
+                lon_max = mid
+        else:
+            mid = (lat_min + lat_max) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_min = mid
+            else:
+                bits <<= 1
+                lat_max = mid
+        even = not even
+        bit_count += 1
+
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(chars)
+
+
+def decode_bbox(cell: str) -> Tuple[float, float, float, float]:
+    """Return (min_lat, min_lon, max_lat, max_lon) of a geohash cell"""
+    lat_min, lat_max = -90.0, 90.0
+    lon_min, lon_max = -180.0, 180.0
+    even = True
+
+    for char in cell:
+        value = _DECODE_MAP[char]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (lon_min + lon_max) / 2
+                if bit:
+                    lon_min = mid
+                else:
+                    lon_max = mid
+            else:
+                mid = (lat_min + lat_max) / 2
+                if bit:
+                    lat_min = mid
+                else:
+                    lat_max = mid
+            even = not even
+
+    return lat_min, lon_min, lat_max, lon_max
+
+
+def decode(cell: str) -> Tuple[float, float]:
+    """Return the (lat, lon) center of a geohash cell"""
+    lat_min, lon_min, lat_max, lon_max = decode_bbox(cell)
+    return (lat_min + lat_max) / 2, (lon_min + lon_max) / 2
@@ -10,7 +10,7 @@ import logging
 import time
 import json
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Set
+from typing import List, Dict, Optional, Set, Tuple
 from pathlib import Path
 from sqlalchemy import text
 
@@ -18,6 +18,7 @@ from sqlalchemy import text
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from geocoding.services.reverse_geocoding_service import ReverseGeocodingService, LocationInfo
+from geocoding.utils import geohash
 from trip_logger_package.services.trip_manager import TripManager
 
 logger = logging.getLogger(__name__)
@@ -30,7 +31,8 @@ class ReverseGeocodingWorker:
                  trip_manager: TripManager,
                  batch_size: int = 10,
                  delay_between_batches: float = 60.0,
-                 connected_clients: Optional[Set] = None):
+                 connected_clients: Optional[Set] = None,
+                 cell_precision: int = 7):
         self.reverse_geocoding_service = reverse_geocoding_service
         self.trip_manager = trip_manager
         self.batch_size = batch_size
@@ -39,10 +41,25 @@ class ReverseGeocodingWorker:
         self.worker_thread = None
         self.connected_clients = connected_clients or set()
         
+        # Los clips se agrupan por celda geohash (precisión 7 ≈ 150 m) y cada
+        # celda se resuelve una sola vez por lote
+        self.cell_precision = cell_precision
+        self._location_column_checked = False
+        
+        # Los clips pendientes se recorren por páginas de id descendente; el
+        # cursor es el id del último clip del lote anterior (None = desde el más
+        # nuevo). Así los clips que fallan no impiden llegar a los más antiguos.
+        self._page_cursor: Optional[int] = None
+        
+        # Evento para despertar el bucle cuando se guarda un clip nuevo
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake_event: Optional[asyncio.Event] = None
+        
         # Estadísticas del worker
         self.stats = {
             'clips_processed': 0,
             'clips_failed': 0,
+            'cells_resolved': 0,
             'last_batch_time': None,
             'last_batch_count': 0,
             'start_time': datetime.now().isoformat()
@@ -58,6 +75,8 @@ class ReverseGeocodingWorker:
             return
         
         self.running = True
+        self._loop = asyncio.get_running_loop()
+        self._wake_event = asyncio.Event()
         
         # Ejecutar el worker loop directamente en el event loop actual
         await self._worker_loop_async()
@@ -67,8 +86,19 @@ class ReverseGeocodingWorker:
     def stop(self):
         """Detener el worker"""
         self.running = False
+        self.notify_new_clip()
         logger.info("ReverseGeocodingWorker detenido")
     
+    def notify_new_clip(self, *args):
+        """Despertar el worker (seguro desde cualquier hilo, p. ej. el de grabación)"""
+        if self._loop is None or self._wake_event is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._wake_event.set)
+        except RuntimeError:
+            # El event loop ya se cerró
+            pass
+    
     async def _worker_loop_async(self):
         """Bucle principal del worker (versión async)"""
         logger.info("Worker loop iniciado")
@@ -94,11 +124,16 @@ class ReverseGeocodingWorker:
                 else:
                     logger.debug("No hay clips pendientes de procesar")
                 
-                # Esperar antes del siguiente lote usando asyncio.sleep
-                for _ in range(int(self.delay_between_batches * 10)):
-                    if not self.running:
-                        break
-                    await asyncio.sleep(0.1)
+                # Quedan páginas por recorrer en esta vuelta: seguir sin esperar
+                if self._page_cursor is not None:
+                    continue
+                
+                # Esperar a un clip nuevo (o al intervalo máximo entre lotes)
+                try:
+                    await asyncio.wait_for(self._wake_event.wait(), timeout=self.delay_between_batches)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake_event.clear()
                     
             except Exception as e:
                 logger.error(f"Error en worker loop: {e}")
@@ -129,30 +164,56 @@ class ReverseGeocodingWorker:
                 time.sleep(30)  # Esperar más tiempo si hay error
     
     async def _process_batch(self) -> int:
-        """Procesar un lote de clips sin ubicación"""
+        """
+        Procesar un lote de clips sin ubicación.
+        
+        Los clips se agrupan por celda geohash: cada celda se resuelve una sola
+        vez a través del servicio (atascos y aparcamientos generan muchos clips
+        en el mismo punto) y todas las actualizaciones se escriben en una sola
+        transacción.
+        """
         clips_to_process = self._get_clips_without_location()
         
         if not clips_to_process:
             return 0
         
-        processed_count = 0
+        cells: Dict[str, List[Dict]] = {}
+        for clip in clips_to_process:
+            cell = geohash.encode(clip['start_lat'], clip['start_lon'], self.cell_precision)
+            cells.setdefault(cell, []).append(clip)
         
-        for clip in clips_to_process[:self.batch_size]:
+        updates = []
+        failed = 0
+        for cell, cell_clips in cells.items():
+            # Coordenadas reales del primer clip de la celda como representante
+            first = cell_clips[0]
             try:
-                success = await self._process_clip(clip)
-                if success:
-                    processed_count += 1
-                    self.stats['clips_processed'] += 1
-                else:
-                    self.stats['clips_failed'] += 1
+                location_info = await self.reverse_geocoding_service.get_location(
+                    first['start_lat'], first['start_lon']
+                )
             except Exception as e:
-                logger.error(f"Error procesando clip {clip['id']}: {e}")
-                self.stats['clips_failed'] += 1
+                logger.error(f"Error resolviendo celda {cell}: {e}")
+                location_info = None
+            
+            if location_info:
+                self.stats['cells_resolved'] += 1
+                updates.extend((clip['id'], location_info) for clip in cell_clips)
+            else:
+                logger.debug(f"No se pudo obtener ubicación para la celda {cell} ({len(cell_clips)} clips)")
+                failed += len(cell_clips)
+        
+        processed_count = self._update_clip_locations(updates) if updates else 0
+        self.stats['clips_processed'] += processed_count
+        self.stats['clips_failed'] += failed + (len(updates) - processed_count)
         
         # Actualizar estadísticas del lote
         self.stats['last_batch_time'] = datetime.now().isoformat()
         self.stats['last_batch_count'] = processed_count
         
+        if processed_count:
+            logger.info(f"Lote de geocodificación: {processed_count} clips actualizados "
+                        f"con {len(cells)} consultas de ubicación")
+        
         # Enviar notificación sobre el procesamiento completado
         if processed_count > 0:
             await self._send_notification({
@@ -201,7 +262,13 @@ class ReverseGeocodingWorker:
             logger.debug(f"Removidos {len(clients_to_remove)} clientes WebSocket desconectados")
     
     def _get_clips_without_location(self) -> List[Dict]:
-        """Obtener clips que no tienen información de ubicación"""
+        """
+        Obtener la siguiente página de clips sin información de ubicación.
+        
+        Las páginas avanzan por id (de más nuevo a más antiguo) aunque los clips
+        de la página anterior no se hayan podido resolver; al llegar al final la
+        vuelta termina y la siguiente empieza otra vez por los más nuevos.
+        """
         try:
             with self.trip_manager.db_manager.session_scope() as session:
                 # Buscar clips que tienen coordenadas GPS pero no tienen location
@@ -210,16 +277,19 @@ class ReverseGeocodingWorker:
                 FROM video_clips
                 WHERE (start_lat IS NOT NULL AND start_lon IS NOT NULL)
                 AND (location IS NULL OR location = '')
-                ORDER BY start_time DESC
+                AND (:cursor IS NULL OR id < :cursor)
+                ORDER BY id DESC
                 LIMIT :batch_limit
-                '''), {"batch_limit": self.batch_size * 2})  # Obtener el doble para tener buffer
+                '''), {"batch_limit": self.batch_size, "cursor": self._page_cursor})
                 
                 clips = [dict(row._mapping) for row in result.fetchall()]
                 
-                return clips
+            self._page_cursor = clips[-1]['id'] if len(clips) >= self.batch_size else None
+            return clips
                 
         except Exception as e:
             logger.error(f"Error obteniendo clips sin ubicación: {e}")
+            self._page_cursor = None
             return []
     
     async def _process_clip(self, clip: Dict) -> bool:
@@ -228,8 +298,6 @@ class ReverseGeocodingWorker:
             clip_id = clip['id']
             start_lat = clip['start_lat']
             start_lon = clip['start_lon']
-            end_lat = clip['end_lat']
-            end_lon = clip['end_lon']
             
             logger.debug(f"Procesando clip {clip_id}")
             
@@ -239,8 +307,7 @@ class ReverseGeocodingWorker:
                 
                 if location_info:
                     # Actualizar la base de datos con la información de ubicación
-                    success = self._update_clip_location(clip_id, location_info)
-                    if success:
+                    if self._update_clip_locations([(clip_id, location_info)]):
                         logger.info(f"Clip {clip_id} actualizado con ubicación: {location_info.get_display_name()}")
                         return True
                 else:
@@ -252,43 +319,63 @@ class ReverseGeocodingWorker:
             logger.error(f"Error procesando clip: {e}")
             return False
     
-    def _update_clip_location(self, clip_id: int, location_info: LocationInfo) -> bool:
-        """Actualizar la ubicación de un clip en la base de datos"""
+    def _ensure_location_column(self, session):
+        """Añadir la columna location a video_clips si no existe (se comprueba una vez)"""
+        if self._location_column_checked:
+            return
+        result = session.execute(text("PRAGMA table_info(video_clips)"))
+        columns = [column[1] for column in result.fetchall()]
+        
+        if 'location' not in columns:
+            session.execute(text("ALTER TABLE video_clips ADD COLUMN location TEXT"))
+            logger.info("Columna 'location' añadida a video_clips")
+        self._location_column_checked = True
+    
+    @staticmethod
+    def _location_json(location_info: LocationInfo, timestamp: str) -> str:
+        return json.dumps({
+            'display_name': location_info.get_display_name(),
+            'city': location_info.city,
+            'town': location_info.town,
+            'village': location_info.village,
+            'state': location_info.state,
+            'country': location_info.country,
+            'country_code': location_info.country_code,
+            'timestamp': timestamp
+        })
+    
+    def _update_clip_locations(self, updates: List[Tuple[int, LocationInfo]]) -> int:
+        """Actualizar la ubicación de varios clips en una sola transacción (executemany)"""
         try:
+            timestamp = datetime.now().isoformat()
+            # Los clips de una misma celda comparten el JSON serializado
+            serialized: Dict[int, str] = {}
+            params = []
+            for clip_id, location_info in updates:
+                key = id(location_info)
+                if key not in serialized:
+                    serialized[key] = self._location_json(location_info, timestamp)
+                params.append({"location_json": serialized[key], "clip_id": clip_id})
+            
             with self.trip_manager.db_manager.session_scope() as session:
-                # Primero verificar si la columna 'location' existe
-                result = session.execute(text("PRAGMA table_info(video_clips)"))
-                columns = [column[1] for column in result.fetchall()]
-                
-                if 'location' not in columns:
-                    # Añadir la columna location si no existe
-                    session.execute(text("ALTER TABLE video_clips ADD COLUMN location TEXT"))
-                    logger.info("Columna 'location' añadida a video_clips")
+                self._ensure_location_column(session)
                 
-                # Crear JSON con la información de ubicación
-                location_json = {
-                    'display_name': location_info.get_display_name(),
-                    'city': location_info.city,
-                    'town': location_info.town,
-                    'village': location_info.village,
-                    'state': location_info.state,
-                    'country': location_info.country,
-                    'country_code': location_info.country_code,
-                    'timestamp': datetime.now().isoformat()
-                }
-                
-                # Actualizar el clip
                 result = session.execute(text('''
                 UPDATE video_clips 
                 SET location = :location_json
                 WHERE id = :clip_id
-                '''), {"location_json": json.dumps(location_json), "clip_id": clip_id})
+                '''), params)
                 
-                return result.rowcount > 0
+                return result.rowcount if result.rowcount is not None and result.rowcount >= 0 else len(params)
                 
         except Exception as e:
-            logger.error(f"Error actualizando ubicación del clip: {e}")
-            return False
+            logger.error(f"Error actualizando ubicación de clips: {e}")
+            return 0
+    
+    def _update_clip_location(self, clip_id: int, location_info: LocationInfo) -> bool:
+        """Actualizar la ubicación de un clip en la base de datos"""
+        return self._update_clip_locations([(clip_id, location_info)]) > 0
+    
     def process_single_clip(self, clip_id: int) -> bool:
         """Procesar un clip específico inmediatamente"""
         try:
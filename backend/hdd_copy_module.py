@@ -15,6 +15,9 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from trip_logger_package.services.trip_manager import TripManager
 from trip_logger_package.database.repository import VideoRepository
 from trip_logger_package.database.connection import get_database_manager
+from trip_logger_package.models.db_models import VideoClip as VideoClipModel, ExternalVideo as ExternalVideoModel
+from backup_engine import BackupEngine, BackupItem, find_manifest_backup_id
+from archive_store import archive_key, is_archive_ref
 
 # Configurar logging
 logging.basicConfig(
@@ -56,10 +59,35 @@ class HDDCopyModule:
             "copied_size": 0,
             "start_time": None,
             "end_time": None,
-            "error": None
+            "error": None,
+            "skipped_files": 0,
+            "failed_files": 0,
+            "throughput_mbps": 0.0,
+            "average_mbps": 0.0
         }
         self.cancel_copy = False
         
+        # Configuración del motor de copia: 2 hilos saturan un HDD USB sin provocar
+        # saltos del cabezal; la verificación relee el destino y compara SHA-256
+        self.copy_workers = 2
+        self.verify_copies = True
+        self._announced_milestones = set()
+        
+        # Estado persistente local: clips respaldados y copia interrumpida pendiente
+        data_path = disk_manager.data_path if disk_manager else os.getcwd()
+        self.state_path = os.path.join(data_path, "backup_state.json")
+        self._state_lock = threading.Lock()
+        self.backup_state = self._load_backup_state()
+        
+        # Hilo que reanuda una copia interrumpida cuando se vuelve a conectar el disco
+        self._resume_stop_event = threading.Event()
+        self._resume_thread = threading.Thread(
+            target=self._resume_watch_loop,
+            name="HDDCopyResumeWatcher",
+            daemon=True
+        )
+        self._resume_thread.start()
+        
         # LEDs controller
         self.led_controller = None
         try:
@@ -87,12 +115,14 @@ class HDDCopyModule:
         # Callbacks
         self.progress_callback = None
     
-    def start_copy_to_hdd(self, destination: Optional[str] = None) -> Dict[str, Any]:
+    def start_copy_to_hdd(self, destination: Optional[str] = None, stop_recording: bool = True) -> Dict[str, Any]:
         """
         Inicia el proceso de copia de videos a un disco duro externo.
         
         Args:
             destination: Ruta de destino opcional (si es None, se detecta automáticamente)
+            stop_recording: Finalizar el trip y detener la grabación durante la copia
+                (la reanudación automática copia sin tocar la grabación)
             
         Returns:
             Dict con el estado de la operación
@@ -161,7 +191,7 @@ class HDDCopyModule:
         logger.info(f"Iniciando copia hacia destino: {destination}")
         self.copy_thread = threading.Thread(
             target=self._copy_thread,
-            args=(destination,),
+            args=(destination, stop_recording),
             daemon=True
         )
         self.copy_thread.start()
@@ -197,12 +227,17 @@ class HDDCopyModule:
             logger.error(f"Error montando unidad: {str(e)}")
             return False
     
-    def _copy_thread(self, destination: str):
+    def _is_recording(self) -> bool:
+        recorder = getattr(self.camera_manager, 'recorder', None)
+        return bool(recorder and recorder.recording)
+    
+    def _copy_thread(self, destination: str, stop_recording: bool = True):
         """
         Función principal del hilo de copia
         
         Args:
             destination: Ruta de destino para la copia
+            stop_recording: Detener la grabación (y el trip) mientras se copia
         """
         was_recording = False  # Inicializar fuera del try
         
@@ -218,16 +253,23 @@ class HDDCopyModule:
                 "copied_size": 0,
                 "start_time": datetime.now().isoformat(),
                 "end_time": None,
-                "error": None
+                "error": None,
+                "skipped_files": 0,
+                "failed_files": 0,
+                "throughput_mbps": 0.0,
+                "average_mbps": 0.0
             }
             self.cancel_copy = False
             self._update_progress()
             
             # Notificar por audio
-            self.audio_notifier.announce("Iniciando copia de videos al disco externo. Se detendrá la grabación temporalmente.")
+            if stop_recording:
+                self.audio_notifier.announce("Iniciando copia de videos al disco externo. Se detendrá la grabación temporalmente.")
+            else:
+                self.audio_notifier.announce("Reanudando copia de videos al disco externo.")
             
             # Detener grabación y trip correctamente
-            was_recording = self.camera_manager.recorder.recording if self.camera_manager.recorder else False
+            was_recording = stop_recording and self._is_recording()
             if was_recording:
                 logger.info("Deteniendo grabación para realizar copia")
                 
@@ -277,197 +319,54 @@ class HDDCopyModule:
                 # Tiempo adicional de seguridad para asegurar que la base de datos se actualice
                 time.sleep(3)
             
-            # Crear directorio en el destino si no existe
-            backup_folder = os.path.join(
-                destination, 
-                f"dashcam_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            )
-            os.makedirs(backup_folder, exist_ok=True)
-            
-            # Get videos list from database using VideoRepository
-            with self.db_manager.session_scope() as session:
-                video_repo = VideoRepository(session)
-                
-                # Get all video clips and external videos
-                video_clips = video_repo.get_all_video_clips()
-                external_videos = video_repo.get_all_external_videos()
-                
-                all_videos = list(video_clips) + list(external_videos)
-                
-                if not all_videos:
-                    self._finish_copy(False, "No hay videos en la base de datos")
-                    return
-                
-                # Filter videos that have not been backed up
-                videos = []
-                for video in all_videos:
-                    if not getattr(video, 'backed_up', False):
-                        videos.append((
-                            video.id,
-                            video.file_path,
-                            video.file_size or 0
-                        ))
-                
-                # Sort by start_time if available
-                videos_with_time = []
-                for video_tuple in videos:
-                    video_id = video_tuple[0]
-                    # Find the full video data to get start_time
-                    full_video = next((v for v in all_videos if v.id == video_id), None)
-                    start_time = full_video.start_time if full_video else None
-                    videos_with_time.append((video_tuple, start_time))
-                
-                # Sort by start_time, videos without time go to the end
-                videos_with_time.sort(key=lambda x: x[1] if x[1] else datetime.max)
-                videos = [item[0] for item in videos_with_time]
-            
-            logger.info(f"Videos encontrados para copia: {len(videos)}")
-            for i, (video_id, file_path, file_size) in enumerate(videos):
-                logger.info(f"Video {i+1}: ID={video_id}, Path={file_path}, Size={file_size}")
+            # Construir la lista de archivos desde el catálogo (una consulta por tabla)
+            items = self._collect_backup_items()
+            logger.info(f"Videos encontrados para copia: {len(items)}")
             
-            if not videos:
+            if not items:
                 self._finish_copy(True, "No hay videos nuevos para copiar")
-                
-                # Reiniciar grabación si estaba activa
-                if was_recording:
-                    self.camera_manager.start_recording()
                 return
             
             # Update status
             self.copy_status = "copying"
-            self.copy_stats["total_files"] = len(videos)
-            self.copy_stats["total_size"] = sum(video[2] for video in videos if video[2])
             self._update_progress()
             
             # Notificar por audio
-            self.audio_notifier.announce(f"Copiando {len(videos)} videos al disco externo.")
+            self.audio_notifier.announce(f"Copiando {len(items)} videos al disco externo.")
             
             # Setup LED indicators
             self._set_led_progress(0)
-            
-            # Start copying
-            for i, (video_id, file_path, file_size) in enumerate(videos):
-                if self.cancel_copy:
-                    self._finish_copy(False, "Copia cancelada por el usuario")
-                    break
-                
-                # Actualizar estado
-                self.current_file = file_path
-                
-                try:
-                    # Log de debug para este archivo
-                    logger.info(f"Procesando archivo {i+1}/{len(videos)}: {file_path}")
-                    
-                    # Normalizar la ruta para manejar casos como ../data/videos/
-                    if os.path.isabs(file_path):
-                        # Normalizar ruta absoluta para eliminar ../ innecesarios
-                        source_path = os.path.normpath(file_path)
-                        logger.debug(f"Ruta absoluta normalizada: {source_path}")
-                    else:
-                        # Para rutas relativas, construir desde data_path
-                        source_path = os.path.normpath(os.path.join(self.disk_manager.data_path, file_path))
-                        logger.debug(f"Ruta relativa construida y normalizada: {source_path}")
-                    
-                    # Verificación adicional: si la ruta normalizada sigue siendo problemática,
-                    # manejar diferentes tipos de duplicación
-                    if '/videos/../data/videos/' in source_path:
-                        # Extraer la parte después del último /videos/
-                        video_part = source_path.split('/videos/')[-1]
-                        source_path = os.path.join('/root/dashcam-v2/data/videos', video_part)
-                        logger.debug(f"Ruta corregida para duplicación de videos: {source_path}")
-                    elif '/data/data/videos/' in source_path:
-                        # Manejar duplicación de /data/data/
-                        video_part = source_path.split('/data/data/videos/')[-1]
-                        source_path = os.path.join('/root/dashcam-v2/data/videos', video_part)
-                        logger.debug(f"Ruta corregida para duplicación de data: {source_path}")
-                    elif source_path.count('/data/') > 1:
-                        # Manejar cualquier otra duplicación de /data/
-                        # Encontrar la última ocurrencia de /data/videos/
-                        if '/data/videos/' in source_path:
-                            parts = source_path.split('/data/videos/')
-                            if len(parts) > 1:
-                                video_part = parts[-1]
-                                source_path = os.path.join('/root/dashcam-v2/data/videos', video_part)
-                                logger.debug(f"Ruta corregida para múltiple duplicación de data: {source_path}")
-                    
-                    logger.debug(f"Verificando existencia de archivo: {source_path}")
-                    if os.path.exists(source_path):
-                        logger.info(f"Archivo existe, iniciando copia: {source_path}")
-                        
-                        # Crear subdirectorios si es necesario
-                        # Extraer la ruta relativa basada en el nombre del archivo
-                        if os.path.isabs(file_path):
-                            # Si es ruta absoluta, extraer solo la parte relativa a partir de 'videos'
-                            rel_path = file_path.split('/videos/')[-1] if '/videos/' in file_path else os.path.basename(file_path)
-                            rel_path = os.path.dirname(rel_path)
-                        else:
-                            rel_path = os.path.dirname(file_path)
-                        
-                        dest_dir = os.path.join(backup_folder, rel_path)
-                        os.makedirs(dest_dir, exist_ok=True)
-                        logger.debug(f"Directorio de destino creado: {dest_dir}")
-                        
-                        # Copiar archivo - usar solo el nombre del archivo para el destino
-                        filename = os.path.basename(file_path)
-                        dest_path = os.path.join(dest_dir, filename)
-                        logger.info(f"Copiando desde {source_path} hacia {dest_path}")
-                        shutil.copy2(source_path, dest_path)
-                        logger.info(f"Archivo copiado exitosamente: {filename}")
-                        
-                        # Actualizar estado
-                        self.copy_stats["copied_files"] += 1
-                        self.copy_stats["copied_size"] += file_size if file_size else 0
-                        
-                        # Actualizar base de datos usando VideoRepository
-                        with self.db_manager.session_scope() as update_session:
-                            update_video_repo = VideoRepository(update_session)
-                            
-                            # Find the video to update
-                            video_to_update = None
-                            video_clips = update_video_repo.get_all_video_clips()
-                            external_videos = update_video_repo.get_all_external_videos()
-                            
-                            for video in list(video_clips) + list(external_videos):
-                                if video.id == video_id:
-                                    video_to_update = video
-                                    break
-                            
-                            if video_to_update:
-                                # Update the backup information
-                                video_to_update.backed_up = True
-                                video_to_update.backup_path = dest_path
-                                update_session.commit()
-                                logger.debug(f"Base de datos actualizada para archivo ID {video_id}")
-                            else:
-                                logger.warning(f"No se encontró el video con ID {video_id} para actualizar")
-                    else:
-                        logger.warning(f"Archivo no encontrado: {source_path}")
-                        # Continuar con el siguiente archivo en lugar de fallar
-                        
-                    # Calcular y actualizar progreso
-                    progress = min(int((i + 1) * 100 / len(videos)), 100)
-                    self.copy_progress = progress
-                    self._update_progress()
-                    
-                    # Actualizar LEDs
-                    self._set_led_progress(progress)
-                    
-                    # Notificación de audio cada 25%
-                    if progress == 25:
-                        self.audio_notifier.announce("25 por ciento completado")
-                    elif progress == 50:
-                        self.audio_notifier.announce("50 por ciento completado")
-                    elif progress == 75:
-                        self.audio_notifier.announce("75 por ciento completado")
-                except Exception as e:
-                    logger.error(f"Error copiando archivo {file_path}: {str(e)}")
-                    # Continuamos con el siguiente archivo
-            
-            # Finalizar
-            logger.info("Proceso de copia finalizado exitosamente")
-            
-            # Notificar completado
-            if not self.cancel_copy:
+            self._announced_milestones = set()
+            
+            engine = BackupEngine(
+                destination,
+                workers=self.copy_workers,
+                verify=self.verify_copies,
+                cancel_check=lambda: self.cancel_copy,
+                progress_callback=self._on_engine_progress
+            )
+            # Mientras copia se marca como interrumpida: si se desconecta el disco o se
+            # apaga el sistema a mitad de copia, se reanudará al volver a conectarlo
+            engine.manifest.ensure_header()
+            self._save_backup_state(interrupted_backup_id=engine.manifest.backup_id, destination=destination)
+            result = engine.run(items)
+            
+            # Guardar qué clips quedaron respaldados (lo usa el motor de retención)
+            self._merge_backed_up_clips(engine.backed_up_clip_ids(), items)
+            
+            logger.info(f"Proceso de copia finalizado: {result['status']} "
+                        f"({result['copied_files']} copiados, {result['skipped_files']} ya existentes, "
+                        f"{result['failed_files']} fallidos, {result['average_mbps']} MB/s)")
+            
+            if result["status"] == "cancelled":
+                # Queda pendiente: se reanudará al volver a conectar el disco
+                self._save_backup_state(interrupted_backup_id=result.get("backup_id"), destination=destination)
+                self._finish_copy(False, "Copia cancelada por el usuario")
+            elif result["status"] == "error":
+                self._save_backup_state(interrupted_backup_id=result.get("backup_id"), destination=destination)
+                self._finish_copy(False, f"{result['failed_files']} archivos no se pudieron copiar")
+            else:
+                self._save_backup_state(interrupted_backup_id=None, destination=destination)
                 self._finish_copy(True, f"Copia completada: {self.copy_stats['copied_files']} archivos copiados")
         
         except Exception as e:
@@ -479,6 +378,192 @@ class HDDCopyModule:
             if was_recording:
                 self.camera_manager.start_recording()
     
+    def _resolve_source_path(self, file_path: str) -> str:
+        """Normaliza una ruta del catálogo (absoluta, relativa o con ../data duplicado)"""
+        data_path = self.disk_manager.data_path
+        if os.path.isabs(file_path):
+            source_path = os.path.normpath(file_path)
+        else:
+            source_path = os.path.normpath(os.path.join(data_path, file_path))
+        
+        if os.path.exists(source_path):
+            return source_path
+        
+        # Rutas con duplicaciones como /videos/../data/videos/ o /data/data/videos/
+        if '/videos/' in source_path:
+            video_part = source_path.split('/videos/')[-1]
+            candidate = os.path.join(data_path, "videos", video_part)
+            if os.path.exists(candidate):
+                return candidate
+        return source_path
+    
+    @staticmethod
+    def _backup_rel_path(file_path: str, folder: str) -> str:
+        """Ruta dentro del backup: conserva la carpeta diaria bajo videos/"""
+        if '/videos/' in file_path:
+            return os.path.join("videos", file_path.split('/videos/')[-1])
+        if file_path.startswith("videos/"):
+            return file_path
+        return os.path.join(folder, os.path.basename(file_path))
+    
+    def _collect_backup_items(self) -> List[BackupItem]:
+        """Archivos a respaldar, ordenados por fecha de inicio"""
+        items = []
+        with self.db_manager.session_scope() as session:
+            clips = session.query(
+                VideoClipModel.id,
+                VideoClipModel.road_video_file,
+                VideoClipModel.interior_video_file
+            ).order_by(VideoClipModel.start_time).all()
+            externals = session.query(
+                ExternalVideoModel.id,
+                ExternalVideoModel.file_path
+            ).order_by(ExternalVideoModel.date).all()
+        
+        for clip in clips:
+            for kind, file_path in (("road", clip.road_video_file), ("interior", clip.interior_video_file)):
+                if not file_path:
+                    continue
+                if is_archive_ref(file_path):
+                    item = self._archived_backup_item(clip.id, file_path)
+                    if item is not None:
+                        items.append(item)
+                    continue
+                source_path = self._resolve_source_path(file_path)
+                try:
+                    items.append(BackupItem(f"clip:{clip.id}:{kind}", clip.id, source_path,
+                                            self._backup_rel_path(file_path, "videos")))
+                except OSError:
+                    logger.warning(f"Archivo no encontrado: {source_path}")
+        
+        for video in externals:
+            if not video.file_path:
+                continue
+            source_path = self._resolve_source_path(video.file_path)
+            try:
+                items.append(BackupItem(f"external:{video.id}", None, source_path,
+                                        os.path.join("external", f"{video.id}_{os.path.basename(video.file_path)}")))
+            except OSError:
+                logger.warning(f"Archivo no encontrado: {source_path}")
+        
+        return items
+    
+    def _archived_backup_item(self, clip_id: int, file_path: str) -> Optional[BackupItem]:
+        """Clip archivado: se copia su segmento directamente desde el pack del archivo"""
+        key = archive_key(file_path)
+        store = self.disk_manager.get_archive_store()
+        segment = store.get(key)
+        if segment is None:
+            logger.warning(f"Clip archivado sin segmento en el archivo: {key}")
+            return None
+        # Mismo destino que el archivo original; la fecha de archivado hace de mtime estable
+        rel_path = self._backup_rel_path(segment.source_path or f"{key.replace(':', '_')}.mp4", "videos")
+        try:
+            archived_ns = int(datetime.fromisoformat(segment.archived_at).timestamp() * 1_000_000_000)
+        except (TypeError, ValueError):
+            archived_ns = None
+        try:
+            return BackupItem(key, clip_id, store.pack_file(segment), rel_path,
+                              offset=segment.offset, size=segment.length, mtime_ns=archived_ns)
+        except OSError:
+            logger.warning(f"Pack no encontrado: {store.pack_file(segment)}")
+            return None
+    
+    def _on_engine_progress(self, stats: Dict[str, Any]):
+        """Traduce las estadísticas del motor al estado del módulo, LEDs y avisos"""
+        for key in ("total_files", "copied_files", "skipped_files", "failed_files",
+                    "total_size", "copied_size", "throughput_mbps", "average_mbps"):
+            self.copy_stats[key] = stats.get(key, self.copy_stats.get(key))
+        
+        total = stats.get("total_size") or 0
+        progress = min(int(stats.get("copied_size", 0) * 100 / total), 100) if total else 0
+        if stats.get("current_file"):
+            self.current_file = stats["current_file"]
+        
+        if progress != self.copy_progress:
+            self.copy_progress = progress
+            self._set_led_progress(progress)
+            
+            # Notificación de audio cada 25%
+            for milestone in (25, 50, 75):
+                if progress >= milestone and milestone not in self._announced_milestones:
+                    self._announced_milestones.add(milestone)
+                    self.audio_notifier.announce(f"{milestone} por ciento completado")
+        
+        self._update_progress()
+    
+    def _load_backup_state(self) -> Dict[str, Any]:
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault("backed_up_clips", [])
+        state.setdefault("interrupted_backup_id", None)
+        state.setdefault("last_destination", None)
+        return state
+    
+    def _write_backup_state(self):
+        tmp_path = self.state_path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.backup_state, f)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            logger.error(f"Error guardando estado de backup: {str(e)}")
+    
+    def _save_backup_state(self, interrupted_backup_id: Optional[str], destination: str):
+        with self._state_lock:
+            self.backup_state["interrupted_backup_id"] = interrupted_backup_id
+            self.backup_state["last_destination"] = destination
+            self._write_backup_state()
+    
+    def _merge_backed_up_clips(self, manifest_clips: Dict[int, set], items: List[BackupItem]):
+        """Un clip cuenta como respaldado cuando todos sus archivos están en el manifiesto"""
+        expected: Dict[int, set] = {}
+        for item in items:
+            if item.clip_id is not None:
+                expected.setdefault(item.clip_id, set()).add(item.key)
+        
+        complete = {clip_id for clip_id, keys in expected.items()
+                    if keys <= manifest_clips.get(clip_id, set())}
+        with self._state_lock:
+            backed_up = set(self.backup_state["backed_up_clips"]) | complete
+            self.backup_state["backed_up_clips"] = sorted(backed_up)
+            self._write_backup_state()
+    
+    def get_backed_up_clip_ids(self) -> set:
+        """IDs de clips con copia completa en un disco externo"""
+        with self._state_lock:
+            return set(self.backup_state["backed_up_clips"])
+    
+    def _resume_watch_loop(self):
+        """
+        Reanuda automáticamente una copia interrumpida al reconectar el disco.
+        Solo con la dashcam parada: la reanudación nunca detiene una grabación.
+        """
+        while not self._resume_stop_event.wait(15):
+            try:
+                self.resume_interrupted_copy()
+            except Exception as e:
+                logger.debug(f"Error comprobando reconexión del disco de backup: {str(e)}")
+    
+    def resume_interrupted_copy(self) -> bool:
+        """Reanuda la copia interrumpida si su disco está conectado y no se está grabando"""
+        backup_id = self.backup_state.get("interrupted_backup_id")
+        if not backup_id or self.is_copying or not self.disk_manager or self._is_recording():
+            return False
+        
+        for drive in self.disk_manager.detect_usb_drives() or []:
+            mount_points = [drive.get("mountpoint")] + [
+                p.get("mountpoint") for p in drive.get("partitions", [])
+            ]
+            for mount_point in filter(None, mount_points):
+                if find_manifest_backup_id(mount_point) == backup_id:
+                    logger.info(f"Disco de backup reconectado en {mount_point}, reanudando copia")
+                    return self.start_copy_to_hdd(mount_point, stop_recording=False)["success"]
+        return False
+    
     def _finish_copy(self, success: bool, message: str):
         """
         Finalizar proceso de copia y actualizar estado
@@ -716,6 +801,11 @@ class HDDCopyModule:
         except Exception as e:
             logger.error(f"Error apagando LEDs durante cleanup: {str(e)}")
         
+        try:
+            self._resume_stop_event.set()
+        except Exception as e:
+            logger.error(f"Error deteniendo vigilancia de reanudación: {str(e)}")
+        
         try:
             # Limpiar otras referencias
             self.progress_callback = None
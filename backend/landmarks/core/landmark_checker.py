@@ -8,6 +8,7 @@ import sys
 sys.path.append('/root/dashcam-v2/backend')
 from data_persistence import get_persistence_manager
 from .landmarks_db import LandmarksDB
+from .proximity_index import LandmarkProximityIndex
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -19,6 +20,9 @@ class LandmarkChecker:
         self.last_notified = {}  # Store landmark IDs and when they were last announced
         self.notification_cooldown = 300  # 5 minutes cooldown between repeat notifications
         
+        # Landmarks indexed by position for check_nearby, refreshed incrementally on changes
+        self.proximity_index = LandmarkProximityIndex()
+        
         # Get persistence manager
         self.persistence = get_persistence_manager()
         
@@ -59,16 +63,49 @@ class LandmarkChecker:
         try:
             # Load landmarks from the database
             self.landmarks = self.landmarks_db.get_all_landmarks()
+            self.proximity_index.rebuild(self.landmarks)
             logger.info(f"Loaded {len(self.landmarks)} landmarks from database")
                 
         except Exception as e:
             logger.error(f"Error loading landmarks: {str(e)}")
             # Initialize with empty list if loading fails
             self.landmarks = []
+            self.proximity_index.rebuild([])
+    
+    def _refresh_landmarks(self):
+        """Update the landmark list after an incremental change to the proximity index"""
+        self.landmarks = self.proximity_index.all()
             
     def check_nearby(self, lat, lon, max_distance=None):
         """Check if vehicle is near any landmarks, return details of closest one within radius"""
-        return self.landmarks_db.check_nearby(lat, lon, max_distance)
+        if not lat or not lon:
+            return None
+            
+        try:
+            nearest = self.proximity_index.nearest_in_radius(
+                lat, lon, self.landmarks_db._calculate_distance, max_distance
+            )
+            if nearest is None:
+                return None
+            
+            landmark, distance = nearest
+            closest_landmark = dict(landmark)
+            closest_landmark['distance'] = distance
+            
+            # Only mark for notification if cooldown expired or first time
+            current_time = datetime.now().timestamp()
+            landmark_id = landmark['id']
+            if (landmark_id not in self.last_notified or
+                    current_time - self.last_notified[landmark_id] > self.notification_cooldown):
+                closest_landmark['notify'] = True
+                self.last_notified[landmark_id] = current_time
+            else:
+                closest_landmark['notify'] = False
+            
+            return closest_landmark
+        except Exception as e:
+            logger.error(f"Error checking nearby landmarks: {str(e)}")
+            return None
 
     def get_landmarks_in_area(self, center_lat, center_lon, radius_km=10):
         """Get all landmarks within a specific area (for map displays)"""
@@ -133,14 +170,30 @@ class LandmarkChecker:
             # Add to database
             result = self.landmarks_db.add_landmark(landmark)
             
-            # Reload landmarks
+            # Update the proximity index
             if result:
-                self.load_landmarks()
+                self.proximity_index.upsert(dict(result))
+                self._refresh_landmarks()
             
             return result
         except Exception as e:
             logger.error(f"Error adding landmark: {str(e)}")
             return None
+    
+    def add_landmarks_bulk(self, landmarks):
+        """Add or update many landmarks in one database transaction; returns how many were written"""
+        try:
+            written = self.landmarks_db.add_landmarks_bulk(landmarks)
+            
+            # Update only the written landmarks in the proximity index
+            self.proximity_index.upsert_many(written)
+            if written:
+                self._refresh_landmarks()
+            
+            return len(written)
+        except Exception as e:
+            logger.error(f"Error bulk adding landmarks: {str(e)}")
+            return 0
             
     def remove_landmark(self, landmark_id):
         """Remove a landmark by ID"""
@@ -148,9 +201,10 @@ class LandmarkChecker:
             # Remove from database
             result = self.landmarks_db.remove_landmark(landmark_id)
             
-            # Reload landmarks
+            # Update the proximity index
             if result:
-                self.load_landmarks()
+                self.proximity_index.remove(landmark_id)
+                self._refresh_landmarks()
                 
             return result
         except Exception as e:
@@ -163,9 +217,11 @@ class LandmarkChecker:
             # Remove from database using batch operation
             count = self.landmarks_db.remove_landmarks_batch(landmark_ids)
             
-            # Reload landmarks
+            # Update the proximity index
             if count > 0:
-                self.load_landmarks()
+                for landmark_id in landmark_ids:
+                    self.proximity_index.remove(landmark_id)
+                self._refresh_landmarks()
                 
             return count
         except Exception as e:
@@ -178,9 +234,10 @@ class LandmarkChecker:
             # Remove from database
             count = self.landmarks_db.remove_landmarks_by_category(category)
             
-            # Reload landmarks
+            # Update the proximity index
             if count > 0:
-                self.load_landmarks()
+                self.proximity_index.remove_where(lambda landmark: landmark.get('category') == category)
+                self._refresh_landmarks()
                 
             return count
         except Exception as e:
@@ -193,9 +250,10 @@ class LandmarkChecker:
             # Remove from database
             count = self.landmarks_db.remove_trip_landmarks(trip_id)
             
-            # Reload landmarks
+            # Update the proximity index
             if count > 0:
-                self.load_landmarks()
+                self.proximity_index.remove_where(lambda landmark: landmark.get('trip_id') == trip_id)
+                self._refresh_landmarks()
                 
             return count
         except Exception as e:
@@ -1,13 +1,15 @@
 from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, Text, DateTime, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker, relationship, Session
 from sqlalchemy.sql import func
 import os
 import json
 import math
 import logging
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+import uuid
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Any, Iterable
 from contextlib import contextmanager
 
 # Configure logging
@@ -17,6 +19,9 @@ logger = logging.getLogger(__name__)
 # SQLAlchemy setup
 Base = declarative_base()
 
+# Filas por executemany en las inserciones masivas (todas en la misma transacción)
+BULK_UPSERT_BATCH = 1000
+
 class Landmark(Base):
     __tablename__ = 'landmarks'
     
@@ -227,6 +232,65 @@ class LandmarksDB:
             logger.error(f"Error adding landmark: {str(e)}")
             return None
 
+    def add_landmarks_bulk(self, landmarks: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Insert or update many landmarks in a single transaction (executemany
+        upsert by id, without a SELECT per landmark). Returns the landmarks
+        written with the created_at stored in the database (the original one
+        for updated landmarks), or an empty list if the transaction failed.
+        """
+        # created_at solo se usa al insertar; una actualización conserva la fecha original
+        created_at = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+        table = Landmark.__table__
+        statement = sqlite_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.id],
+            set_={column: statement.excluded[column]
+                  for column in ('name', 'lat', 'lon', 'radius_m', 'description', 'category', 'trip_id')}
+        )
+        
+        written = []
+
+        def flush(session, rows):
+            session.execute(statement, rows)
+            # Las filas actualizadas conservan su created_at: leerlo de la tabla, una consulta por bloque
+            stored = dict(session.query(Landmark.id, Landmark.created_at)
+                          .filter(Landmark.id.in_({row['id'] for row in rows})).all())
+            for row in rows:
+                row['created_at'] = stored.get(row['id']) or row['created_at']
+            written.extend(rows)
+
+        try:
+            with self.get_session() as session:
+                rows = []
+                for landmark_data in landmarks:
+                    row = {
+                        'id': landmark_data.get('id') or str(uuid.uuid4())[:8],
+                        'name': landmark_data['name'],
+                        'lat': float(landmark_data['lat']),
+                        'lon': float(landmark_data['lon']),
+                        'radius_m': landmark_data.get('radius_m', 500),
+                        'description': landmark_data.get('description', ''),
+                        'category': landmark_data.get('category', 'custom'),
+                        'trip_id': landmark_data.get('trip_id'),
+                        'created_at': created_at
+                    }
+                    rows.append(row)
+                    if len(rows) >= BULK_UPSERT_BATCH:
+                        flush(session, rows)
+                        rows = []
+                if rows:
+                    flush(session, rows)
+            
+            logger.info(f"Bulk upserted {len(written)} landmarks")
+            for row in written:
+                if isinstance(row['created_at'], datetime):
+                    row['created_at'] = row['created_at'].isoformat()
+            return written
+        except Exception as e:
+            logger.error(f"Error bulk adding landmarks: {str(e)}")
+            return []
+
     def update_landmark(self, landmark_id: str, landmark_data: Dict[str, Any]) -> bool:
         """Update an existing landmark using SQLAlchemy"""
         try:
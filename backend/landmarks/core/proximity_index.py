@@ -0,0 +1,159 @@
+"""
+Índice de proximidad en memoria de los landmarks, para ``check_nearby`` en
+cada posición GPS sin recorrer la tabla entera.
+
+Rejilla de celdas de ``CELL_DEG`` grados con los landmarks de cada celda; se
+actualiza landmark a landmark (alta, cambio, baja), así que una importación
+o un borrado no obliga a recargar todo desde la base de datos. La búsqueda
+mira las celdas que cubren el mayor radio de los landmarks indexados.
+
+Las importaciones masivas escriben desde un hilo (``asyncio.to_thread``)
+mientras ``check_nearby`` consulta desde el bucle de eventos, así que todo
+acceso a las estructuras internas pasa por un lock y las búsquedas devuelven
+listas ya copiadas.
+"""
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+CELL_DEG = 0.01
+# Metros por grado de latitud con el radio terrestre de la fórmula de Haversine
+METERS_PER_DEG_LAT = 6371000 * math.pi / 180
+DEFAULT_RADIUS_M = 500
+
+_LON_CELLS = int(round(360 / CELL_DEG))
+_LAT_CELLS = int(round(180 / CELL_DEG))
+
+
+def _cell(lat: float, lon: float) -> Tuple[int, int]:
+    row = min(_LAT_CELLS - 1, max(0, int(math.floor((lat + 90) / CELL_DEG))))
+    col = int(math.floor((lon + 180) / CELL_DEG)) % _LON_CELLS
+    return row, col
+
+
+class LandmarkProximityIndex:
+    """Landmarks by id plus a lat/lon grid of them, updated incrementally"""
+
+    def __init__(self, landmarks: Iterable[Dict] = ()):
+        self._landmarks: Dict[str, Dict] = {}
+        self._cells: Dict[Tuple[int, int], Dict[str, Dict]] = {}
+        self._cell_of: Dict[str, Tuple[int, int]] = {}
+        self.max_radius_m = 0.0
+        self._lock = threading.RLock()
+        self.rebuild(landmarks)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._landmarks)
+
+    def __contains__(self, landmark_id) -> bool:
+        with self._lock:
+            return landmark_id in self._landmarks
+
+    def get(self, landmark_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._landmarks.get(landmark_id)
+
+    def all(self) -> List[Dict]:
+        with self._lock:
+            return list(self._landmarks.values())
+
+    def rebuild(self, landmarks: Iterable[Dict]):
+        with self._lock:
+            self._landmarks.clear()
+            self._cells.clear()
+            self._cell_of.clear()
+            self.max_radius_m = 0.0
+            for landmark in landmarks:
+                self.upsert(landmark)
+
+    def upsert(self, landmark: Dict):
+        """Add a landmark or replace the one with the same id (keeping its created_at if the new one has none)"""
+        with self._lock:
+            self._upsert(landmark)
+
+    def upsert_many(self, landmarks: Iterable[Dict]):
+        with self._lock:
+            for landmark in landmarks:
+                self._upsert(landmark)
+
+    def _upsert(self, landmark: Dict):
+        landmark_id = landmark["id"]
+        previous = self._landmarks.get(landmark_id)
+        if previous is not None:
+            if landmark.get("created_at") is None and previous.get("created_at") is not None:
+                landmark = {**landmark, "created_at": previous["created_at"]}
+            self._unlink(landmark_id)
+        cell = _cell(float(landmark["lat"]), float(landmark["lon"]))
+        self._landmarks[landmark_id] = landmark
+        self._cells.setdefault(cell, {})[landmark_id] = landmark
+        self._cell_of[landmark_id] = cell
+        # El radio máximo solo crece; rebuild() lo vuelve a ajustar
+        self.max_radius_m = max(self.max_radius_m, float(landmark.get("radius_m") or DEFAULT_RADIUS_M))
+
+    def remove(self, landmark_id: str) -> bool:
+        with self._lock:
+            if landmark_id not in self._landmarks:
+                return False
+            self._unlink(landmark_id)
+            del self._landmarks[landmark_id]
+            return True
+
+    def remove_where(self, predicate: Callable[[Dict], bool]) -> int:
+        with self._lock:
+            ids = [landmark_id for landmark_id, landmark in self._landmarks.items() if predicate(landmark)]
+            for landmark_id in ids:
+                self.remove(landmark_id)
+            return len(ids)
+
+    def _unlink(self, landmark_id: str):
+        cell = self._cell_of.pop(landmark_id)
+        bucket = self._cells[cell]
+        del bucket[landmark_id]
+        if not bucket:
+            del self._cells[cell]
+
+    def candidates(self, lat: float, lon: float, radius_m: float) -> List[Dict]:
+        """Landmarks in the grid cells that cover ``radius_m`` around a point (a superset of those in range)"""
+        # 1% de margen sobre el rectángulo envolvente del círculo
+        lat_span = radius_m * 1.01 / METERS_PER_DEG_LAT
+        cos_lat = max(math.cos(math.radians(min(89.9, abs(lat) + lat_span))), 1e-6)
+        lon_span = lat_span / cos_lat
+        row0, col0 = _cell(lat - lat_span, lon - lon_span)
+        row1, col1 = _cell(lat + lat_span, lon + lon_span)
+        cols = (col1 - col0) % _LON_CELLS + 1 if lon_span < 180 - 2 * CELL_DEG else _LON_CELLS
+
+        found = []
+        with self._lock:
+            # Con radios enormes es más barato recorrer las celdas ocupadas
+            if (row1 - row0 + 1) * cols > len(self._cells):
+                for (row, col), bucket in self._cells.items():
+                    if row0 <= row <= row1 and (col - col0) % _LON_CELLS < cols:
+                        found.extend(bucket.values())
+                return found
+            for row in range(row0, row1 + 1):
+                for offset in range(cols):
+                    bucket = self._cells.get((row, (col0 + offset) % _LON_CELLS))
+                    if bucket:
+                        found.extend(bucket.values())
+        return found
+
+    def nearest_in_radius(self, lat: float, lon: float, distance_fn: Callable[[float, float, float, float], float],
+                          max_distance: Optional[float] = None) -> Optional[Tuple[Dict, float]]:
+        """
+        Closest landmark whose own radius (capped at ``max_distance``) contains
+        the point, as (landmark, distance_m), or None.
+        """
+        with self._lock:
+            max_radius_m = self.max_radius_m
+        search_radius = max_radius_m if max_distance is None else min(max_radius_m, max_distance)
+        closest = None
+        min_distance = float("inf")
+        for landmark in self.candidates(lat, lon, search_radius):
+            distance = distance_fn(lat, lon, landmark["lat"], landmark["lon"])
+            landmark_radius = landmark.get("radius_m") or DEFAULT_RADIUS_M
+            if max_distance is not None:
+                landmark_radius = min(landmark_radius, max_distance)
+            if distance <= landmark_radius and distance < min_distance:
+                closest, min_distance = landmark, distance
+        return (closest, min_distance) if closest is not None else None
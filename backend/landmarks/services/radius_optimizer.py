@@ -11,8 +11,22 @@ from dataclasses import dataclass
 from geopy.distance import geodesic
 import logging
 
+from utils.spatial_index import GeoPointIndex
+
 logger = logging.getLogger(__name__)
 
+# Holgura del prefiltro esférico frente a la distancia geodésica (< 0.5%)
+GEODESIC_SLACK = 1.01
+
+
+def _center_index(circles: List['CoverageCircle'], radius_km: float) -> GeoPointIndex:
+    """Índice espacial sobre los centros de los círculos."""
+    return GeoPointIndex(
+        np.array([c.center.lat for c in circles], dtype=np.float64),
+        np.array([c.center.lon for c in circles], dtype=np.float64),
+        radius_km
+    )
+
 @dataclass
 class Waypoint:
     """Representa un waypoint con coordenadas geográficas."""
@@ -100,6 +114,13 @@ class WaypointDensityAnalyzer:
         clusters = []
         visited = set()
         
+        # Solo los candidatos del índice pasan a la distancia geodésica exacta
+        index = GeoPointIndex(
+            np.array([wp.lat for wp in waypoints], dtype=np.float64),
+            np.array([wp.lon for wp in waypoints], dtype=np.float64),
+            analysis_radius * GEODESIC_SLACK
+        )
+        
         for i, waypoint in enumerate(waypoints):
             if i in visited:
                 continue
@@ -108,10 +129,11 @@ class WaypointDensityAnalyzer:
             visited.add(i)
             
             # Buscar waypoints cercanos (dentro de radio de análisis)
-            for j, other_waypoint in enumerate(waypoints):
+            for j in index.within(waypoint.lat, waypoint.lon)[0].tolist():
                 if j in visited or i == j:
                     continue
                 
+                other_waypoint = waypoints[j]
                 if waypoint.distance_to(other_waypoint) <= analysis_radius:
                     cluster.append(other_waypoint)
                     visited.add(j)
@@ -323,34 +345,67 @@ class CirclePackingOptimizer:
         """Optimización rápida para datasets grandes - ajuste mínimo de superposiciones."""
         logger.debug("Aplicando ajuste rápido de superposiciones")
         
+        # Solo se superponen centros a menos de r1 + r2; el índice acota los
+        # candidatos y se recorre la lista completa si un radio crece más allá
+        index = _center_index(circles, 2 * max(c.radius_km for c in circles) * GEODESIC_SLACK)
+        
         adjusted_circles = []
+        max_adjusted_radius = 0.0
         for i, circle in enumerate(circles):
             adjusted_circle = circle
             
             # Solo verificar superposiciones con círculos ya procesados
-            for existing in adjusted_circles:
-                overlap_area = adjusted_circle.overlap_area_with(existing)
-                overlap_ratio = overlap_area / adjusted_circle.area() if adjusted_circle.area() > 0 else 0
-                
-                if overlap_ratio > self.overlap_tolerance:
-                    # Reducir radio ligeramente
-                    distance_between_centers = existing.center.distance_to(adjusted_circle.center)
-                    new_radius = max(distance_between_centers * 0.9, self.overlap_tolerance * adjusted_circle.radius_km, 2.0)
-                    
-                    # Recalcular waypoints cubiertos con nuevo radio
-                    covered = [wp for wp in adjusted_circle.waypoints_covered 
-                              if adjusted_circle.center.distance_to(wp) <= new_radius]
+            position = 0
+            while position < len(adjusted_circles):
+                reach_radius = adjusted_circle.radius_km
+                candidates = self._overlap_candidates(index, adjusted_circle, position,
+                                                      len(adjusted_circles), max_adjusted_radius)
+                position = len(adjusted_circles)
+                for j in candidates:
+                    existing = adjusted_circles[j]
+                    overlap_area = adjusted_circle.overlap_area_with(existing)
+                    overlap_ratio = overlap_area / adjusted_circle.area() if adjusted_circle.area() > 0 else 0
                     
-                    adjusted_circle = CoverageCircle(
-                        adjusted_circle.center, new_radius, covered
-                    )
+                    if overlap_ratio > self.overlap_tolerance:
+                        # Reducir radio ligeramente
+                        distance_between_centers = existing.center.distance_to(adjusted_circle.center)
+                        new_radius = max(distance_between_centers * 0.9, self.overlap_tolerance * adjusted_circle.radius_km, 2.0)
+                        
+                        # Recalcular waypoints cubiertos con nuevo radio
+                        covered = [wp for wp in adjusted_circle.waypoints_covered 
+                                  if adjusted_circle.center.distance_to(wp) <= new_radius]
+                        
+                        adjusted_circle = CoverageCircle(
+                            adjusted_circle.center, new_radius, covered
+                        )
+                        
+                        # Si el radio creció, los candidatos restantes ya no bastan
+                        if new_radius > reach_radius:
+                            position = j + 1
+                            break
             
             adjusted_circles.append(adjusted_circle)
+            max_adjusted_radius = max(max_adjusted_radius, adjusted_circle.radius_km)
             
             if i % 10 == 0:  # Log progreso cada 10 círculos
                 logger.debug(f"Procesados {i+1}/{len(circles)} círculos")
         
         return adjusted_circles
+    
+    @staticmethod
+    def _overlap_candidates(index: GeoPointIndex, circle: CoverageCircle, start: int, stop: int,
+                            max_other_radius: float) -> List[int]:
+        """
+        Índices en [start, stop) de círculos cuyo centro está a menos de
+        radio + max_other_radius de ``circle``, en orden ascendente. Si el
+        alcance supera el del índice se devuelven todos.
+        """
+        reach = (circle.radius_km + max_other_radius) * GEODESIC_SLACK
+        if reach > index.radius_km:
+            return list(range(start, stop))
+        nearby = index.within(circle.center.lat, circle.center.lon, reach)[0]
+        return nearby[(nearby >= start) & (nearby < stop)].tolist()
+
 
 class RadiusOptimizer:
     """Clase principal para optimización de radio de cobertura de geodatos."""
@@ -431,13 +486,24 @@ class RadiusOptimizer:
         total_coverage_area = sum(circle.area() for circle in circles)
         avg_radius = sum(circle.radius_km for circle in circles) / len(circles)
         
-        # Calcular superposiciones
+        # Calcular superposiciones (solo pares de centros a menos de r1 + r2,
+        # en el mismo orden i < j que el recorrido completo)
         total_overlap_area = 0
-        for i, circle1 in enumerate(circles):
-            for circle2 in circles[i+1:]:
-                overlap = circle1.overlap_area_with(circle2)
+        center_lats = np.array([c.center.lat for c in circles], dtype=np.float64)
+        center_lons = np.array([c.center.lon for c in circles], dtype=np.float64)
+        index = GeoPointIndex(center_lats, center_lons, 2 * max(c.radius_km for c in circles) * GEODESIC_SLACK)
+        first, second = [], []
+        for query, point, _ in index.pairs(center_lats, center_lons):
+            keep = point > query
+            first.append(query[keep])
+            second.append(point[keep])
+        if first:
+            first, second = np.concatenate(first), np.concatenate(second)
+            order = np.lexsort((second, first))
+            for i, j in zip(first[order].tolist(), second[order].tolist()):
+                overlap = circles[i].overlap_area_with(circles[j])
                 if overlap > 0:
-                    logger.debug(f"Superposición entre círculo {i} y {i+1}: {overlap:.2f} km²")
+                    logger.debug(f"Superposición entre círculo {i} y {j}: {overlap:.2f} km²")
                 total_overlap_area += overlap
         
         # Contar waypoints únicos cubiertos
@@ -149,6 +149,9 @@ try:
             connected_clients=connected_clients
         )
         logger.info("ReverseGeocodingWorker inicializado")
+        
+        # Despertar el worker cada vez que se guarda un clip nuevo
+        camera_manager.add_clip_listener(reverse_geocoding_worker.notify_new_clip)
     else:
         logger.info("Geocodificación inversa deshabilitada")
     
@@ -191,10 +194,17 @@ try:
     )
     logger.info("DiskManager inicializado")
     
+    # Iniciar el motor de retención (libera espacio antes de que el disco se llene)
+    disk_manager.retention_engine.start()
+    logger.info("RetentionEngine iniciado")
+    
     # Inicializar el módulo de copia a HDD
     hdd_copy_module = HDDCopyModule(disk_manager, camera_manager, audio_notifier)
     logger.info("HDDCopyModule inicializado")
     
+    # Los clips con copia en disco externo se borran antes al liberar espacio
+    disk_manager.retention_engine.add_backup_status_provider(hdd_copy_module.get_backed_up_clip_ids)
+    
     # Inicializar el monitor de espacio en disco
     from disk_space_monitor import get_disk_space_monitor
     disk_space_monitor = get_disk_space_monitor(
@@ -253,6 +263,7 @@ try:
     trips_routes.trip_logger = trip_logger
     trips_routes.auto_trip_manager = auto_trip_manager
     trips_routes.db_manager = trip_logger.db_manager  # Añadir el gestor de base de datos para consultas directas
+    trips_routes.disk_manager = disk_manager
     
     storage_routes.disk_manager = disk_manager
     
@@ -340,6 +351,7 @@ try:
         audio_notifier=audio_notifier,
         set_recording_state_callback=set_global_recording_state
     )
+    auto_trip_manager.reverse_geocoding_service = reverse_geocoding_service
     
     logger.info("Rutas configuradas correctamente")
 except Exception as e:
@@ -357,6 +369,7 @@ try:
     # Initialize configuration for modules that need it
     import routes.offline_maps as offline_maps
     offline_maps.config = config
+    offline_maps.init_mbtiles_service()
     
     import routes.organic_maps as organic_maps
     organic_maps.init_modules(config)
@@ -502,6 +515,13 @@ async def startup_event():
     else:
         logger.info("Worker de geocodificación inversa no disponible (deshabilitado)")
     
+    # Reanudar las descargas de mapas MWM que quedaron a medias
+    try:
+        from routes.organic_maps_utils import download as mwm_download
+        mwm_download.resume_pending_downloads()
+    except Exception as e:
+        logger.error(f"Error reanudando descargas de mapas: {e}")
+    
     # Initialize WebRTC module - DISABLED
     # logger.info("Inicializando módulo WebRTC...")
     # try:
@@ -803,7 +823,34 @@ async def shutdown_event():
             disk_space_monitor.stop()
     except Exception as e:
         logger.error(f"Error al detener DiskSpaceMonitor: {e}")
-    
+
+    # Cerrar las sesiones HTTP del cliente de Nominatim compartido
+    try:
+        from geocoding.downloader.nominatim_api import get_nominatim_client
+        await get_nominatim_client().close()
+    except Exception as e:
+        logger.error(f"Error al cerrar el cliente de Nominatim: {e}")
+
+    # Cerrar la sesión HTTP del proxy de teselas
+    try:
+        await offline_maps.close_tile_proxy()
+    except Exception as e:
+        logger.error(f"Error al cerrar el proxy de teselas: {e}")
+
+    # Detener el pool de procesos del renderizador de teselas MWM
+    try:
+        import routes.organic_maps as organic_maps
+        await organic_maps.close_mwm_renderer()
+    except Exception as e:
+        logger.error(f"Error al cerrar el renderizador de teselas MWM: {e}")
+
+    # Detener las descargas de mapas (quedan en la cola y se reanudan al arrancar)
+    try:
+        from routes.organic_maps_utils import download as mwm_download
+        await mwm_download.close_download_manager()
+    except Exception as e:
+        logger.error(f"Error al cerrar el gestor de descargas de mapas: {e}")
+
     # Cleanup WebRTC manager explicitly - DISABLED
     # try:
     #     logger.info("Cerrando WebRTC manager...")
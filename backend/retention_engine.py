@@ -0,0 +1,480 @@
+"""
+Retention Engine Module
+Keeps free space on the recording disk above a configurable watermark by
+deleting the least valuable clips first, using the video_clips catalog instead
+of walking the file tree.
+
+Victims are ranked by:
+- Landmark priority (clips near priority landmarks are kept longest)
+- Quality (normal quality clips go before high quality ones)
+- Backup status (clips already copied to an external HDD go first)
+- Age (oldest first)
+
+Files and database rows are deleted together in small batches, and the
+deletion rate is capped so that unlinking large files does not compete with
+the recording I/O. Clips moved to the archive store (``archive:`` file
+values) release their segments there instead.
+"""
+
+import os
+import shutil
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from archive_store import ArchiveStore, archive_key, is_archive_ref
+from trip_logger_package.database.connection import get_database_manager
+from trip_logger_package.models.db_models import VideoClip as VideoClipModel
+from video_maker import prune_summary_cache
+
+logger = logging.getLogger('retention_engine')
+
+# Valores por defecto de las claves de configuración de almacenamiento que usa el motor
+DEFAULT_RETENTION_SETTINGS = {
+    "autoCleanEnabled": False,
+    "autoCleanThreshold": 90,        # % de uso que dispara la limpieza
+    "autoCleanTargetThreshold": 85,  # % de uso al que se quiere volver tras limpiar
+    "autoCleanDays": 30,             # Clips más antiguos se borran siempre
+    "minFreeSpaceMB": 2048,          # Reserva mínima absoluta para no llegar a ENOSPC
+    "retentionDeleteRateMB": 200     # MB/s máximos de borrado
+}
+
+# Categorías de landmark que activan la grabación prioritaria (CameraManager);
+# los clips guardan la categoría del landmark en VideoClip.landmark_type
+PRIORITY_LANDMARK_CATEGORIES = frozenset({
+    'tourist_attraction', 'tourism', 'monument', 'museum', 'castle',
+    'viewpoint', 'attraction', 'trip_point', 'manual_waypoint',
+    'heritage', 'archaeological_site', 'historic'
+})
+
+
+class RetentionCandidate:
+    """Clip del catálogo que puede ser eliminado"""
+
+    __slots__ = ('id', 'trip_id', 'start_time', 'quality', 'near_landmark',
+                 'landmark_type', 'files', 'backed_up')
+
+    def __init__(self, row, backed_up: bool):
+        self.id = row.id
+        self.trip_id = row.trip_id
+        self.start_time = row.start_time
+        self.quality = row.quality
+        self.near_landmark = bool(row.near_landmark)
+        self.landmark_type = row.landmark_type
+        self.files = [f for f in (row.road_video_file, row.interior_video_file) if f]
+        self.backed_up = backed_up
+
+    @property
+    def landmark_rank(self) -> int:
+        if self.landmark_type in PRIORITY_LANDMARK_CATEGORIES:
+            return 2
+        return 1 if self.near_landmark else 0
+
+    @property
+    def quality_rank(self) -> int:
+        return 1 if self.quality == 'high' else 0
+
+    def sort_key(self):
+        # Menor = se elimina antes
+        return (
+            self.landmark_rank,
+            self.quality_rank,
+            0 if self.backed_up else 1,
+            self.start_time or datetime.min,
+            self.id
+        )
+
+
+class RetentionEngine:
+    """
+    Deletes clips (files and catalog rows) to keep the recording disk below its
+    usage watermark. Runs in a background thread like DiskSpaceMonitor.
+    """
+
+    def __init__(self,
+                 data_path: str,
+                 db_path: Optional[str] = None,
+                 settings_provider: Optional[Callable[[], Dict[str, Any]]] = None,
+                 check_interval: int = 30,
+                 batch_size: int = 20,
+                 min_clip_age: int = 600,
+                 archive_store_provider: Optional[Callable[[], ArchiveStore]] = None):
+        """
+        Initialize the retention engine.
+
+        Args:
+            data_path: Recording data path (the disk whose free space is managed)
+            db_path: Path to the recordings database
+            settings_provider: Callable returning the current storage settings
+            check_interval: Seconds between watermark checks
+            batch_size: Clips deleted per transaction
+            min_clip_age: Clips younger than this (seconds) are never deleted
+            archive_store_provider: Callable returning the archive store that holds
+                archived clips (by default the one under <data_path>/archive)
+        """
+        self.data_path = os.path.abspath(data_path)
+        self.db_manager = get_database_manager(db_path)
+        self.settings_provider = settings_provider or (lambda: {})
+        self.check_interval = check_interval
+        self.batch_size = batch_size
+        self.min_clip_age = min_clip_age
+        self._archive_store_provider = archive_store_provider
+        self._archive_store: Optional[ArchiveStore] = None
+
+        # Proveedores del estado de copia de seguridad (p.ej. el manifiesto del HDDCopyModule)
+        self._backup_status_providers: List[Callable[[], Set[int]]] = []
+
+        # Threading control
+        self._stop_event = threading.Event()
+        self._run_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+        self.stats = {
+            "runs": 0,
+            "deleted_clips": 0,
+            "deleted_files": 0,
+            "freed_bytes": 0,
+            "last_run": None,
+            "last_result": None
+        }
+
+    # ------------------------------------------------------------------
+    # Configuración
+    # ------------------------------------------------------------------
+    def get_settings(self) -> Dict[str, Any]:
+        settings = dict(DEFAULT_RETENTION_SETTINGS)
+        try:
+            settings.update({k: v for k, v in (self.settings_provider() or {}).items() if v is not None})
+        except Exception as e:
+            logger.warning(f"Error reading storage settings, using defaults: {e}")
+        return settings
+
+    def add_backup_status_provider(self, provider: Callable[[], Set[int]]):
+        """Register a callable that returns the IDs of clips already backed up"""
+        self._backup_status_providers.append(provider)
+
+    def _get_backed_up_ids(self) -> Set[int]:
+        backed_up: Set[int] = set()
+        for provider in self._backup_status_providers:
+            try:
+                backed_up.update(provider() or ())
+            except Exception as e:
+                logger.warning(f"Error getting backup status: {e}")
+        return backed_up
+
+    def get_archive_store(self) -> Optional[ArchiveStore]:
+        """Archive store of the archived clips, or None if nothing was ever archived"""
+        if self._archive_store_provider is not None:
+            return self._archive_store_provider()
+        if self._archive_store is None:
+            root = os.path.join(self.data_path, "archive")
+            if not os.path.isdir(root):
+                return None
+            self._archive_store = ArchiveStore(root)
+        return self._archive_store
+
+    # ------------------------------------------------------------------
+    # Espacio en disco
+    # ------------------------------------------------------------------
+    def get_disk_usage(self) -> Dict[str, int]:
+        usage = shutil.disk_usage(self.data_path)
+        return {"total": usage.total, "used": usage.used, "free": usage.free}
+
+    def bytes_to_free(self, settings: Optional[Dict[str, Any]] = None,
+                      usage: Optional[Dict[str, int]] = None) -> int:
+        """
+        Bytes that must be released to get back under the watermark (0 if none).
+
+        Nothing is deleted unless auto-clean is enabled. Then the trigger is
+        the higher of the usage threshold and the absolute free-space floor
+        (minFreeSpaceMB); once triggered the engine frees down to the target
+        threshold so it does not oscillate around the trigger point.
+        """
+        settings = settings or self.get_settings()
+        usage = usage or self.get_disk_usage()
+        total = usage["total"]
+        if total <= 0:
+            return 0
+
+        if not settings.get("autoCleanEnabled"):
+            # Sin limpieza automática no se borra nada por espacio
+            return 0
+
+        min_free = int(settings["minFreeSpaceMB"]) * 1024 * 1024
+
+        trigger_free = max(min_free, int(total * (100 - settings["autoCleanThreshold"]) / 100))
+        if usage["free"] >= trigger_free:
+            return 0
+
+        target_percent = min(settings["autoCleanTargetThreshold"], settings["autoCleanThreshold"])
+        target_free = max(min_free, int(total * (100 - target_percent) / 100))
+        return max(0, target_free - usage["free"])
+
+    # ------------------------------------------------------------------
+    # Selección de víctimas
+    # ------------------------------------------------------------------
+    def _load_candidates(self, older_than: Optional[datetime] = None) -> List[RetentionCandidate]:
+        """Load deletable clips from the catalog, cheapest to lose first"""
+        newest_allowed = datetime.now() - timedelta(seconds=self.min_clip_age)
+        if older_than is not None:
+            newest_allowed = min(newest_allowed, older_than)
+
+        backed_up = self._get_backed_up_ids()
+
+        with self.db_manager.session_scope() as session:
+            rows = session.query(
+                VideoClipModel.id,
+                VideoClipModel.trip_id,
+                VideoClipModel.start_time,
+                VideoClipModel.quality,
+                VideoClipModel.near_landmark,
+                VideoClipModel.landmark_type,
+                VideoClipModel.road_video_file,
+                VideoClipModel.interior_video_file
+            ).filter(VideoClipModel.start_time < newest_allowed).all()
+
+            candidates = [RetentionCandidate(row, row.id in backed_up) for row in rows]
+
+        candidates.sort(key=RetentionCandidate.sort_key)
+        return candidates
+
+    def resolve_path(self, file_path: str) -> Optional[str]:
+        """Resolve a path stored in the catalog to an existing file"""
+        if os.path.isabs(file_path):
+            return file_path if os.path.exists(file_path) else None
+
+        relative = file_path
+        if relative.startswith("data/"):
+            relative = relative[len("data/"):]
+        for base in (self.data_path, os.path.join(self.data_path, "videos")):
+            candidate = os.path.normpath(os.path.join(base, relative))
+            if os.path.exists(candidate):
+                return candidate
+        return None
+
+    def _candidate_size(self, candidate: RetentionCandidate) -> int:
+        size = 0
+        for stored_path in candidate.files:
+            if is_archive_ref(stored_path):
+                store = self.get_archive_store()
+                size += store.reclaimable_size(archive_key(stored_path)) if store else 0
+                continue
+            path = self.resolve_path(stored_path)
+            if path:
+                try:
+                    size += os.path.getsize(path)
+                except OSError:
+                    pass
+        return size
+
+    # ------------------------------------------------------------------
+    # Borrado
+    # ------------------------------------------------------------------
+    def _delete_batch(self, batch: List[RetentionCandidate], rate_limit_bytes: float) -> Dict[str, int]:
+        """Delete the files of a batch of clips and their rows in one transaction"""
+        freed = 0
+        deleted_files = 0
+        touched_dirs = set()
+        batch_start = time.monotonic()
+
+        processed_ids = []
+        archived_keys = []
+        for candidate in batch:
+            removed_all = True
+            for stored_path in candidate.files:
+                if is_archive_ref(stored_path):
+                    # El segmento se libera en el archivo junto con el resto del lote
+                    archived_keys.append(archive_key(stored_path))
+                    continue
+                path = self.resolve_path(stored_path)
+                if not path:
+                    continue
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                    freed += size
+                    deleted_files += 1
+                    touched_dirs.add(os.path.dirname(path))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    # La fila se conserva para no perder la referencia a un archivo que sigue en disco
+                    logger.warning(f"Could not delete {path}: {e}")
+                    removed_all = False
+            if removed_all:
+                processed_ids.append(candidate.id)
+
+            # Limitar la tasa de borrado para no interferir con la grabación
+            if rate_limit_bytes > 0:
+                expected = freed / rate_limit_bytes
+                elapsed = time.monotonic() - batch_start
+                if expected > elapsed and self._stop_event.wait(expected - elapsed):
+                    break
+
+        if archived_keys:
+            store = self.get_archive_store()
+            try:
+                if store is not None:
+                    archived_freed = store.remove(archived_keys)
+                    freed += archived_freed
+                    deleted_files += len(archived_keys)
+            except OSError as e:
+                # Sin la baja en el índice del archivo las filas tienen que seguir apuntando a él
+                logger.warning(f"Could not release archived segments: {e}")
+                archived_ids = {candidate.id for candidate in batch
+                                if any(is_archive_ref(f) for f in candidate.files)}
+                processed_ids = [clip_id for clip_id in processed_ids if clip_id not in archived_ids]
+
+        # Solo se borran las filas de los clips cuyos archivos ya no están en disco
+        if processed_ids:
+            with self.db_manager.session_scope() as session:
+                session.query(VideoClipModel).filter(
+                    VideoClipModel.id.in_(processed_ids)
+                ).delete(synchronize_session=False)
+
+        # Eliminar carpetas diarias que hayan quedado vacías (los intermedios del
+        # resumen diario de clips borrados no deben mantenerlas vivas)
+        for directory in touched_dirs:
+            try:
+                if not directory.startswith(self.data_path):
+                    continue
+                prune_summary_cache(directory)
+                if not os.listdir(directory):
+                    os.rmdir(directory)
+            except OSError:
+                pass
+
+        return {"clips": len(processed_ids), "files": deleted_files, "bytes": freed}
+
+    def _delete_candidates(self, candidates: Iterable[RetentionCandidate],
+                           bytes_needed: Optional[int], settings: Dict[str, Any]) -> Dict[str, Any]:
+        rate_limit = float(settings.get("retentionDeleteRateMB") or 0) * 1024 * 1024
+        result = {"deleted": 0, "deletedFiles": 0, "freedSpace": 0}
+
+        batch: List[RetentionCandidate] = []
+        planned_bytes = 0
+        for candidate in candidates:
+            if self._stop_event.is_set():
+                break
+            if bytes_needed is not None:
+                # Se estima el tamaño antes de encolar para no borrar de más
+                if planned_bytes >= bytes_needed:
+                    break
+                planned_bytes += self._candidate_size(candidate)
+            batch.append(candidate)
+            if len(batch) >= self.batch_size:
+                self._accumulate(result, self._delete_batch(batch, rate_limit))
+                batch = []
+
+        if batch and not self._stop_event.is_set():
+            self._accumulate(result, self._delete_batch(batch, rate_limit))
+
+        return result
+
+    def _accumulate(self, result: Dict[str, Any], batch_result: Dict[str, int]):
+        result["deleted"] += batch_result["clips"]
+        result["deletedFiles"] += batch_result["files"]
+        result["freedSpace"] += batch_result["bytes"]
+        self.stats["deleted_clips"] += batch_result["clips"]
+        self.stats["deleted_files"] += batch_result["files"]
+        self.stats["freed_bytes"] += batch_result["bytes"]
+
+    def purge_older_than(self, days: int) -> Dict[str, Any]:
+        """Delete every clip older than the given number of days (files and rows)"""
+        with self._run_lock:
+            cutoff = datetime.now() - timedelta(days=days)
+            candidates = self._load_candidates(older_than=cutoff)
+            result = self._delete_candidates(candidates, None, self.get_settings())
+            logger.info(f"Purged {result['deleted']} clips older than {days} days, "
+                        f"freed {result['freedSpace']} bytes")
+            return result
+
+    def enforce(self) -> Dict[str, Any]:
+        """
+        Run one retention pass: expire clips past the age limit (when
+        auto-clean is enabled) and free space down to the target watermark.
+        """
+        with self._run_lock:
+            settings = self.get_settings()
+            result = {"deleted": 0, "deletedFiles": 0, "freedSpace": 0, "bytesNeeded": 0}
+
+            if settings.get("autoCleanEnabled"):
+                cutoff = datetime.now() - timedelta(days=int(settings["autoCleanDays"]))
+                expired = self._load_candidates(older_than=cutoff)
+                if expired:
+                    expired_result = self._delete_candidates(expired, None, settings)
+                    for key in ("deleted", "deletedFiles", "freedSpace"):
+                        result[key] += expired_result[key]
+
+            # Marca de espacio libre (0 si la limpieza automática está desactivada)
+            bytes_needed = self.bytes_to_free(settings)
+            result["bytesNeeded"] = bytes_needed
+            if bytes_needed > 0:
+                logger.warning(f"Free space below watermark, releasing {bytes_needed} bytes")
+                candidates = self._load_candidates()
+                space_result = self._delete_candidates(candidates, bytes_needed, settings)
+                for key in ("deleted", "deletedFiles", "freedSpace"):
+                    result[key] += space_result[key]
+                if space_result["freedSpace"] < bytes_needed:
+                    logger.error("Retention could not reach the free space watermark: "
+                                 f"freed {space_result['freedSpace']} of {bytes_needed} bytes")
+
+            self.stats["runs"] += 1
+            self.stats["last_run"] = datetime.now().isoformat()
+            self.stats["last_result"] = result
+            if result["deleted"]:
+                logger.info(f"Retention pass deleted {result['deleted']} clips, "
+                            f"freed {result['freedSpace']} bytes")
+            return result
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida
+    # ------------------------------------------------------------------
+    def _loop(self):
+        logger.info("Retention engine started")
+        while not self._stop_event.is_set():
+            try:
+                self.enforce()
+            except Exception as e:
+                logger.error(f"Error in retention loop: {e}")
+            self._stop_event.wait(self.check_interval)
+        logger.info("Retention engine stopped")
+
+    def start(self):
+        """Start the background retention thread"""
+        if self._running:
+            logger.warning("Retention engine is already running")
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="RetentionEngine", daemon=True)
+        self._thread.start()
+        self._running = True
+
+    def stop(self):
+        """Stop the background retention thread"""
+        if not self._running:
+            return
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=5.0)
+        self._running = False
+
+    def get_status(self) -> Dict[str, Any]:
+        settings = self.get_settings()
+        try:
+            usage = self.get_disk_usage()
+            bytes_needed = self.bytes_to_free(settings, usage)
+        except Exception as e:
+            usage, bytes_needed = {"error": str(e)}, None
+        return {
+            "running": self._running,
+            "check_interval": self.check_interval,
+            "batch_size": self.batch_size,
+            "settings": {k: settings[k] for k in DEFAULT_RETENTION_SETTINGS},
+            "disk": usage,
+            "bytes_needed": bytes_needed,
+            "stats": dict(self.stats)
+        }
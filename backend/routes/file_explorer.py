@@ -1,7 +1,10 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from typing import Dict, Any, Optional, List
 from pydantic import BaseModel
+import asyncio
 import os
+import stat
 import logging
 import datetime
 import shutil
@@ -9,6 +12,8 @@ from pathlib import Path
 import subprocess
 import json
 
+from utils.directory_index import directory_index, filter_entries, select_page, VIDEO_EXTENSIONS, MIME_TYPES
+
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
@@ -43,21 +48,21 @@ def get_file_extension(filename: str) -> str:
 
 def is_video_file(filename: str) -> bool:
     """Determina si el archivo es un video basado en su extensión"""
-    video_extensions = ['.mp4', '.avi', '.mov', '.webm', '.mkv', '.insv', '.mts', '.m2ts']
-    return get_file_extension(filename) in video_extensions
+    return get_file_extension(filename) in VIDEO_EXTENSIONS
 
 def get_file_info(file_path: str) -> Dict[str, Any]:
     """Obtiene información detallada sobre un archivo"""
     try:
-        if not os.path.exists(file_path):
+        try:
+            stat_info = os.stat(file_path)
+        except FileNotFoundError:
             return {
                 "name": os.path.basename(file_path),
                 "path": file_path,
                 "error": "El archivo no existe"
             }
-            
-        stat_info = os.stat(file_path)
-        is_dir = os.path.isdir(file_path)
+
+        is_dir = stat.S_ISDIR(stat_info.st_mode)
         
         try:
             mtime = datetime.datetime.fromtimestamp(stat_info.st_mtime).isoformat()
@@ -100,18 +105,7 @@ def get_file_info(file_path: str) -> Dict[str, Any]:
 
 def get_mime_type(file_path: str) -> str:
     """Intenta determinar el tipo MIME de un archivo"""
-    extension = get_file_extension(file_path)
-    mime_types = {
-        '.mp4': 'video/mp4',
-        '.avi': 'video/x-msvideo',
-        '.mov': 'video/quicktime',
-        '.webm': 'video/webm',
-        '.mkv': 'video/x-matroska',
-        '.insv': 'video/mp4',  # Insta360 usa contenedores MP4
-        '.mts': 'video/mp2t',
-        '.m2ts': 'video/mp2t'
-    }
-    return mime_types.get(extension, 'application/octet-stream')
+    return MIME_TYPES.get(get_file_extension(file_path), 'application/octet-stream')
 
 def get_normalized_path(base_path: str, rel_path: str) -> str:
     """Normaliza una ruta relativa combinándola con la base y validando que no salga del directorio base"""
@@ -131,161 +125,189 @@ def get_normalized_path(base_path: str, rel_path: str) -> str:
     
     return full_path
 
+def resolve_directory(path: str) -> str:
+    """Traduce la ruta pedida por el frontend a un directorio real del sistema"""
+    # Verificar primero si es una ruta predefinida
+    if path == "videos":
+        # Directorio de videos interno
+        return os.path.join(disk_manager.data_path, "videos")
+
+    if path == "external" or path.startswith("external/"):
+        # Directorio montado externo
+        if not disk_manager or not disk_manager.settings:
+            raise HTTPException(status_code=500, detail="El administrador de disco no está inicializado")
+
+        mount_point = disk_manager.settings.get("mountPoint")
+        if not mount_point or not os.path.isdir(mount_point):
+            raise HTTPException(status_code=404, detail="No hay disco externo montado")
+
+        if path == "external":
+            return mount_point
+
+        # Extraer la parte relativa
+        rel_path = path.replace("external/", "", 1)
+        return os.path.join(mount_point, rel_path)
+
+    if path.startswith("videos/"):
+        # Subdirectorio dentro de videos interno
+        return os.path.join(disk_manager.data_path, path)
+
+    # Ruta absoluta (para compatibilidad)
+    # Validar que no se esté accediendo a rutas sensibles
+    sensitive_paths = ["/etc", "/root", "/home", "/var/log", "/boot"]
+    if any(path.startswith(sp) for sp in sensitive_paths):
+        raise HTTPException(status_code=403, detail="Acceso a directorios sensibles del sistema no permitido")
+    return path
+
+def get_current_directory_info(base_dir: str) -> Dict[str, Any]:
+    """Información sobre el directorio que se está listando"""
+    return {
+        "path": base_dir,
+        "name": os.path.basename(base_dir) or base_dir,
+        "parent_path": os.path.dirname(base_dir) if base_dir != "/" else None
+    }
+
+def build_error_listing(path: str, message: str) -> Dict[str, Any]:
+    """Respuesta con error en lugar de lanzar una excepción"""
+    error_entry = {
+        "name": "Error",
+        "path": path,
+        "error": message
+    }
+    return {
+        "current_directory": get_current_directory_info(path),
+        "entries": [error_entry],
+        "items": [error_entry],  # Formato antiguo
+        "current_path": path,  # Formato antiguo
+        "total": 0,
+        "next_cursor": None
+    }
+
 @router.get("/list")
-async def list_directory(path: str, filter_video: bool = False):
-    """Lista el contenido de un directorio"""
+async def list_directory(path: str, filter_video: bool = False,
+                         sort_by: str = Query("name", pattern="^(name|size|modified)$"),
+                         order: str = Query("asc", pattern="^(asc|desc)$"),
+                         search: Optional[str] = None,
+                         cursor: Optional[str] = None,
+                         limit: Optional[int] = Query(None, ge=1, le=5000)):
+    """
+    Lista el contenido de un directorio.
+
+    Sin ``limit`` devuelve todas las entradas como antes. Con ``limit`` devuelve
+    una página y ``next_cursor`` para pedir la siguiente. El orden y el filtrado
+    se hacen en el servidor sobre un índice en caché validado por mtime.
+    """
     try:
-        # Verificar primero si es una ruta predefinida
-        if path == "videos":
-            # Directorio de videos interno
-            base_dir = os.path.join(disk_manager.data_path, "videos")
-        elif path == "external":
-            # Directorio montado externo
-            if not disk_manager or not disk_manager.settings:
-                raise HTTPException(status_code=500, detail="El administrador de disco no está inicializado")
-            
-            mount_point = disk_manager.settings.get("mountPoint")
-            if not mount_point or not os.path.isdir(mount_point):
-                raise HTTPException(status_code=404, detail="No hay disco externo montado")
-            
-            base_dir = mount_point
-        else:
-            # Verificar si se está intentando navegar en un subdirectorio
-            if path.startswith("videos/"):
-                # Subdirectorio dentro de videos interno
-                base_dir = os.path.join(disk_manager.data_path, path)
-            elif path.startswith("external/"):
-                # Subdirectorio dentro del disco externo
-                if not disk_manager or not disk_manager.settings:
-                    raise HTTPException(status_code=500, detail="El administrador de disco no está inicializado")
-                
-                mount_point = disk_manager.settings.get("mountPoint")
-                if not mount_point or not os.path.isdir(mount_point):
-                    raise HTTPException(status_code=404, detail="No hay disco externo montado")
-                
-                # Extraer la parte relativa
-                rel_path = path.replace("external/", "", 1)
-                base_dir = os.path.join(mount_point, rel_path)
-            else:
-                # Ruta absoluta (para compatibilidad)
-                base_dir = path
-                
-                # Validar que no se esté accediendo a rutas sensibles
-                sensitive_paths = ["/etc", "/root", "/home", "/var/log", "/boot"]
-                if any(base_dir.startswith(sp) for sp in sensitive_paths):
-                    raise HTTPException(status_code=403, detail="Acceso a directorios sensibles del sistema no permitido")
-        
+        base_dir = resolve_directory(path)
+
         # Verificar que el directorio existe
-        if not os.path.exists(base_dir) or not os.path.isdir(base_dir):
+        if not os.path.isdir(base_dir):
             logger.warning(f"Directorio no encontrado o no es un directorio: {base_dir}")
             # En lugar de lanzar una excepción, devolvemos un directorio vacío
             return {
-                "current_directory": {
-                    "path": base_dir,
-                    "name": os.path.basename(base_dir) or base_dir,
-                    "parent_path": os.path.dirname(base_dir) if base_dir != "/" else None
-                },
+                "current_directory": get_current_directory_info(base_dir),
                 "entries": [],
                 "items": [],  # Formato antiguo
-                "current_path": base_dir  # Formato antiguo
+                "current_path": base_dir,  # Formato antiguo
+                "total": 0,
+                "next_cursor": None
             }
-        
-        # Listar contenido
-        entries = []
+
         try:
-            with os.scandir(base_dir) as it:
-                try:
-                    sorted_entries = sorted(it, key=lambda e: (not e.is_dir(), e.name))
-                except Exception as sort_err:
-                    logger.error(f"Error al ordenar entradas del directorio {base_dir}: {sort_err}")
-                    # Intentar listar sin ordenar
-                    it.seekable() and it.seek(0)
-                    sorted_entries = list(it)
-                
-                for entry in sorted_entries:
-                    try:
-                        # Si se solicita solo videos y el elemento actual no es un directorio ni un video, continuar
-                        if filter_video and not entry.is_dir() and not is_video_file(entry.name):
-                            continue
-                        
-                        # Obtener información del archivo
-                        entry_info = get_file_info(entry.path)
-                        entries.append(entry_info)
-                    except Exception as e:
-                        logger.warning(f"Error procesando entrada {entry.path}: {e}")
-                        # Incluir entrada con error para depuración
-                        entries.append({
-                            "name": entry.name,
-                            "path": entry.path,
-                            "error": str(e)
-                        })
+            # El escaneo puede tardar en discos externos lentos: fuera del event loop
+            snapshot = await asyncio.to_thread(directory_index.get_snapshot, base_dir)
         except Exception as dir_error:
             logger.error(f"Error al escanear directorio {base_dir}: {dir_error}")
-            # Agregar una entrada de error
-            entries.append({
-                "name": "Error",
-                "path": base_dir,
-                "error": f"Error al acceder al directorio: {str(dir_error)}"
-            })
-        
-        # Incluir información sobre el directorio actual
-        current_dir_info = {
-            "path": base_dir,
-            "name": os.path.basename(base_dir) or base_dir,
-            "parent_path": os.path.dirname(base_dir) if base_dir != "/" else None
-        }
-        
+            return build_error_listing(base_dir, f"Error al acceder al directorio: {str(dir_error)}")
+
+        page = select_page(
+            snapshot,
+            sort_by=sort_by,
+            descending=(order == "desc"),
+            filter_video=filter_video,
+            search=search,
+            cursor=cursor,
+            limit=limit
+        )
+
         # Para compatibilidad con ambos formatos (antiguo y nuevo)
-        response_data = {
-            "current_directory": current_dir_info,
-            "entries": entries,
-            "items": entries,  # Formato antiguo
-            "current_path": base_dir  # Formato antiguo
+        return {
+            "current_directory": get_current_directory_info(base_dir),
+            "entries": page["entries"],
+            "items": page["entries"],  # Formato antiguo
+            "current_path": base_dir,  # Formato antiguo
+            "total": page["total"],
+            "next_cursor": page["next_cursor"]
         }
-        
-        return response_data
+    except HTTPException:
+        raise
     except ValueError as ve:
         logger.error(f"Valor inválido al listar directorio {path}: {ve}")
-        # Devolver una respuesta con error en lugar de lanzar una excepción
-        return {
-            "current_directory": {
-                "path": path,
-                "name": os.path.basename(path) or path,
-                "parent_path": os.path.dirname(path) if path != "/" else None
-            },
-            "entries": [{
-                "name": "Error",
-                "path": path,
-                "error": f"Valor inválido: {str(ve)}"
-            }],
-            "items": [{
-                "name": "Error",
-                "path": path,
-                "error": f"Valor inválido: {str(ve)}"
-            }],  # Formato antiguo
-            "current_path": path  # Formato antiguo
-        }
+        return build_error_listing(path, f"Valor inválido: {str(ve)}")
     except Exception as e:
         logger.error(f"Error al listar directorio {path}: {e}")
-        # Devolver una respuesta con error en lugar de lanzar una excepción
-        return {
-            "current_directory": {
-                "path": path,
-                "name": os.path.basename(path) or path,
-                "parent_path": os.path.dirname(path) if path != "/" else None
-            },
-            "entries": [{
-                "name": "Error",
-                "path": path,
-                "error": f"Error al listar directorio: {str(e)}"
-            }],
-            "items": [{
-                "name": "Error",
-                "path": path,
-                "error": f"Error al listar directorio: {str(e)}"
-            }],  # Formato antiguo
-            "current_path": path  # Formato antiguo
-        }
+        return build_error_listing(path, f"Error al listar directorio: {str(e)}")
+
+@router.get("/list/stream")
+async def stream_directory(path: str, filter_video: bool = False,
+                           sort_by: str = Query("name", pattern="^(name|size|modified|none)$"),
+                           order: str = Query("asc", pattern="^(asc|desc)$"),
+                           search: Optional[str] = None):
+    """
+    Lista un directorio enorme como JSON en streaming.
+
+    El documento tiene la misma forma que ``/list`` (``current_directory``,
+    ``entries``, ``total``, este último al final). Con ``sort_by=none`` la
+    cabecera sale antes de escanear y las entradas se envían en el orden del
+    sistema de archivos a medida que se leen; con un orden, el directorio se
+    escanea antes de responder (o sale de la caché), así que un error de
+    lectura llega como error HTTP. Si el escaneo falla a mitad de un envío ya
+    empezado, el documento se cierra igualmente con un campo ``error``.
+    """
+    base_dir = resolve_directory(path)
+    if not os.path.isdir(base_dir):
+        raise HTTPException(status_code=404, detail=f"Directorio no encontrado: {base_dir}")
+
+    chunk_size = 500
+
+    def prepare():
+        header = json.dumps(get_current_directory_info(base_dir))
+        snapshot = directory_index.cached_snapshot(base_dir)
+        if sort_by == "none":
+            return header, snapshot.entries if snapshot is not None else directory_index.iter_scan(base_dir)
+        if snapshot is None:
+            snapshot = directory_index.get_snapshot(base_dir)
+        return header, snapshot.ordered(sort_by, order == "desc")
+
+    try:
+        header, entries = await asyncio.to_thread(prepare)
+    except OSError as e:
+        logger.error(f"Error escaneando {base_dir}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error leyendo directorio: {str(e)}")
+
+    # Generador síncrono: Starlette lo recorre en un hilo, fuera del event loop
+    def generate():
+        yield '{"current_directory":' + header + ',"entries":['
+        total = 0
+        chunk = []
+        error = None
+        try:
+            for entry in filter_entries(entries, filter_video, search):
+                chunk.append(json.dumps(entry.info))
+                if len(chunk) >= chunk_size:
+                    yield ("," if total else "") + ",".join(chunk)
+                    total += len(chunk)
+                    chunk = []
+        except Exception as e:
+            # Ya se envió la cabecera (200): se cierra el JSON avisando del error
+            logger.error(f"Error escaneando {base_dir} durante el streaming: {e}")
+            error = str(e)
+        if chunk:
+            yield ("," if total else "") + ",".join(chunk)
+            total += len(chunk)
+        yield '],"total":' + str(total) + ('' if error is None else ',"error":' + json.dumps(error)) + '}'
+
+    return StreamingResponse(generate(), media_type="application/json")
 
 @router.post("/move")
 async def move_file(request: FileMoveRequest):
@@ -304,6 +326,8 @@ async def move_file(request: FileMoveRequest):
         
         # Mover el archivo
         shutil.move(source_path, target_path)
+        directory_index.invalidate(os.path.dirname(source_path))
+        directory_index.invalidate(target_dir)
         
         return {"success": True, "message": f"Archivo movido exitosamente de {source_path} a {target_path}"}
     except HTTPException:
@@ -335,6 +359,7 @@ async def delete_file(request: DeleteRequest):
             shutil.rmtree(path)
         else:
             os.remove(path)
+        directory_index.invalidate(path)
         
         return {"success": True, "message": f"Elemento eliminado exitosamente: {path}"}
     except HTTPException:
@@ -2,14 +2,13 @@ from fastapi import APIRouter, HTTPException, BackgroundTasks, Request, Form, Fi
 from fastapi.responses import JSONResponse, FileResponse
 import os
 import json
-import requests
 import logging
 import aiohttp
-import aiofiles
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
 import asyncio
 import tempfile
+import threading
 import shutil
 from datetime import datetime
 import zipfile
@@ -19,6 +18,11 @@ import random
 import sqlite3
 from pathlib import Path
 
+from utils.mbtiles_service import MBTilesTileService, TripTileArchives, detect_tile_format
+from utils.mbtiles_writer import MBTilesWriter, TRIP_MBTILES_NAME
+from utils.tile_planner import plan_corridor, plan_summary, route_points
+from utils.tile_proxy import ContentAddressedTileStore, TileProxy, valid_tile
+
 # Define router
 router = APIRouter()
 
@@ -32,6 +36,21 @@ config = None
 # Base directory for offline maps
 OFFLINE_MAPS_DIR = "offline_maps"
 
+# Almacén de teselas compartido por todos los viajes (direccionado por contenido)
+TILE_STORE_DIR = "tile_store"
+
+# Servicio de teselas MBTiles (conexiones persistentes y LRU), creado al primer uso
+_mbtiles_service: Optional[MBTilesTileService] = None
+
+# Proxy de teselas online con almacén compartido, creado al primer uso
+_tile_proxy: Optional[TileProxy] = None
+
+# MBTiles por viaje escritos por la descarga de teselas, abiertos al primer uso
+_trip_archives: Optional[TripTileArchives] = None
+
+# Teselas descargadas que se acumulan antes de insertarlas en el MBTiles del viaje
+TILE_WRITE_BATCH = 256
+
 class MapTileRequest(BaseModel):
     z: int
     x: int
@@ -42,6 +61,40 @@ class OfflineMapRequest(BaseModel):
     trip_id: str
     bounds: Dict[str, float]
     zoom_levels: List[int]
+    # Puntos de la ruta ({lat, lng}); si se envían se descarga solo el corredor de la ruta
+    route: Optional[List[Dict[str, Any]]] = None
+
+def _allowed_zoom_levels(zoom_levels: List[int]) -> List[int]:
+    # Validate zoom levels (limit to 8-16 to prevent excessive downloads)
+    allowed_zoom_levels = [z for z in zoom_levels if 8 <= z <= 16]
+    if not allowed_zoom_levels:
+        raise HTTPException(status_code=400, detail="Invalid zoom levels. Must be between 8 and 16")
+    return allowed_zoom_levels
+
+async def _plan_corridor_tiles(points, zoom_levels: List[int]):
+    """
+    Tiles of the route corridor that are not in the shared tile store yet,
+    the plan summary and the corridor tiles already in the store (which the
+    download copies into the trip MBTiles instead of fetching them again)
+    """
+    plan = await asyncio.to_thread(plan_corridor, points, zoom_levels)
+    proxy = _get_tile_proxy()
+    stored = {}
+    for z in plan:
+        stored[z] = await asyncio.to_thread(proxy.store.existing_tiles, proxy.source, z)
+    tiles = [{"x": x, "y": y, "z": z} for z, zoom_tiles in plan.items() for x, y in sorted(zoom_tiles - stored[z])]
+    store_tiles = [{"x": x, "y": y, "z": z} for z, zoom_tiles in plan.items() for x, y in sorted(zoom_tiles & stored[z])]
+    return tiles, plan_summary(points, plan, stored), store_tiles
+
+@router.post("/plan-tiles")
+async def plan_map_tiles(request: OfflineMapRequest):
+    """Tile counts and size estimate of a download, before starting it"""
+    allowed_zoom_levels = _allowed_zoom_levels(request.zoom_levels)
+    points = route_points(request.route or [])
+    if not points:
+        raise HTTPException(status_code=400, detail="A route with at least one point is required")
+    _, plan, _ = await _plan_corridor_tiles(points, allowed_zoom_levels)
+    return {"status": "success", "trip_id": request.trip_id, **plan}
 
 @router.post("/download-tiles")
 async def download_map_tiles(request: OfflineMapRequest, background_tasks: BackgroundTasks):
@@ -49,14 +102,18 @@ async def download_map_tiles(request: OfflineMapRequest, background_tasks: Backg
     try:
         logger.info(f"Starting map tiles download for trip: {request.trip_id}")
         
-        # Validate zoom levels (limit to 8-16 to prevent excessive downloads)
-        allowed_zoom_levels = [z for z in request.zoom_levels if 8 <= z <= 16]
+        allowed_zoom_levels = _allowed_zoom_levels(request.zoom_levels)
         
-        if not allowed_zoom_levels:
-            raise HTTPException(status_code=400, detail="Invalid zoom levels. Must be between 8 and 16")
-        
-        # Calculate required tiles
-        tiles = calculate_tiles_for_bounds(request.bounds, allowed_zoom_levels)
+        # Calculate required tiles: corredor de la ruta si se conoce, si no el rectángulo
+        plan = None
+        store_tiles = []
+        points = route_points(request.route or [])
+        if points:
+            tiles, plan, store_tiles = await _plan_corridor_tiles(points, allowed_zoom_levels)
+            logger.info(f"Corridor plan for trip {request.trip_id}: {plan['to_download']} tiles to download, "
+                        f"{plan['in_store']} already in the shared store (bounding box: {plan['bbox_tiles']})")
+        else:
+            tiles = calculate_tiles_for_bounds(request.bounds, allowed_zoom_levels)
         
         # Estimar el tamaño aproximado de la descarga (5KB por tile en promedio)
         estimated_size_mb = len(tiles) * 5 / 1024  # Tamaño en MB
@@ -84,12 +141,17 @@ async def download_map_tiles(request: OfflineMapRequest, background_tasks: Backg
             "trip_id": request.trip_id,
             "bounds": request.bounds,
             "zoom_levels": allowed_zoom_levels,
-            "total_tiles": len(tiles),
+            # Las del almacén compartido también acaban en el MBTiles del viaje
+            "total_tiles": len(tiles) + len(store_tiles),
             "downloaded_tiles": 0,
             "download_started": datetime.now().isoformat(),
             "download_completed": None,
-            "status": "in_progress"
+            "status": "in_progress",
+            "storage": TRIP_MBTILES_NAME,
+            "planner": "corridor" if plan else "bounds"
         }
+        if plan:
+            metadata["tiles_in_shared_store"] = plan["in_store"]
         
         # Save initial metadata
         metadata_path = os.path.join(trip_maps_dir, "metadata.json")
@@ -102,16 +164,20 @@ async def download_map_tiles(request: OfflineMapRequest, background_tasks: Backg
             request.trip_id,
             tiles,
             trip_maps_dir,
-            metadata_path
+            metadata_path,
+            store_tiles
         )
         
-        return {
+        response = {
             "status": "success",
             "message": f"Download of {len(tiles)} tiles started in the background",
             "trip_id": request.trip_id,
             "total_tiles": len(tiles),
             "zoom_levels": allowed_zoom_levels
         }
+        if plan:
+            response["plan"] = plan
+        return response
     except Exception as e:
         if isinstance(e, HTTPException):
             raise e
@@ -178,46 +244,71 @@ async def check_download_status(trip_id: str):
         logger.error(f"Error checking download status for trip {trip_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error checking download status: {str(e)}")
 
+def _get_tile_proxy() -> TileProxy:
+    global _tile_proxy
+    if _tile_proxy is None:
+        store = ContentAddressedTileStore(os.path.join(config.data_path, OFFLINE_MAPS_DIR, TILE_STORE_DIR))
+        _tile_proxy = TileProxy(store, url_template=config.map_tile_url,
+                                offline_only=config.map_tiles_offline_only)
+    return _tile_proxy
+
+async def close_tile_proxy():
+    if _tile_proxy is not None:
+        await _tile_proxy.close()
+    if _trip_archives is not None:
+        _trip_archives.close()
+
+def _get_trip_archives() -> TripTileArchives:
+    global _trip_archives
+    if _trip_archives is None:
+        _trip_archives = TripTileArchives(os.path.join(config.data_path, OFFLINE_MAPS_DIR), TRIP_MBTILES_NAME)
+    return _trip_archives
+
+def _tile_response(body: bytes, content_type: str, etag: str, request: Request) -> Response:
+    headers = {"Cache-Control": "public, max-age=86400", "ETag": etag}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=content_type, headers=headers)
+
 @router.get("/tile/{trip_id}/{z}/{x}/{y}")
-async def get_map_tile(trip_id: str, z: int, x: int, y: int):
+async def get_map_tile(trip_id: str, z: int, x: int, y: int, request: Request):
     """Get a map tile for a trip"""
     try:
-        # Check if the tile exists locally
-        tile_path = os.path.join(config.data_path, OFFLINE_MAPS_DIR, trip_id, f"{z}", f"{x}", f"{y}.png")
+        if not valid_tile(z, x, y):
+            raise HTTPException(status_code=404, detail="Tile not found")
+        
+        # Teselas descargadas con el viaje (MBTiles por viaje)
+        entry = await asyncio.to_thread(_get_trip_archives().read_tile, trip_id, z, x, y)
+        if entry is not None:
+            return _tile_response(entry.data, entry.content_type, entry.etag, request)
         
+        # Árbol PNG de descargas antiguas que aún no se han migrado
+        # (tools/migrate_trip_tiles_to_mbtiles.py)
+        tile_path = os.path.join(config.data_path, OFFLINE_MAPS_DIR, trip_id, f"{z}", f"{x}", f"{y}.png")
         if os.path.exists(tile_path):
             logger.debug(f"Serving cached tile {z}/{x}/{y} for trip {trip_id}")
             return FileResponse(tile_path, media_type="image/png")
         
-        # If not, fetch it from OpenStreetMap
-        logger.debug(f"Fetching tile {z}/{x}/{y} from OSM for trip {trip_id}")
-        tile_url = f"https://a.tile.openstreetmap.org/{z}/{x}/{y}.png"
-        response = requests.get(tile_url)
-        
-        if response.status_code != 200:
+        # Almacén compartido o servidor de origen (salvo en modo solo offline)
+        tile = await _get_tile_proxy().get_tile(z, x, y)
+        if tile is None:
             raise HTTPException(status_code=404, detail="Tile not found")
         
-        # Save tile for future use
-        try:
-            # Create directories if they don't exist
-            os.makedirs(os.path.dirname(tile_path), exist_ok=True)
-            
-            # Save the tile
-            with open(tile_path, "wb") as f:
-                f.write(response.content)
-                
-            logger.debug(f"Saved tile {z}/{x}/{y} for trip {trip_id}")
-        except Exception as save_error:
-            logger.warning(f"Could not save tile {z}/{x}/{y} for trip {trip_id}: {str(save_error)}")
-        
-        # Return the tile
-        return Response(content=response.content, media_type="image/png")
+        digest, data = tile
+        return _tile_response(data, detect_tile_format(data)[0], f'"{digest[:32]}"', request)
     except Exception as e:
         if isinstance(e, HTTPException):
             raise e
         logger.error(f"Error getting map tile {z}/{x}/{y} for trip {trip_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error getting map tile: {str(e)}")
 
+@router.get("/tile-proxy/stats")
+async def get_tile_proxy_stats():
+    """Statistics of the tile proxy and the shared tile store"""
+    proxy = _get_tile_proxy()
+    store_stats = await asyncio.to_thread(proxy.store.get_stats)
+    return {"status": "success", "proxy": proxy.get_stats(), "store": store_stats}
+
 @router.delete("/{trip_id}")
 async def delete_offline_map(trip_id: str):
     """Delete offline map for a trip"""
@@ -227,6 +318,9 @@ async def delete_offline_map(trip_id: str):
         if not os.path.exists(trip_maps_dir):
             raise HTTPException(status_code=404, detail=f"No offline map found for trip {trip_id}")
         
+        # Cerrar el MBTiles del viaje antes de borrarlo
+        _get_trip_archives().discard(trip_id)
+        
         # Delete the directory
         shutil.rmtree(trip_maps_dir)
         
@@ -270,16 +364,77 @@ async def export_offline_map(trip_id: str):
         logger.error(f"Error exporting offline map for trip {trip_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error exporting offline map: {str(e)}")
 
-async def download_tiles_background_task(trip_id: str, tiles: List[Dict[str, int]], output_dir: str, metadata_path: str):
-    """Background task to download map tiles"""
+def _copy_store_tiles(writer: MBTilesWriter, proxy: TileProxy, store_tiles: List[Dict[str, int]]):
+    """
+    Copy tiles from the shared store into the trip MBTiles, so that the trip
+    archive (and its export) is complete on its own. Returns (tiles copied or
+    already in the trip MBTiles, tiles whose store object is gone).
+    """
+    copied = 0
+    missing = []
+    by_zoom: Dict[int, List[Dict[str, int]]] = {}
+    for tile in store_tiles:
+        by_zoom.setdefault(tile['z'], []).append(tile)
+    for z, zoom_tiles in sorted(by_zoom.items()):
+        in_trip = writer.existing_tiles(z)
+        rows = []
+        for tile in zoom_tiles:
+            if (tile['x'], tile['y']) in in_trip:
+                copied += 1
+                continue
+            stored = proxy.store.get(proxy.source, z, tile['x'], tile['y'])
+            if stored is None:
+                missing.append(tile)
+                continue
+            rows.append((z, tile['x'], tile['y'], stored[1]))
+            if len(rows) >= TILE_WRITE_BATCH:
+                copied += writer.write_batch(rows)
+                rows = []
+        copied += writer.write_batch(rows)
+    return copied, missing
+
+async def download_tiles_background_task(trip_id: str, tiles: List[Dict[str, int]], output_dir: str, metadata_path: str,
+                                          store_tiles: Optional[List[Dict[str, int]]] = None):
+    """
+    Background task to download map tiles into the trip MBTiles; ``store_tiles``
+    are already in the shared tile store and are copied from there
+    """
     downloaded = 0
     failed = 0
+    writer = None
+    # Teselas descargadas pendientes de insertar: (z, x, y, datos)
+    pending = []
     
     # Read metadata
     with open(metadata_path, "r") as f:
         metadata = json.load(f)
     
+    async def flush_pending():
+        if pending:
+            rows = pending[:]
+            pending.clear()
+            await asyncio.to_thread(writer.write_batch, rows)
+    
     try:
+        # El mismo origen que el proxy, para que las teselas del almacén compartido valgan para el viaje
+        url_template = _get_tile_proxy().url_template
+        writer = await asyncio.to_thread(MBTilesWriter, os.path.join(output_dir, TRIP_MBTILES_NAME))
+        await asyncio.to_thread(writer.set_metadata, {
+            "name": f"trip {trip_id}",
+            "format": "png",
+            "type": "baselayer",
+            "minzoom": min(metadata["zoom_levels"]),
+            "maxzoom": max(metadata["zoom_levels"]),
+            "bounds": ",".join(str(float(metadata["bounds"][k])) for k in ("west", "south", "east", "north"))
+        })
+        
+        if store_tiles:
+            copied, missing = await asyncio.to_thread(_copy_store_tiles, writer, _get_tile_proxy(), store_tiles)
+            downloaded += copied
+            # Objetos perdidos del almacén: se descargan como el resto
+            tiles = tiles + missing
+            logger.info(f"Trip {trip_id}: {copied} tiles copied from the shared store, {len(missing)} to download again")
+        
         # Optimizamos la configuración de conexión para mejorar la velocidad
         # - Aumentamos el límite de conexiones, pero manteniendo un valor razonable para evitar bloqueos
         # - Usamos keep-alive para reutilizar conexiones y reducir la latencia
@@ -319,6 +474,12 @@ async def download_tiles_background_task(trip_id: str, tiles: List[Dict[str, int
             # Procesar por nivel de zoom (de menor a mayor) para tener primero los mapas menos detallados
             for zoom_level in sorted(tiles_by_zoom.keys()):
                 zoom_tiles = tiles_by_zoom[zoom_level]
+                
+                # Reanudar: las teselas que ya están en el MBTiles del viaje no se vuelven a pedir
+                stored = await asyncio.to_thread(writer.existing_tiles, zoom_level)
+                if stored:
+                    zoom_tiles = [t for t in zoom_tiles if (t['x'], t['y']) not in stored]
+                    downloaded += len(tiles_by_zoom[zoom_level]) - len(zoom_tiles)
                 zoom_total = len(zoom_tiles)
                 
                 logger.info(f"Processing zoom level {zoom_level}: {zoom_total} tiles")
@@ -332,27 +493,16 @@ async def download_tiles_background_task(trip_id: str, tiles: List[Dict[str, int
                     
                     logger.debug(f"Processing batch {batch_num}/{batch_total} for zoom {zoom_level}")
                     
-                    # Preparación eficiente: crear directorios para todo el lote de una vez
-                    tile_dirs = set()
-                    for tile in batch:
-                        tile_dir = os.path.join(output_dir, f"{tile['z']}", f"{tile['x']}")
-                        tile_dirs.add(tile_dir)
-                    
-                    # Crear directorios en paralelo
-                    for tile_dir in tile_dirs:
-                        os.makedirs(tile_dir, exist_ok=True)
-                    
                     # Crear tareas para este lote con distribución inteligente de carga
                     tasks = []
                     for i, tile in enumerate(batch):
                         # Usar un servidor aleatorio pero con distribución inteligente para balancear carga
                         server_index = (i + zoom_level) % 3  # Distribución cíclica con offset por nivel de zoom
                         server = chr(ord('a') + server_index)  # a, b, c
-                        tile_url = f"https://{server}.tile.openstreetmap.org/{tile['z']}/{tile['x']}/{tile['y']}.png"
-                        tile_path = os.path.join(output_dir, f"{tile['z']}", f"{tile['x']}", f"{tile['y']}.png")
+                        tile_url = url_template.format(s=server, z=tile['z'], x=tile['x'], y=tile['y'])
                         
                         # Crear la tarea de descarga
-                        tasks.append(download_single_tile(session, tile_url, tile_path))
+                        tasks.append(download_single_tile(session, tile_url))
                     
                     # Añadir retraso global antes de comenzar el lote - más eficiente que retrasos individuales
                     # Variar según el nivel de zoom para distribuir la carga de manera escalonada
@@ -365,10 +515,9 @@ async def download_tiles_background_task(trip_id: str, tiles: List[Dict[str, int
                     # Procesar resultados eficientemente
                     success_count = 0
                     fail_count = 0
-                    for result in batch_results:
-                        if isinstance(result, Exception):
-                            fail_count += 1
-                        elif result is True:
+                    for tile, result in zip(batch, batch_results):
+                        if isinstance(result, bytes):
+                            pending.append((tile['z'], tile['x'], tile['y'], result))
                             success_count += 1
                         else:
                             fail_count += 1
@@ -376,6 +525,10 @@ async def download_tiles_background_task(trip_id: str, tiles: List[Dict[str, int
                     downloaded += success_count
                     failed += fail_count
                     
+                    # Inserción por lotes en una sola transacción
+                    if len(pending) >= TILE_WRITE_BATCH:
+                        await flush_pending()
+                    
                     # Actualizar metadatos con corrección atómica usando archivos temporales
                     # Esto evita corrupción de datos si hay interrupciones
                     metadata["downloaded_tiles"] = downloaded
@@ -408,6 +561,9 @@ async def download_tiles_background_task(trip_id: str, tiles: List[Dict[str, int
                     else:
                         # Algunos fallos, esperar proporcionalmente
                         await asyncio.sleep(1.5)
+                
+                # Cada zoom queda completo en el MBTiles antes de pasar al siguiente
+                await flush_pending()
         
         # Update final metadata
         metadata["status"] = "completed"
@@ -433,17 +589,18 @@ async def download_tiles_background_task(trip_id: str, tiles: List[Dict[str, int
                 json.dump(metadata, f, indent=2)
         except Exception as metadata_error:
             logger.error(f"Failed to update metadata for trip {trip_id}: {str(metadata_error)}")
+    finally:
+        if writer is not None:
+            try:
+                # Conservar lo ya descargado para poder reanudar
+                await flush_pending()
+            except Exception as write_error:
+                logger.error(f"Failed to store pending tiles for trip {trip_id}: {str(write_error)}")
+            await asyncio.to_thread(writer.close)
 
-async def download_single_tile(session, url, output_path, max_retries=2, timeout=15):
-    """Download a single tile with improved retry logic and error handling"""
+async def download_single_tile(session, url, max_retries=2, timeout=15) -> Optional[bytes]:
+    """Download a single tile with improved retry logic and error handling; returns its bytes or None"""
     try:
-        # Check if file already exists
-        if os.path.exists(output_path):
-            return True
-        
-        # Ensure the parent directory exists
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        
         # Try to download with retries
         retry_count = 0
         while retry_count <= max_retries:
@@ -466,19 +623,18 @@ async def download_single_tile(session, url, output_path, max_retries=2, timeout
                     
                     # Manejar diferentes códigos de estado HTTP con estrategias específicas
                     if status == 200:
-                        # Éxito - guardar el tile
-                        async with aiofiles.open(output_path, "wb") as f:
-                            await f.write(await response.read())
+                        # Éxito - el llamador guarda el tile en el MBTiles del viaje
+                        data = await response.read()
                         
                         # Log successful download occasionally
                         if random.random() < 0.05:  # Log ~5% of successful downloads to reduce noise
                             logger.debug(f"Successfully downloaded tile {url}")
                         
-                        return True
+                        return data
                     elif status == 404:
                         # Tile no encontrado - no tiene sentido reintentar
                         logger.info(f"Tile not found at {url} (404 Not Found)")
-                        return False
+                        return None
                     elif status == 429:
                         # Too Many Requests - backoff exponencial
                         retry_count += 1
@@ -496,7 +652,7 @@ async def download_single_tile(session, url, output_path, max_retries=2, timeout
                             continue
                         else:
                             logger.error(f"Persistent server error {status} for {url} after {max_retries} retries")
-                            return False
+                            return None
                     else:
                         # Otro código de estado - reintentar una vez más
                         retry_count += 1
@@ -507,7 +663,7 @@ async def download_single_tile(session, url, output_path, max_retries=2, timeout
                             continue
                         else:
                             logger.error(f"Failed to download {url}: status {status} after {max_retries} retries")
-                            return False
+                            return None
                             
             except asyncio.TimeoutError:
                 # Timeout específico - incrementar el tiempo de espera en reintentos
@@ -518,7 +674,7 @@ async def download_single_tile(session, url, output_path, max_retries=2, timeout
                     await asyncio.sleep(wait_time)
                 else:
                     logger.warning(f"Timeout downloading {url} after {max_retries} retries")
-                    return False
+                    return None
                     
             except aiohttp.ClientConnectorError as e:
                 # Error de conexión - posible problema de red
@@ -529,7 +685,7 @@ async def download_single_tile(session, url, output_path, max_retries=2, timeout
                     await asyncio.sleep(wait_time)
                 else:
                     logger.warning(f"Connection error for {url} after {max_retries} retries: {str(e)}")
-                    return False
+                    return None
                     
             except aiohttp.ClientError as e:
                 # Otros errores del cliente HTTP
@@ -540,11 +696,11 @@ async def download_single_tile(session, url, output_path, max_retries=2, timeout
                     await asyncio.sleep(wait_time)
                 else:
                     logger.warning(f"Failed to download {url} after {max_retries} retries: {str(e)}")
-                    return False
+                    return None
                     
     except Exception as e:
         logger.warning(f"Unexpected error downloading tile {url}: {str(e)}")
-        return False
+        return None
 
 def calculate_tiles_for_bounds(bounds, zoom_levels):
     """Calculate the tiles needed to cover the given bounds at the specified zoom levels,
@@ -821,36 +977,28 @@ def calculate_tiles_for_bounds(bounds, zoom_levels):
 async def get_mbtiles_metadata():
     """Get metadata from the MBTiles file"""
     try:
-        logger.info("[get_mbtiles_metadata] Starting metadata request...")
-        
-        # Find the MBTiles file
-        mbtiles_path = find_mbtiles_file()
-        logger.info(f"[get_mbtiles_metadata] Found MBTiles file: {mbtiles_path}")
-        if not mbtiles_path:
-            logger.error("[get_mbtiles_metadata] No MBTiles file found")
-            raise HTTPException(status_code=404, detail="No MBTiles file found")
-        
-        logger.info(f"[get_mbtiles_metadata] Found MBTiles file: {mbtiles_path}")
+        service = _get_mbtiles_service()
+        if not service:
+            raise HTTPException(status_code=500, detail="Configuration not initialized")
         
-        # Read metadata from MBTiles
-        logger.info("[get_mbtiles_metadata] Creating MBTilesReader...")
+        # Metadatos combinados de todos los archivos del mosaico
         try:
-            with MBTilesReader(mbtiles_path) as reader:
-                logger.info("[get_mbtiles_metadata] MBTilesReader initialized successfully")
-                metadata = reader.get_metadata()
-                logger.info(f"[get_mbtiles_metadata] Metadata retrieved successfully: {metadata}")
-                
-                return {
-                    "status": "success",
-                    "file_path": mbtiles_path,
-                    "metadata": metadata
-                }
+            metadata = await asyncio.to_thread(service.get_metadata)
         except sqlite3.Error as db_error:
             logger.error(f"[get_mbtiles_metadata] SQLite error: {str(db_error)}", exc_info=True)
             raise HTTPException(status_code=500, detail=f"Database error: {str(db_error)}")
-        except Exception as reader_error:
-            logger.error(f"[get_mbtiles_metadata] MBTilesReader error: {str(reader_error)}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"Reader error: {str(reader_error)}")
+        if metadata is None:
+            logger.error("[get_mbtiles_metadata] No MBTiles file found")
+            raise HTTPException(status_code=404, detail="No MBTiles file found")
+        
+        files = service.get_stats()["files"]
+        return {
+            "status": "success",
+            "file_path": files[0] if files else None,
+            "files": files,
+            "metadata": metadata,
+            "tile_service": service.get_stats()
+        }
     
     except HTTPException:
         raise
@@ -917,6 +1065,35 @@ async def get_mbtiles_list():
         logger.error(f"[get_mbtiles_list] Error listing MBTiles files: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error listing MBTiles files: {str(e)}")
 
+@router.get("/mbtiles/info")
+async def get_mbtiles_info():
+    """Get detailed information about available tiles in the MBTiles files"""
+    try:
+        service = _get_mbtiles_service()
+        if not service:
+            raise HTTPException(status_code=500, detail="Configuration not initialized")
+        
+        # Cobertura por archivo desde el índice persistido (sin recorrer las tablas)
+        files = await asyncio.to_thread(service.get_files)
+        if not files:
+            logger.error("[get_mbtiles_info] No MBTiles file found")
+            raise HTTPException(status_code=404, detail="No MBTiles file found")
+        
+        metadata = await asyncio.to_thread(service.get_metadata)
+        return {
+            "status": "success",
+            "file_path": files[0]["path"],
+            "metadata": metadata,
+            "files": files,
+            "tile_service": service.get_stats()
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"[get_mbtiles_info] Error getting MBTiles info: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error getting info: {str(e)}")
+
 @router.get("/mbtiles/{filename}")
 async def serve_mbtiles_file(filename: str):
     """Serve MBTiles file for frontend consumption"""
@@ -1097,171 +1274,64 @@ class MBTilesReader:
             logger.error(f"[MBTilesReader.get_available_tiles_info] Error: {str(e)}", exc_info=True)
             return {}
 
+def _get_mbtiles_service() -> Optional[MBTilesTileService]:
+    global _mbtiles_service
+    if _mbtiles_service is None and config:
+        _mbtiles_service = MBTilesTileService(os.path.join(config.data_path, OFFLINE_MAPS_DIR))
+    return _mbtiles_service
+
+def init_mbtiles_service():
+    """Create the tile service and build the mosaic coverage index in the background"""
+    service = _get_mbtiles_service()
+    if service:
+        threading.Thread(target=service.active_sources, name="MBTilesCoverageIndex", daemon=True).start()
+
 def find_mbtiles_file() -> Optional[str]:
-    """Find the first available MBTiles file"""
-    try:
-        logger.info("[find_mbtiles_file] Starting search for MBTiles files...")
-        
-        if not config:
-            logger.error("[find_mbtiles_file] Config not initialized!")
-            return None
-        
-        logger.info(f"[find_mbtiles_file] Config data_path: {config.data_path}")
-        offline_maps_path = os.path.join(config.data_path, OFFLINE_MAPS_DIR)
-        logger.info(f"[find_mbtiles_file] Looking in directory: {offline_maps_path}")
-        
-        if not os.path.exists(offline_maps_path):
-            logger.error(f"[find_mbtiles_file] Directory does not exist: {offline_maps_path}")
-            return None
-        
-        files_found = os.listdir(offline_maps_path)
-        logger.info(f"[find_mbtiles_file] Files in directory: {files_found}")
-        
-        for filename in files_found:
-            logger.info(f"[find_mbtiles_file] Checking file: {filename}")
-            if filename.endswith('.mbtiles'):
-                file_path = os.path.join(offline_maps_path, filename)
-                logger.info(f"[find_mbtiles_file] Found MBTiles file: {file_path}")
-                if os.path.exists(file_path):
-                    file_size = os.path.getsize(file_path)
-                    logger.info(f"[find_mbtiles_file] File exists and size is: {file_size} bytes")
-                    return file_path
-                else:
-                    logger.warning(f"[find_mbtiles_file] File path exists in listing but not accessible: {file_path}")
-        
-        logger.warning("[find_mbtiles_file] No MBTiles files found in directory")
-        return None
-    except Exception as e:
-        logger.error(f"[find_mbtiles_file] Error finding MBTiles file: {str(e)}", exc_info=True)
+    """First MBTiles file of the mosaic (resolved by the tile service and re-checked on changes)"""
+    service = _get_mbtiles_service()
+    if not service:
+        logger.error("[find_mbtiles_file] Config not initialized!")
         return None
+    return service.active_path()
 
 @router.get("/mbtiles/tile/{z}/{x}/{y}")
-async def get_mbtiles_tile(z: int, x: int, y: int):
+async def get_mbtiles_tile(z: int, x: int, y: int, request: Request):
     """Get a tile from MBTiles in XYZ format for Leaflet"""
-    try:
-        logger.info(f"[get_mbtiles_tile] Requested tile: z={z}, x={x}, y={y}")
-        
-        # Find the MBTiles file
-        mbtiles_path = find_mbtiles_file()
-        if not mbtiles_path:
-            logger.error("[get_mbtiles_tile] No MBTiles file found")
-            raise HTTPException(status_code=404, detail="No MBTiles file found")
-        
-        logger.info(f"[get_mbtiles_tile] Using MBTiles file: {mbtiles_path}")
-        
-        # Read the tile from MBTiles
-        logger.info(f"[get_mbtiles_tile] Creating MBTilesReader for file: {mbtiles_path}")
+    service = _get_mbtiles_service()
+    if not service:
+        raise HTTPException(status_code=500, detail="Configuration not initialized")
+    
+    # Las teselas calientes salen de la LRU sin pasar por el pool de hilos
+    found, tile = service.cached_tile(z, x, y)
+    if not found:
         try:
-            with MBTilesReader(mbtiles_path) as reader:
-                logger.info(f"[get_mbtiles_tile] MBTilesReader initialized successfully")
-                tile_data = reader.get_tile(z, x, y)
-                
-                if tile_data is None:
-                    # Get some context about what tiles are available near this coordinate
-                    cursor = reader._conn.cursor()
-                    
-                    # Check if any tiles exist at this zoom level
-                    cursor.execute("SELECT COUNT(*) FROM tiles WHERE zoom_level = ?", (z,))
-                    tiles_at_zoom = cursor.fetchone()[0]
-                    
-                    # Check what zoom levels are available
-                    cursor.execute("SELECT DISTINCT zoom_level FROM tiles ORDER BY zoom_level")
-                    available_zooms = [row[0] for row in cursor.fetchall()]
-                    
-                    # Check bounds at this zoom level
-                    cursor.execute("""
-                        SELECT MIN(tile_column), MAX(tile_column), MIN(tile_row), MAX(tile_row) 
-                        FROM tiles WHERE zoom_level = ?
-                    """, (z,))
-                    bounds_result = cursor.fetchone()
-                    
-                    tms_y = (2 ** z) - 1 - y  # Convert to TMS for logging
-                    
-                    logger.warning(f"[get_mbtiles_tile] Tile not found: z={z}, x={x}, y={y} (TMS: z={z}, x={x}, tms_y={tms_y})")
-                    logger.info(f"[get_mbtiles_tile] Available zoom levels: {available_zooms}")
-                    logger.info(f"[get_mbtiles_tile] Tiles at zoom {z}: {tiles_at_zoom}")
-                    
-                    if bounds_result and bounds_result[0] is not None:
-                        min_x, max_x, min_y, max_y = bounds_result
-                        logger.info(f"[get_mbtiles_tile] Bounds at zoom {z}: x=[{min_x}-{max_x}], tms_y=[{min_y}-{max_y}]")
-                        
-                        # Check if requested coordinates are outside bounds
-                        if x < min_x or x > max_x:
-                            logger.warning(f"[get_mbtiles_tile] Requested x={x} is outside bounds [{min_x}-{max_x}]")
-                        if tms_y < min_y or tms_y > max_y:
-                            logger.warning(f"[get_mbtiles_tile] Requested tms_y={tms_y} is outside bounds [{min_y}-{max_y}]")
-                    
-                    raise HTTPException(status_code=404, detail=f"Tile not found at z={z}, x={x}, y={y}")
-                
-                logger.info(f"[get_mbtiles_tile] Found tile data, size: {len(tile_data)} bytes")
-                
-                # Determine content type based on the tile data
-                if tile_data.startswith(b'\x89PNG'):
-                    content_type = "image/png"
-                elif tile_data.startswith(b'\xff\xd8\xff'):
-                    content_type = "image/jpeg"
-                elif tile_data.startswith(b'RIFF') and b'WEBP' in tile_data[:12]:
-                    content_type = "image/webp"
-                else:
-                    content_type = "image/png"  # Default fallback
-                
-                logger.info(f"[get_mbtiles_tile] Returning tile with content type: {content_type}")
-                
-                return Response(
-                    content=tile_data,
-                    media_type=content_type,
-                    headers={
-                        "Cache-Control": "public, max-age=86400",  # Cache for 24 hours
-                        "Access-Control-Allow-Origin": "*"
-                    }
-                )
+            tile = await asyncio.to_thread(service.get_tile, z, x, y)
         except sqlite3.Error as db_error:
-            logger.error(f"[get_mbtiles_tile] SQLite error: {str(db_error)}", exc_info=True)
+            logger.error(f"[get_mbtiles_tile] SQLite error for z={z}, x={x}, y={y}: {str(db_error)}")
             raise HTTPException(status_code=500, detail=f"Database error: {str(db_error)}")
-        except Exception as reader_error:
-            logger.error(f"[get_mbtiles_tile] MBTilesReader error: {str(reader_error)}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"Reader error: {str(reader_error)}")
     
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"[get_mbtiles_tile] Error serving MBTiles tile z={z}, x={x}, y={y}: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Error serving tile: {str(e)}")
-
-@router.get("/mbtiles/info")
-async def get_mbtiles_info():
-    """Get detailed information about available tiles in the MBTiles file"""
-    try:
-        logger.info("[get_mbtiles_info] Starting MBTiles info request...")
-        
-        # Find the MBTiles file
-        mbtiles_path = find_mbtiles_file()
-        if not mbtiles_path:
-            logger.error("[get_mbtiles_info] No MBTiles file found")
+    if tile is None:
+        if not service.get_stats()["files"]:
             raise HTTPException(status_code=404, detail="No MBTiles file found")
-        
-        logger.info(f"[get_mbtiles_info] Found MBTiles file: {mbtiles_path}")
-        
-        # Read info from MBTiles
-        try:
-            with MBTilesReader(mbtiles_path) as reader:
-                logger.info("[get_mbtiles_info] MBTilesReader initialized successfully")
-                metadata = reader.get_metadata()
-                tiles_info = reader.get_available_tiles_info()
-                
-                return {
-                    "status": "success",
-                    "file_path": mbtiles_path,
-                    "metadata": metadata,
-                    "tiles_info": tiles_info
-                }
-        except Exception as reader_error:
-            logger.error(f"[get_mbtiles_info] MBTilesReader error: {str(reader_error)}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"Reader error: {str(reader_error)}")
+        logger.debug(f"[get_mbtiles_tile] Tile not found: z={z}, x={x}, y={y}")
+        raise HTTPException(status_code=404, detail=f"Tile not found at z={z}, x={x}, y={y}")
     
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"[get_mbtiles_info] Error getting MBTiles info: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Error getting info: {str(e)}")
-
+    headers = {
+        "Cache-Control": "public, max-age=86400",  # Cache for 24 hours
+        "Access-Control-Allow-Origin": "*",
+        "ETag": tile.etag
+    }
+    if tile.encoding:
+        headers["Vary"] = "Accept-Encoding"
+    
+    if tile.etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    
+    body = tile.data
+    if tile.encoding == "gzip":
+        if "gzip" in request.headers.get("accept-encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+        else:
+            body = tile.decoded()
+    
+    return Response(content=body, media_type=tile.content_type, headers=headers)
@@ -19,11 +19,15 @@ import zipfile
 import io
 import math
 import sys
+import time
 
 # Importar módulos modularizados
 from .organic_maps_utils import server_connection
 from .organic_maps_utils import region_search
 from .organic_maps_utils import download
+from .organic_maps_utils.trip_registry import TRIP_REGIONS_FILE, TileLatencyStats, TripRegionRegistry
+from utils.mwm_renderer import MWMTileRenderer, PRIORITY_VIEWPORT, RendererBusy, render_vector_tile
+from utils.tile_planner import plan_corridor, route_points
 
 # Define router
 router = APIRouter()
@@ -44,6 +48,18 @@ available_regions = None
 # Store download tasks
 active_downloads = {}
 
+# Servicio de renderizado de teselas MWM (pool de procesos), creado al primer uso
+_mwm_renderer: Optional[MWMTileRenderer] = None
+
+# Precalentamientos del corredor en curso, por viaje
+_warm_tasks: Dict[str, asyncio.Task] = {}
+
+# Metadatos de región de los viajes (trip_regions.json) en memoria, creado al primer uso
+_trip_registry: Optional[TripRegionRegistry] = None
+
+# Latencia de las peticiones de teselas MWM, por tipo de respuesta
+_tile_latency = TileLatencyStats()
+
 # Inicializar variables en módulos
 def init_modules(app_config):
     """Inicializa las variables de configuración en los módulos"""
@@ -54,8 +70,11 @@ def init_modules(app_config):
     server_connection.config = app_config
     server_connection.ORGANIC_MAPS_DIR = ORGANIC_MAPS_DIR
     region_search.config = app_config
+    region_search.ORGANIC_MAPS_DIR = ORGANIC_MAPS_DIR
     download.config = app_config
     download.ORGANIC_MAPS_DIR = ORGANIC_MAPS_DIR
+    if _on_region_downloaded not in download.download_listeners:
+        download.download_listeners.append(_on_region_downloaded)
     
     # Inicializar la URL base en el módulo de conexión
     server_connection.init_urls()
@@ -284,13 +303,14 @@ async def get_regions_for_trip(request: OrganicTripRequest):
         trip_dir = os.path.join(config.data_path, ORGANIC_MAPS_DIR, request.trip_id)
         os.makedirs(trip_dir, exist_ok=True)
         
-        with open(os.path.join(trip_dir, "trip_regions.json"), "w") as f:
+        with open(os.path.join(trip_dir, TRIP_REGIONS_FILE), "w") as f:
             json.dump({
                 "trip_id": request.trip_id,
                 "coordinates": request.coordinates,
                 "required_regions": [r["id"] for r in required_regions],
                 "timestamp": datetime.now().isoformat()
             }, f, indent=2)
+        _get_trip_registry().invalidate(request.trip_id)
             
         return {
             "trip_id": request.trip_id,
@@ -348,7 +368,9 @@ async def download_region_mwm(region_id: str, background_tasks: BackgroundTasks)
             region_id,
             region.get("mwm_url", ""),
             mwm_file_path,
-            metadata_path
+            metadata_path,
+            expected_size=region.get("size"),
+            sha1=region.get("sha1")
         )
         
         return {
@@ -367,6 +389,18 @@ async def download_region_mwm(region_id: str, background_tasks: BackgroundTasks)
 async def check_mwm_download_status(region_id: str):
     """Check the status of an MWM download"""
     try:
+        # Descarga en curso: progreso en vivo del gestor de descargas
+        live_state = download.active_downloads.get(region_id)
+        if live_state and live_state.get("status") in ("initializing", "downloading", "finalizing"):
+            return {
+                "status": "in_progress",
+                "progress": live_state.get("progress", 0),
+                "downloaded_bytes": live_state.get("downloaded_bytes", 0),
+                "total_bytes": live_state.get("total_bytes", 0),
+                "speed_kbps": live_state.get("speed_kbps", 0),
+                "message": live_state.get("message", f"Downloading region {region_id}")
+            }
+        
         metadata_path = os.path.join(config.data_path, ORGANIC_MAPS_DIR, region_id, "metadata.json")
         
         if not os.path.exists(metadata_path):
@@ -390,51 +424,58 @@ async def check_mwm_download_status(region_id: str):
         logger.error(f"Error checking download status for region {region_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error checking download status: {str(e)}")
 
+@router.get("/download-queue")
+async def get_download_queue():
+    """Persistent MWM download queue with the progress of each job"""
+    manager = download.get_download_manager()
+    jobs = await asyncio.to_thread(manager.store.list)
+    return {
+        "downloads": [manager.progress(job.job_id) for job in jobs],
+        "stats": manager.get_stats()
+    }
+
 @router.get("/tile/{trip_id}/{z}/{x}/{y}")
 async def get_mwm_tile(trip_id: str, z: int, x: int, y: int):
     """Get a map tile rendered from MWM data for a trip"""
+    started = time.perf_counter()
     try:
-        # Check if we have trip regions info
-        trip_regions_path = os.path.join(config.data_path, ORGANIC_MAPS_DIR, trip_id, "trip_regions.json")
-        
-        if not os.path.exists(trip_regions_path):
+        # Metadatos del viaje desde el registro en memoria (revalidado por mtime)
+        trip = _get_trip_registry().get(trip_id)
+        if trip is None:
             raise HTTPException(status_code=404, detail=f"No MWM data found for trip {trip_id}")
         
-        # Load trip regions
-        with open(trip_regions_path, "r") as f:
-            trip_data = json.load(f)
-        
-        required_regions = trip_data.get("required_regions", [])
+        # Camino rápido: tesela ya en la caché de disco (Organic Maps, no las teselas OSM de offline_maps)
+        tile_path, stat_result = trip.cached_tile(z, x, y)
+        if stat_result is not None:
+            _tile_latency.record("hit", time.perf_counter() - started)
+            return FileResponse(tile_path, media_type="image/png", stat_result=stat_result)
         
-        if not required_regions:
+        if not trip.required_regions:
             raise HTTPException(status_code=404, detail=f"No regions found for trip {trip_id}")
         
-        # Check if we have generated Organic Maps tiles directory (not to be confused with standard OSM tiles in offline_maps)
-        tiles_dir = os.path.join(config.data_path, ORGANIC_MAPS_DIR, trip_id, "tiles")
-        
-        # Check if the MWM-generated tile exists in our cache
-        tile_path = os.path.join(tiles_dir, str(z), str(x), f"{y}.png")
-        
-        if os.path.exists(tile_path):
-            return FileResponse(tile_path, media_type="image/png")
-        
         # If the tile doesn't exist, we need to generate it from the MWM file (landmarks, POIs)
-        os.makedirs(os.path.dirname(tile_path), exist_ok=True)
-        
-        # Try to render the tile from the MWM file
         try:
-            tile_generated = await process_and_render_mwm_tile(tile_path, z, x, y, trip_id, required_regions)
+            tile_generated = await process_and_render_mwm_tile(tile_path, z, x, y, trip_id, trip.required_regions,
+                                                               mwm_paths=trip.mwm_paths)
             
             # If the tile was generated successfully, return it
             if tile_generated:
-                return FileResponse(tile_path, media_type="image/png")
+                stat_result = trip.remember(z, x, y)
+                _tile_latency.record("render", time.perf_counter() - started)
+                return FileResponse(tile_path, media_type="image/png", stat_result=stat_result)
+        except RendererBusy:
+            # Cola llena: no guardar un placeholder, el cliente reintentará
+            _tile_latency.record("busy", time.perf_counter() - started)
+            raise HTTPException(status_code=503, detail="Tile renderer busy", headers={"Retry-After": "1"})
         except Exception as e:
             logger.error(f"Error processing MWM: {str(e)}")
             # Continue to generate placeholder if MWM processing fails
         
         # If we couldn't generate the tile from MWM, create a placeholder
         await generate_placeholder_tile(tile_path, z, x, y, trip_id)
-        return FileResponse(tile_path, media_type="image/png")
+        stat_result = trip.remember(z, x, y)
+        _tile_latency.record("placeholder", time.perf_counter() - started)
+        return FileResponse(tile_path, media_type="image/png", stat_result=stat_result)
         
     except Exception as e:
         if isinstance(e, HTTPException):
@@ -442,6 +483,43 @@ async def get_mwm_tile(trip_id: str, z: int, x: int, y: int):
         logger.error(f"Error getting MWM tile {z}/{x}/{y} for trip {trip_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error getting tile: {str(e)}")
 
+@router.post("/warm/{trip_id}")
+async def warm_trip_tiles(trip_id: str, zoom_levels: List[int] = Query([10, 12, 14])):
+    """Pre-render in the background the MWM tiles along the trip route (lowest render priority)"""
+    trip = _get_trip_registry().get(trip_id)
+    if trip is None:
+        raise HTTPException(status_code=404, detail=f"No MWM data found for trip {trip_id}")
+    
+    points = route_points(trip.coordinates)
+    mwm_paths = trip.mwm_paths
+    if not points or not mwm_paths:
+        raise HTTPException(status_code=404, detail=f"No route or MWM files available for trip {trip_id}")
+    
+    task = _warm_tasks.get(trip_id)
+    if task is not None and not task.done():
+        return {"status": "already_running", "trip_id": trip_id}
+    
+    zooms = sorted({z for z in zoom_levels if 8 <= z <= 16})
+    if not zooms:
+        raise HTTPException(status_code=400, detail="Invalid zoom levels. Must be between 8 and 16")
+    plan = await asyncio.to_thread(plan_corridor, points, zooms)
+    jobs = [(z, x, y, trip.tile_path(z, x, y)) for z, tiles in plan.items() for x, y in sorted(tiles)]
+    
+    def warm_done(done_task: asyncio.Task):
+        _warm_tasks.pop(trip_id, None)
+        if not done_task.cancelled() and done_task.exception() is None:
+            logger.info(f"Warm render for trip {trip_id} finished: {done_task.result()} tiles rendered")
+    
+    task = asyncio.ensure_future(_get_mwm_renderer().warm(mwm_paths, jobs))
+    _warm_tasks[trip_id] = task
+    task.add_done_callback(warm_done)
+    return {"status": "started", "trip_id": trip_id, "tiles": len(jobs), "zoom_levels": zooms}
+
+@router.get("/renderer/stats")
+async def get_renderer_stats():
+    """Statistics of the MWM tile renderer"""
+    return {"status": "success", "renderer": _get_mwm_renderer().get_stats(), "warming": sorted(_warm_tasks)}
+
 async def generate_placeholder_tile(tile_path: str, z: int, x: int, y: int, trip_id: str):
     """Generate a placeholder tile for demonstration purposes"""
     try:
@@ -480,192 +558,60 @@ async def generate_placeholder_tile(tile_path: str, z: int, x: int, y: int, trip
         logger.error(f"Error generating placeholder tile: {str(e)}")
         raise
 
-async def process_and_render_mwm_tile(tile_path: str, z: int, x: int, y: int, trip_id: str, region_ids: list):
+def _get_mwm_renderer() -> MWMTileRenderer:
+    global _mwm_renderer
+    if _mwm_renderer is None:
+        _mwm_renderer = MWMTileRenderer(mwm_tool=os.path.join(config.data_path, "tools", "mwm_tool"))
+    return _mwm_renderer
+
+async def close_mwm_renderer():
+    if _mwm_renderer is not None:
+        await _mwm_renderer.close()
+
+def _get_trip_registry() -> TripRegionRegistry:
+    global _trip_registry
+    if _trip_registry is None:
+        _trip_registry = TripRegionRegistry(os.path.join(config.data_path, ORGANIC_MAPS_DIR))
+    return _trip_registry
+
+def _on_region_downloaded(region_id: str):
+    # Los viajes que esperaban esta región vuelven a buscar sus archivos MWM
+    if _trip_registry is not None:
+        _trip_registry.invalidate_region(region_id)
+
+def _region_mwm_paths(region_ids: list) -> List[str]:
+    paths = []
+    for region_id in region_ids:
+        mwm_file_path = os.path.join(config.data_path, ORGANIC_MAPS_DIR, region_id, f"{region_id}.mwm")
+        if os.path.exists(mwm_file_path):
+            paths.append(mwm_file_path)
+        else:
+            logger.warning(f"MWM file not found for region {region_id}")
+    return paths
+
+async def process_and_render_mwm_tile(tile_path: str, z: int, x: int, y: int, trip_id: str, region_ids: list,
+                                      priority: int = PRIORITY_VIEWPORT,
+                                      mwm_paths: Optional[List[str]] = None) -> bool:
     """
-    Process MWM files and render a tile for the specified coordinates.
+    Render a tile from the trip MWM files with the shared renderer service.
     
     Args:
         tile_path: Path where the generated tile should be saved
         z, x, y: Tile coordinates
         trip_id: ID of the trip
         region_ids: List of region IDs to check for the tile
+        priority: Queue priority (viewport tiles before background warming)
+        mwm_paths: MWM files of the regions, if already resolved (trip registry)
         
     Returns:
         bool: True if the tile was generated successfully
     """
-    try:
-        # Import required libraries for MWM processing
-        try:
-            import mapbox_vector_tile
-        except ImportError:
-            logger.error("mapbox_vector_tile not installed. Please install with 'pip install mapbox-vector-tile'")
-            return False
-            
-        from PIL import Image, ImageDraw
-        
-        # Calculate geographic bounds for this tile
-        n = 2.0 ** z
-        lon_min = x / n * 360.0 - 180.0
-        lat_max = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
-        lon_max = (x + 1) / n * 360.0 - 180.0
-        lat_min = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
-        
-        logger.info(f"Processing tile {z}/{x}/{y} for trip {trip_id} with bounds: {lat_min},{lon_min} - {lat_max},{lon_max}")
-        
-        # Check each region for data covering this tile
-        for region_id in region_ids:
-            mwm_file_path = os.path.join(config.data_path, ORGANIC_MAPS_DIR, region_id, f"{region_id}.mwm")
-            
-            if not os.path.exists(mwm_file_path):
-                logger.warning(f"MWM file not found for region {region_id}")
-                continue
-            
-            logger.info(f"Checking MWM file for region {region_id}: {mwm_file_path}")
-            
-            try:
-                # Attempt to extract vector tile data from the MWM file
-                # This is where we would integrate with a library that can read MWM format
-                
-                # For now, we'll implement a basic solution using the mwm_parser library if available
-                try:
-                    # Try to import the mwm parser library if it's available
-                    sys.path.append(os.path.join(config.data_path, "tools"))
-                    from mwm_extractor import MWMReader
-                    
-                    # Initialize parser with the MWM file
-                    parser = MWMReader(mwm_file_path)
-                    
-                    # Get vector tile data for the requested coordinates
-                    vector_data = parser.extract_tile(z, x, y)
-                    
-                    if vector_data:
-                        logger.info(f"Successfully extracted vector data from MWM for {z}/{x}/{y}")
-                        
-                        # Render the vector data to an image
-                        img = render_vector_tile(vector_data, 256, 256)
-                        
-                        # Save the generated image
-                        img.save(tile_path)
-                        return True
-                except ImportError:
-                    logger.warning("mwm_extractor library not available, trying alternative method")
-                except Exception as e:
-                    logger.error(f"Error using mwm_extractor: {str(e)}")
-                
-                # Alternative approach: use binary data extraction
-                # This is a simplified approach - in a real implementation, 
-                # you would need to understand the MWM file format in detail
-                
-                # Execute an external tool if available
-                mwm_tool = os.path.join(config.data_path, "tools", "mwm_tool")
-                if os.path.exists(mwm_tool):
-                    cmd = [
-                        mwm_tool, 
-                        "extract",
-                        "--input", mwm_file_path,
-                        "--z", str(z),
-                        "--x", str(x),
-                        "--y", str(y),
-                        "--output", tile_path
-                    ]
-                    
-                    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                    stdout, stderr = process.communicate()
-                    
-                    if process.returncode == 0 and os.path.exists(tile_path):
-                        logger.info(f"Successfully generated tile using mwm_tool for {z}/{x}/{y}")
-                        return True
-                    else:
-                        logger.error(f"mwm_tool failed: {stderr.decode('utf-8')}")
-                
-            except Exception as e:
-                logger.error(f"Error processing MWM file {region_id}: {str(e)}")
-                continue
-        
-        # No regions had data for this tile
-        logger.warning(f"No data found in any region for tile {z}/{x}/{y}")
-        return False
-        
-    except Exception as e:
-        logger.error(f"Error in process_and_render_mwm_tile: {str(e)}")
+    if mwm_paths is None:
+        mwm_paths = _region_mwm_paths(region_ids)
+    if not mwm_paths:
         return False
-
-def render_vector_tile(vector_data, width=256, height=256):
-    """
-    Render vector tile data to a PNG image
-    
-    Args:
-        vector_data: Vector tile data in MVT format
-        width, height: Dimensions of the output image
-        
-    Returns:
-        PIL.Image: The rendered tile
-    """
-    try:
-        import mapbox_vector_tile
-        from PIL import Image, ImageDraw
-        
-        # Create a blank image
-        img = Image.new('RGBA', (width, height), (255, 255, 255, 0))
-        draw = ImageDraw.Draw(img)
-        
-        try:
-            # Parse MVT data
-            tile_data = mapbox_vector_tile.decode(vector_data)
-            
-            # Process each layer in the vector tile
-            for layer_name, layer in tile_data.items():
-                # Choose color based on layer type
-                if layer_name == 'road' or layer_name == 'roads':
-                    color = (120, 120, 120, 255)  # Gray for roads
-                elif layer_name == 'building' or layer_name == 'buildings':
-                    color = (200, 200, 200, 255)  # Light gray for buildings
-                elif layer_name == 'water':
-                    color = (100, 149, 237, 255)  # Cornflower blue for water
-                elif layer_name == 'landuse':
-                    color = (173, 216, 140, 255)  # Light green for landuse
-                else:
-                    color = (0, 0, 0, 255)  # Black for other features
-                
-                # Draw each feature in the layer
-                for feature in layer['features']:
-                    geometry_type = feature['type']
-                    geometry = feature['geometry']
-                    
-                    if geometry_type == 'LineString':
-                        for line in geometry:
-                            points = [(p[0], p[1]) for p in line]
-                            draw.line(points, fill=color, width=1)
-                    elif geometry_type == 'Polygon':
-                        for polygon in geometry:
-                            points = [(p[0], p[1]) for p in polygon]
-                            draw.polygon(points, outline=color, fill=color[:3] + (100,))
-                    elif geometry_type == 'Point':
-                        for point in geometry:
-                            draw.ellipse((point[0]-2, point[1]-2, point[0]+2, point[1]+2), fill=color)
-        
-        except Exception as e:
-            logger.error(f"Error rendering vector tile: {str(e)}")
-            # Draw a message in the image indicating an error
-            draw.text((10, 10), "Error rendering tile", fill=(255, 0, 0, 255))
-        
-        return img
-    except ImportError as e:
-        logger.error(f"Required module not found: {str(e)}")
-        # Create a simple error image
-        from PIL import Image, ImageDraw
-        img = Image.new('RGB', (width, height), (255, 200, 200))
-        draw = ImageDraw.Draw(img)
-        draw.text((10, 10), f"Module error: {str(e)}", fill=(255, 0, 0))
-        return img
-    except Exception as e:
-        logger.error(f"Unexpected error in render_vector_tile: {str(e)}")
-        # Create a simple error image
-        from PIL import Image, ImageDraw
-        img = Image.new('RGB', (width, height), (255, 200, 200))
-        draw = ImageDraw.Draw(img)
-        draw.text((10, 10), "Error", fill=(255, 0, 0))
-        return img
+    data = await _get_mwm_renderer().render(mwm_paths, z, x, y, tile_path, priority=priority)
+    return data is not None
 
 # Después de la definición de ORGANIC_MAPS_BASE_URL, añadimos:
 
@@ -882,7 +828,7 @@ async def retry_failed_download(region_id: str, background_tasks: BackgroundTask
             metadata = json.load(f)
         
         # Verificar si es una descarga fallida
-        if metadata.get("status") != "failed":
+        if metadata.get("status") not in ("failed", "error"):
             return {
                 "status": "no_retry_needed",
                 "message": f"La descarga de {region_id} no necesita reintento (estado: {metadata.get('status')})"
@@ -892,13 +838,7 @@ async def retry_failed_download(region_id: str, background_tasks: BackgroundTask
         output_dir = os.path.join(config.data_path, ORGANIC_MAPS_DIR, region_id)
         output_path = os.path.join(output_dir, f"{region_id}.mwm")
         
-        # Eliminar archivo parcial si existe
-        if os.path.exists(output_path):
-            try:
-                os.remove(output_path)
-                logger.info(f"Eliminado archivo parcial para {region_id}")
-            except Exception as e:
-                logger.warning(f"No se pudo eliminar archivo parcial: {str(e)}")
+        # El archivo parcial se conserva: el gestor de descargas continúa desde el último byte guardado
         
         # Obtener URL para la descarga
         mwm_url = metadata.get("mwm_url", "")
@@ -918,7 +858,7 @@ async def retry_failed_download(region_id: str, background_tasks: BackgroundTask
         metadata["status"] = "retrying"
         metadata["retry_started"] = datetime.now().isoformat()
         metadata["progress"] = 0
-        metadata["message"] = f"Reiniciando descarga para {region_id}"
+        metadata["message"] = f"Reanudando descarga para {region_id}"
         
         with open(metadata_path, "w") as f:
             json.dump(metadata, f, indent=2)
@@ -977,6 +917,32 @@ async def get_country_maps(country_code: str):
         logger.error(f"Error al obtener mapas de país {country_code}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error al obtener mapas de país: {str(e)}")
 
+@router.post("/route-regions")
+async def get_route_regions(request: CountryMapsForRouteRequest):
+    """
+    Exact MWM regions crossed by a route, from the region border index.
+    Cheap enough to be called on every waypoint edit of the trip planner (no network access).
+    """
+    if not request.coordinates:
+        raise HTTPException(status_code=400, detail="Se requieren coordenadas")
+
+    region_ids = await region_search.find_region_ids_for_route(request.coordinates)
+    if region_ids is None:
+        raise HTTPException(status_code=503, detail="Region borders not available")
+
+    regions_by_id = {r["id"]: r for r in available_regions or []}
+    regions = []
+    for region_id in region_ids:
+        mwm_path = os.path.join(config.data_path, ORGANIC_MAPS_DIR, region_id, f"{region_id}.mwm")
+        region_info = regions_by_id.get(region_id, {})
+        regions.append({
+            "id": region_id,
+            "name": region_info.get("name", region_id.replace("_", " ")),
+            "size_mb": region_info.get("size_mb"),
+            "downloaded": os.path.exists(mwm_path)
+        })
+    return {"regions": regions, "count": len(regions)}
+
 @router.post("/country-maps-for-route")
 async def get_country_maps_for_route(request: CountryMapsForRouteRequest, background_tasks: BackgroundTasks):
     """
@@ -1016,7 +982,8 @@ async def get_country_maps_for_route(request: CountryMapsForRouteRequest, backgr
             raise HTTPException(status_code=404, detail=f"No se encontraron mapas para el país {country}")            # Iniciar descargas en segundo plano
         download_results = []
         for region in country_maps[:10]:  # Limitar a 10 mapas para no sobrecargar
-            result = await download.start_map_download(region["id"], region["mwm_url"], background_tasks)
+            result = await download.start_map_download(region["id"], region["mwm_url"], background_tasks,
+                                                        expected_size=region.get("size"), sha1=region.get("sha1"))
             download_results.append(result)
         
         return {
@@ -1139,6 +1106,8 @@ async def get_organic_maps_system_status():
             "total_size_mb": total_size / (1024 * 1024),
             "directory": organic_maps_dir,
             "config_path": config.data_path,
+            "tile_latency": _tile_latency.summary(),
+            "trip_registry": _get_trip_registry().get_stats(),
             "version": "2.0"
         }
     except Exception as e:
@@ -11,6 +11,9 @@ import shutil
 import time
 from datetime import datetime
 
+from utils.download_manager import (DownloadManager, STATUS_CANCELLED, STATUS_COMPLETED, STATUS_DOWNLOADING,
+                                    STATUS_FAILED, STATUS_QUEUED, STATUS_VERIFYING)
+
 # Configurar logging
 logger = logging.getLogger(__name__)
 
@@ -21,6 +24,22 @@ ORGANIC_MAPS_DIR = "organic_maps"
 # Lista de descargas activas
 active_downloads = {}
 
+# Cola persistente del gestor de descargas (dentro de ORGANIC_MAPS_DIR)
+DOWNLOAD_QUEUE_DB = "downloads.db"
+
+# Gestor de descargas reanudables, creado al primer uso
+_download_manager = None
+
+# Funciones a las que se avisa (con el region_id) cuando un archivo MWM queda en su ubicación final
+download_listeners = []
+
+def _notify_downloaded(region_id):
+    for listener in list(download_listeners):
+        try:
+            listener(region_id)
+        except Exception as e:
+            logger.warning(f"Error notificando la descarga de {region_id}: {str(e)}")
+
 async def get_available_regions():
     """
     Obtiene la lista de regiones disponibles, ya sea desde una caché o del servidor.
@@ -86,146 +105,185 @@ async def get_available_regions():
         logger.error(f"Error getting available regions: {str(e)}")
         return {"error": str(e), "regions": []}
 
-async def download_map_file(region_id, mwm_url, temp_path, metadata_path):
+async def download_map_file(region_id, mwm_url, temp_path, metadata_path, expected_size=None, sha1=None):
     """
-    Descarga un archivo de mapa específico.
+    Descarga un archivo de mapa específico a través del gestor de descargas
+    (reanudable con peticiones Range, con reintentos y verificación de tamaño/hash).
     
     Args:
         region_id: ID de la región a descargar
         mwm_url: URL del archivo .mwm
         temp_path: Ruta temporal para guardar el archivo durante la descarga
         metadata_path: Ruta para el archivo de metadatos
+        expected_size: Tamaño exacto esperado en bytes (opcional)
+        sha1: SHA-1 esperado, en hexadecimal o base64 (opcional)
         
     Returns:
         Dict con información sobre el resultado de la descarga
     """
-    global active_downloads
+    download_state = _download_state(region_id)
+    download_state.update({"status": "initializing", "message": "Iniciando descarga..."})
+    final_path = os.path.join(os.path.dirname(temp_path), f"{region_id}.mwm")
+    
+    try:
+        logger.info(f"Descargando mapa {region_id} desde {mwm_url}")
+        manager = get_download_manager()
+        manager.enqueue(region_id, mwm_url, final_path, part_path=temp_path,
+                        expected_size=expected_size, expected_sha1=sha1)
+        job = await manager.wait(region_id)
+    except Exception as e:
+        error_msg = f"Error durante la descarga: {str(e)}"
+        logger.error(error_msg)
+        
+        download_state["status"] = "error"
+        download_state["message"] = error_msg
+        
+        return {"success": False, "error": error_msg}
     
-    # Inicializar o actualizar estado de descarga
-    download_state = active_downloads.get(region_id, {
+    if job is None or job.status != STATUS_COMPLETED or download_state.get("status") != "completed":
+        error_msg = download_state.get("message") if download_state.get("status") == "error" else None
+        error_msg = error_msg or f"Descarga no completada: {job.error or job.status if job else 'desconocido'}"
+        return {"success": False, "error": error_msg}
+    
+    metadata = None
+    try:
+        with open(metadata_path, "r") as f:
+            metadata = json.load(f)
+    except Exception:
+        pass
+    
+    return {
+        "success": True,
+        "file_path": final_path,
+        "size_mb": download_state.get("size_mb", 0),
+        "metadata": metadata
+    }
+
+def _download_state(region_id):
+    """Estado de la descarga de una región que consultan los endpoints de progreso"""
+    return active_downloads.setdefault(region_id, {
         "status": "initializing",
         "progress": 0,
         "message": "Iniciando descarga...",
         "start_time": time.time(),
+        "region_id": region_id,
         "total_bytes": 0,
         "downloaded_bytes": 0,
         "speed_kbps": 0
     })
+
+# Estados del gestor de descargas -> estados que ya conocía la interfaz
+_STATUS_NAMES = {
+    STATUS_QUEUED: "initializing",
+    STATUS_DOWNLOADING: "downloading",
+    STATUS_VERIFYING: "finalizing",
+    STATUS_COMPLETED: "completed",
+    STATUS_FAILED: "error",
+    STATUS_CANCELLED: "cancelled"
+}
+
+def _on_download_update(job):
+    """Listener del gestor: progreso en active_downloads y, al terminar, metadata.json y aviso a los interesados"""
+    region_id = job.job_id
+    download_state = _download_state(region_id)
+    total = job.total_size or job.expected_size or 0
+    downloaded = job.downloaded_bytes
+    progress = min(100, int(downloaded * 100 / total)) if total else 0
+    speed_kbps = get_download_manager().progress(region_id)["speed_kbps"] if _download_manager else 0
     
-    active_downloads[region_id] = download_state
+    download_state.update({
+        "status": _STATUS_NAMES.get(job.status, job.status),
+        "progress": progress,
+        "total_bytes": total,
+        "downloaded_bytes": downloaded,
+        "speed_kbps": speed_kbps,
+        "attempts": job.attempts
+    })
     
-    try:
-        # Asegurarnos de que existe el directorio temporal
-        os.makedirs(os.path.dirname(temp_path), exist_ok=True)
-        
-        logger.info(f"Descargando mapa {region_id} desde {mwm_url}")
-        
-        # Variables para trackeo de velocidad
-        last_update_time = time.time()
-        last_bytes = 0
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.get(mwm_url, timeout=60) as response:
-                if response.status != 200:
-                    error_msg = f"Error al descargar mapa: HTTP {response.status}"
-                    logger.error(error_msg)
-                    
-                    download_state["status"] = "error"
-                    download_state["message"] = error_msg
-                    return {"success": False, "error": error_msg}
-                
-                total_size = int(response.headers.get("Content-Length", 0))
-                if total_size == 0:
-                    # Si no tenemos tamaño, usar un valor estimado
-                    total_size = 50 * 1024 * 1024  # 50MB estimado
-                
-                download_state["total_bytes"] = total_size
-                
-                with open(temp_path, "wb") as f:
-                    downloaded = 0
-                    async for chunk in response.content.iter_chunked(8192):
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        
-                        # Actualizar progreso
-                        progress = min(100, int(downloaded * 100 / total_size)) if total_size > 0 else 0
-                        download_state["downloaded_bytes"] = downloaded
-                        download_state["progress"] = progress
-                        
-                        # Actualizar velocidad cada segundo
-                        current_time = time.time()
-                        if current_time - last_update_time >= 1:
-                            # Calcular velocidad en KB/s
-                            time_diff = current_time - last_update_time
-                            byte_diff = downloaded - last_bytes
-                            speed_kbps = byte_diff / time_diff / 1024
-                            
-                            download_state["speed_kbps"] = round(speed_kbps, 2)
-                            download_state["message"] = f"Descargando... {progress}% ({round(speed_kbps, 1)} KB/s)"
-                            
-                            # Actualizar variables para la próxima medición
-                            last_update_time = current_time
-                            last_bytes = downloaded
-                
-                # Verificar si la descarga se completó
-                if os.path.getsize(temp_path) < 1024:
-                    error_msg = "El archivo descargado es demasiado pequeño, posiblemente inválido"
-                    logger.error(error_msg)
-                    
-                    download_state["status"] = "error"
-                    download_state["message"] = error_msg
-                    return {"success": False, "error": error_msg}
-                
-                # Descarga completada, actualizar metadata y mover archivo a ubicación final
-                download_state["status"] = "finalizing"
-                download_state["message"] = "Finalizando descarga..."
-                download_state["progress"] = 100
-                
-                # Crear metadata
-                map_dir = os.path.dirname(temp_path)
-                final_path = os.path.join(map_dir, f"{region_id}.mwm")
-                
-                # Mover archivo a ubicación final
-                shutil.move(temp_path, final_path)
-                
-                # Obtener tamaño real del archivo
-                file_size = os.path.getsize(final_path)
-                file_size_mb = round(file_size / (1024 * 1024), 2)
-                
-                # Guardar metadatos
-                metadata = {
-                    "id": region_id,
-                    "url": mwm_url,
-                    "download_timestamp": datetime.now().isoformat(),
-                    "file_path": final_path,
-                    "size_bytes": file_size,
-                    "size_mb": file_size_mb
-                }
-                
-                with open(metadata_path, "w") as f:
-                    json.dump(metadata, f, indent=2)
-                
-                download_state["status"] = "completed"
-                download_state["message"] = "Descarga completada"
-                
-                logger.info(f"Descarga completa: {region_id} ({file_size_mb} MB)")
-                return {
-                    "success": True,
-                    "file_path": final_path,
-                    "size_mb": file_size_mb,
-                    "metadata": metadata
-                }
-                
-    except Exception as e:
-        error_msg = f"Error durante la descarga: {str(e)}"
+    if job.status == STATUS_DOWNLOADING:
+        download_state["message"] = f"Descargando... {progress}% ({round(speed_kbps, 1)} KB/s)"
+        if job.error:
+            download_state["message"] += f" - reintento {job.attempts} tras: {job.error}"
+    elif job.status == STATUS_VERIFYING:
+        download_state["progress"] = 100
+        download_state["message"] = "Verificando y finalizando descarga..."
+    elif job.status == STATUS_FAILED:
+        download_state["message"] = f"Error durante la descarga: {job.error}"
+    elif job.status == STATUS_COMPLETED:
+        _finish_download(job, download_state)
+
+def _finish_download(job, download_state):
+    region_id = job.job_id
+    file_size = os.path.getsize(job.dest)
+    
+    # Verificar que el archivo descargado es un mapa y no una página de error
+    if file_size < 1024:
+        error_msg = "El archivo descargado es demasiado pequeño, posiblemente inválido"
         logger.error(error_msg)
-        
+        os.remove(job.dest)
         download_state["status"] = "error"
         download_state["message"] = error_msg
-        
-        return {"success": False, "error": error_msg}
+        return
+    
+    file_size_mb = round(file_size / (1024 * 1024), 2)
+    metadata_path = os.path.join(os.path.dirname(job.dest), "metadata.json")
+    metadata = {}
+    try:
+        with open(metadata_path, "r") as f:
+            metadata = json.load(f)
+    except Exception:
+        pass
+    
+    metadata.update({
+        "id": region_id,
+        "url": job.url,
+        "download_timestamp": datetime.now().isoformat(),
+        "download_completed": datetime.now().isoformat(),
+        "status": "completed",
+        "file_path": job.dest,
+        "size_bytes": file_size,
+        "size_mb": file_size_mb,
+        "sha1": job.sha1
+    })
+    metadata.pop("error", None)
+    
+    try:
+        with open(metadata_path, "w") as f:
+            json.dump(metadata, f, indent=2)
+    except Exception as e:
+        logger.error(f"Error al guardar metadata de {region_id}: {str(e)}")
+    
+    download_state["status"] = "completed"
+    download_state["progress"] = 100
+    download_state["size_mb"] = file_size_mb
+    download_state["message"] = "Descarga completada"
+    
+    logger.info(f"Descarga completa: {region_id} ({file_size_mb} MB)")
+    _notify_downloaded(region_id)
+
+def get_download_manager():
+    """Gestor de descargas compartido (cola persistente en ORGANIC_MAPS_DIR), creado al primer uso"""
+    global _download_manager
+    if _download_manager is None:
+        _download_manager = DownloadManager(
+            os.path.join(config.data_path, ORGANIC_MAPS_DIR, DOWNLOAD_QUEUE_DB),
+            rate_limit=getattr(config, "map_download_rate_kbps", 0) * 1024,
+            connections=getattr(config, "map_download_connections", 1)
+        )
+        _download_manager.listeners.append(_on_download_update)
+    return _download_manager
+
+def resume_pending_downloads():
+    """Reanuda las descargas que quedaron a medias en la ejecución anterior (llamar con el event loop en marcha)"""
+    return get_download_manager().resume_pending()
+
+async def close_download_manager():
+    global _download_manager
+    if _download_manager is not None:
+        await _download_manager.close()
+        _download_manager = None
 
-async def start_map_download(region_id, mwm_url, background_tasks=None):
+async def start_map_download(region_id, mwm_url, background_tasks=None, expected_size=None, sha1=None):
     """
     Inicia la descarga de un mapa en segundo plano.
     
@@ -233,6 +291,8 @@ async def start_map_download(region_id, mwm_url, background_tasks=None):
         region_id: ID de la región a descargar
         mwm_url: URL del archivo .mwm
         background_tasks: Gestor de tareas en segundo plano (optional)
+        expected_size: Tamaño exacto esperado en bytes (opcional)
+        sha1: SHA-1 esperado, en hexadecimal o base64 (opcional)
         
     Returns:
         Dict con información sobre el estado inicial de la descarga
@@ -240,7 +300,7 @@ async def start_map_download(region_id, mwm_url, background_tasks=None):
     global active_downloads
     
     # Comprobar si ya hay una descarga activa para esta región
-    if region_id in active_downloads and active_downloads[region_id].get("status") in ["downloading", "initializing"]:
+    if region_id in active_downloads and active_downloads[region_id].get("status") in ["downloading", "initializing", "finalizing"]:
         return {
             "status": "already_downloading",
             "message": f"Ya hay una descarga en curso para {region_id}",
@@ -313,10 +373,11 @@ async def start_map_download(region_id, mwm_url, background_tasks=None):
     # Iniciar descarga en segundo plano
     if background_tasks:
         # Si se proporcionó un objeto background_tasks, usarlo para iniciar la descarga
-        background_tasks.add_task(download_map_file, region_id, mwm_url, temp_path, metadata_path)
+        background_tasks.add_task(download_map_file, region_id, mwm_url, temp_path, metadata_path,
+                                  expected_size, sha1)
     else:
         # Caso contrario, iniciar como tarea asyncio
-        asyncio.create_task(download_map_file(region_id, mwm_url, temp_path, metadata_path))
+        asyncio.create_task(download_map_file(region_id, mwm_url, temp_path, metadata_path, expected_size, sha1))
     
     return {
         "status": "download_started",
@@ -370,7 +431,7 @@ def get_download_status(region_id):
         "message": f"No hay información de descarga para {region_id}"
     }
 
-async def download_mwm_background_task(region_id, mwm_url, file_path, metadata_path):
+async def download_mwm_background_task(region_id, mwm_url, file_path, metadata_path, expected_size=None, sha1=None):
     """
     Función para descargar un archivo MWM en segundo plano.
     Esta función es llamada desde las tareas en segundo plano.
@@ -380,6 +441,8 @@ async def download_mwm_background_task(region_id, mwm_url, file_path, metadata_p
         mwm_url: URL del archivo MWM a descargar
         file_path: Ruta donde se guardará el archivo final
         metadata_path: Ruta al archivo de metadatos para actualizarlo
+        expected_size: Tamaño exacto esperado en bytes (opcional)
+        sha1: SHA-1 esperado, en hexadecimal o base64 (opcional)
     """
     logger.info(f"Iniciando descarga en segundo plano para {region_id} desde {mwm_url}")
     
@@ -388,7 +451,7 @@ async def download_mwm_background_task(region_id, mwm_url, file_path, metadata_p
         temp_file = f"{file_path}.temp"
         
         # Iniciar descarga
-        result = await download_map_file(region_id, mwm_url, temp_file, metadata_path)
+        result = await download_map_file(region_id, mwm_url, temp_file, metadata_path, expected_size, sha1)
         
         if result.get("success", False):
             # Cargar metadata actual
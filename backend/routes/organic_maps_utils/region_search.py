@@ -2,16 +2,60 @@
 Módulo para buscar y detectar regiones de mapas basadas en coordenadas GPS.
 """
 
+import asyncio
 import logging
+import threading
 from datetime import datetime
 import sys
 import os
 
+from utils.region_index import RegionIndex
+
 # Configurar logging
 logger = logging.getLogger(__name__)
 
 # Variables globales que serán inicializadas desde el archivo principal
 config = None
+ORGANIC_MAPS_DIR = "organic_maps"
+
+# Directorio (dentro de ORGANIC_MAPS_DIR) con las fronteras .poly de las regiones
+BORDERS_DIR = "borders"
+
+# Índice de cobertura de regiones, cargado al primer uso y recargado si cambia el directorio
+_region_index = None
+_region_index_mtime = None
+_region_index_lock = threading.Lock()
+
+def get_region_index():
+    """
+    Devuelve el índice de fronteras de regiones, o None si no hay fronteras descargadas.
+    La primera llamada lee todos los .poly (segundos con el mundo entero): llamar desde un hilo.
+    """
+    global _region_index, _region_index_mtime
+    
+    borders_dir = os.path.join(config.data_path, ORGANIC_MAPS_DIR, BORDERS_DIR)
+    try:
+        mtime = os.stat(borders_dir).st_mtime_ns
+    except OSError:
+        return None
+    
+    if _region_index is None or mtime != _region_index_mtime:
+        with _region_index_lock:
+            if _region_index is None or mtime != _region_index_mtime:
+                _region_index = RegionIndex.from_directory(borders_dir)
+                _region_index_mtime = mtime
+    
+    return _region_index if len(_region_index) else None
+
+async def find_region_ids_for_route(coordinates):
+    """
+    IDs exactos de las regiones MWM que atraviesa una ruta [[lat, lon], ...], en orden de paso,
+    o None si no hay índice de fronteras.
+    """
+    index = await asyncio.to_thread(get_region_index)
+    if index is None:
+        return None
+    return await asyncio.to_thread(index.regions_for_route, coordinates)
 
 async def find_regions_for_coordinates(coordinates, all_regions, max_regions=5):
     """
@@ -20,7 +64,8 @@ async def find_regions_for_coordinates(coordinates, all_regions, max_regions=5):
     Args:
         coordinates: Lista de coordenadas [lat, lon]
         all_regions: Lista de todas las regiones disponibles
-        max_regions: Número máximo de regiones a devolver
+        max_regions: Número máximo de regiones a devolver (solo en la búsqueda heurística;
+            con el índice de fronteras se devuelven todas las que cruza la ruta)
         
     Returns:
         Lista de regiones que cubren las coordenadas
@@ -33,6 +78,26 @@ async def find_regions_for_coordinates(coordinates, all_regions, max_regions=5):
         logger.warning("No hay regiones disponibles para buscar")
         return []
     
+    # Con las fronteras de las regiones la respuesta es exacta (todas las que cruza la ruta)
+    try:
+        region_ids = await find_region_ids_for_route(coordinates)
+    except Exception as e:
+        logger.warning(f"Error consultando el índice de fronteras: {str(e)}")
+        region_ids = None
+    
+    if region_ids:
+        regions_by_id = {r["id"]: r for r in all_regions}
+        missing = [region_id for region_id in region_ids if region_id not in regions_by_id]
+        if missing:
+            logger.warning(f"Regiones de la ruta sin archivo MWM en el servidor: {', '.join(missing)}")
+        matched_regions = [regions_by_id[region_id] for region_id in region_ids if region_id in regions_by_id]
+        if matched_regions:
+            logger.info(f"Índice de fronteras: {len(matched_regions)} regiones para la ruta: "
+                        f"{', '.join(r['id'] for r in matched_regions)}")
+            return matched_regions
+    elif region_ids is None:
+        logger.info("Sin fronteras de regiones descargadas, usando búsqueda heurística")
+    
     # Extraer latitudes y longitudes
     lats = [coord[0] for coord in coordinates]
     lons = [coord[1] for coord in coordinates]
@@ -80,6 +80,41 @@ async def check_mirror_availability():
     logger.error("Ningún espejo está disponible. Usando URL por defecto.")
     return f"{ORGANIC_MAPS_URLS[0]}/{MAP_VERSIONS[0]}"
 
+def parse_countries_txt(data):
+    """
+    Extrae {region_id: (tamaño en bytes, sha1 en base64)} del árbol de countries.txt
+    de Organic Maps (nodos con "id", "s", "sha1_base64" e hijos en "g").
+    """
+    checksums = {}
+    pending = [data] if isinstance(data, dict) else []
+    while pending:
+        node = pending.pop()
+        if node.get("s") and node.get("id"):
+            checksums[node["id"].replace(' ', '_')] = (int(node["s"]), node.get("sha1_base64"))
+        pending.extend(child for child in node.get("g") or [] if isinstance(child, dict))
+    return checksums
+
+async def add_file_checksums(session, working_url, files):
+    """
+    Añade "size" (bytes) y "sha1" a las regiones de ``files`` que aparecen en el
+    countries.txt del espejo. Si no está disponible, las descargas solo comprueban
+    el tamaño que anuncia el servidor.
+    """
+    try:
+        async with session.get(f"{working_url}/countries.txt", timeout=15) as response:
+            if response.status != 200:
+                logger.info(f"countries.txt no disponible ({response.status}): sin tamaños ni SHA-1 exactos")
+                return
+            checksums = parse_countries_txt(json.loads(await response.text(encoding='utf-8', errors='ignore')))
+    except Exception as e:
+        logger.warning(f"Error obteniendo countries.txt: {str(e)}")
+        return
+
+    for file_info in files:
+        if file_info["id"] in checksums:
+            file_info["size"], file_info["sha1"] = checksums[file_info["id"]]
+    logger.info(f"Tamaño y SHA-1 conocidos para {sum(1 for f in files if 'size' in f)} de {len(files)} regiones")
+
 async def get_available_map_files(version="250511"):
     """
     Obtiene la lista de archivos de mapas disponibles en el espejo activo.
@@ -235,6 +270,8 @@ async def get_available_map_files(version="250511"):
                                     "map_version": version
                                 })
                             
+                            # Tamaño exacto y SHA-1 de cada archivo (countries.txt), para verificar las descargas
+                            await add_file_checksums(session, working_url, files)
                             return files
                     else:
                         logger.warning(f"No se pudo acceder al listado de directorios: {response.status}")
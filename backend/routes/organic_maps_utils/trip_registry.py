@@ -0,0 +1,185 @@
+"""
+Registro en memoria de los metadatos de región de cada viaje (trip_regions.json)
+y estadísticas de latencia de las teselas MWM.
+
+Antes cada petición de tesela abría y parseaba trip_regions.json antes incluso
+de mirar la caché. Ahora el viaje se carga una vez y se revalida por mtime como
+mucho cada ``REVALIDATE_SECONDS``; las escrituras de /regions-for-trip y las
+descargas de MWM completadas lo invalidan en el acto. Cada viaje recuerda además
+el ``os.stat_result`` de las teselas que ya sabe que están en disco, de modo que
+servir una tesela cacheada es una búsqueda en diccionario más el sendfile de
+FileResponse, sin ``exists``/``stat`` previos.
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TRIP_REGIONS_FILE = "trip_regions.json"
+
+# Cada cuánto se comprueba el mtime de trip_regions.json de un viaje ya cargado
+REVALIDATE_SECONDS = 2.0
+# Teselas conocidas por viaje antes de vaciar la tabla (acota la memoria)
+MAX_KNOWN_TILES = 100_000
+# Muestras de latencia conservadas por tipo de respuesta
+LATENCY_SAMPLES = 2048
+
+TileKey = Tuple[int, int, int]
+
+
+@dataclass
+class TripRegions:
+    trip_id: str
+    mtime_ns: int
+    required_regions: List[str]
+    coordinates: list
+    mwm_paths: List[str]
+    tiles_dir: str
+    checked_at: float
+    tiles: Dict[TileKey, os.stat_result] = field(default_factory=dict)
+
+    def tile_path(self, z: int, x: int, y: int) -> str:
+        return os.path.join(self.tiles_dir, str(z), str(x), f"{y}.png")
+
+    def cached_tile(self, z: int, x: int, y: int) -> Tuple[str, Optional[os.stat_result]]:
+        """(path, stat) of the tile, stat None if not on disk; only the first hit of a tile touches the filesystem"""
+        key = (z, x, y)
+        path = self.tile_path(z, x, y)
+        stat_result = self.tiles.get(key)
+        if stat_result is not None:
+            return path, stat_result
+        return path, self.remember(z, x, y) if os.path.isfile(path) else None
+
+    def remember(self, z: int, x: int, y: int) -> Optional[os.stat_result]:
+        """Record a tile that has just been written to disk"""
+        try:
+            stat_result = os.stat(self.tile_path(z, x, y))
+        except OSError:
+            return None
+        if len(self.tiles) >= MAX_KNOWN_TILES:
+            self.tiles.clear()
+        self.tiles[(z, x, y)] = stat_result
+        return stat_result
+
+
+class TripRegionRegistry:
+    """trip_id -> TripRegions, loaded lazily from <base_dir>/<trip_id>/trip_regions.json"""
+
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        self._trips: Dict[str, TripRegions] = {}
+        self._lock = threading.Lock()
+        self.stats = {"loads": 0, "revalidations": 0, "invalidations": 0}
+
+    def _regions_path(self, trip_id: str) -> str:
+        return os.path.join(self.base_dir, trip_id, TRIP_REGIONS_FILE)
+
+    def _mwm_paths(self, region_ids: List[str]) -> List[str]:
+        paths = []
+        for region_id in region_ids:
+            path = os.path.join(self.base_dir, region_id, f"{region_id}.mwm")
+            if os.path.exists(path):
+                paths.append(path)
+            else:
+                logger.warning(f"MWM file not found for region {region_id}")
+        return paths
+
+    def get(self, trip_id: str) -> Optional[TripRegions]:
+        entry = self._trips.get(trip_id)
+        now = time.monotonic()
+        if entry is not None and now - entry.checked_at < REVALIDATE_SECONDS:
+            return entry
+        return self._load(trip_id, entry, now)
+
+    def _load(self, trip_id: str, entry: Optional[TripRegions], now: float) -> Optional[TripRegions]:
+        path = self._regions_path(trip_id)
+        with self._lock:
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                self._trips.pop(trip_id, None)
+                return None
+            if entry is not None and entry.mtime_ns == mtime_ns:
+                entry.checked_at = now
+                self.stats["revalidations"] += 1
+                return entry
+
+            with open(path, "r") as f:
+                trip_data = json.load(f)
+            required_regions = trip_data.get("required_regions", [])
+            loaded = TripRegions(
+                trip_id=trip_id,
+                mtime_ns=mtime_ns,
+                required_regions=required_regions,
+                coordinates=trip_data.get("coordinates") or [],
+                mwm_paths=self._mwm_paths(required_regions),
+                tiles_dir=os.path.join(self.base_dir, trip_id, "tiles"),
+                checked_at=now
+            )
+            # Las teselas en disco siguen siendo válidas aunque cambien las regiones
+            if entry is not None:
+                loaded.tiles = entry.tiles
+            self._trips[trip_id] = loaded
+            self.stats["loads"] += 1
+            return loaded
+
+    def invalidate(self, trip_id: str):
+        """Forget a trip (its trip_regions.json was rewritten)"""
+        with self._lock:
+            if self._trips.pop(trip_id, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def invalidate_region(self, region_id: str):
+        """Reload on next use every trip that needs ``region_id`` (its MWM file has just been downloaded)"""
+        with self._lock:
+            for entry in self._trips.values():
+                if region_id in entry.required_regions:
+                    entry.mtime_ns = -1
+                    entry.checked_at = float("-inf")
+                    self.stats["invalidations"] += 1
+
+    def get_stats(self) -> Dict:
+        return {"trips": len(self._trips), "known_tiles": sum(len(e.tiles) for e in self._trips.values()),
+                **self.stats}
+
+
+class TileLatencyStats:
+    """Latency of the last ``samples`` tile responses of each kind (hit, render, placeholder...)"""
+
+    def __init__(self, samples: int = LATENCY_SAMPLES):
+        self.samples = samples
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, int] = {}
+
+    def record(self, kind: str, seconds: float):
+        if kind not in self._latencies:
+            self._latencies[kind] = deque(maxlen=self.samples)
+            self._counts[kind] = 0
+        self._latencies[kind].append(seconds)
+        self._counts[kind] += 1
+
+    @staticmethod
+    def _percentile(ordered: List[float], pct: float) -> float:
+        # Rango más cercano: el valor por debajo del cual queda el pct% de las muestras
+        return ordered[max(0, math.ceil(pct / 100.0 * len(ordered)) - 1)]
+
+    def summary(self) -> Dict[str, Dict]:
+        result = {}
+        for kind, latencies in self._latencies.items():
+            ordered = sorted(latencies)
+            if not ordered:
+                continue
+            result[kind] = {
+                "count": self._counts[kind],
+                "samples": len(ordered),
+                **{f"p{pct}_ms": round(self._percentile(ordered, pct) * 1000, 3) for pct in (50, 90, 99)},
+                "max_ms": round(ordered[-1] * 1000, 3)
+            }
+        return result
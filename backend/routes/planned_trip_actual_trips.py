@@ -4,6 +4,8 @@ from typing import Dict, List, Optional
 import json
 import logging
 
+from archive_store import with_playable_files
+
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
@@ -118,7 +120,7 @@ async def get_actual_trip_details(planned_trip_id: str, trip_id: int):
             try:
                 videos = trip_logger.get_trip_videos(trip_id)
                 video_clips = [
-                    video if isinstance(video, dict) else {
+                    with_playable_files(video if isinstance(video, dict) else {
                         'id': getattr(video, 'id', None),
                         'trip_id': getattr(video, 'trip_id', None),
                         'start_time': getattr(video, 'start_time', None),
@@ -133,7 +135,7 @@ async def get_actual_trip_details(planned_trip_id: str, trip_id: int):
                         'end_lon': getattr(video, 'end_lon', None),
                         'landmark_type': getattr(video, 'landmark_type', None),
                         'location': getattr(video, 'location', None)
-                    }
+                    })
                     for video in videos
                 ]
             except Exception as e:
@@ -189,7 +191,7 @@ async def get_trip_video_clips(planned_trip_id: str, trip_id: int):
         if hasattr(trip_logger, 'get_trip_videos'):
             videos = trip_logger.get_trip_videos(trip_id)
             clips = [
-                video if isinstance(video, dict) else {
+                with_playable_files(video if isinstance(video, dict) else {
                     'id': getattr(video, 'id', None),
                     'trip_id': getattr(video, 'trip_id', None),
                     'start_time': getattr(video, 'start_time', None),
@@ -204,7 +206,7 @@ async def get_trip_video_clips(planned_trip_id: str, trip_id: int):
                     'end_lon': getattr(video, 'end_lon', None),
                     'landmark_type': getattr(video, 'landmark_type', None),
                     'location': getattr(video, 'location', None)
-                }
+                })
                 for video in videos
             ]
         
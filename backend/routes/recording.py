@@ -2,6 +2,8 @@ from fastapi import APIRouter, HTTPException
 from typing import Dict
 import logging
 
+from archive_store import with_playable_files
+
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
@@ -104,7 +106,7 @@ async def debug_database():
                             'road_video_file': getattr(video, 'road_video_file', None),
                             'interior_video_file': getattr(video, 'interior_video_file', None)
                         }
-                        recent_clips.append(video_dict)
+                        recent_clips.append(with_playable_files(video_dict))
             else:
                 trip_dict['clips_count'] = 0
                 
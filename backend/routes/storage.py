@@ -1,6 +1,8 @@
 from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from typing import Dict, Any, Optional, List
 from pydantic import BaseModel
+import asyncio
 import os
 import pwd
 import grp
@@ -20,6 +22,9 @@ class DriveSettings(BaseModel):
     autoCleanEnabled: Optional[bool] = None
     autoCleanThreshold: Optional[int] = None
     autoCleanDays: Optional[int] = None
+    autoCleanTargetThreshold: Optional[int] = None
+    minFreeSpaceMB: Optional[int] = None
+    retentionDeleteRateMB: Optional[int] = None
 
 class MountDriveRequest(BaseModel):
     device: Optional[str] = None
@@ -79,13 +84,24 @@ async def update_storage_settings(settings: DriveSettings):
 @router.post("/clean")
 async def clean_old_videos(request: CleanupRequest):
     """Clean up videos older than specified days"""
-    result = disk_manager.clean_old_videos(request.days)
+    result = await asyncio.to_thread(disk_manager.clean_old_videos, request.days)
     return {
         "success": True, 
         "deleted": result["deleted"],
         "freedSpace": result["freedSpace"]
     }
 
+@router.get("/retention/status")
+async def get_retention_status():
+    """Get the retention engine status, watermark settings and deletion stats"""
+    return disk_manager.retention_engine.get_status()
+
+@router.post("/retention/run")
+async def run_retention_pass():
+    """Run a retention pass immediately (outside the periodic schedule)"""
+    result = await asyncio.to_thread(disk_manager.retention_engine.enforce)
+    return {"success": True, **result}
+
 @router.post("/backup")
 async def backup_videos(destination: str):
     """Backup videos to external location"""
@@ -102,17 +118,43 @@ async def backup_videos(destination: str):
 
 @router.post("/archive")
 async def archive_videos(archive_type: str = "standard"):
-    """Compress old videos to save space"""
-    if archive_type not in ["standard", "high-compression"]:
+    """Move videos older than 60 days into the incremental archive store"""
+    if archive_type not in ["standard", "high-compression", "store"]:
         raise HTTPException(status_code=400, detail="Invalid archive type")
         
-    result = disk_manager.archive_videos(archive_type)
+    result = await asyncio.to_thread(disk_manager.archive_videos, archive_type)
     return {
         "success": True, 
         "archived": result["archived"],
-        "savedSpace": result["savedSpace"]
+        "savedSpace": result["savedSpace"],
+        "skipped": result.get("skipped", 0),
+        "deduplicated": result.get("deduplicated", 0),
+        "failed": result.get("failed", 0)
     }
 
+@router.get("/archive/status")
+async def get_archive_status():
+    """Get archive store statistics (segments, packs and sizes)"""
+    return disk_manager.get_archive_store().get_stats()
+
+@router.get("/archive/clips/{clip_id}")
+async def get_archived_clip(clip_id: int, camera: str = "road"):
+    """Stream a single archived clip directly from its day pack"""
+    if camera not in ["road", "interior"]:
+        raise HTTPException(status_code=400, detail="Invalid camera")
+    
+    store = disk_manager.get_archive_store()
+    key = f"clip:{clip_id}:{camera}"
+    segment = store.get(key)
+    if segment is None:
+        raise HTTPException(status_code=404, detail="Clip not found in archive")
+    
+    return StreamingResponse(
+        store.iter_segment(key),
+        media_type="video/mp4",
+        headers={"Content-Length": str(segment.length)}
+    )
+
 @router.post("/mount")
 async def mount_storage_drive(request: Optional[MountDriveRequest] = None):
     """Mount the configured storage drive or a specific device"""
@@ -16,6 +16,7 @@ from sse_starlette.sse import EventSourceResponse
 from data_persistence import get_persistence_manager
 from geocoding.services.reverse_geocoding_service import LocationInfo
 from geocoding.downloader.geodata_downloader import GeodataDownloader
+from geocoding.downloader.nominatim_api import get_nominatim_client
 from geocoding.utils.coverage_calculator import CoverageCalculator
 from geocoding.utils.db_storage import DBStorage
 
@@ -1294,25 +1295,10 @@ async def download_trip_landmarks_optimized_with_progress(trip: PlannedTrip,
 async def search_places(request: PlaceSearchRequest):
     """Search for places using OpenStreetMap Nominatim API"""
     try:
-        # Use Nominatim API to search for places
-        search_url = "https://nominatim.openstreetmap.org/search"
-        
-        params = {
-            "q": request.query,
-            "format": "json",
-            "limit": request.limit,
-            "addressdetails": 1
-        }
-        
-        # Add user-agent to comply with Nominatim usage policy
-        headers = {
-            "User-Agent": "DashcamV2/1.0"
-        }
-        
-        response = requests.get(search_url, params=params, headers=headers)
-        response.raise_for_status()
-        
-        results = response.json()
+        # Use Nominatim API to search for places (cliente compartido, con límite global)
+        results = await get_nominatim_client().search(request.query, limit=request.limit, addressdetails=1)
+        if results is None:
+            raise HTTPException(status_code=502, detail="Failed to search for places: Nominatim unavailable")
         
         # Transform results to our format
         formatted_results = []
@@ -1333,6 +1319,8 @@ async def search_places(request: PlaceSearchRequest):
         
         return {"results": formatted_results}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error searching for places: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to search for places: {str(e)}")
@@ -12,6 +12,7 @@ from trip_logger_package.models import VideoClipModel, ExternalVideoModel
 from trip_logger_package.database import VideoRepository
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, or_
+from archive_store import with_playable_files
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +24,7 @@ auto_trip_manager = None
 config = None
 video_base_path = None
 db_manager = None  # Variable para el gestor de la base de datos que proporciona sesiones SQLAlchemy
+disk_manager = None  # Para el archivo de clips antiguos (rutas originales de los clips archivados)
 
 # Route to get all trips
 @router.get("")
@@ -64,6 +66,7 @@ async def get_trips(date_str: Optional[str] = None):
                             }
                             # Add trip start time for compatibility
                             trip_start = trip.get('start_time') if isinstance(trip, dict) else getattr(trip, 'start_time', None)
+                            video_dict = with_playable_files(video_dict)
                             video_dict['trip_start_time'] = trip_start
                             video_clips.append(video_dict)
                 
@@ -344,13 +347,20 @@ def get_videos_by_date_from_db(target_date: date) -> List[Dict]:
             
             # 3. Buscar mediante cadenas de texto en la ruta del archivo
             # Esto es útil para encontrar videos almacenados en carpetas por fecha
+            dated_folder = f"/{target_date.year}-{target_date.month:02d}-{target_date.day:02d}/"
+            # Los clips archivados ya no tienen la ruta en la fila: se busca en su ruta original
+            archived_ids = set()
+            archive_store = disk_manager.existing_archive_store() if disk_manager else None
+            if archive_store is not None:
+                archived_ids = archive_store.clip_ids_with_source(f"/{date_str}/", dated_folder)
             path_query = session.query(VideoClipModel).filter(
                 or_(
                     VideoClipModel.road_video_file.like(f"%/{date_str}/%"),
                     VideoClipModel.interior_video_file.like(f"%/{date_str}/%"),
                     # También buscar con formato de fecha YYYY-MM-DD
-                    VideoClipModel.road_video_file.like(f"%/{target_date.year}-{target_date.month:02d}-{target_date.day:02d}/%"),
-                    VideoClipModel.interior_video_file.like(f"%/{target_date.year}-{target_date.month:02d}-{target_date.day:02d}/%")
+                    VideoClipModel.road_video_file.like(f"%{dated_folder}%"),
+                    VideoClipModel.interior_video_file.like(f"%{dated_folder}%"),
+                    VideoClipModel.id.in_(archived_ids)
                 )
             )
             
@@ -410,7 +420,7 @@ def get_videos_by_date_from_db(target_date: date) -> List[Dict]:
                     'location': video.location,
                     'near_landmark': video.near_landmark
                 }
-                videos.append(video_dict)
+                videos.append(with_playable_files(video_dict))
                 
     except Exception as e:
         logger.error(f"Error getting videos from database: {e}")
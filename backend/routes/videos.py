@@ -29,6 +29,14 @@ async def generate_summary(day: str, background_tasks: BackgroundTasks):
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
 
+# Route to check daily summary progress
+@router.get("/summary-status/{day}")
+async def get_summary_status(day: str):
+    status = video_maker.get_summary_status(day)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"No summary has been generated for {day}")
+    return status
+
 # Route to upload Insta360 videos
 @router.post("/upload")
 async def upload_video(
@@ -396,6 +404,20 @@ async def get_external_video(video_id: str):
             raise
         raise HTTPException(status_code=500, detail=f"Error al procesar la solicitud: {str(e)}")
 
+# Clips archivados: la ruta pública apunta al segmento dentro del archivo
+@router.get("/archive/{clip_id}/{camera}")
+async def get_archived_video(clip_id: int, camera: str):
+    """
+    Redirige al endpoint de almacenamiento que sirve el segmento archivado
+    
+    Args:
+        clip_id: ID del clip archivado
+        camera: Cámara del clip ("road" o "interior")
+    """
+    if camera not in ("road", "interior"):
+        raise HTTPException(status_code=404, detail="Cámara no válida")
+    return RedirectResponse(url=f"/api/storage/archive/clips/{clip_id}?camera={camera}")
+
 # Endpoint para servir archivos de video directamente
 @router.get("/{path:path}", include_in_schema=True)
 async def get_video_file(path: str):
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Tests del archivado de clips antiguos (DiskManager.archive_videos y
+archive_store): las filas del catálogo pasan a apuntar al archivo antes de
+borrar el original, un fallo en un clip no detiene la ejecución, cada
+recodificación usa su propio archivo temporal, la retención libera los
+segmentos archivados, la copia al disco externo los lee del pack y la API
+devuelve una URL reproducible en lugar de la referencia ``archive:``.
+"""
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import disk_manager as disk_manager_module
+from archive_store import ArchiveStore, archive_ref, playable_path, with_playable_files
+from backup_engine import BackupEngine, BACKUP_DIR_NAME
+from disk_manager import DiskManager
+from hdd_copy_module import HDDCopyModule
+from trip_logger_package.database.connection import DatabaseManager
+from trip_logger_package.models.db_models import VideoClip as VideoClipModel
+
+
+def new_disk_manager():
+    data_path = tempfile.mkdtemp()
+    manager = DiskManager(data_path=data_path)
+    manager.db_manager = DatabaseManager(os.path.join(data_path, "recordings.db"))
+    return manager
+
+
+def add_clip(manager, name, days_ago, interior=False):
+    day = (datetime.now() - timedelta(days=days_ago)).strftime("%Y-%m-%d")
+    paths = {}
+    for kind in ("road", "interior") if interior else ("road",):
+        rel_path = f"videos/{day}/{name}_{kind}.mp4"
+        full_path = os.path.join(manager.data_path, rel_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "wb") as f:
+            f.write(f"{name}-{kind}".encode() * 1000)
+        paths[kind] = (rel_path, full_path)
+    start = datetime.now() - timedelta(days=days_ago)
+    with manager.db_manager.session_scope() as session:
+        clip = VideoClipModel(start_time=start, end_time=start + timedelta(minutes=1),
+                              road_video_file=paths["road"][0],
+                              interior_video_file=paths["interior"][0] if interior else None)
+        session.add(clip)
+        session.flush()
+        return clip.id, paths
+
+
+def clip_files(manager, clip_id):
+    with manager.db_manager.session_scope() as session:
+        clip = session.get(VideoClipModel, clip_id)
+        return clip.road_video_file, clip.interior_video_file
+
+
+def test_rows_point_at_archive_before_originals_are_removed():
+    manager = new_disk_manager()
+    old_id, old_paths = add_clip(manager, "old", 90, interior=True)
+    broken_id, broken_paths = add_clip(manager, "broken", 80)
+    recent_id, recent_paths = add_clip(manager, "recent", 5)
+
+    store = manager.get_archive_store()
+    original_add = store.add
+
+    def add(key, payload_path, day, **kwargs):
+        if key == f"clip:{broken_id}:road":
+            raise IOError("disk error")
+        return original_add(key, payload_path, day, **kwargs)
+
+    store.add = add
+    result = manager.archive_videos("store")
+    assert result["archived"] == 2 and result["failed"] == 1
+
+    # El clip archivado apunta al archivo y sus originales ya no están
+    assert clip_files(manager, old_id) == (archive_ref(f"clip:{old_id}:road"), archive_ref(f"clip:{old_id}:interior"))
+    assert not os.path.exists(old_paths["road"][1]) and not os.path.exists(old_paths["interior"][1])
+    assert b"".join(store.iter_segment(f"clip:{old_id}:road")) == b"old-road" * 1000
+    # El que falló y el reciente siguen intactos
+    assert clip_files(manager, broken_id)[0] == broken_paths["road"][0] and os.path.exists(broken_paths["road"][1])
+    assert clip_files(manager, recent_id)[0] == recent_paths["road"][0] and os.path.exists(recent_paths["road"][1])
+
+    # Reintento: el clip que falló se archiva y los ya archivados no se vuelven a tocar
+    store.add = original_add
+    result = manager.archive_videos("store")
+    assert result["archived"] == 1 and result["failed"] == 0
+    assert clip_files(manager, broken_id)[0] == archive_ref(f"clip:{broken_id}:road")
+
+
+def test_interrupted_run_repoints_already_archived_file():
+    manager = new_disk_manager()
+    clip_id, paths = add_clip(manager, "cut", 70)
+    # Una ejecución anterior se cortó después de añadir al archivo y antes de actualizar la fila
+    day = (datetime.now() - timedelta(days=70)).strftime("%Y-%m-%d")
+    manager.get_archive_store().add(f"clip:{clip_id}:road", paths["road"][1], day, clip_id=clip_id)
+
+    result = manager.archive_videos("store")
+    assert result["skipped"] == 1 and result["archived"] == 0
+    assert clip_files(manager, clip_id)[0] == archive_ref(f"clip:{clip_id}:road")
+    assert not os.path.exists(paths["road"][1])
+
+
+def test_concurrent_encodes_use_unique_temp_files():
+    manager = new_disk_manager()
+    source = os.path.join(manager.data_path, "source.mp4")
+    with open(source, "wb") as f:
+        f.write(b"x" * 10000)
+
+    outputs = []
+    barrier = threading.Barrier(2)
+
+    def run(args, capture_output):
+        outputs.append(args[-1])
+        barrier.wait(5)
+        with open(args[-1], "wb") as f:
+            f.write(b"y" * 100)
+        return SimpleNamespace(returncode=0)
+
+    original_run = disk_manager_module.subprocess.run
+    disk_manager_module.subprocess.run = run
+    results = []
+    try:
+        threads = [threading.Thread(target=lambda: results.append(manager._compress_for_archive(source, "standard")))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        disk_manager_module.subprocess.run = original_run
+
+    assert len(set(outputs)) == 2 and sorted(results) == sorted(outputs)
+    assert all(os.path.dirname(path) == manager.get_archive_store().root for path in outputs)
+
+
+def archived_manager():
+    """Dos clips archivados el mismo día (uno con cámara interior) y otro en otro día"""
+    manager = new_disk_manager()
+    manager.retention_engine.db_manager = manager.db_manager
+    first_id, _ = add_clip(manager, "first", 90, interior=True)
+    second_id, _ = add_clip(manager, "second", 90)
+    other_id, _ = add_clip(manager, "other", 80)
+    assert manager.archive_videos("store")["archived"] == 4
+    return manager, first_id, second_id, other_id
+
+
+def test_retention_releases_archived_segments():
+    manager, first_id, second_id, other_id = archived_manager()
+    store = manager.get_archive_store()
+    packs = {name: os.path.getsize(os.path.join(store.packs_path, name)) for name in os.listdir(store.packs_path)}
+    engine = manager.retention_engine
+    first_day = (datetime.now() - timedelta(days=90)).strftime("%Y-%m-%d") + ".pack"
+    assert engine._candidate_size(next(c for c in engine._load_candidates() if c.id == first_id)) == len(b"first-road" + b"first-interior") * 1000
+
+    # Solo uno de los clips del día: su pack sigue en uso por el otro
+    result = engine._delete_candidates([c for c in engine._load_candidates() if c.id == first_id], None,
+                                       engine.get_settings())
+    assert result == {"deleted": 1, "deletedFiles": 2, "freedSpace": 0}
+    assert not store.contains(f"clip:{first_id}:road") and os.path.exists(os.path.join(store.packs_path, first_day))
+    assert b"".join(store.iter_segment(f"clip:{second_id}:road")) == b"second-road" * 1000
+
+    # Purga por antigüedad: se borran las filas y los packs que quedan sin segmentos
+    result = engine.purge_older_than(30)
+    assert result["deleted"] == 2 and result["freedSpace"] == sum(packs.values())
+    assert os.listdir(store.packs_path) == [] and store.segments == {}
+    with manager.db_manager.session_scope() as session:
+        assert session.query(VideoClipModel).count() == 0
+    # Las bajas quedan en el índice
+    assert ArchiveStore(store.root).segments == {}
+
+
+def test_retention_keeps_rows_when_archive_cannot_be_updated():
+    manager, first_id, _, _ = archived_manager()
+    store = manager.get_archive_store()
+    original = store._append_index
+
+    def failing_append(*records):
+        raise OSError("read-only filesystem")
+
+    store._append_index = failing_append
+    try:
+        result = manager.retention_engine.purge_older_than(30)
+    finally:
+        store._append_index = original
+    assert result["deleted"] == 0 and store.contains(f"clip:{first_id}:road")
+    assert clip_files(manager, first_id)[0] == archive_ref(f"clip:{first_id}:road")
+
+
+def test_backup_reads_archived_clips_from_the_store():
+    manager, first_id, second_id, other_id = archived_manager()
+    destination = tempfile.mkdtemp()
+    module = HDDCopyModule(manager, SimpleNamespace(), SimpleNamespace(announce=lambda message: None))
+    module._resume_stop_event.set()
+    module.db_manager = manager.db_manager
+
+    items = module._collect_backup_items()
+    assert sorted(item.key for item in items) == sorted(
+        [f"clip:{first_id}:road", f"clip:{first_id}:interior", f"clip:{second_id}:road", f"clip:{other_id}:road"])
+    result = BackupEngine(destination).run(items)
+    assert result["status"] == "completed" and result["copied_files"] == 4
+
+    # Cada clip en la ruta de su archivo original, con el contenido del segmento
+    day = (datetime.now() - timedelta(days=90)).strftime("%Y-%m-%d")
+    backup_root = os.path.join(destination, BACKUP_DIR_NAME)
+    with open(os.path.join(backup_root, "videos", day, "second_road.mp4"), "rb") as f:
+        assert f.read() == b"second-road" * 1000
+    with open(os.path.join(backup_root, "videos", day, "first_interior.mp4"), "rb") as f:
+        assert f.read() == b"first-interior" * 1000
+
+    # Archivar otro clip en el mismo pack no obliga a volver a copiar los anteriores
+    add_clip(manager, "late", 90)
+    manager.archive_videos("store")
+    result = BackupEngine(destination).run(module._collect_backup_items())
+    assert result["copied_files"] == 1 and result["skipped_files"] == 4
+
+
+def test_api_paths_of_archived_clips():
+    assert playable_path(archive_ref("clip:12:interior")) == "/api/videos/archive/12/interior"
+    assert playable_path("videos/2024-01-01/a.mp4") == "videos/2024-01-01/a.mp4" and playable_path(None) is None
+    video = {"id": 12, "road_video_file": archive_ref("clip:12:road"), "interior_video_file": None}
+    assert with_playable_files(video) == {"id": 12, "road_video_file": "/api/videos/archive/12/road",
+                                          "interior_video_file": None, "archived": True}
+    assert video["road_video_file"] == archive_ref("clip:12:road")
+
+    # La URL pública redirige al segmento servido por /api/storage
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from routes import videos as videos_routes
+    app = FastAPI()
+    app.include_router(videos_routes.router, prefix="/api/videos")
+    client = TestClient(app)
+    response = client.get("/api/videos/archive/12/road", follow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["location"] == "/api/storage/archive/clips/12?camera=road"
+    assert client.get("/api/videos/archive/12/rear", follow_redirects=False).status_code == 404
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
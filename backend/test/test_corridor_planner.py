@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Tests del planificador de corredor (corridor_planner): las celdas cubren toda
+la ruta, las que quedan más lejos que corridor_km se excluyen, los códigos
+enteros coinciden con geohash.encode, se restan las celdas ya cubiertas en
+detailed_geocoding y en la caché (salvo filas caducadas) y la salida sigue el
+orden de la ruta.
+"""
+import os
+import sys
+import math
+import random
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from geocoding.utils.corridor_planner import (
+    cell_codes, code_centers, codes_to_geohashes, corridor_cell_codes, plan_corridor_cells
+)
+from geocoding.utils.geohash import encode
+
+# Madrid -> Guadalajara -> Calatayud, hacia el este
+ROUTE = [(40.4168, -3.7038), (40.6333, -3.1667), (40.7, -2.4), (41.3533, -1.6431)]
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return 6371.0 * 2 * math.asin(math.sqrt(a))
+
+
+def route_samples(polyline, step_km=0.05):
+    """Puntos cada ~step_km a lo largo de la polilínea"""
+    points = []
+    for a, b in zip(polyline[:-1], polyline[1:]):
+        steps = max(1, int(haversine_km(*a, *b) / step_km))
+        for i in range(steps + 1):
+            t = i / steps
+            points.append((a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t))
+    return points
+
+
+def distance_to_route_km(lat, lon, samples):
+    return min(haversine_km(lat, lon, s_lat, s_lon) for s_lat, s_lon in samples)
+
+
+def test_corridor_covers_every_point_of_the_route():
+    samples = route_samples(ROUTE)
+    lats = np.array([p[0] for p in samples])
+    lons = np.array([p[1] for p in samples])
+    for precision, corridor_km in ((6, 0.1), (6, 2.0), (5, 30.0)):
+        codes, _ = corridor_cell_codes(ROUTE, corridor_km, precision)
+        # Incluso con un corredor más estrecho que la celda, toda celda atravesada entra
+        assert set(cell_codes(lats, lons, precision).tolist()) <= set(codes.tolist())
+
+    # Un único punto: su celda y las vecinas dentro del corredor, todas del segmento 0
+    codes, segments = corridor_cell_codes([ROUTE[0]], 1.0, 6)
+    assert int(cell_codes([ROUTE[0][0]], [ROUTE[0][1]], 6)[0]) in codes.tolist()
+    assert set(segments.tolist()) == {0}
+
+
+def test_cells_beyond_the_corridor_are_excluded():
+    corridor_km = 3.0
+    samples = route_samples(ROUTE)
+    codes, _ = corridor_cell_codes(ROUTE, corridor_km, 6)
+    lats, lons = code_centers(codes, 6)
+    for lat, lon in zip(lats[::3], lons[::3]):
+        assert distance_to_route_km(lat, lon, samples) <= corridor_km + 0.05
+
+    # A 6 km al norte del primer tramo no se descarga nada; a 1 km sí
+    mid_lat, mid_lon = (ROUTE[0][0] + ROUTE[1][0]) / 2, (ROUTE[0][1] + ROUTE[1][1]) / 2
+    far = int(cell_codes([mid_lat + 6.0 / 110.574], [mid_lon], 6)[0])
+    near = int(cell_codes([mid_lat + 1.0 / 110.574], [mid_lon], 6)[0])
+    assert far not in codes.tolist() and near in codes.tolist()
+
+
+def test_codes_match_geohash_encode():
+    rng = random.Random(35)
+    points = [(rng.uniform(-89.9, 89.9), rng.uniform(-179.9, 179.9)) for _ in range(500)]
+    points += [(40.4168, -3.7038), (-33.8688, 151.2093), (0.0, 0.0), (64.1466, -21.9426)]
+    lats = np.array([p[0] for p in points])
+    lons = np.array([p[1] for p in points])
+    for precision in (5, 6, 7):
+        codes = cell_codes(lats, lons, precision)
+        expected = [encode(lat, lon, precision) for lat, lon in points]
+        assert codes_to_geohashes(codes, precision) == expected
+        # El centro de cada celda vuelve a caer en la misma celda
+        center_lats, center_lons = code_centers(codes, precision)
+        assert [encode(lat, lon, precision) for lat, lon in zip(center_lats, center_lons)] == expected
+
+
+def make_covered_db(stored, fresh, stale):
+    db_path = os.path.join(tempfile.mkdtemp(), "geocoding_offline.db")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE detailed_geocoding (id INTEGER PRIMARY KEY, lat REAL, lon REAL, name TEXT)")
+        conn.execute("CREATE TABLE geocoding_cache (id INTEGER PRIMARY KEY, lat REAL, lon REAL, "
+                     "location_info TEXT, timestamp TIMESTAMP, source TEXT)")
+        conn.executemany("INSERT INTO detailed_geocoding (lat, lon, name) VALUES (?, ?, 'x')", stored)
+        now = datetime.now()
+        conn.executemany("INSERT INTO geocoding_cache (lat, lon, location_info, timestamp, source) "
+                         "VALUES (?, ?, '{}', ?, 'nominatim')",
+                         [(lat, lon, now.isoformat()) for lat, lon in fresh] +
+                         [(lat, lon, (now - timedelta(days=30)).isoformat()) for lat, lon in stale])
+    return db_path
+
+
+def test_covered_cells_are_subtracted_but_not_stale_cache():
+    full = plan_corridor_cells(ROUTE, 2.0)
+    cells = full["cells"]
+    stored, fresh, stale = cells[3], cells[len(cells) // 2], cells[-4]
+    db_path = make_covered_db(stored=[(stored["lat"], stored["lon"])],
+                              fresh=[(fresh["lat"], fresh["lon"])],
+                              stale=[(stale["lat"], stale["lon"])])
+
+    plan = plan_corridor_cells(ROUTE, 2.0, db_paths=[db_path])
+    planned = {cell["cell"] for cell in plan["cells"]}
+    assert plan["total_cells"] == full["total_cells"] and plan["covered_cells"] == 2
+    assert stored["cell"] not in planned and fresh["cell"] not in planned
+    # Una entrada de caché caducada no cuenta como cubierta
+    assert stale["cell"] in planned
+    assert len(planned) == full["total_cells"] - 2
+
+    # Bases inexistentes o sin esas tablas no rompen el plan
+    empty_db = os.path.join(tempfile.mkdtemp(), "empty.db")
+    sqlite3.connect(empty_db).close()
+    missing = os.path.join(tempfile.mkdtemp(), "missing.db")
+    assert plan_corridor_cells(ROUTE, 2.0, db_paths=[empty_db, missing])["covered_cells"] == 0
+
+
+def test_cells_are_in_route_order():
+    # Ruta hacia el oeste con un tramo de vuelta al norte: el orden no es el de los códigos
+    route = list(reversed(ROUTE)) + [(41.0, -4.2)]
+    plan = plan_corridor_cells(route, 2.0)
+    segments = [cell["segment"] for cell in plan["cells"]]
+    assert segments == sorted(segments) and set(segments) == set(range(len(route) - 1))
+
+    # Cada celda pertenece al primer tramo cuyo corredor la contiene
+    samples = [route_samples([a, b]) for a, b in zip(route[:-1], route[1:])]
+    for cell in plan["cells"][::25]:
+        own = distance_to_route_km(cell["lat"], cell["lon"], samples[cell["segment"]])
+        assert own <= 2.05
+        for earlier in samples[:cell["segment"]]:
+            assert distance_to_route_km(cell["lat"], cell["lon"], earlier) > 1.95
+
+    # La primera celda está junto al origen y la última junto al destino
+    first, last = plan["cells"][0], plan["cells"][-1]
+    assert haversine_km(first["lat"], first["lon"], *route[0]) < haversine_km(last["lat"], last["lon"], *route[0])
+    assert distance_to_route_km(last["lat"], last["lon"], samples[-1]) <= 2.05
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
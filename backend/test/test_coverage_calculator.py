@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Tests de la cobertura de ruta con índice espacial (coverage_calculator y
+utils.spatial_index): mismos resultados que el recorrido por fuerza bruta
+anterior en una ruta de referencia con huecos sin cubrir, índice vacío, un
+solo punto, ruta que cruza el antimeridiano y latitudes altas.
+"""
+import os
+import sys
+import random
+
+import numpy as np
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from geocoding.utils.coverage_calculator import (
+    calculate_distance_km, calculate_trip_route_coverage, generate_route_segment_points
+)
+from utils.spatial_index import GeoPointIndex
+
+# Madrid -> Zaragoza -> Barcelona
+ROUTE = [{"lat": 40.4168, "lon": -3.7038}, {"lat": 41.6488, "lon": -0.8891}, {"lat": 41.3874, "lon": 2.1686}]
+
+
+def brute_force_coverage(waypoints, geodata_points, radius_km):
+    """Cálculo original: cada punto de la ruta contra todos los puntos descargados"""
+    samples = []
+    total_km = 0
+    for start, end in zip(waypoints[:-1], waypoints[1:]):
+        distance_km = calculate_distance_km(start["lat"], start["lon"], end["lat"], end["lon"])
+        total_km += distance_km
+        samples.extend(generate_route_segment_points(start["lat"], start["lon"], end["lat"], end["lon"],
+                                                     max(1, int(distance_km))))
+    covered = [
+        any(calculate_distance_km(lat, lon, p["lat"], p["lon"]) <= radius_km for p in geodata_points)
+        for lat, lon in samples
+    ]
+    return samples, covered, total_km
+
+
+def geodata_along(waypoints, every, jitter_km, seed, skip=()):
+    """Puntos descargados cerca de la ruta, salvo en los tramos de muestras ``skip``"""
+    rng = random.Random(seed)
+    samples, _, _ = brute_force_coverage(waypoints, [], 0)
+    points = []
+    for index in range(0, len(samples), every):
+        if any(first <= index <= last for first, last in skip):
+            continue
+        lat, lon = samples[index]
+        points.append({"lat": lat + rng.uniform(-1, 1) * jitter_km / 111.0,
+                       "lon": lon + rng.uniform(-1, 1) * jitter_km / 111.0})
+    return points
+
+
+def assert_matches_brute_force(waypoints, geodata_points, radius_km):
+    samples, covered, total_km = brute_force_coverage(waypoints, geodata_points, radius_km)
+    result = calculate_trip_route_coverage(waypoints, geodata_points, radius_km)
+    assert "error" not in result, result.get("error")
+    assert result["total_route_points"] == len(samples)
+    assert result["covered_route_points"] == sum(covered)
+    assert result["total_route_distance_km"] == round(total_km, 2)
+    expected_pct = round(sum(covered) / len(samples) * 100, 2) if samples else 0
+    assert result["coverage_percentage"] == expected_pct
+
+    # Los huecos son exactamente las rachas de muestras sin cubrir (sin cruzar tramos)
+    uncovered = [i for i, ok in enumerate(covered) if not ok]
+    assert sum(gap["route_points"] for gap in result["coverage_gaps"]) == len(uncovered)
+    for gap in result["coverage_gaps"]:
+        first = samples.index((gap["start"]["lat"], gap["start"]["lon"]))
+        assert not any(covered[first:first + gap["route_points"]])
+        assert samples[first + gap["route_points"] - 1] == (gap["end"]["lat"], gap["end"]["lon"])
+    return result, covered
+
+
+def test_index_matches_brute_force_with_gaps():
+    # Sin datos en dos zonas: una dentro del primer tramo y otra que llega al final de la ruta
+    geodata = geodata_along(ROUTE, every=3, jitter_km=2.0, seed=36, skip=((80, 120), (420, 10_000)))
+    for radius_km in (1.5, 3.0, 10.0):
+        result, covered = assert_matches_brute_force(ROUTE, geodata, radius_km)
+        assert 0 < sum(covered) < len(covered)
+    result, _ = assert_matches_brute_force(ROUTE, geodata, 3.0)
+    assert len(result["coverage_gaps"]) >= 2 and result["uncovered_distance_km"] > 40
+    assert [s["route_points"] for s in result["segments"]] == [
+        max(1, int(calculate_distance_km(a["lat"], a["lon"], b["lat"], b["lon"]))) - 1
+        for a, b in zip(ROUTE[:-1], ROUTE[1:])
+    ]
+
+
+def test_empty_index_and_single_points():
+    result, covered = assert_matches_brute_force(ROUTE, [], 5.0)
+    assert result["covered_route_points"] == 0
+    # Sin datos todo tramo es un hueco completo
+    assert [gap["segment_index"] for gap in result["coverage_gaps"]] == [0, 1]
+    assert GeoPointIndex([], [], 5.0).any_within([40.0], [-3.0]).tolist() == [False]
+    assert len(GeoPointIndex([], [], 5.0).within(40.0, -3.0)[0]) == 0
+
+    # Un único punto descargado en mitad de la ruta
+    single = [{"lat": 41.0, "lon": -2.3}]
+    assert_matches_brute_force(ROUTE, single, 25.0)
+
+    # Un único waypoint no tiene ruta
+    result = calculate_trip_route_coverage(ROUTE[:1], single, 25.0)
+    assert result["total_route_points"] == 0 and result["coverage_percentage"] == 0
+    assert result["segments"] == [] and result["coverage_gaps"] == []
+
+
+def test_antimeridian_and_high_latitude():
+    # Fiyi: la ruta llega a 179.99°E y los datos están al otro lado, en 179.99°O
+    fiji = [{"lat": -16.8, "lon": 178.4}, {"lat": -16.9, "lon": 179.99}]
+    across = [{"lat": -16.9, "lon": -179.99}, {"lat": -16.85, "lon": 179.2}]
+    result, covered = assert_matches_brute_force(fiji, across, 5.0)
+    assert covered[-1] and result["covered_route_points"] > 0
+    index = GeoPointIndex([-16.9], [-179.99], 5.0)
+    indices, distances = index.within(-16.9, 179.99)
+    assert indices.tolist() == [0] and abs(distances[0] - calculate_distance_km(-16.9, 179.99, -16.9, -179.99)) < 1e-6
+
+    # Svalbard hacia el polo: los grados de longitud apenas miden nada
+    arctic = [{"lat": 78.22, "lon": 15.65}, {"lat": 80.5, "lon": 25.0}, {"lat": 89.5, "lon": -150.0}]
+    rng = random.Random(36)
+    polar = [{"lat": rng.uniform(78, 90), "lon": rng.uniform(-180, 180)} for _ in range(400)]
+    assert_matches_brute_force(arctic, polar, 20.0)
+
+
+def test_neighbour_queries_match_brute_force():
+    rng = random.Random(360)
+    lats = np.array([rng.uniform(-89, 89) for _ in range(300)] + [89.99, -89.99, 0.0, 0.0])
+    lons = np.array([rng.uniform(-180, 180) for _ in range(300)] + [0.0, 90.0, 179.999, -179.999])
+    radius_km = 1500.0
+    index = GeoPointIndex(lats, lons, radius_km)
+
+    expected = {
+        (i, j) for i in range(len(lats)) for j in range(len(lats))
+        if calculate_distance_km(lats[i], lons[i], lats[j], lons[j]) <= radius_km
+    }
+    found = set()
+    for rows, points, distances in index.pairs(lats, lons, chunk_size=50):
+        found.update(zip(rows.tolist(), points.tolist()))
+        for i, j, d in zip(rows, points, distances):
+            assert abs(d - calculate_distance_km(lats[i], lons[i], lats[j], lons[j])) < 1e-6
+    assert found == expected
+
+    for i in (0, 300, 302, 303):
+        indices, _ = index.within(lats[i], lons[i], radius_km / 2)
+        assert indices.tolist() == sorted(
+            j for j in range(len(lats))
+            if calculate_distance_km(lats[i], lons[i], lats[j], lons[j]) <= radius_km / 2)
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
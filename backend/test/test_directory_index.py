@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Tests del índice de listados de directorio (utils.directory_index) y de los
+endpoints /list y /list/stream del explorador de archivos: orden, filtros,
+paginación con cursor, estadísticas de la caché y streaming sin esperar al
+escaneo completo.
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+from types import SimpleNamespace
+
+from fastapi import HTTPException
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import routes.file_explorer as file_explorer
+from utils.directory_index import DirectoryIndex, select_page
+
+
+def build_tree():
+    data_path = tempfile.mkdtemp()
+    directory = os.path.join(data_path, "videos", "clips")
+    os.makedirs(os.path.join(directory, "b_dir"))
+    os.makedirs(os.path.join(directory, "A_dir"))
+    for i, name in enumerate(["b.mp4", "a.txt", "C.mp4", "B.MOV", "c.jpg"]):
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(b"x" * (10 * (i + 1)))
+        os.utime(os.path.join(directory, name), (1_600_000_000 + i, 1_600_000_000 + i))
+    return data_path, directory
+
+
+async def read_stream(response):
+    return "".join([chunk if isinstance(chunk, str) else chunk.decode() async for chunk in response.body_iterator])
+
+
+def test_sort_filter_and_pagination():
+    _, directory = build_tree()
+    index = DirectoryIndex()
+    snapshot = index.get_snapshot(directory)
+
+    names = [e["name"] for e in select_page(snapshot)["entries"]]
+    # Directorios primero y orden sensible a mayúsculas, como el listado original
+    assert names == ["A_dir", "b_dir", "B.MOV", "C.mp4", "a.txt", "b.mp4", "c.jpg"]
+    sizes = [e["name"] for e in select_page(snapshot, sort_by="size", descending=True)["entries"]]
+    assert sizes[2:] == ["c.jpg", "B.MOV", "C.mp4", "a.txt", "b.mp4"]
+    videos = [e["name"] for e in select_page(snapshot, filter_video=True, search="b")["entries"]]
+    assert videos == ["b_dir", "B.MOV", "b.mp4"]
+
+    first = select_page(snapshot, limit=3)
+    assert first["total"] == 7 and first["next_cursor"]
+    # El directorio cambia entre páginas: se sigue después de la última entrada devuelta
+    with open(os.path.join(directory, "0.mp4"), "wb") as f:
+        f.write(b"x")
+    os.utime(directory, ns=(0, 10**9))
+    snapshot = index.get_snapshot(directory)
+    second = select_page(snapshot, cursor=first["next_cursor"], limit=10)
+    assert [e["name"] for e in second["entries"]] == ["C.mp4", "a.txt", "b.mp4", "c.jpg"]
+    assert second["total"] == 8
+    assert index.stats == {"hits": 0, "misses": 2, "invalidations": 0}
+    index.get_snapshot(directory)
+    assert index.stats["hits"] == 1
+
+
+def test_stats_are_consistent_across_threads():
+    _, directory = build_tree()
+    index = DirectoryIndex(max_age=0.0)
+    threads = [threading.Thread(target=lambda: [index.get_snapshot(directory) for _ in range(200)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert index.stats["hits"] + index.stats["misses"] == 1600
+
+
+def test_stream_listing():
+    async def run():
+        data_path, directory = build_tree()
+        file_explorer.disk_manager = SimpleNamespace(data_path=data_path, settings={})
+        file_explorer.directory_index.clear()
+
+        # Sin orden: se empieza a enviar antes de terminar el escaneo
+        scanned = []
+        original = file_explorer.directory_index._build_entry
+
+        def build_entry(entry):
+            scanned.append(entry.name)
+            return original(entry)
+        file_explorer.directory_index._build_entry = build_entry
+        try:
+            response = await file_explorer.stream_directory("videos/clips", sort_by="none")
+            iterator = response.body_iterator
+            header = await iterator.__anext__()
+            assert header.startswith('{"current_directory":') and scanned == []
+            rest = "".join([chunk async for chunk in iterator])
+        finally:
+            file_explorer.directory_index._build_entry = original
+        document = json.loads(header + rest)
+        assert document["total"] == 7 and sorted(e["name"] for e in document["entries"]) == sorted(scanned)
+
+        # El escaneo en streaming deja el directorio en caché para el listado ordenado
+        hits = file_explorer.directory_index.stats["hits"]
+        response = await file_explorer.stream_directory("videos/clips", filter_video=True, sort_by="name", order="asc")
+        document = json.loads(await read_stream(response))
+        assert [e["name"] for e in document["entries"]] == ["A_dir", "b_dir", "B.MOV", "C.mp4", "b.mp4"]
+        assert document["total"] == 5 and file_explorer.directory_index.stats["hits"] == hits + 1
+
+        listing = await file_explorer.list_directory("videos/clips", sort_by="name", order="asc", cursor=None,
+                                                   search=None, limit=2)
+        assert [e["name"] for e in listing["entries"]] == ["A_dir", "b_dir"] and listing["total"] == 7
+
+    asyncio.run(run())
+
+
+def test_stream_listing_scan_errors():
+    async def run():
+        data_path, directory = build_tree()
+        file_explorer.disk_manager = SimpleNamespace(data_path=data_path, settings={})
+        file_explorer.directory_index.clear()
+        index = file_explorer.directory_index
+        original = index._iter_entries
+
+        def failing_scan(path):
+            # El directorio deja de poder leerse a mitad del escaneo (readdir falla)
+            for i, entry in enumerate(original(path)):
+                if i == 2:
+                    raise PermissionError(f"Permission denied: {path}")
+                yield entry
+        index._iter_entries = failing_scan
+        try:
+            # Con orden, el escaneo se hace antes de responder: error HTTP, no un 200 truncado
+            try:
+                await file_explorer.stream_directory("videos/clips", sort_by="name", order="asc")
+                assert False, "se esperaba HTTPException"
+            except HTTPException as e:
+                assert e.status_code == 500
+
+            # Sin orden la cabecera ya salió: el documento se cierra con "error"
+            response = await file_explorer.stream_directory("videos/clips", sort_by="none")
+            document = json.loads(await read_stream(response))
+        finally:
+            index._iter_entries = original
+        assert document["total"] == len(document["entries"]) == 2
+        assert "Permission denied" in document["error"]
+        assert file_explorer.directory_index.cached_snapshot(directory) is None
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
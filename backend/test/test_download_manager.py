@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Tests del gestor de descargas reanudables (utils.download_manager) contra un
+servidor HTTP local con rangos, ETag y fallos inyectados: cortes a mitad de
+respuesta, errores 500, descarga en varios segmentos, reanudación tras un
+reinicio, límite de ancho de banda, comprobación de hash y archivo cambiado
+en el servidor; y su uso desde la descarga de mapas MWM de Organic Maps.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from aiohttp import web
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from utils import download_manager
+from utils.download_manager import DownloadJob, DownloadManager, STATUS_COMPLETED, STATUS_DOWNLOADING, STATUS_FAILED
+from routes.organic_maps_utils import download
+from routes.organic_maps_utils.server_connection import parse_countries_txt
+
+SIZE = 1024 * 1024 + 123
+
+
+class RangeServer:
+    """Servidor de un archivo con Range/If-Range y fallos configurables"""
+
+    def __init__(self, data: bytes, ranges: bool = True):
+        self.data = data
+        self.etag = '"v1"'
+        self.ranges = ranges
+        self.fail_statuses = []
+        self.drop_after = []
+        self.delay = 0.0
+        self.requests = []
+        self.runner = None
+        self.url = None
+
+    async def handle(self, request):
+        range_header = request.headers.get("Range")
+        self.requests.append(range_header)
+        status = self.fail_statuses.pop(0) if self.fail_statuses else None
+        if status:
+            return web.Response(status=status)
+
+        start, end = 0, len(self.data)
+        partial = False
+        if_range = request.headers.get("If-Range")
+        if self.ranges and range_header and (if_range is None or if_range == self.etag):
+            first, last = re.match(r"bytes=(\d+)-(\d*)", range_header).groups()
+            start = int(first)
+            end = min(len(self.data), int(last) + 1) if last else len(self.data)
+            if start >= len(self.data):
+                return web.Response(status=416)
+            partial = True
+
+        response = web.StreamResponse(status=206 if partial else 200)
+        response.content_length = end - start
+        response.headers["ETag"] = self.etag
+        if self.ranges:
+            response.headers["Accept-Ranges"] = "bytes"
+        if partial:
+            response.headers["Content-Range"] = f"bytes {start}-{end - 1}/{len(self.data)}"
+        await response.prepare(request)
+
+        limit = self.drop_after.pop(0) if self.drop_after and end - start > 1 else None
+        position = start
+        while position < end:
+            block = self.data[position:min(end, position + 32 * 1024)]
+            if limit is not None and position - start + len(block) > limit:
+                # Corte de la conexión a mitad de respuesta
+                await response.write(block[:max(0, limit - (position - start))])
+                request.transport.close()
+                return response
+            await response.write(block)
+            position += len(block)
+            if self.delay:
+                await asyncio.sleep(self.delay)
+        await response.write_eof()
+        return response
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/map.mwm", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/map.mwm"
+        return self
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def ranged_starts(self):
+        """Inicio de cada petición con Range (sin contar la de sondeo)"""
+        return [int(r.split("=")[1].split("-")[0]) for r in self.requests[1:] if r]
+
+
+def payload(seed=0):
+    return os.urandom(16) + bytes((i * 31 + seed) % 251 for i in range(SIZE - 16))
+
+
+def new_manager(directory, **kwargs):
+    kwargs.setdefault("retry_delay", 0.01)
+    return DownloadManager(os.path.join(directory, "downloads.db"), **kwargs)
+
+
+def test_retries_resume_with_range_after_failures():
+    async def run():
+        data = payload()
+        server = await RangeServer(data).start()
+        directory = tempfile.mkdtemp()
+        manager = new_manager(directory)
+        try:
+            # Sondeo correcto, un 500 y dos cortes a mitad de respuesta
+            server.fail_statuses = [None, 500]
+            server.drop_after = [300 * 1024, 200 * 1024]
+            dest = os.path.join(directory, "map.mwm")
+            manager.enqueue("map", server.url, dest, expected_sha1=hashlib.sha1(data).hexdigest())
+            job = await manager.wait("map")
+
+            assert job.status == STATUS_COMPLETED, job.error
+            assert open(dest, "rb").read() == data
+            assert not os.path.exists(dest + download_manager.PART_SUFFIX)
+            assert job.sha1 == hashlib.sha1(data).hexdigest()
+            # Cada reintento continúa donde se cortó la conexión
+            assert server.ranged_starts()[-2:] == [300 * 1024, 500 * 1024], server.requests
+            assert manager.get_stats()["retries"] == 3
+        finally:
+            await manager.close()
+            await server.stop()
+
+    asyncio.run(run())
+
+
+def test_segmented_download_with_several_connections():
+    async def run():
+        data = payload(1)
+        server = await RangeServer(data).start()
+        directory = tempfile.mkdtemp()
+        original = download_manager.MIN_SEGMENT_SIZE
+        download_manager.MIN_SEGMENT_SIZE = 128 * 1024
+        manager = new_manager(directory, connections=4)
+        try:
+            server.drop_after = [0, 100 * 1024]
+            dest = os.path.join(directory, "map.mwm")
+            manager.enqueue("map", server.url, dest, expected_size=SIZE)
+            job = await manager.wait("map")
+
+            assert job.status == STATUS_COMPLETED, job.error
+            assert len(job.segments) == 4
+            assert open(dest, "rb").read() == data
+            progress = manager.progress("map")
+            assert progress["progress"] == 100 and progress["downloaded_bytes"] == SIZE
+        finally:
+            download_manager.MIN_SEGMENT_SIZE = original
+            await manager.close()
+            await server.stop()
+
+    asyncio.run(run())
+
+
+def test_queue_survives_restart_and_resumes():
+    async def run():
+        data = payload(2)
+        server = await RangeServer(data).start()
+        directory = tempfile.mkdtemp()
+        dest = os.path.join(directory, "map.mwm")
+        original = download_manager.CHECKPOINT_BYTES
+        download_manager.CHECKPOINT_BYTES = 64 * 1024
+        try:
+            server.delay = 0.02
+            manager = new_manager(directory)
+            manager.enqueue("map", server.url, dest)
+            while (manager.get("map").downloaded_bytes or 0) < 200 * 1024:
+                await asyncio.sleep(0.02)
+            await manager.close()
+
+            saved = new_manager(directory).store.get("map")
+            assert saved.status == STATUS_DOWNLOADING and saved.downloaded_bytes >= 128 * 1024
+            assert saved.downloaded_bytes < SIZE
+
+            server.delay = 0.0
+            server.requests.clear()
+            manager = new_manager(directory)
+            assert manager.resume_pending() == ["map"]
+            job = await manager.wait("map")
+            assert job.status == STATUS_COMPLETED, job.error
+            assert open(dest, "rb").read() == data
+            # Sin sondeo nuevo: la primera petición pide solo lo que faltaba
+            assert server.requests[0] == f"bytes={saved.downloaded_bytes}-{SIZE - 1}"
+            assert manager.resume_pending() == []
+            await manager.close()
+        finally:
+            download_manager.CHECKPOINT_BYTES = original
+            await server.stop()
+
+    asyncio.run(run())
+
+
+def test_bandwidth_limit_is_shared_by_connections():
+    async def run():
+        data = payload(3)
+        server = await RangeServer(data).start()
+        directory = tempfile.mkdtemp()
+        original = download_manager.MIN_SEGMENT_SIZE
+        download_manager.MIN_SEGMENT_SIZE = 128 * 1024
+        manager = new_manager(directory, rate_limit=512 * 1024, connections=3)
+        try:
+            started = time.monotonic()
+            manager.enqueue("map", server.url, os.path.join(directory, "map.mwm"))
+            job = await manager.wait("map")
+            elapsed = time.monotonic() - started
+            assert job.status == STATUS_COMPLETED, job.error
+            # 1 MB a 512 KB/s con un segundo de ráfaga: al menos ~1 s
+            assert 0.9 <= elapsed < 5, elapsed
+        finally:
+            download_manager.MIN_SEGMENT_SIZE = original
+            await manager.close()
+            await server.stop()
+
+    asyncio.run(run())
+
+
+def test_integrity_failure_and_changed_remote_file():
+    async def run():
+        data = payload(4)
+        server = await RangeServer(data).start()
+        directory = tempfile.mkdtemp()
+        manager = new_manager(directory, max_attempts=2)
+        try:
+            dest = os.path.join(directory, "bad.mwm")
+            manager.enqueue("bad", server.url, dest, expected_sha1="0" * 40)
+            job = await manager.wait("bad")
+            assert job.status == STATUS_FAILED and "SHA-1" in job.error
+            assert not os.path.exists(dest) and not os.path.exists(dest + download_manager.PART_SUFFIX)
+
+            # El archivo cambia en el servidor después de un corte: If-Range devuelve 200 y se empieza de cero
+            server.drop_after = [400 * 1024]
+            new_data = payload(5)
+
+            def on_update(job):
+                if job.attempts == 1 and server.data is data:
+                    server.data, server.etag = new_data, '"v2"'
+
+            manager.listeners.append(on_update)
+            dest = os.path.join(directory, "changed.mwm")
+            manager.enqueue("changed", server.url, dest)
+            job = await manager.wait("changed")
+            assert job.status == STATUS_COMPLETED, job.error
+            assert open(dest, "rb").read() == new_data
+            assert job.etag == '"v2"' and manager.get_stats()["restarts"] == 1
+        finally:
+            await manager.close()
+            await server.stop()
+
+    asyncio.run(run())
+
+
+def test_server_without_range_support():
+    async def run():
+        data = payload(6)
+        server = await RangeServer(data, ranges=False).start()
+        directory = tempfile.mkdtemp()
+        manager = new_manager(directory, connections=4)
+        try:
+            server.drop_after = [0, 500 * 1024]
+            dest = os.path.join(directory, "map.mwm")
+            manager.enqueue("map", server.url, dest)
+            job = await manager.wait("map")
+            assert job.status == STATUS_COMPLETED, job.error
+            assert not job.accept_ranges and len(job.segments) == 1
+            assert open(dest, "rb").read() == data
+        finally:
+            await manager.close()
+            await server.stop()
+
+    asyncio.run(run())
+
+
+def test_download_map_file_writes_metadata_and_notifies():
+    async def run():
+        data = payload(7)
+        server = await RangeServer(data).start()
+        data_path = tempfile.mkdtemp()
+        download.config = SimpleNamespace(data_path=data_path, map_download_rate_kbps=0, map_download_connections=2)
+        download._download_manager = None
+        download.active_downloads.clear()
+        notified = []
+        download.download_listeners.append(notified.append)
+        try:
+            region_dir = os.path.join(data_path, "organic_maps", "Spain_Aragon")
+            os.makedirs(region_dir)
+            metadata_path = os.path.join(region_dir, "metadata.json")
+            with open(metadata_path, "w") as f:
+                json.dump({"id": "Spain_Aragon", "status": "downloading", "mwm_url": server.url}, f)
+
+            server.drop_after = [0, 256 * 1024]
+            result = await download.download_map_file(
+                "Spain_Aragon", server.url, os.path.join(region_dir, "Spain_Aragon.mwm.tmp"), metadata_path,
+                expected_size=SIZE, sha1=hashlib.sha1(data).hexdigest())
+
+            assert result["success"], result
+            assert open(result["file_path"], "rb").read() == data
+            metadata = result["metadata"]
+            assert metadata["status"] == "completed" and metadata["sha1"] == hashlib.sha1(data).hexdigest()
+            assert metadata["mwm_url"] == server.url and metadata["size_bytes"] == SIZE
+            state = download.active_downloads["Spain_Aragon"]
+            assert state["status"] == "completed" and state["progress"] == 100
+            assert notified == ["Spain_Aragon"]
+            assert download.get_download_manager().progress("Spain_Aragon")["status"] == STATUS_COMPLETED
+        finally:
+            download.download_listeners.remove(notified.append)
+            await download.close_download_manager()
+            await server.stop()
+
+    asyncio.run(run())
+
+
+def test_checkpoint_saves_offsets_taken_before_fsync():
+    async def run():
+        directory = tempfile.mkdtemp()
+        manager = new_manager(directory)
+        part_path = os.path.join(directory, "map.mwm.part")
+        with open(part_path, "wb") as f:
+            f.truncate(400)
+        job = DownloadJob("map", "http://localhost/map.mwm", os.path.join(directory, "map.mwm"), part_path,
+                          status=STATUS_DOWNLOADING, total_size=400, segments=[[0, 200, 50], [200, 400, 30]])
+        original = download_manager.os.fsync
+
+        def fsync_while_segments_advance(fd):
+            # Los otros segmentos siguen escribiendo (sin fsync) mientras se sincroniza
+            job.segments[0][2] = 120
+            job.segments[1][2] = 90
+            original(fd)
+
+        download_manager.os.fsync = fsync_while_segments_advance
+        fd = os.open(part_path, os.O_RDWR)
+        try:
+            state = {"unsaved": 80}
+            await manager._checkpoint(job, fd, state)
+        finally:
+            download_manager.os.fsync = original
+            os.close(fd)
+        saved = manager.store.get("map")
+        assert saved.segments == [[0, 200, 50], [200, 400, 30]] and state["unsaved"] == 0
+        assert job.segments == [[0, 200, 120], [200, 400, 90]]
+        await manager.close()
+
+    asyncio.run(run())
+
+
+def test_countries_txt_gives_exact_size_and_sha1():
+    countries = {"id": "Countries", "g": [
+        {"id": "Spain", "g": [
+            {"id": "Spain_Aragon", "s": 51234567, "sha1_base64": "2jmj7l5rSw0yVb/vlWAYkK/YBwk="},
+            {"id": "Spain_Madrid", "s": "40000000", "sha1_base64": None},
+        ]},
+        {"id": "Andorra", "s": 1234, "sha1_base64": "qUqP5cyxm6YcTAhz05Hph5gvu9M="},
+    ]}
+    assert parse_countries_txt(countries) == {
+        "Spain_Aragon": (51234567, "2jmj7l5rSw0yVb/vlWAYkK/YBwk="),
+        "Spain_Madrid": (40000000, None),
+        "Andorra": (1234, "qUqP5cyxm6YcTAhz05Hph5gvu9M="),
+    }
+    # Base64 de countries.txt: el gestor lo compara con el SHA-1 en hexadecimal
+    assert download_manager.normalize_sha1("2jmj7l5rSw0yVb/vlWAYkK/YBwk=") == hashlib.sha1(b"").hexdigest()
+    assert parse_countries_txt([]) == {}
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Tests de los packs de gazetteer (geocoding.utils.gazetteer_pack): formato
+binario (cabecera, alineación, claves ordenadas, tabla de cadenas), búsqueda
+por celdas igual que la búsqueda exhaustiva, actualización incremental con
+filas borradas, escrituras concurrentes y activación de packs por viaje.
+"""
+import os
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+from geocoding.services.reverse_geocoding_service import ReverseGeocodingService
+from geocoding.utils import gazetteer_pack
+from geocoding.utils.corridor_planner import cell_codes
+from geocoding.utils.db_storage import store_geodata_batch
+from geocoding.utils.gazetteer_pack import (PACK_FIELDS, PACK_MAGIC, PACK_VERSION, GazetteerPack,
+                                            build_pack, write_pack)
+
+
+def place(lat, lon, city, road="Calle Mayor"):
+    return {"lat": lat, "lon": lon, "city": city, "road": road, "country": "España", "country_code": "es"}
+
+
+def record(lat, lon, city):
+    return {"lat": lat, "lon": lon, "name": city,
+            "address": {"city": city, "road": "Calle Mayor", "country": "España", "country_code": "es"}}
+
+
+def grid_places(count=400, seed=7):
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(40.0, 40.5, count)
+    lons = rng.uniform(-3.9, -3.4, count)
+    return [place(float(lat), float(lon), f"City {i % 37}", road=f"Road {i % 11}")
+            for i, (lat, lon) in enumerate(zip(lats, lons))]
+
+
+def test_binary_layout():
+    path = os.path.join(tempfile.mkdtemp(), "trip.gzpack")
+    places = grid_places(50)
+    write_pack(path, places, {"trip_id": "t1"})
+    data = open(path, "rb").read()
+
+    (magic, version, precision, record_count, string_count, meta_len,
+     keys_off, records_off, strings_off, data_off, meta_off) = gazetteer_pack._HEADER.unpack_from(data, 0)
+    assert magic == PACK_MAGIC and version == PACK_VERSION and record_count == 50
+    assert all(offset % 8 == 0 for offset in (keys_off, records_off, strings_off, meta_off))
+
+    # Claves ordenadas y coherentes con las coordenadas de cada registro
+    keys = np.frombuffer(data, dtype="<u8", count=record_count, offset=keys_off)
+    assert np.all(np.diff(keys.astype(np.int64)) >= 0)
+    coords = [struct.unpack_from("<dd", data, records_off + i * gazetteer_pack._RECORD.size) for i in range(50)]
+    expected = cell_codes(np.array([c[0] for c in coords]), np.array([c[1] for c in coords]), precision)
+    assert keys.astype(np.int64).tolist() == expected.tolist()
+
+    # Cadenas internadas: cada valor distinto una sola vez, la vacía es la 0
+    distinct = {""} | {p.get(field) or "" for p in places for field in PACK_FIELDS}
+    assert string_count == len(distinct)
+    offsets = np.frombuffer(data, dtype="<u4", count=string_count + 1, offset=strings_off)
+    assert offsets[0] == offsets[1] == 0 and data_off == strings_off + 4 * (string_count + 1)
+    assert data[meta_off:meta_off + meta_len] == b'{"trip_id": "t1"}'
+
+    pack = GazetteerPack(path)
+    try:
+        assert pack.metadata == {"trip_id": "t1"}
+        by_coords = {(p["lat"], p["lon"]): p for p in places}
+        for packed in pack.records():
+            original = by_coords[(packed["lat"], packed["lon"])]
+            assert all(packed[field] == (original.get(field) or "") for field in PACK_FIELDS)
+    finally:
+        pack.close()
+
+
+def test_lookup_matches_exhaustive_search():
+    path = os.path.join(tempfile.mkdtemp(), "trip.gzpack")
+    places = grid_places()
+    write_pack(path, places, {})
+    pack = GazetteerPack(path)
+    try:
+        rng = np.random.default_rng(3)
+        for lat, lon in zip(rng.uniform(39.95, 40.55, 200), rng.uniform(-3.95, -3.35, 200)):
+            lat_range = 1.0 / 111.32
+            lon_range = 1.0 / (111.32 * max(abs(np.cos(np.radians(lat))), 0.01))
+            inside = [p for p in places if abs(p["lat"] - lat) <= lat_range and abs(p["lon"] - lon) <= lon_range]
+            result = pack.lookup_nearest(float(lat), float(lon), radius_km=1.0)
+            if not inside:
+                assert result is None
+                continue
+            best = min(abs(p["lat"] - lat) + abs(p["lon"] - lon) for p in inside)
+            assert abs(result["distance"] - best) < 1e-12
+    finally:
+        pack.close()
+
+    # Pack vacío: se abre y no encuentra nada
+    write_pack(path, [], {})
+    pack = GazetteerPack(path)
+    assert pack.record_count == 0 and pack.lookup_nearest(40.0, -3.0) is None
+    pack.close()
+
+
+def test_incremental_build_adds_and_drops_rows():
+    tmp = tempfile.mkdtemp()
+    db_path, pack_path = os.path.join(tmp, "geocoding_offline.db"), os.path.join(tmp, "trip.gzpack")
+    store_geodata_batch([record(40 + i * 0.01, -3.0, f"City {i}") for i in range(10)], "trip1", db_path)
+    store_geodata_batch([record(41.0, -4.0, "Other trip")], "trip2", db_path)
+
+    result = build_pack(db_path, pack_path, trip_id="trip1")
+    assert result["updated"] and result["records"] == 10
+    assert build_pack(db_path, pack_path, trip_id="trip1")["updated"] is False
+
+    store_geodata_batch([record(45.0, -3.0, "New")], "trip1", db_path)
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("DELETE FROM detailed_geocoding WHERE city IN ('City 2', 'City 3')")
+    conn.close()
+
+    result = build_pack(db_path, pack_path, trip_id="trip1")
+    assert result["added"] == 1 and result["removed"] == 2 and result["records"] == 9
+    pack = GazetteerPack(pack_path)
+    try:
+        cities = {p["city"] for p in pack.records()}
+    finally:
+        pack.close()
+    assert "City 2" not in cities and "City 3" not in cities and "New" in cities
+    assert "Other trip" not in cities
+
+
+def test_concurrent_writers_use_unique_temp_files():
+    path = os.path.join(tempfile.mkdtemp(), "trip.gzpack")
+    barrier = threading.Barrier(2)
+    sources, errors = [], []
+    original_replace = gazetteer_pack.os.replace
+
+    def replace(src, dst):
+        # Los dos escritores terminan de escribir antes de que ninguno renombre
+        sources.append(src)
+        barrier.wait(5)
+        original_replace(src, dst)
+
+    def writer(city):
+        try:
+            write_pack(path, [place(40.0, -3.0, city)], {"city": city})
+        except Exception as e:
+            errors.append(e)
+
+    gazetteer_pack.os.replace = replace
+    try:
+        threads = [threading.Thread(target=writer, args=(city,)) for city in ("A", "B")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+    finally:
+        gazetteer_pack.os.replace = original_replace
+
+    assert errors == [] and len(set(sources)) == 2
+    assert os.listdir(os.path.dirname(path)) == ["trip.gzpack"]
+    pack = GazetteerPack(path)
+    assert pack.metadata["city"] in ("A", "B")
+    pack.close()
+
+
+class SlowPackStore:
+    def __init__(self):
+        self.activated = []
+        self.active_trip_id = None
+
+    def activate_trip(self, trip_id):
+        time.sleep(0.05)
+        self.activated.append(trip_id)
+        self.active_trip_id = trip_id
+
+
+def test_set_active_trip_applies_only_the_latest():
+    service = ReverseGeocodingService(os.path.join(tempfile.mkdtemp(), "geocoding.db"))
+    service.gazetteer_packs = SlowPackStore()
+    for trip_id in ("t1", "t2", "t3", None, "t4"):
+        service.set_active_trip(trip_id)
+    for thread in [t for t in threading.enumerate() if t.name == "GazetteerPackLoad"]:
+        thread.join(5)
+    # Nunca dos activaciones a la vez, y la última pedida es la que queda
+    assert service.gazetteer_packs.active_trip_id == "t4"
+    assert service.gazetteer_packs.activated[-1] == "t4" and len(service.gazetteer_packs.activated) <= 2
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
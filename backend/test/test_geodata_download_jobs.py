@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Tests del motor de descarga de geodatos (download_jobs) contra un servidor
+Nominatim de prueba local: concurrencia limitada, límite de peticiones,
+checkpoints por punto para reanudar, pausa y reintento de puntos fallidos.
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from geocoding.downloader.download_jobs import DownloadCheckpointStore, DownloadPoint, TokenBucket
+from geocoding.downloader.geodata_downloader import GeodataDownloader
+from geocoding.utils.db_storage import store_geodata_batch
+
+
+class StubNominatim:
+    """Servidor /reverse mínimo que cuenta peticiones y concurrencia"""
+
+    def __init__(self, delay: float = 0.02, fail_first: int = 0):
+        self.delay = delay
+        self.fail_first = fail_first
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.runner = None
+        self.url = None
+
+    async def reverse(self, request):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            lat, lon = float(request.query["lat"]), float(request.query["lon"])
+            self.requests.append((lat, lon))
+            if len(self.requests) <= self.fail_first:
+                return web.Response(status=503)
+            if lat < 0:
+                # Sin lugar (mar abierto)
+                return web.json_response({"error": "Unable to geocode"})
+            return web.json_response({
+                "place_id": len(self.requests),
+                "display_name": f"Calle {lat:.4f}, Ciudad",
+                "address": {"road": f"Calle {lat:.4f}", "city": "Ciudad", "country": "España", "country_code": "es"},
+                "boundingbox": [str(lat - 0.001), str(lat + 0.001), str(lon - 0.001), str(lon + 0.001)]
+            })
+        finally:
+            self.in_flight -= 1
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/reverse", self.reverse)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/reverse"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+
+def make_points(count: int, lat0: float = 40.0):
+    return [DownloadPoint(lat0 + i * 0.001, -3.7, "grid_point", 1.0, i % 3) for i in range(count)]
+
+
+def count_rows(db_path: str) -> int:
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM detailed_geocoding").fetchone()[0]
+
+
+def test_concurrent_download_streams_batches():
+    async def run():
+        tmp = tempfile.mkdtemp()
+        db_path = os.path.join(tmp, "geocoding.db")
+        batches = []
+
+        def store(records):
+            batches.append(len(records))
+            return store_geodata_batch(records, "trip-1", db_path)
+
+        async with StubNominatim() as server:
+            downloader = GeodataDownloader(nominatim_url=server.url, rate_limiter=TokenBucket(1000, 10),
+                                           concurrency=4)
+            job = downloader.create_job("trip-1:a", make_points(30), store, batch_size=8)
+            result = await job.run()
+            await downloader.close()
+
+        assert result["status"] == "completed"
+        assert result["successful"] == 30 and result["failed"] == 0
+        assert 1 < server.max_in_flight <= 4, server.max_in_flight
+        assert max(batches) <= 8 and sum(batches) == 30, batches
+        assert count_rows(db_path) == 30
+
+    asyncio.run(run())
+
+
+def test_token_bucket_limits_rate():
+    async def run():
+        bucket = TokenBucket(rate=20, capacity=1)
+        start = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(11)))
+        elapsed = time.monotonic() - start
+        # 1 token inicial + 10 a 20/s -> ~0.5 s
+        assert 0.45 <= elapsed < 1.5, elapsed
+
+    asyncio.run(run())
+
+
+def test_cancel_then_resume_from_checkpoint():
+    async def run():
+        tmp = tempfile.mkdtemp()
+        checkpoint = DownloadCheckpointStore(os.path.join(tmp, "jobs.db"))
+        stored = []
+        points = make_points(40)
+
+        async with StubNominatim() as server:
+            downloader = GeodataDownloader(nominatim_url=server.url, rate_limiter=TokenBucket(1000, 10),
+                                           concurrency=3)
+
+            def cancel_midway(job):
+                if job.stats["completed_points"] >= 15:
+                    job.cancel()
+
+            first = downloader.create_job("trip-2:a", points, stored.extend, checkpoint=checkpoint,
+                                          batch_size=5, progress_callback=cancel_midway)
+            result = await first.run()
+            assert result["status"] == "cancelled"
+            done_first = len(checkpoint.completed_points("trip-2:a"))
+            assert 15 <= done_first < 40, done_first
+
+            second = downloader.create_job("trip-2:a", points, stored.extend, checkpoint=checkpoint)
+            result = await second.run()
+            await downloader.close()
+
+        assert result["status"] == "completed"
+        assert result["resumed_points"] == done_first
+        # Ningún punto se pide dos veces y todos quedan guardados
+        assert len(server.requests) == 40, len(server.requests)
+        assert len({(r["lat"], r["lon"]) for r in stored}) == 40
+        checkpoint.close()
+
+    asyncio.run(run())
+
+
+def test_failed_points_are_retried_and_empty_points_are_not():
+    async def run():
+        tmp = tempfile.mkdtemp()
+        checkpoint = DownloadCheckpointStore(os.path.join(tmp, "jobs.db"))
+        points = make_points(6) + make_points(4, lat0=-10.0)
+
+        async with StubNominatim(fail_first=3) as server:
+            # Sin reintentos en el cliente HTTP: aquí se prueba el reintento entre ejecuciones
+            downloader = GeodataDownloader(nominatim_url=server.url, rate_limiter=TokenBucket(1000, 10),
+                                           concurrency=1, max_retries=0)
+            result = await downloader.create_job("trip-3:a", points, lambda r: None,
+                                                 checkpoint=checkpoint).run()
+            assert result["failed"] == 3 and result["empty"] == 4
+            assert len(checkpoint.completed_points("trip-3:a")) == 7
+
+            result = await downloader.create_job("trip-3:a", points, lambda r: None,
+                                                 checkpoint=checkpoint).run()
+            await downloader.close()
+
+        # Solo se repiten los 3 puntos que fallaron
+        assert result["successful"] == 3 and result["failed"] == 0
+        assert len(server.requests) == 13
+        assert len(checkpoint.completed_points("trip-3:a")) == 10
+        checkpoint.close()
+
+    asyncio.run(run())
+
+
+def test_pause_stops_requests_until_resume():
+    async def run():
+        tmp = tempfile.mkdtemp()
+        checkpoint = DownloadCheckpointStore(os.path.join(tmp, "jobs.db"))
+
+        async with StubNominatim() as server:
+            downloader = GeodataDownloader(nominatim_url=server.url, rate_limiter=TokenBucket(1000, 10),
+                                           concurrency=2)
+            job = downloader.create_job("trip-4:a", make_points(20), lambda r: None,
+                                        checkpoint=checkpoint, batch_size=100)
+            task = asyncio.create_task(job.run())
+
+            while job.stats["completed_points"] < 5:
+                await asyncio.sleep(0.005)
+            job.pause()
+            await asyncio.sleep(0.1)
+            paused_at = len(server.requests)
+            await asyncio.sleep(0.2)
+            assert len(server.requests) == paused_at
+            # Lo descargado antes de pausar ya está en el checkpoint
+            assert len(checkpoint.completed_points("trip-4:a")) == paused_at
+
+            job.resume()
+            result = await task
+            await downloader.close()
+
+        assert result["status"] == "completed"
+        assert len(server.requests) == 20
+        checkpoint.close()
+
+    asyncio.run(run())
+
+
+def test_pause_before_run_starts_paused():
+    async def run():
+        tmp = tempfile.mkdtemp()
+        checkpoint = DownloadCheckpointStore(os.path.join(tmp, "jobs.db"))
+
+        async with StubNominatim() as server:
+            downloader = GeodataDownloader(nominatim_url=server.url, rate_limiter=TokenBucket(1000, 10),
+                                           concurrency=2)
+            job = downloader.create_job("trip-5:a", make_points(6), lambda r: None,
+                                        checkpoint=checkpoint, batch_size=100)
+            # Pausado desde la ruta antes de que arranque la tarea
+            job.pause()
+            task = asyncio.create_task(job.run())
+            await asyncio.sleep(0.2)
+            assert job.status == "paused" and len(server.requests) == 0
+
+            job.resume()
+            result = await asyncio.wait_for(task, 10)
+            await downloader.close()
+
+        assert result["status"] == "completed"
+        assert len(server.requests) == 6
+        checkpoint.close()
+
+    asyncio.run(run())
+
+
+def test_cancel_before_run_downloads_nothing():
+    async def run():
+        tmp = tempfile.mkdtemp()
+        checkpoint = DownloadCheckpointStore(os.path.join(tmp, "jobs.db"))
+
+        async with StubNominatim() as server:
+            downloader = GeodataDownloader(nominatim_url=server.url, rate_limiter=TokenBucket(1000, 10),
+                                           concurrency=2)
+            job = downloader.create_job("trip-6:a", make_points(6), lambda r: None,
+                                        checkpoint=checkpoint, batch_size=100)
+            # Cancelado desde la ruta antes de que arranque la tarea
+            job.cancel()
+            result = await asyncio.wait_for(job.run(), 10)
+            await downloader.close()
+
+        assert result["status"] == "cancelled" and job.cancelled
+        assert len(server.requests) == 0 and result["completed_points"] == 0
+        checkpoint.close()
+
+    asyncio.run(run())
+
+
+def test_store_batch_closes_connection():
+    db_path = os.path.join(tempfile.mkdtemp(), "geocoding_offline.db")
+    closed = []
+    original_connect = sqlite3.connect
+
+    class TrackedConnection(sqlite3.Connection):
+        def close(self):
+            closed.append(True)
+            super().close()
+
+    sqlite3.connect = lambda *args, **kwargs: original_connect(*args, factory=TrackedConnection, **kwargs)
+    try:
+        assert store_geodata_batch([{"lat": 40.0, "lon": -3.0, "address": {"city": "Madrid"}}], "trip", db_path) == 1
+    finally:
+        sqlite3.connect = original_connect
+    assert closed == [True]
+    assert count_rows(db_path) == 1
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
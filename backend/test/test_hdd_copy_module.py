@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Tests de la copia a disco externo (backup_engine y hdd_copy_module): copia
+y reanudación con el manifiesto, detección de copias dañadas o desfasadas,
+nombre del archivo en curso y reanudación automática sin tocar la grabación.
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime
+from types import SimpleNamespace
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import hdd_copy_module
+from backup_engine import BackupEngine, BackupItem, BACKUP_DIR_NAME
+from hdd_copy_module import HDDCopyModule
+from trip_logger_package.database.connection import DatabaseManager
+from trip_logger_package.models.db_models import VideoClip as VideoClipModel
+
+
+class FakeRecorder:
+    def __init__(self, recording):
+        self.recording = recording
+        self.recording_thread = None
+
+
+class FakeCameraManager:
+    def __init__(self, recording=False):
+        self.recorder = FakeRecorder(recording)
+        self.trip_logger = None
+        self.calls = []
+
+    def stop_recording(self):
+        self.calls.append("stop")
+        self.recorder.recording = False
+        return []
+
+    def start_recording(self):
+        self.calls.append("start")
+        self.recorder.recording = True
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def clip_items(source_dir, count=3):
+    return [BackupItem(f"clip:{i}:road", i, os.path.join(source_dir, "videos", "2024-01-01", f"clip{i}.mp4"),
+                       f"videos/2024-01-01/clip{i}.mp4") for i in range(count)]
+
+
+def make_items(source_dir, count=3, size=200 * 1024):
+    for i in range(count):
+        write_file(os.path.join(source_dir, "videos", "2024-01-01", f"clip{i}.mp4"), bytes([i]) * size)
+    return clip_items(source_dir, count)
+
+
+def new_module(data_path, camera_manager, drives=()):
+    disk_manager = SimpleNamespace(data_path=data_path, db_path=os.path.join(data_path, "recordings.db"),
+                                   detect_usb_drives=lambda: list(drives))
+    module = HDDCopyModule(disk_manager, camera_manager, SimpleNamespace(announce=lambda message: None))
+    module._resume_stop_event.set()
+    module.db_manager = DatabaseManager(disk_manager.db_path)
+    module.led_controller = None
+    return module
+
+
+def test_manifest_resume_and_stale_copies():
+    source_dir, destination = tempfile.mkdtemp(), tempfile.mkdtemp()
+    items = make_items(source_dir)
+    result = BackupEngine(destination, workers=2).run(items)
+    assert result["status"] == "completed" and result["copied_files"] == 3
+    assert result["current_file"].startswith("videos/2024-01-01/clip")
+
+    # Segunda ejecución: nada que copiar
+    result = BackupEngine(destination).run(clip_items(source_dir))
+    assert result["skipped_files"] == 3 and result["copied_files"] == 0
+
+    # Copia dañada en el destino con el mismo tamaño y fecha: se vuelve a copiar
+    dest_path = os.path.join(destination, BACKUP_DIR_NAME, "videos", "2024-01-01", "clip1.mp4")
+    stat = os.stat(dest_path)
+    with open(dest_path, "r+b") as f:
+        f.write(b"corrupt")
+    os.utime(dest_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    # Origen regrabado en el mismo segundo con el mismo tamaño
+    source_path = os.path.join(source_dir, "videos", "2024-01-01", "clip2.mp4")
+    stat = os.stat(source_path)
+    write_file(source_path, b"\x07" * stat.st_size)
+    os.utime(source_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+
+    result = BackupEngine(destination).run(clip_items(source_dir))
+    assert result["skipped_files"] == 1 and result["copied_files"] == 2
+    assert open(dest_path, "rb").read() == bytes([1]) * 200 * 1024
+    dest_path = os.path.join(destination, BACKUP_DIR_NAME, "videos", "2024-01-01", "clip2.mp4")
+    assert open(dest_path, "rb").read() == b"\x07" * 200 * 1024
+
+
+def test_progress_reports_file_name():
+    data_path, destination = tempfile.mkdtemp(), tempfile.mkdtemp()
+    module = new_module(data_path, FakeCameraManager())
+    engine = BackupEngine(destination, progress_callback=module._on_engine_progress)
+    engine.run(make_items(data_path, count=1))
+    assert module.current_file == "videos/2024-01-01/clip0.mp4"
+    assert module.copy_stats["throughput_mbps"] >= 0
+
+
+def test_auto_resume_never_touches_recording():
+    data_path, destination = tempfile.mkdtemp(), tempfile.mkdtemp()
+    camera_manager = FakeCameraManager(recording=True)
+    module = new_module(data_path, camera_manager, drives=[{"mountpoint": destination, "partitions": []}])
+
+    path = os.path.join(data_path, "videos", "2024-01-01", "clip.mp4")
+    write_file(path, b"v" * 1024)
+    with module.db_manager.session_scope() as session:
+        session.add(VideoClipModel(start_time=datetime(2024, 1, 1), end_time=datetime(2024, 1, 1, 0, 1),
+                                   road_video_file="videos/2024-01-01/clip.mp4"))
+
+    engine = BackupEngine(destination)
+    engine.manifest.ensure_header()
+    module._save_backup_state(interrupted_backup_id=engine.manifest.backup_id, destination=destination)
+
+    # Grabando: la copia pendiente espera
+    assert module.resume_interrupted_copy() is False and camera_manager.calls == []
+
+    # Parada: se reanuda sin detener ni arrancar la grabación aunque empiece a grabar a mitad
+    camera_manager.recorder.recording = False
+    original_finish = module._finish_copy
+    module._finish_copy = lambda success, message: (setattr(camera_manager.recorder, "recording", True),
+                                                    original_finish.__func__(module, success, message))
+    original_sleep = hdd_copy_module.time.sleep
+    hdd_copy_module.time.sleep = lambda seconds: None
+    try:
+        assert module.resume_interrupted_copy() is True
+        module.copy_thread.join(10)
+    finally:
+        hdd_copy_module.time.sleep = original_sleep
+    assert module.copy_status == "completed" and module.copy_stats["copied_files"] == 1
+    assert camera_manager.calls == []
+    assert module.backup_state["interrupted_backup_id"] is None
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
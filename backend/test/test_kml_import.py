@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Tests de la importación de KML/KMZ: lectura en streaming (utils.kml_reader),
+inserción masiva de landmarks en LandmarksDB, índice de proximidad
+incremental de LandmarkChecker y el endpoint import-landmarks-from-kml.
+"""
+import asyncio
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import tracemalloc
+import xml.etree.ElementTree as ET
+import zipfile
+from types import SimpleNamespace
+
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import event
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from landmarks.core.landmark_checker import LandmarkChecker
+from landmarks.core.landmarks_db import LandmarksDB
+import routes.kml_parser as kml_parser
+from utils import kml_reader
+
+
+def build_kml(count, namespace="http://www.opengis.net/kml/2.2"):
+    """Exportación tipo Google My Maps: carpetas con muchos puntos, una ruta y una MultiGeometry"""
+    rng = random.Random(count)
+    xmlns = f' xmlns="{namespace}"' if namespace else ""
+    parts = [f'<?xml version="1.0" encoding="UTF-8"?><kml{xmlns}><Document><name>Export</name>',
+             '<Style id="s"><IconStyle><scale>1</scale></IconStyle></Style>']
+    expected = []
+    for folder in range(4):
+        parts.append(f"<Folder><name>Folder {folder}</name>")
+        for i in range(count // 4):
+            lat, lon = round(rng.uniform(36, 43), 6), round(rng.uniform(-9, 3), 6)
+            name = f"Place {folder}-{i} &amp; co"
+            parts.append(f"<Placemark><name>{name}</name><description><![CDATA[<b>desc {i}</b>]]></description>"
+                         f"<styleUrl>#s</styleUrl><Point><coordinates>\n  {lon},{lat},0\n</coordinates></Point></Placemark>")
+            expected.append({"name": f"Place {folder}-{i} & co", "lat": lat, "lon": lon, "description": f"<b>desc {i}</b>"})
+        parts.append("</Folder>")
+    parts.append("<Placemark><name>Route</name><LineString><coordinates>-3.7,40.4,0 -3.6,40.5,0 bad -3.5,40.6"
+                 "</coordinates></LineString></Placemark>")
+    parts.append("<Placemark><MultiGeometry><Point><coordinates>2.17,41.38</coordinates></Point>"
+                 "<Point><coordinates>2.0,41.0</coordinates></Point></MultiGeometry></Placemark>")
+    expected.append({"name": "Unnamed", "lat": 41.38, "lon": 2.17, "description": None})
+    parts.append("</Document></kml>")
+    return "".join(parts).encode("utf-8"), expected
+
+
+def kmz_bytes(kml):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as kmz:
+        kmz.writestr("images/readme.txt", "x")
+        kmz.writestr("doc.kml", kml)
+    return buffer.getvalue()
+
+
+def upload(content, filename):
+    spooled = tempfile.SpooledTemporaryFile(max_size=1024)
+    spooled.write(content)
+    spooled.seek(0)
+    return UploadFile(spooled, filename=filename)
+
+
+def new_checker(directory):
+    os.environ["DASHCAM_DB_PATH"] = os.path.join(directory, "recordings.db")
+    try:
+        return LandmarkChecker(landmarks_file=os.path.join(directory, "landmarks.json"))
+    finally:
+        del os.environ["DASHCAM_DB_PATH"]
+
+
+def test_streaming_reader_matches_expected_and_stays_small():
+    kml, expected = build_kml(400)
+    result = kml_reader.read_kml(io.BytesIO(kml))
+    assert result["placemarks"] == expected
+    route = [w for w in result["waypoints"] if w["name"].startswith("Route")]
+    assert [(w["name"], w["lat"], w["lon"]) for w in route] == [
+        ("Route - Point 1", 40.4, -3.7), ("Route - Point 2", 40.5, -3.6), ("Route - Point 3", 40.6, -3.5)]
+    assert len(result["waypoints"]) == len(expected) + 3
+
+    # Sin espacio de nombres y dentro de un KMZ
+    plain, plain_expected = build_kml(8, namespace=None)
+    assert list(kml_reader.iter_point_placemarks(io.BytesIO(plain))) == plain_expected
+    with kml_reader.open_kml(io.BytesIO(kmz_bytes(kml)), "export.KMZ") as stream:
+        assert list(kml_reader.iter_point_placemarks(stream)) == expected
+
+    # Los Placemark leídos se sueltan: memoria muy por debajo de la del árbol completo
+    big, _ = build_kml(20000)
+    tracemalloc.start()
+    ET.fromstring(big)
+    dom_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    count = sum(1 for _ in kml_reader.iter_placemarks(io.BytesIO(big)))
+    stream_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert count == 20002
+    assert stream_peak * 4 < dom_peak, (stream_peak, dom_peak)
+
+
+def test_bulk_upsert_is_one_transaction_without_per_landmark_selects():
+    db = LandmarksDB(os.path.join(tempfile.mkdtemp(), "recordings.db"))
+    db.add_landmark({"id": "keep", "name": "Old", "lat": 1.0, "lon": 1.0})
+    created_at = db.get_all_landmarks()[0]["created_at"]
+
+    statements = []
+    event.listen(db.engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, params, context, executemany: statements.append((statement, executemany)))
+    landmarks = [{"id": f"lm{i}", "name": f"L{i}", "lat": 40 + i * 1e-4, "lon": -3.0, "trip_id": "t1"} for i in range(2500)]
+    landmarks.append({"id": "keep", "name": "New", "lat": 2.0, "lon": 2.0, "radius_m": 50})
+    written = db.add_landmarks_bulk(iter(landmarks))
+
+    assert len(written) == 2501
+    # Solo una lectura de created_at por bloque, ninguna por landmark
+    selects = [statement for statement, _ in statements if statement.lstrip().upper().startswith("SELECT")]
+    assert len(selects) == 3 and all("created_at" in statement for statement in selects)
+    inserts = [executemany for statement, executemany in statements if statement.lstrip().upper().startswith("INSERT")]
+    assert inserts == [True, True, True]
+
+    by_id = {landmark["id"]: landmark for landmark in db.get_all_landmarks()}
+    assert len(by_id) == 2501
+    assert by_id["keep"]["name"] == "New" and by_id["keep"]["radius_m"] == 50
+    # Una actualización conserva la fecha de creación, y es la que se devuelve
+    assert by_id["keep"]["created_at"] == created_at
+    returned = {landmark["id"]: landmark for landmark in written}
+    assert returned["keep"]["created_at"] == created_at
+    assert returned["lm7"]["created_at"] == by_id["lm7"]["created_at"]
+    assert by_id["lm7"]["trip_id"] == "t1" and by_id["lm7"]["radius_m"] == 500
+
+
+def test_proximity_index_matches_database_and_updates_incrementally():
+    checker = new_checker(tempfile.mkdtemp())
+    rng = random.Random(3)
+    landmarks = [{"id": f"p{i}", "name": f"P{i}", "lat": rng.uniform(40, 40.2), "lon": rng.uniform(-3.2, -3.0),
+                  "radius_m": rng.choice([100, 500, 2000]), "category": rng.choice(["a", "b"]),
+                  "trip_id": rng.choice(["t1", "t2"])} for i in range(1500)]
+    # Cerca del antimeridiano
+    landmarks.append({"id": "edge", "name": "Edge", "lat": 1.0, "lon": 179.999, "radius_m": 1000})
+    assert checker.add_landmarks_bulk(landmarks) == 1501
+
+    # A partir de aquí nada debe recargar todo desde la base de datos
+    def no_reload():
+        raise AssertionError("full reload")
+    checker.landmarks_db.get_all_landmarks = no_reload
+    assert len(checker.landmarks) == 1501
+
+    def db_nearest(lat, lon, max_distance=None):
+        best = None
+        for landmark in checker.landmarks:
+            distance = checker.landmarks_db._calculate_distance(lat, lon, landmark["lat"], landmark["lon"])
+            radius = landmark["radius_m"] or 500
+            if max_distance is not None:
+                radius = min(radius, max_distance)
+            if distance <= radius and (best is None or distance < best[1]):
+                best = (landmark["id"], distance)
+        return best
+
+    for _ in range(500):
+        lat, lon = rng.uniform(39.95, 40.25), rng.uniform(-3.25, -2.95)
+        max_distance = rng.choice([None, 200])
+        found = checker.check_nearby(lat, lon, max_distance)
+        expected = db_nearest(lat, lon, max_distance)
+        if expected is None:
+            assert found is None, (lat, lon)
+        else:
+            assert (found["id"], found["distance"]) == expected, (lat, lon)
+    assert checker.check_nearby(1.0, -179.999)["id"] == "edge"
+
+    # Aviso con enfriamiento
+    lat, lon = landmarks[0]["lat"], landmarks[0]["lon"]
+    first = checker.check_nearby(lat, lon)
+    assert first["notify"] is True and checker.check_nearby(lat, lon)["notify"] is False
+
+    removed = sum(1 for landmark in landmarks if landmark.get("trip_id") == "t1")
+    assert checker.remove_trip_landmarks("t1") == removed
+    assert len(checker.landmarks) == 1501 - removed
+    assert all(landmark.get("trip_id") != "t1" for landmark in checker.landmarks)
+    assert checker.remove_landmark("edge") and checker.check_nearby(1.0, -179.999) is None
+    remaining_b = sum(1 for landmark in checker.landmarks if landmark["category"] == "b")
+    assert checker.remove_landmarks_by_category("b") == remaining_b
+    assert {landmark["category"] for landmark in checker.landmarks} == {"a"}
+
+
+def test_proximity_index_is_safe_during_bulk_import():
+    checker = new_checker(tempfile.mkdtemp())
+    checker.add_landmark("Here", 40.0, -3.0, radius_m=2000)
+    index = checker.proximity_index
+    errors = []
+
+    def writer():
+        # Como la importación en asyncio.to_thread: altas y bajas mientras se consulta
+        try:
+            for round_ in range(30):
+                index.upsert_many({"id": f"w{i}", "name": f"W{i}", "lat": 40.0 + (i + round_) * 1e-4, "lon": -3.0,
+                                   "radius_m": 100} for i in range(300))
+                index.remove_where(lambda landmark: landmark["id"].startswith("w"))
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    checked = 0
+    while thread.is_alive() or checked == 0:
+        # Con el índice mutando, la búsqueda tiene que seguir viendo el landmark fijo
+        assert checker.check_nearby(40.0, -3.0, 5000) is not None
+        assert index.nearest_in_radius(40.0, -3.0, checker.landmarks_db._calculate_distance) is not None
+        checked += 1
+    thread.join()
+    assert errors == [] and checked > 1
+
+
+def test_import_landmarks_from_kml_endpoint():
+    async def run():
+        directory = tempfile.mkdtemp()
+        checker = new_checker(directory)
+        trip = SimpleNamespace(id="trip1", name="Spain", landmarks_downloaded=False, waypoints=None)
+        kml_parser.landmark_checker = checker
+        kml_parser.planned_trips = [trip]
+        kml, expected = build_kml(2000)
+
+        response = await kml_parser.import_landmarks_from_kml("trip1", upload(kmz_bytes(kml), "export.kmz"), None)
+        assert response["imported_count"] == len(expected) and trip.landmarks_downloaded
+        trip_landmarks = checker.landmarks_db.get_landmarks_by_trip("trip1")
+        assert len(trip_landmarks) == len(expected) and len(checker.landmarks) == len(expected)
+        assert {landmark["category"] for landmark in trip_landmarks} == {"kml_import"}
+        assert checker.check_nearby(expected[5]["lat"], expected[5]["lon"])["name"] == expected[5]["name"]
+
+        # Reimportar el mismo archivo actualiza en lugar de duplicar; la selección filtra por posición
+        response = await kml_parser.import_landmarks_from_kml("trip1", upload(kml, "export.kml"), "[0, 2, 99999]")
+        assert response["imported_count"] == 2
+        assert len(checker.landmarks_db.get_landmarks_by_trip("trip1")) == len(expected)
+
+        preview = await kml_parser.upload_kml_file(upload(kml, "export.kml"))
+        assert preview["placemarks"] == expected
+
+        for content, filename, status in ((b"<kml><Placemark>", "bad.kml", 400), (b"not a zip", "bad.kmz", 400),
+                                          (kml, "export.gpx", 400)):
+            try:
+                await kml_parser.import_landmarks_from_kml("trip1", upload(content, filename), None)
+                assert False, "expected HTTPException"
+            except HTTPException as e:
+                assert e.status_code == status, (filename, e.detail)
+        assert len(checker.landmarks_db.get_landmarks_by_trip("trip1")) == len(expected)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Tests del servicio de teselas MBTiles (utils.mbtiles_service): mosaico de
+varios archivos, LRU y recarga cuando cambia el directorio sin bloquear las
+teselas mientras se indexa un archivo nuevo, índice de cobertura persistido
+y conversión de filas TMS a XYZ.
+"""
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from utils import mbtiles_service
+from utils.mbtiles_service import (COVERAGE_INDEX_FILE, COVERAGE_ZOOM, MBTilesSource, MBTilesTileService,
+                                   _cell_key, tile_bounds)
+
+
+def tile_bytes(z, x, y, label=""):
+    return b'\x89PNG\r\n\x1a\n' + f"{label}{z}/{x}/{y}".encode()
+
+
+def make_mbtiles(path, tiles, name=None, label=""):
+    """MBTiles con ``tiles`` [(z, x, y)] en coordenadas XYZ (se guardan en TMS)"""
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+        conn.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
+        conn.executemany("INSERT INTO metadata VALUES (?, ?)",
+                         [("name", name or os.path.basename(path)), ("format", "png")])
+        conn.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)",
+                         [(z, x, (1 << z) - 1 - y, tile_bytes(z, x, y, label)) for z, x, y in tiles])
+        conn.commit()
+    finally:
+        conn.close()
+    return path
+
+
+def block(z, x0, y0, size):
+    return [(z, x, y) for x in range(x0, x0 + size) for y in range(y0, y0 + size)]
+
+
+def test_mosaic_serves_every_file_and_prefers_the_detailed_one():
+    directory = tempfile.mkdtemp()
+    # Extracto general (pocas teselas) y uno detallado que se solapa en parte
+    make_mbtiles(os.path.join(directory, "a_general.mbtiles"), block(6, 30, 20, 2) + [(12, 2000, 1500)],
+                 label="general:")
+    make_mbtiles(os.path.join(directory, "b_detailed.mbtiles"),
+                 block(12, 2000, 1500, 4) + block(12, 2100, 1400, 2), label="detailed:")
+    service = MBTilesTileService(directory, watch_interval=60)
+
+    assert service.get_tile(6, 31, 21).data == tile_bytes(6, 31, 21, "general:")
+    assert service.get_tile(12, 2101, 1401).data == tile_bytes(12, 2101, 1401, "detailed:")
+    # La misma tesela en los dos: gana el archivo con más teselas en esa celda
+    assert service.get_tile(12, 2000, 1500).data == tile_bytes(12, 2000, 1500, "detailed:")
+    assert service.get_tile(12, 3000, 3000) is None and service.get_tile(3, 0, 0) is None
+
+    # Segunda lectura desde la LRU, también la de una tesela inexistente
+    reads = service.stats["db_reads"]
+    assert service.cached_tile(12, 2000, 1500)[1].data == tile_bytes(12, 2000, 1500, "detailed:")
+    assert service.cached_tile(12, 3000, 3000) == (True, None)
+    assert service.stats["db_reads"] == reads
+
+    metadata = service.get_metadata()
+    assert metadata["name"] == "a_general.mbtiles + b_detailed.mbtiles"
+    assert metadata["minzoom"] == "6" and metadata["maxzoom"] == "12"
+    assert [f["total_tiles"] for f in service.get_files()] == [5, 20]
+    service.close()
+
+
+def test_new_file_is_picked_up_and_removed_file_dropped():
+    directory = tempfile.mkdtemp()
+    make_mbtiles(os.path.join(directory, "spain.mbtiles"), block(10, 500, 380, 2))
+    service = MBTilesTileService(directory, watch_interval=0)
+    assert service.get_tile(10, 600, 300) is None
+
+    path = make_mbtiles(os.path.join(directory, "france.mbtiles"), block(10, 600, 300, 2))
+    assert service.get_tile(10, 600, 300).data == tile_bytes(10, 600, 300)
+    os.remove(path)
+    service.invalidate()
+    assert service.get_tile(10, 600, 300) is None
+    assert service.get_tile(10, 500, 380).data == tile_bytes(10, 500, 380)
+    assert service.stats["reloads"] == 3
+    service.close()
+
+
+def test_tiles_keep_serving_while_a_new_file_is_indexed():
+    directory = tempfile.mkdtemp()
+    make_mbtiles(os.path.join(directory, "spain.mbtiles"), block(10, 500, 380, 2))
+    service = MBTilesTileService(directory, watch_interval=0)
+    assert service.get_tile(10, 500, 380) is not None
+
+    indexing, release = threading.Event(), threading.Event()
+    original = mbtiles_service.MBTilesSource.compute_coverage
+
+    def slow_coverage(source):
+        indexing.set()
+        release.wait(5)
+        return original(source)
+
+    mbtiles_service.MBTilesSource.compute_coverage = slow_coverage
+    try:
+        make_mbtiles(os.path.join(directory, "france.mbtiles"), block(10, 600, 300, 2))
+        builder = threading.Thread(target=service.get_tile, args=(10, 501, 381))
+        builder.start()
+        assert indexing.wait(5)
+
+        # Con el índice a medias, las teselas salen del mosaico anterior al momento
+        started = time.monotonic()
+        assert service.get_tile(10, 501, 380).data == tile_bytes(10, 501, 380)
+        assert service.get_tile(10, 600, 300) is None
+        assert service.get_metadata()["name"] == "spain.mbtiles"
+        assert time.monotonic() - started < 1
+        release.set()
+        builder.join(5)
+    finally:
+        mbtiles_service.MBTilesSource.compute_coverage = original
+        release.set()
+
+    assert service.get_tile(10, 600, 300).data == tile_bytes(10, 600, 300)
+    service.close()
+
+
+def test_coverage_cells_are_in_xyz():
+    path = make_mbtiles(os.path.join(tempfile.mkdtemp(), "tiles.mbtiles"),
+                        block(5, 10, 12, 2) + block(COVERAGE_ZOOM + 2, 301, 398, 4))
+    source = MBTilesSource(path)
+    try:
+        coverage = source.compute_coverage()
+        # Por debajo de COVERAGE_ZOOM cada celda es una tesela
+        assert sorted(tuple(c) for c in coverage["cells"]["5"]) == sorted((x, y, 1) for _, x, y in block(5, 10, 12, 2))
+        # Por encima, celdas de 4x4 teselas con la fila ya en XYZ: 301..304 y 398..401
+        # caen en dos celdas por eje
+        z = COVERAGE_ZOOM + 2
+        cells = {(cx, cy): count for cx, cy, count in coverage["cells"][str(z)]}
+        assert cells == {(75, 99): 6, (76, 99): 2, (75, 100): 6, (76, 100): 2}
+        assert set(cells) == {_cell_key(z, x, y)[1:] for _, x, y in block(z, 301, 398, 4)}
+
+        zoom = coverage["zooms"][str(z)]
+        assert zoom["tiles"] == 16 and zoom["range"] == [300, 396, 307, 403]
+        assert zoom["bounds"] == [round(v, 6) for v in tile_bounds(z, 300, 396, 307, 403)]
+        west, south, east, north = zoom["bounds"]
+        assert west < east and south < north
+
+        # Lectura en XYZ de filas guardadas en TMS, en los bordes de celda
+        for _, x, y in block(z, 301, 398, 4):
+            assert source.read_tile(z, x, y) == tile_bytes(z, x, y)
+        assert source.read_tile(z, 301, (1 << z) - 1 - 398) is None
+    finally:
+        source.close()
+
+
+def test_tile_lookup_routes_every_xyz_tile_to_its_file():
+    directory = tempfile.mkdtemp()
+    z = COVERAGE_ZOOM + 3
+    north = block(z, 1000, 700, 9)
+    south = block(z, 1000, 709, 9)
+    make_mbtiles(os.path.join(directory, "north.mbtiles"), north, label="north:")
+    make_mbtiles(os.path.join(directory, "south.mbtiles"), south, label="south:")
+    service = MBTilesTileService(directory, watch_interval=60)
+    try:
+        for label, tiles in (("north:", north), ("south:", south)):
+            for _, x, y in tiles:
+                assert service.get_tile(z, x, y).data == tile_bytes(z, x, y, label)
+        # Tesela sin datos dentro de una celda cubierta
+        assert service.get_tile(z, 1009, 700) is None
+    finally:
+        service.close()
+
+
+def test_coverage_index_is_persisted_and_revalidated():
+    directory = tempfile.mkdtemp()
+    spain = make_mbtiles(os.path.join(directory, "spain.mbtiles"), block(10, 500, 380, 2))
+    france = make_mbtiles(os.path.join(directory, "france.mbtiles"), block(10, 600, 300, 2))
+    calls = []
+    original = MBTilesSource.compute_coverage
+
+    def counting(source):
+        calls.append(os.path.basename(source.path))
+        return original(source)
+
+    MBTilesSource.compute_coverage = counting
+    try:
+        service = MBTilesTileService(directory, watch_interval=60)
+        service.invalidate()
+        service.close()
+        assert sorted(calls) == ["france.mbtiles", "spain.mbtiles"]
+        index_path = os.path.join(directory, COVERAGE_INDEX_FILE)
+        with open(index_path) as f:
+            assert sorted(json.load(f)["files"]) == ["france.mbtiles", "spain.mbtiles"]
+
+        # Otro arranque: todo sale del índice
+        calls.clear()
+        service = MBTilesTileService(directory, watch_interval=60)
+        assert service.get_tile(10, 600, 300) is not None
+        service.close()
+        assert calls == []
+
+        # Archivo reescrito: solo se reindexa ese; archivo borrado: sale del índice
+        os.remove(spain)
+        make_mbtiles(spain, block(10, 500, 380, 3))
+        os.remove(france)
+        service = MBTilesTileService(directory, watch_interval=60)
+        assert service.get_tile(10, 502, 382) is not None and service.get_tile(10, 600, 300) is None
+        service.close()
+        assert calls == ["spain.mbtiles"]
+        with open(index_path) as f:
+            files = json.load(f)["files"]
+        assert list(files) == ["spain.mbtiles"] and files["spain.mbtiles"]["zooms"]["10"]["tiles"] == 9
+
+        # Índice de otra versión: se ignora y se recalcula
+        with open(index_path, "w") as f:
+            json.dump({"version": -1, "coverage_zoom": COVERAGE_ZOOM, "files": files}, f)
+        calls.clear()
+        service = MBTilesTileService(directory, watch_interval=60)
+        service.get_tile(10, 500, 380)
+        service.close()
+        assert calls == ["spain.mbtiles"]
+    finally:
+        MBTilesSource.compute_coverage = original
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
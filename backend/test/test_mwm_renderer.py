@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Tests del servicio de renderizado de teselas MWM (utils.mwm_renderer):
+lectura sobre mmap con tabla de secciones perezosa, agrupación de peticiones,
+cola con prioridad (viewport antes que precalentamiento) y renderizado real
+en el pool de procesos.
+"""
+import asyncio
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import utils.mwm_renderer as mwm_renderer
+from tools.mwm_extractor import MWMReader
+from utils.mwm_renderer import MappedMWMReader, MWMTileRenderer, PRIORITY_WARM, RendererBusy
+
+
+def write_mwm(path, sections):
+    with open(path, "wb") as f:
+        f.write(b"MWM" + bytes([7, 1]))
+        for tag, offset, size in sections:
+            f.write(tag.ljust(8, b"\x00") + struct.pack("<QQ", offset, size))
+    return path
+
+
+def test_mapped_reader_matches_reader_and_reads_sections_lazily():
+    path = write_mwm(os.path.join(tempfile.mkdtemp(), "spain.mwm"),
+                     [(b"dat", 5, 24), (b"geom0", 29, 8), (b"dat", 53, 16)])
+    # Índice que dejaban versiones anteriores: se borra al abrir
+    legacy_index = path + mwm_renderer.LEGACY_SECTION_INDEX_SUFFIX
+    with open(legacy_index, "w") as f:
+        f.write("{}")
+
+    # Abrir y extraer teselas no recorre la tabla de secciones
+    original = MappedMWMReader._read_sections
+    MappedMWMReader._read_sections = lambda self: (_ for _ in ()).throw(AssertionError("scanned"))
+    try:
+        reader = MappedMWMReader(path)
+        assert reader.header == MWMReader(path).header
+        reader.extract_tile(10, 500, 380)
+    finally:
+        MappedMWMReader._read_sections = original
+    assert not os.path.exists(legacy_index)
+
+    expected = MWMReader(path)
+    assert reader.sections == expected.sections
+    assert reader.get_section_data("dat") == expected.get_section_data("dat")
+    assert reader.get_section_data("missing") is None
+    reader.close()
+
+    # Nada se persiste junto al mapa
+    assert os.listdir(os.path.dirname(path)) == ["spain.mwm"]
+    with open(path, "r+b") as f:
+        f.write(b"XYZ")
+    try:
+        MappedMWMReader(path)
+        assert False, "invalid header accepted"
+    except ValueError:
+        pass
+
+
+def test_concurrent_requests_are_coalesced_and_viewport_goes_first():
+    calls = []
+    gate = threading.Event()
+
+    def fake_render(paths, z, x, y, output_path, mwm_tool=None):
+        gate.wait(5)
+        calls.append((z, x, y))
+        return b"png-" + output_path.encode()
+
+    async def run():
+        original = mwm_renderer.render_mwm_tile
+        mwm_renderer.render_mwm_tile = fake_render
+        renderer = MWMTileRenderer(workers=1, use_processes=False)
+        try:
+            # El primer trabajo ocupa el único worker; el resto espera en la cola
+            first = asyncio.ensure_future(renderer.render(["a.mwm"], 10, 0, 0, "t/10/0/0.png"))
+            await asyncio.sleep(0.05)
+            warm = asyncio.ensure_future(renderer.warm(["a.mwm"], [(12, i, 0, f"t/12/{i}/0.png") for i in range(3)]))
+            await asyncio.sleep(0.05)
+            viewport = [asyncio.ensure_future(renderer.render(["a.mwm"], 14, 5, 5, "t/14/5/5.png")) for _ in range(5)]
+            await asyncio.sleep(0.05)
+            gate.set()
+            results = await asyncio.gather(first, *viewport)
+            assert await warm == 3
+        finally:
+            mwm_renderer.render_mwm_tile = original
+            await renderer.close()
+
+        assert len(set(results[1:])) == 1 and results[1] == b"png-t/14/5/5.png"
+        # Una sola renderización de la tesela visible, y antes que el precalentamiento
+        assert calls.count((14, 5, 5)) == 1
+        assert calls[:2] == [(10, 0, 0), (14, 5, 5)]
+        assert renderer.stats["coalesced"] == 4
+
+    asyncio.run(run())
+
+
+def test_full_queue_evicts_warm_tiles_and_rejects_equal_priority():
+    gate = threading.Event()
+
+    def fake_render(paths, z, x, y, output_path, mwm_tool=None):
+        gate.wait(5)
+        return b"png"
+
+    async def run():
+        original = mwm_renderer.render_mwm_tile
+        mwm_renderer.render_mwm_tile = fake_render
+        renderer = MWMTileRenderer(workers=1, max_queue=2, use_processes=False)
+        try:
+            busy = asyncio.ensure_future(renderer.render([], 10, 0, 0, "busy"))
+            await asyncio.sleep(0.05)
+            warm = [asyncio.ensure_future(renderer.render([], 12, i, 0, f"warm{i}", priority=PRIORITY_WARM))
+                    for i in range(2)]
+            await asyncio.sleep(0.05)
+            visible = [asyncio.ensure_future(renderer.render([], 14, i, 1, f"visible{i}")) for i in range(2)]
+            await asyncio.sleep(0.05)
+            # Cola llena de teselas visibles: la siguiente se rechaza
+            try:
+                await renderer.render([], 14, 2, 2, "visible-2")
+                assert False, "expected RendererBusy"
+            except RendererBusy:
+                pass
+            gate.set()
+            assert await asyncio.gather(*visible) == [b"png", b"png"]
+            # Las teselas de precalentamiento dejaron su sitio a las visibles
+            assert await asyncio.gather(*warm) == [None, None]
+            await busy
+        finally:
+            mwm_renderer.render_mwm_tile = original
+            await renderer.close()
+
+        assert renderer.stats["evicted"] == 2 and renderer.stats["rejected"] == 1
+
+    asyncio.run(run())
+
+
+def test_process_pool_renders_and_stores_png():
+    async def run():
+        root = tempfile.mkdtemp()
+        path = write_mwm(os.path.join(root, "spain.mwm"), [(b"dat", 5, 24)])
+        renderer = MWMTileRenderer(workers=1)
+        try:
+            output = os.path.join(root, "tiles", "12", "2000", "1500.png")
+            data = await renderer.render([path], 12, 2000, 1500, output)
+        finally:
+            await renderer.close()
+
+        assert data.startswith(b"\x89PNG")
+        with open(output, "rb") as f:
+            assert f.read() == data
+        assert renderer.stats["rendered"] == 1
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
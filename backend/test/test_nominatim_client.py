@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Tests del cliente HTTP compartido de Nominatim (nominatim_api) contra un
+servidor local: reutilización de conexiones, reintentos condicionales,
+Retry-After, presupuesto de reintentos, límite de peticiones e histogramas.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+
+from aiohttp import web
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from geocoding.downloader.download_jobs import TokenBucket
+from geocoding.downloader.nominatim_api import NominatimHTTPClient, RetryBudget
+
+
+class MockNominatim:
+    """Servidor /reverse y /search que responde según una lista de estados"""
+
+    def __init__(self, statuses=(), retry_after=None, delay: float = 0.0):
+        self.statuses = list(statuses)
+        self.retry_after = retry_after
+        self.delay = delay
+        self.requests = []
+        self.peers = set()
+        self.runner = None
+        self.url = None
+
+    def _next_status(self) -> int:
+        return self.statuses.pop(0) if self.statuses else 200
+
+    async def reverse(self, request):
+        self.requests.append((time.monotonic(), dict(request.query)))
+        self.peers.add(request.transport.get_extra_info("peername"))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        status = self._next_status()
+        if status != 200:
+            headers = {"Retry-After": str(self.retry_after)} if status == 429 and self.retry_after is not None else {}
+            return web.Response(status=status, headers=headers)
+        return web.json_response({
+            "display_name": "Calle Mayor, Madrid",
+            "address": {"road": "Calle Mayor", "city": "Madrid", "country_code": "es"},
+            "user_agent": request.headers.get("User-Agent")
+        })
+
+    async def search(self, request):
+        self.requests.append((time.monotonic(), dict(request.query)))
+        return web.json_response([{"display_name": request.query["q"], "lat": "40.4", "lon": "-3.7"}])
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/reverse", self.reverse)
+        app.router.add_get("/search", self.search)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+
+def make_client(url: str, **kwargs) -> NominatimHTTPClient:
+    kwargs.setdefault("rate_limiter", TokenBucket(1000, 100))
+    kwargs.setdefault("backoff_base", 0.01)
+    return NominatimHTTPClient(base_url=url, **kwargs)
+
+
+def test_keep_alive_reuses_connection():
+    async def run():
+        async with MockNominatim() as server:
+            client = make_client(server.url, user_agent="TestAgent/1.0")
+            for i in range(5):
+                data = await client.reverse(40.0 + i * 0.01, -3.7, zoom=18)
+                assert data["display_name"] == "Calle Mayor, Madrid"
+            await client.close()
+
+        assert len(server.requests) == 5
+        # Una sola conexión TCP para las 5 peticiones
+        assert len(server.peers) == 1
+        assert server.requests[0][1]["zoom"] == "18" and server.requests[0][1]["format"] == "json"
+        assert data["user_agent"] == "TestAgent/1.0"
+        stats = client.get_stats()
+        assert stats["sessions_created"] == 1 and stats["successful"] == 5 and stats["retries"] == 0
+
+    asyncio.run(run())
+
+
+def test_retries_transient_errors_only():
+    async def run():
+        async with MockNominatim(statuses=[503, 502]) as server:
+            client = make_client(server.url)
+            assert await client.reverse(40.0, -3.7) is not None
+            assert len(server.requests) == 3
+
+            # 404 no es transitorio: no se reintenta
+            server.statuses = [404]
+            assert await client.reverse(40.0, -3.7) is None
+            assert len(server.requests) == 4
+
+            # Agotados los reintentos
+            server.statuses = [500, 500, 500, 500]
+            assert await client.reverse(40.0, -3.7) is None
+            assert len(server.requests) == 7
+            await client.close()
+
+        stats = client.get_stats()
+        assert stats["requests"] == 3 and stats["successful"] == 1 and stats["failed"] == 2
+        assert stats["retries"] == 4 and stats["attempts"] == 7
+        assert stats["error_histogram"] == {"http_503": 1, "http_502": 1, "http_404": 1, "http_500": 3}
+        assert sum(stats["latency_histogram"].values()) == 7
+
+    asyncio.run(run())
+
+
+def test_retry_after_is_honored():
+    async def run():
+        async with MockNominatim(statuses=[429], retry_after=0.3) as server:
+            client = make_client(server.url)
+            assert await client.reverse(40.0, -3.7) is not None
+            await client.close()
+        assert len(server.requests) == 2
+        assert server.requests[1][0] - server.requests[0][0] >= 0.29
+
+        # Un Retry-After mayor que max_retry_after no se espera
+        async with MockNominatim(statuses=[429], retry_after=120) as server:
+            client = make_client(server.url, max_retry_after=5)
+            assert await client.reverse(40.0, -3.7) is None
+            await client.close()
+        assert len(server.requests) == 1
+
+    asyncio.run(run())
+
+
+def test_retry_budget_limits_retries_during_outage():
+    async def run():
+        async with MockNominatim(statuses=[503] * 100) as server:
+            client = make_client(server.url, retry_budget=RetryBudget(ratio=0.1, capacity=3))
+            for _ in range(10):
+                assert await client.reverse(40.0, -3.7) is None
+            await client.close()
+
+        stats = client.get_stats()
+        # 3 fichas iniciales + 0.1 por petición: muchos menos que 10 * 2 reintentos
+        assert stats["retries"] == 3
+        assert stats["retry_budget_exhausted"] == 9
+        assert len(server.requests) == 13
+
+    asyncio.run(run())
+
+
+def test_timeout_is_recorded_and_retried():
+    async def run():
+        async with MockNominatim(delay=0.5) as server:
+            client = make_client(server.url, timeout=0.1, max_retries=1)
+            assert await client.reverse(40.0, -3.7) is None
+            await client.close()
+        stats = client.get_stats()
+        assert stats["error_histogram"] == {"timeout": 2}
+        assert stats["attempts"] == 2
+
+    asyncio.run(run())
+
+
+def test_shared_rate_limiter_across_loops():
+    """Dos event loops (hilos) con el mismo cliente respetan el límite global"""
+    async def requests(client, count):
+        for i in range(count):
+            await client.reverse(40.0 + i * 0.01, -3.7)
+
+    async def run():
+        async with MockNominatim() as server:
+            client = make_client(server.url, rate_limiter=TokenBucket(rate=20.0, capacity=1.0))
+            thread = threading.Thread(target=lambda: asyncio.run(requests(client, 5)))
+            started = time.monotonic()
+            thread.start()
+            await requests(client, 5)
+            await asyncio.to_thread(thread.join)
+            elapsed = time.monotonic() - started
+            await client.close()
+
+        assert len(server.requests) == 10
+        # 10 peticiones a 20/s con una sola ficha inicial: al menos 9/20 s
+        assert elapsed >= 0.44
+        assert client.get_stats()["sessions_created"] == 2
+
+    asyncio.run(run())
+
+
+def test_search():
+    async def run():
+        async with MockNominatim() as server:
+            client = make_client(server.url)
+            results = await client.search("Puerta del Sol", limit=3, addressdetails=1)
+            await client.close()
+        assert results[0]["display_name"] == "Puerta del Sol"
+        assert server.requests[0][1] == {"q": "Puerta del Sol", "format": "json", "limit": "3",
+                                         "addressdetails": "1"}
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Tests de la base de datos offline de geocoding (geocoding.utils.db_storage):
+el índice R*Tree se construye sin bloquear las consultas ni el event loop,
+y las sustituciones con INSERT OR REPLACE no dejan entradas huérfanas.
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from geocoding.utils import db_storage
+from geocoding.utils.db_storage import DBStorage, store_geodata_batch
+
+
+def record(lat, lon, city):
+    return {"lat": lat, "lon": lon, "name": city,
+            "address": {"city": city, "road": "Calle Mayor", "country": "España", "country_code": "es"}}
+
+
+def new_database(count=200):
+    path = os.path.join(tempfile.mkdtemp(), "geocoding_offline.db")
+    store_geodata_batch([record(40 + i * 0.01, -3 - i * 0.01, f"City {i}") for i in range(count)], "trip1", path)
+    return path
+
+
+def test_index_build_does_not_block_lookups():
+    path = new_database()
+    storage = DBStorage(geocoding_db_path=path)
+    building, release = threading.Event(), threading.Event()
+    original = db_storage.ensure_spatial_index
+
+    def slow_ensure(*args, **kwargs):
+        building.set()
+        release.wait(5)
+        return original(*args, **kwargs)
+
+    db_storage.ensure_spatial_index = slow_ensure
+    try:
+        thread = threading.Thread(target=storage.prepare)
+        thread.start()
+        assert building.wait(5)
+        # Sin índice todavía: la consulta responde al momento sin esperar a la construcción
+        started = time.monotonic()
+        assert storage.lookup_nearest(40.0, -3.0) is None
+        assert time.monotonic() - started < 1
+        release.set()
+        thread.join(5)
+    finally:
+        db_storage.ensure_spatial_index = original
+        release.set()
+
+    result = storage.lookup_nearest(40.0501, -3.0501, radius_km=2.0)
+    assert result["city"] == "City 5" and storage._sources[0].spatial_index == "rtree"
+    storage.close()
+
+
+def test_async_methods_do_not_block_the_event_loop():
+    async def run():
+        path = new_database()
+        storage = DBStorage(geocoding_db_path=path)
+        storage.prepare()
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        holder = threading.Thread(target=lambda: (storage._lock.acquire(), time.sleep(0.3), storage._lock.release()))
+        holder.start()
+        await asyncio.sleep(0.02)
+        task = asyncio.create_task(ticker())
+        try:
+            assert await storage.is_available()
+            before = len(ticks)
+            assert await storage.get_record_count() >= 200
+            result = await storage.reverse_geocode(40.1, -3.1, radius_km=2.0)
+        finally:
+            task.cancel()
+        holder.join()
+        # El bucle siguió atendiendo otras tareas mientras se esperaba el lock
+        assert before >= 5, before
+        assert result["city"] == "City 10"
+        storage.close()
+
+    asyncio.run(run())
+
+
+def test_replaced_rows_leave_no_orphan_rtree_entries():
+    path = new_database(10)
+    # Un índice construido antes del trigger ya tenía huérfanos de sustituciones anteriores
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE VIRTUAL TABLE detailed_geocoding_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)")
+        conn.execute("INSERT INTO detailed_geocoding_rtree VALUES (9999, 1, 1, 1, 1)")
+        conn.execute("INSERT INTO detailed_geocoding_rtree SELECT rowid, lat, lat, lon, lon FROM detailed_geocoding")
+    storage = DBStorage(geocoding_db_path=path)
+    storage.prepare()
+
+    store_geodata_batch([record(40.0, -3.0, "Renamed"), record(40.0, -3.0, "Renamed again")], "trip1", path)
+    # Sin trip_id (NULL) no hay sustitución: las dos filas quedan indexadas
+    store_geodata_batch([record(50.0, 5.0, "A"), record(50.0, 5.0, "B")], None, path)
+
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("SELECT COUNT(*) FROM detailed_geocoding").fetchone()[0]
+        indexed = conn.execute("SELECT COUNT(*) FROM detailed_geocoding_rtree").fetchone()[0]
+        orphans = conn.execute("SELECT COUNT(*) FROM detailed_geocoding_rtree "
+                               "WHERE id NOT IN (SELECT rowid FROM detailed_geocoding)").fetchone()[0]
+    finally:
+        conn.close()
+    assert rows == 12 and indexed == 12 and orphans == 0
+    assert storage.lookup_nearest(40.0, -3.0)["city"] == "Renamed again"
+    storage.close()
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Tests de los radios adaptativos (adaptive_radius_calculator) y del
+optimizador de radio (radius_optimizer) con índice espacial frente a los
+recorridos O(n²) anteriores, sobre waypoints aleatorios con semilla que
+incluyen waypoints duplicados y colocalizados.
+"""
+import os
+import sys
+import random
+
+import numpy as np
+from geopy.distance import geodesic
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from geocoding.utils.adaptive_radius_calculator import AdaptiveRadiusCalculator
+from utils.spatial_index import geodesic_km
+from landmarks.services.radius_optimizer import (
+    CirclePackingOptimizer, CoverageCircle, RadiusOptimizer, Waypoint, WaypointDensityAnalyzer
+)
+
+# Ciudades en franjas de latitud urbana, suburbana y rural
+CENTERS = [(40.42, -3.70), (41.39, 2.17), (25.77, -80.19), (65.01, 25.47), (5.6, -0.19)]
+
+
+def random_points(count, seed, spread=0.15):
+    rng = random.Random(seed)
+    points = []
+    for i in range(count):
+        lat, lon = rng.choice(CENTERS)
+        points.append((lat + rng.gauss(0, spread), lon + rng.gauss(0, spread), f"Parada {i}"))
+    return points
+
+
+def waypoint_dicts(seed, count=80):
+    waypoints = [{"lat": lat, "lon": lon, "name": name} for lat, lon, name in random_points(count, seed)]
+    # El mismo dict dos veces, una copia igual y un punto colocalizado con otro nombre
+    waypoints.append(waypoints[3])
+    waypoints.append(dict(waypoints[5]))
+    waypoints.append({**waypoints[7], "name": "Colocalizado"})
+    return waypoints
+
+
+def legacy_radii(calculator, waypoints):
+    """Cálculo anterior: dos recorridos de todos los waypoints por cada waypoint"""
+    radii = []
+    for waypoint in waypoints:
+        area_type = calculator.detect_area_type(waypoint['lat'], waypoint['lon'])
+        base = {"urban": 6.0, "suburban": 10.0}.get(area_type, 15.0)
+        radius = base * calculator.calculate_density_factor(waypoint, waypoints)
+        radius *= calculator.calculate_overlap_reduction_factor(waypoint, waypoints, radius)
+        radii.append(max(calculator.min_radius, min(calculator.max_radius, radius)))
+    return radii
+
+
+class LegacyDensityAnalyzer(WaypointDensityAnalyzer):
+    """Clustering anterior: cada waypoint contra todos los demás"""
+
+    def analyze_density_clusters(self, waypoints):
+        if not waypoints:
+            return []
+        analysis_radius = 15.0 if len(waypoints) > 50 else 10.0
+        clusters = []
+        visited = set()
+        for i, waypoint in enumerate(waypoints):
+            if i in visited:
+                continue
+            cluster = [waypoint]
+            visited.add(i)
+            for j, other_waypoint in enumerate(waypoints):
+                if j in visited or i == j:
+                    continue
+                if waypoint.distance_to(other_waypoint) <= analysis_radius:
+                    cluster.append(other_waypoint)
+                    visited.add(j)
+            if len(cluster) >= 3 or len(waypoints) <= 20:
+                clusters.append(cluster)
+            else:
+                clusters.extend([wp] for wp in cluster)
+        return clusters
+
+
+class LegacyPackingOptimizer(CirclePackingOptimizer):
+    """Ajuste rápido anterior: cada círculo contra todos los ya procesados"""
+
+    def _fast_overlap_adjustment(self, circles):
+        adjusted_circles = []
+        for circle in circles:
+            adjusted_circle = circle
+            for existing in adjusted_circles:
+                overlap_area = adjusted_circle.overlap_area_with(existing)
+                overlap_ratio = overlap_area / adjusted_circle.area() if adjusted_circle.area() > 0 else 0
+                if overlap_ratio > self.overlap_tolerance:
+                    distance_between_centers = existing.center.distance_to(adjusted_circle.center)
+                    new_radius = max(distance_between_centers * 0.9, self.overlap_tolerance * adjusted_circle.radius_km, 2.0)
+                    covered = [wp for wp in adjusted_circle.waypoints_covered
+                               if adjusted_circle.center.distance_to(wp) <= new_radius]
+                    adjusted_circle = CoverageCircle(adjusted_circle.center, new_radius, covered)
+            adjusted_circles.append(adjusted_circle)
+        return adjusted_circles
+
+
+def legacy_optimizer():
+    optimizer = RadiusOptimizer()
+    optimizer.density_analyzer = LegacyDensityAnalyzer(optimizer.min_radius_km, optimizer.max_radius_km)
+    optimizer.packing_optimizer = LegacyPackingOptimizer(optimizer.overlap_tolerance)
+    return optimizer
+
+
+def legacy_overlap(circles):
+    return sum(c1.overlap_area_with(c2) for i, c1 in enumerate(circles) for c2 in circles[i + 1:])
+
+
+def circle_summary(circles):
+    return [(c.center.lat, c.center.lon, c.radius_km, [(wp.lat, wp.lon, wp.name) for wp in c.waypoints_covered])
+            for c in circles]
+
+
+def test_vectorized_geodesic_matches_geopy():
+    rng = random.Random(37)
+    pairs = [(rng.uniform(-89, 89), rng.uniform(-180, 180), rng.uniform(-89, 89), rng.uniform(-180, 180))
+             for _ in range(300)]
+    # Mismo punto, ecuador, antimeridiano, cerca del polo y a pocos metros
+    pairs += [(10, 20, 10, 20), (0, 0, 0, 1), (0, 179.9, 0, -179.9), (89.9, 0, 89.9, 180), (40, -3, 40.0001, -3)]
+    coords = np.array(pairs)
+    distances = geodesic_km(coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3])
+    expected = [geodesic((a, b), (c, d)).kilometers for a, b, c, d in pairs]
+    assert np.max(np.abs(distances - expected)) < 1e-6
+
+
+def test_optimized_radii_match_per_waypoint_calculation():
+    calculator = AdaptiveRadiusCalculator()
+    for seed in (37, 370):
+        waypoints = waypoint_dicts(seed)
+        radii = calculator.calculate_optimized_radii(waypoints)
+        legacy = legacy_radii(calculator, waypoints)
+        # Mismas distancias geodésicas: solo difiere el redondeo de las sumas
+        assert max(abs(a - b) for a, b in zip(radii, legacy)) < 1e-6
+
+        # Duplicados y copias iguales se excluyen como vecinos en ambos cálculos
+        assert radii[3] == radii[-3] and radii[5] == radii[-2]
+        assert legacy[3] == legacy[-3] and legacy[5] == legacy[-2]
+        # Un punto colocalizado con otro nombre sí cuenta como vecino a 0 km
+        alone = [wp for i, wp in enumerate(waypoints) if i != len(waypoints) - 1]
+        assert calculator.calculate_optimized_radii(alone)[7] > radii[7]
+        assert legacy_radii(calculator, alone)[7] > legacy[7]
+
+    assert calculator.calculate_optimized_radii([]) == []
+    # Un único waypoint sin vecinos: radio base del área
+    assert calculator.calculate_optimized_radii([{"lat": 40.0, "lon": -3.0}]) == [6.0]
+
+
+def test_optimizer_matches_brute_force():
+    for seed, count in ((37, 120), (38, 15)):
+        waypoints = [Waypoint(lat, lon, name) for lat, lon, name in random_points(count, seed, spread=0.3)]
+        waypoints += [waypoints[0], Waypoint(waypoints[1].lat, waypoints[1].lon, waypoints[1].name),
+                      Waypoint(waypoints[2].lat, waypoints[2].lon, "Colocalizado")]
+
+        assert LegacyDensityAnalyzer().analyze_density_clusters(waypoints) == \
+            WaypointDensityAnalyzer().analyze_density_clusters(waypoints)
+
+        result = RadiusOptimizer().optimize_coverage(waypoints)
+        expected = legacy_optimizer().optimize_coverage(waypoints)
+        assert circle_summary(result.optimized_circles) == circle_summary(expected.optimized_circles)
+        assert result.total_overlap_area == expected.total_overlap_area
+        assert result.waypoints_covered == expected.waypoints_covered
+        assert abs(result.total_overlap_area - legacy_overlap(result.optimized_circles)) < 1e-9
+
+
+def test_fast_overlap_adjustment_matches_brute_force():
+    # Círculos de radios muy distintos muy juntos: el ajuste puede agrandar radios
+    rng = random.Random(3700)
+    circles = []
+    for i in range(60):
+        center = Waypoint(40.0 + rng.uniform(0, 0.6), -3.0 + rng.uniform(0, 0.6), f"c{i}")
+        covered = [Waypoint(center.lat + rng.uniform(-0.05, 0.05), center.lon + rng.uniform(-0.05, 0.05))
+                   for _ in range(3)]
+        circles.append(CoverageCircle(center, rng.choice([2.0, 3.0, 8.0, 20.0]), covered))
+    circles.append(CoverageCircle(circles[0].center, 5.0, circles[0].waypoints_covered))
+
+    adjusted = CirclePackingOptimizer()._fast_overlap_adjustment(circles)
+    expected = LegacyPackingOptimizer()._fast_overlap_adjustment(circles)
+    assert circle_summary(adjusted) == circle_summary(expected)
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
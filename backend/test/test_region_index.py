@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Tests del índice de cobertura de regiones MWM (utils.region_index) y de su uso
+en la búsqueda de regiones de Organic Maps: lectura de fronteras .poly,
+consultas exactas de puntos y rutas frente a un cálculo por fuerza bruta,
+y /api/organic-maps/route-regions.
+"""
+import asyncio
+import math
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import numpy as np
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import routes.organic_maps as organic_maps
+from routes.organic_maps_utils import region_search
+from utils.region_index import QUANTIZE_DEG, RegionIndex, parse_poly
+
+
+def blob(lon, lat, radius, seed, n=300):
+    """Polígono irregular (lon, lat) ya ajustado a la resolución del índice"""
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * math.pi, n, endpoint=False)
+    radii = radius * (1 + 0.3 * rng.random(n))
+    ring = np.c_[lon + radii * np.cos(angles), lat + radii * np.sin(angles)]
+    return np.round(ring / QUANTIZE_DEG) * QUANTIZE_DEG
+
+
+# Región con un enclave (hueco) que es a su vez otra región, una región
+# separada y una franja más estrecha que la distancia entre puntos de ruta
+REGIONS = {
+    "Spain_Aragon": [blob(0, 41, 1.5, 1), blob(0.3, 41, 0.4, 2)],
+    "Spain_Enclave": [blob(0.3, 41, 0.4, 2)],
+    "Spain_Catalonia": [blob(4, 41.5, 1, 3)],
+    "Spain_Strip": [np.array([[1.9, 38.0], [1.92, 38.0], [1.92, 44.0], [1.9, 44.0]])],
+}
+
+
+def write_poly(directory, region_id, rings):
+    with open(os.path.join(directory, f"{region_id}.poly"), "w") as f:
+        f.write(f"{region_id}\n")
+        for i, ring in enumerate(rings):
+            f.write(f"{'!' if i else ''}{i + 1}\n")
+            for lon, lat in ring:
+                f.write(f"\t{lon:.7E}\t{lat:.7E}\n")
+            f.write("END\n")
+        f.write("END\n")
+
+
+def brute_force(lon, lat):
+    """Regiones que contienen el punto (regla par-impar sobre todos los lados)"""
+    found = set()
+    for region_id, rings in REGIONS.items():
+        crossings = 0
+        for ring in rings:
+            x1, y1 = ring[:, 0], ring[:, 1]
+            x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+            c = (y1 <= lat) != (y2 <= lat)
+            crossings += int(((x1[c] + (lat - y1[c]) * (x2[c] - x1[c]) / (y2[c] - y1[c])) < lon).sum())
+        if crossings % 2:
+            found.add(region_id)
+    return found
+
+
+def build_borders_dir():
+    directory = tempfile.mkdtemp()
+    for region_id, rings in REGIONS.items():
+        write_poly(directory, region_id, rings)
+    return directory
+
+
+def test_parse_poly_and_point_queries_are_exact():
+    directory = build_borders_dir()
+    rings = parse_poly(os.path.join(directory, "Spain_Aragon.poly"))
+    assert len(rings) == 2 and np.allclose(rings[0], REGIONS["Spain_Aragon"][0])
+
+    index = RegionIndex.from_directory(directory)
+    assert len(index) == 4
+    rng = np.random.default_rng(7)
+    for lon, lat in zip(rng.uniform(-2, 5, 2000), rng.uniform(39, 43, 2000)):
+        assert set(index.regions_at(lat, lon)) == brute_force(lon, lat), (lat, lon)
+    # Dentro del enclave solo está el enclave
+    assert index.regions_at(41, 0.3) == ["Spain_Enclave"]
+    assert index.regions_at(10, 10) == []
+
+
+def test_route_crosses_regions_in_order():
+    index = RegionIndex.from_directory(build_borders_dir())
+    # Ruta planificada de tres puntos: el segundo tramo salta la franja entre dos vértices
+    route = [(41.0, -1.0), (41.2, 1.0), (41.5, 4.2)]
+    assert index.regions_for_route(route) == ["Spain_Aragon", "Spain_Enclave", "Spain_Strip", "Spain_Catalonia"]
+
+    rng = np.random.default_rng(11)
+    for _ in range(20):
+        points = list(zip(rng.uniform(39, 43, 3), rng.uniform(-2, 5, 3)))
+        expected = set()
+        for (alat, alon), (blat, blon) in zip(points, points[1:]):
+            for t in np.linspace(0, 1, 1000):
+                expected |= brute_force(alon + (blon - alon) * t, alat + (blat - alat) * t)
+        assert set(index.regions_for_route(points)) == expected, points
+
+    # Traza GPS densa (un punto por segundo durante más de cinco horas)
+    trace = [(41 + 0.05 * math.sin(i / 500), -1.0 + i * 0.0002) for i in range(20000)]
+    assert index.regions_for_route(trace)[:2] == ["Spain_Aragon", "Spain_Enclave"]
+
+
+def test_region_search_and_route_regions_endpoint():
+    async def run():
+        data_path = tempfile.mkdtemp()
+        config = SimpleNamespace(data_path=data_path)
+        organic_maps.config = config
+        region_search.config = config
+        region_search._region_index = None
+        region_search._region_index_mtime = None
+
+        # Sin fronteras: la búsqueda no usa el índice y el endpoint lo indica
+        assert await region_search.find_region_ids_for_route([[41, 0]]) is None
+        try:
+            await organic_maps.get_route_regions(organic_maps.CountryMapsForRouteRequest(coordinates=[[41, 0]]))
+            assert False, "expected 503"
+        except organic_maps.HTTPException as e:
+            assert e.status_code == 503
+
+        borders_dir = os.path.join(data_path, "organic_maps", "borders")
+        os.makedirs(borders_dir)
+        for region_id, rings in REGIONS.items():
+            write_poly(borders_dir, region_id, rings)
+        os.utime(borders_dir, ns=(0, 10**9))
+
+        all_regions = [{"id": region_id, "name": region_id, "size_mb": 10} for region_id in REGIONS]
+        found = await region_search.find_regions_for_coordinates([[41.0, -1.0], [41.5, 4.2]], all_regions, max_regions=1)
+        assert [r["id"] for r in found] == ["Spain_Aragon", "Spain_Enclave", "Spain_Strip", "Spain_Catalonia"]
+
+        os.makedirs(os.path.join(data_path, "organic_maps", "Spain_Aragon"))
+        open(os.path.join(data_path, "organic_maps", "Spain_Aragon", "Spain_Aragon.mwm"), "wb").close()
+        response = await organic_maps.get_route_regions(organic_maps.CountryMapsForRouteRequest(coordinates=[[41, -1]]))
+        assert [(r["id"], r["downloaded"]) for r in response["regions"]] == [("Spain_Aragon", True)]
+
+        # Una frontera nueva recarga el índice
+        write_poly(borders_dir, "Spain_Valencia", [blob(-1, 38.5, 0.5, 4)])
+        os.utime(borders_dir, ns=(0, 2 * 10**9))
+        response = await organic_maps.get_route_regions(organic_maps.CountryMapsForRouteRequest(coordinates=[[38.5, -1]]))
+        assert [r["id"] for r in response["regions"]] == ["Spain_Valencia"]
+        region_search._region_index = None
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
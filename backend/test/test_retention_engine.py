@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Tests del motor de retención (retention_engine): marca de espacio libre solo
+con la limpieza automática activada, orden de víctimas con landmarks
+prioritarios por categoría, filas conservadas cuando un archivo no se puede
+borrar y caché del resumen diario eliminada con los clips.
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import retention_engine
+from retention_engine import RetentionEngine
+from trip_logger_package.database.connection import DatabaseManager
+from trip_logger_package.models.db_models import VideoClip as VideoClipModel
+
+MB = 1024 * 1024
+
+
+def new_engine(settings):
+    data_path = tempfile.mkdtemp()
+    engine = RetentionEngine(data_path, os.path.join(data_path, "recordings.db"),
+                             settings_provider=lambda: settings, min_clip_age=0)
+    engine.db_manager = DatabaseManager(os.path.join(data_path, "recordings.db"))
+    return engine
+
+
+def add_clip(engine, name, hours_ago, size=MB, **fields):
+    day_dir = os.path.join(engine.data_path, "videos", "2024-01-01")
+    os.makedirs(day_dir, exist_ok=True)
+    path = os.path.join(day_dir, f"{name}.mp4")
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    start = datetime.now() - timedelta(hours=hours_ago)
+    with engine.db_manager.session_scope() as session:
+        clip = VideoClipModel(start_time=start, end_time=start + timedelta(minutes=1),
+                              road_video_file=f"videos/2024-01-01/{name}.mp4", **fields)
+        session.add(clip)
+        session.flush()
+        return clip.id, path
+
+
+def remaining_ids(engine):
+    with engine.db_manager.session_scope() as session:
+        return {row.id for row in session.query(VideoClipModel.id).all()}
+
+
+def test_watermark_requires_auto_clean():
+    settings = {"autoCleanEnabled": False, "autoCleanThreshold": 90, "autoCleanTargetThreshold": 85,
+                "minFreeSpaceMB": 2048}
+    engine = new_engine(settings)
+    usage = {"total": 100 * 1024 * MB, "used": 99 * 1024 * MB, "free": 1024 * MB}
+    # Por debajo de la reserva mínima, pero sin limpieza automática no se borra nada
+    assert engine.bytes_to_free(settings, usage) == 0
+
+    clip_id, path = add_clip(engine, "old", 48)
+    engine.get_disk_usage = lambda: usage
+    result = engine.enforce()
+    assert result["deleted"] == 0 and result["bytesNeeded"] == 0
+    assert os.path.exists(path) and remaining_ids(engine) == {clip_id}
+
+    settings["autoCleanEnabled"] = True
+    # Libera hasta el objetivo del 85 %: 15 GB libres
+    assert engine.bytes_to_free(settings, usage) == 14 * 1024 * MB
+
+
+def test_priority_landmark_clips_are_deleted_last():
+    settings = {"autoCleanEnabled": True, "autoCleanDays": 365, "retentionDeleteRateMB": 0}
+    engine = new_engine(settings)
+    priority_id, _ = add_clip(engine, "castle", 50, near_landmark=True, landmark_type="castle")
+    standard_id, _ = add_clip(engine, "fuel", 40, near_landmark=True, landmark_type="gas_station")
+    plain_id, _ = add_clip(engine, "road", 30)
+
+    order = [candidate.id for candidate in engine._load_candidates()]
+    assert order == [plain_id, standard_id, priority_id]
+
+    result = engine._delete_candidates(engine._load_candidates(), 2 * MB, settings)
+    assert result["deleted"] == 2 and remaining_ids(engine) == {priority_id}
+
+
+def test_rows_of_undeletable_files_are_kept():
+    settings = {"autoCleanEnabled": True, "retentionDeleteRateMB": 0}
+    engine = new_engine(settings)
+    locked_id, locked_path = add_clip(engine, "locked", 20)
+    gone_id, gone_path = add_clip(engine, "gone", 10)
+    os.remove(gone_path)
+
+    original_remove = retention_engine.os.remove
+
+    def remove(path):
+        if path == locked_path:
+            raise PermissionError(13, "Permission denied", path)
+        original_remove(path)
+
+    retention_engine.os.remove = remove
+    try:
+        result = engine._delete_batch(engine._load_candidates(), 0)
+    finally:
+        retention_engine.os.remove = original_remove
+
+    # El clip cuyo archivo ya no existía se da por borrado; el bloqueado conserva su fila
+    assert result["clips"] == 1 and result["files"] == 0
+    assert os.path.exists(locked_path) and remaining_ids(engine) == {locked_id}
+
+
+def test_deleted_day_drops_its_summary_cache():
+    settings = {"autoCleanEnabled": True, "retentionDeleteRateMB": 0}
+    engine = new_engine(settings)
+    add_clip(engine, "kept", 20)
+    _, old_path = add_clip(engine, "old", 30)
+    day_dir = os.path.dirname(old_path)
+    cache_dir = os.path.join(day_dir, ".summary_cache")
+    os.makedirs(cache_dir)
+    for name in ("kept", "old"):
+        open(os.path.join(cache_dir, f"{name}.400-1.decimate-3.mkv"), "wb").close()
+
+    # Solo cae el intermedio del clip borrado
+    engine._delete_batch(engine._load_candidates()[:1], 0)
+    assert sorted(os.listdir(cache_dir)) == ["kept.400-1.decimate-3.mkv"]
+
+    # Sin clips la carpeta del día desaparece aunque tuviera caché del resumen
+    engine._delete_batch(engine._load_candidates(), 0)
+    assert remaining_ids(engine) == set() and not os.path.exists(day_dir)
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Tests de la caché de reverse geocoding (ReverseGeocodingCache): celdas
+geohash, búsqueda en celdas vecinas y expiración perezosa de la entrada que
+respondió.
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from geocoding.services.reverse_geocoding_service import LocationInfo, ReverseGeocodingCache
+from geocoding.utils import geohash
+
+
+def new_cache():
+    return ReverseGeocodingCache(os.path.join(tempfile.mkdtemp(), "geocoding.db"))
+
+
+def cell_rows(cache, cell):
+    return cache._connection().execute("SELECT COUNT(*) FROM geocoding_cache WHERE cell = ?", (cell,)).fetchone()[0]
+
+
+def test_neighbour_hit_expires_the_entry_that_served_it():
+    cache = new_cache()
+    # Dos puntos a ambos lados del borde de una celda
+    min_lat, min_lon, max_lat, max_lon = geohash.decode_bbox(cache.cell_for(40.4168, -3.7038))
+    stored = (40.4168, max_lon - 0.0005)
+    queried = (40.4168, max_lon + 0.0005)
+    stored_cell, queried_cell = cache.cell_for(*stored), cache.cell_for(*queried)
+    assert stored_cell != queried_cell
+
+    cache.set(*stored, LocationInfo(city="Madrid", country="España"))
+    cache._memory.clear()
+    assert cache.get(*queried).city == "Madrid"
+    assert cache.stats["db_hits"] == 1
+
+    # La entrada vecina caduca: se borra ella, no la celda consultada
+    old = (datetime.now() - timedelta(hours=cache.max_age_hours + 1)).isoformat()
+    cache._connection().execute("UPDATE geocoding_cache SET timestamp = ?", (old,))
+    cache._memory.clear()
+    assert cache.get(*queried) is None
+    assert cache.stats["expired"] == 1 and cell_rows(cache, stored_cell) == 0
+
+
+def test_fresh_neighbour_is_preferred_over_expired_one():
+    cache = new_cache()
+    min_lat, min_lon, max_lat, max_lon = geohash.decode_bbox(cache.cell_for(40.4168, -3.7038))
+    near, far = (40.4168, max_lon - 0.0002), (40.4168, max_lon - 0.001)
+    cache.set(*near, LocationInfo(city="Old"))
+    cache.set(*far, LocationInfo(city="Fresh"))
+    old = (datetime.now() - timedelta(hours=cache.max_age_hours + 1)).isoformat()
+    cache._connection().execute("UPDATE geocoding_cache SET timestamp = ? WHERE lon = ?", (old, near[1]))
+    cache._memory.clear()
+    # Consulta desde la celda vecina: la entrada vigente gana aunque esté más lejos
+    assert cache.get(40.4168, max_lon + 0.0002).city == "Fresh"
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Tests del servicio de reverse geocoding (ReverseGeocodingService): las
+consultas concurrentes a la misma celda se agrupan (y si se cancela la que
+consulta, otra toma el relevo) y la caché negativa solo recuerda las
+respuestas definitivas de Nominatim, no los fallos transitorios.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from geocoding.services.reverse_geocoding_service import LocationInfo, ReverseGeocodingService
+
+
+class FakeNominatim:
+    """Responde con ``responses`` en orden: LocationInfo, "empty" (sin dirección) o "error" """
+
+    def __init__(self, *responses, delay=0.0):
+        self.responses = list(responses)
+        self.delay = delay
+        self.calls = 0
+
+    async def lookup(self, lat, lon):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        response = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+        if response == "error":
+            return None, False
+        if response == "empty":
+            return None, True
+        return response, True
+
+
+def new_service(nominatim, enable_online=True):
+    service = ReverseGeocodingService(os.path.join(tempfile.mkdtemp(), "geocoding.db"),
+                                      enable_online=enable_online)
+    # Solo Nominatim: sin base offline ni packs de viaje
+    service.db_storage = None
+    service.gazetteer_packs = None
+    service.nominatim = nominatim
+    return service
+
+
+def test_concurrent_requests_for_a_cell_are_coalesced():
+    async def run():
+        nominatim = FakeNominatim(LocationInfo(city="Madrid", country="España"), delay=0.1)
+        service = new_service(nominatim)
+        results = await asyncio.gather(*[service.get_location(40.4168, -3.7038 + i * 1e-6) for i in range(5)])
+        assert nominatim.calls == 1
+        assert [r.city for r in results] == ["Madrid"] * 5
+        assert service.stats["coalesced_hits"] == 4
+
+        # force_online no se agrupa con las consultas normales
+        await asyncio.gather(service.get_location(40.5, -3.5), service.get_location(40.5, -3.5, force_online=True))
+        assert nominatim.calls == 3
+
+    asyncio.run(run())
+
+
+def test_cancelled_leader_hands_the_lookup_to_a_waiter():
+    async def run():
+        nominatim = FakeNominatim(LocationInfo(city="Segovia"), delay=0.2)
+        service = new_service(nominatim)
+        leader = asyncio.create_task(service.get_location(40.9429, -4.1088))
+        await asyncio.sleep(0.05)
+        waiters = [asyncio.create_task(service.get_location(40.9429, -4.1088)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+
+        leader.cancel()
+        results = await asyncio.gather(leader, *waiters, return_exceptions=True)
+        assert isinstance(results[0], asyncio.CancelledError)
+        # Un único relevo repite la consulta y los demás comparten su resultado
+        assert [r.city for r in results[1:]] == ["Segovia"] * 3
+        assert nominatim.calls == 2 and service._inflight == {}
+        assert service.stats["coalesced_hits"] == 3 and service.stats["failed_requests"] == 0
+
+        # Cancelar a quien espera no afecta al líder ni al resto
+        nominatim.calls = 0
+        leader = asyncio.create_task(service.get_location(41.65, -0.88))
+        await asyncio.sleep(0.05)
+        waiter = asyncio.create_task(service.get_location(41.65, -0.88))
+        other = asyncio.create_task(service.get_location(41.65, -0.88))
+        await asyncio.sleep(0.05)
+        waiter.cancel()
+        results = await asyncio.gather(leader, waiter, other, return_exceptions=True)
+        assert results[0].city == "Segovia" and results[2].city == "Segovia"
+        assert isinstance(results[1], asyncio.CancelledError) and nominatim.calls == 1
+
+    asyncio.run(run())
+
+
+def test_transient_failures_are_not_negative_cached():
+    async def run():
+        nominatim = FakeNominatim("error", LocationInfo(city="Toledo"))
+        service = new_service(nominatim)
+        assert await service.get_location(39.86, -4.02) is None
+        assert service._negative == {}
+        # El siguiente intento vuelve a preguntar y obtiene resultado
+        assert (await service.get_location(39.86, -4.02)).city == "Toledo"
+        assert nominatim.calls == 2 and service.stats["negative_hits"] == 0
+
+        # Sin conexión (modo offline) tampoco se recuerda nada
+        offline = new_service(FakeNominatim("empty"), enable_online=False)
+        assert await offline.get_location(39.86, -4.02) is None
+        assert offline._negative == {} and offline.nominatim.calls == 0
+
+    asyncio.run(run())
+
+
+def test_definitive_empty_answers_are_negative_cached():
+    async def run():
+        nominatim = FakeNominatim("empty")
+        service = new_service(nominatim)
+        assert await service.get_location(36.0, -10.0) is None
+        assert await service.get_location(36.0, -10.0) is None
+        assert nominatim.calls == 1 and service.stats["negative_hits"] == 1
+
+        # force_online ignora la caché negativa; al caducar se vuelve a consultar
+        assert await service.get_location(36.0, -10.0, force_online=True) is None
+        assert nominatim.calls == 2
+        cell = service.cache.cell_for(36.0, -10.0)
+        service._negative[cell] = 0
+        assert await service.get_location(36.0, -10.0) is None
+        assert nominatim.calls == 3
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
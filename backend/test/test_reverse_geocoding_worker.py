@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Tests del worker de reverse geocoding de clips: los clips que no se pueden
+resolver no impiden procesar los más antiguos (paginación por id).
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from geocoding.services.reverse_geocoding_service import LocationInfo
+from geocoding.workers.reverse_geocoding_worker import ReverseGeocodingWorker
+from trip_logger_package.database.connection import DatabaseManager
+from trip_logger_package.models.db_models import VideoClip as VideoClipModel
+
+
+class FakeService:
+    """Sin resultado para las coordenadas de failing_lats"""
+
+    def __init__(self, failing_lats):
+        self.failing_lats = failing_lats
+        self.calls = []
+
+    async def get_location(self, lat, lon, force_online=False):
+        self.calls.append(lat)
+        if lat in self.failing_lats:
+            return None
+        return LocationInfo(city=f"City {lat}", country="España")
+
+
+def test_failing_clips_do_not_starve_older_ones():
+    async def run():
+        db_manager = DatabaseManager(os.path.join(tempfile.mkdtemp(), "recordings.db"))
+        start = datetime(2024, 1, 1)
+        with db_manager.session_scope() as session:
+            for i in range(25):
+                # Cada clip en su propia celda; los 10 más nuevos no se pueden resolver
+                session.add(VideoClipModel(start_time=start + timedelta(minutes=i), end_time=start + timedelta(minutes=i + 1),
+                                           start_lat=40.0 + i * 0.01, start_lon=-3.0))
+        failing_lats = [40.0 + i * 0.01 for i in range(15, 25)]
+        service = FakeService(set(failing_lats))
+        worker = ReverseGeocodingWorker(service, SimpleNamespace(db_manager=db_manager), batch_size=10)
+
+        processed = [await worker._process_batch() for _ in range(3)]
+        assert processed == [0, 10, 5]
+        # La vuelta terminó: la siguiente empieza otra vez por los más nuevos
+        assert worker._page_cursor is None
+        with db_manager.session_scope() as session:
+            pending = {round(row.start_lat, 2) for row in session.query(VideoClipModel.start_lat)
+                       .filter(VideoClipModel.location.is_(None))}
+        assert pending == {round(lat, 2) for lat in failing_lats}
+        assert await worker._process_batch() == 0 and len(service.calls) == 35
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
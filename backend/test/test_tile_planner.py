@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Tests del planificador de teselas por corredor (utils.tile_planner) y de
+/api/offline-maps/plan-tiles: cobertura exacta del corredor frente a un
+cálculo por fuerza bruta, rutas planificadas con pocos puntos y teselas ya
+presentes en el almacén compartido.
+"""
+import asyncio
+import math
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import routes.offline_maps as offline_maps
+from utils.tile_planner import (EARTH_CIRCUMFERENCE_M, SIMPLIFY_TILES, bbox_tile_count, corridor_tiles,
+                                plan_corridor, route_points, to_tile_coords)
+
+MADRID = (40.4168, -3.7038)
+ZARAGOZA = (41.6488, -0.8891)
+
+
+def gps_trace(a, b, count):
+    """Traza GPS con curvas entre dos puntos"""
+    return [(a[0] + (b[0] - a[0]) * i / count + 0.02 * math.sin(i / 50),
+             a[1] + (b[1] - a[1]) * i / count) for i in range(count + 1)]
+
+
+def brute_force(points, z, width_m):
+    """Teselas a menos de width_m/2 de algún punto de la ruta densificada (cota inferior del corredor)"""
+    tiles = set()
+    for (alat, alon), (blat, blon) in zip(points, points[1:]):
+        for k in range(21):
+            lat, lon = alat + (blat - alat) * k / 20, alon + (blon - alon) * k / 20
+            x, y = to_tile_coords(lat, lon, z)
+            r = width_m / 2 / (EARTH_CIRCUMFERENCE_M * math.cos(math.radians(lat)) / (1 << z))
+            for tx in range(int(x - r) - 1, int(x + r) + 2):
+                for ty in range(int(y - r) - 1, int(y + r) + 2):
+                    dx = max(tx - x, x - (tx + 1), 0)
+                    dy = max(ty - y, y - (ty + 1), 0)
+                    if math.hypot(dx, dy) <= r:
+                        tiles.add((tx, ty))
+    return tiles
+
+
+def test_corridor_covers_route_and_is_tight():
+    points = gps_trace(MADRID, ZARAGOZA, 600)
+    width = 1500
+    tiles = corridor_tiles(points, 14, width)
+    expected = brute_force(points, 14, width)
+
+    # Nunca falta una tesela del corredor pedido...
+    assert expected <= tiles
+    # ...y solo sobra el margen de la simplificación
+    extra = brute_force(points, 14, width + 2 * SIMPLIFY_TILES * 1.3 * 40075016.686 / (1 << 14))
+    assert tiles <= extra
+    # Mucho menor que el rectángulo que se descargaba antes
+    assert len(tiles) * 10 < bbox_tile_count(points, 14)
+
+
+def test_planned_route_with_few_points():
+    plan = plan_corridor(route_points([{"lat": MADRID[0], "lng": MADRID[1]},
+                                       {"lat": ZARAGOZA[0], "lon": ZARAGOZA[1]}]), [10, 16])
+    # El segmento largo se trocea: corredor continuo de un extremo al otro
+    for z in (10, 16):
+        start = tuple(int(c) for c in to_tile_coords(*MADRID, z))
+        end = tuple(int(c) for c in to_tile_coords(*ZARAGOZA, z))
+        assert start in plan[z] and end in plan[z]
+    assert len(plan[16]) < bbox_tile_count([MADRID, ZARAGOZA], 16) / 50
+
+    # Un único punto: su tesela y, como mucho, las vecinas dentro del margen
+    single = corridor_tiles([MADRID], 14, 10)
+    assert tuple(int(c) for c in to_tile_coords(*MADRID, 14)) in single and len(single) <= 4
+
+
+def test_plan_route_skips_tiles_in_shared_store():
+    async def run():
+        data_path = tempfile.mkdtemp()
+        offline_maps.config = SimpleNamespace(data_path=data_path, map_tile_url="http://127.0.0.1:9/{z}/{x}/{y}.png",
+                                              map_tiles_offline_only=True)
+        offline_maps._tile_proxy = None
+        proxy = offline_maps._get_tile_proxy()
+        points = gps_trace(MADRID, ZARAGOZA, 200)
+        corridor = corridor_tiles(points, 12)
+        for x, y in sorted(corridor)[:5]:
+            proxy.store.put(proxy.source, 12, x, y, b'\x89PNG' + bytes([x % 256]))
+        # Teselas de otro origen no cuentan
+        proxy.store.put("other-style", 12, *sorted(corridor)[-1], b'\x89PNG')
+
+        request = offline_maps.OfflineMapRequest(trip_id="trip-1", bounds={}, zoom_levels=[12, 13, 20],
+                                                 route=[{"lat": lat, "lng": lon, "time": "t"} for lat, lon in points])
+        plan = await offline_maps.plan_map_tiles(request)
+        assert set(plan["zoom_levels"]) == {"12", "13"}
+        assert plan["zoom_levels"]["12"]["tiles"] == len(corridor)
+        assert plan["zoom_levels"]["12"]["in_store"] == 5
+        assert plan["to_download"] == plan["total_tiles"] - 5
+        assert plan["estimated_size_mb"] > 0
+
+        tiles, _, store_tiles = await offline_maps._plan_corridor_tiles(points, [12])
+        assert len(tiles) == len(corridor) - 5
+        assert sorted((t["x"], t["y"]) for t in store_tiles) == sorted(corridor)[:5]
+
+        await offline_maps.close_tile_proxy()
+        proxy.store.close()
+        offline_maps._tile_proxy = None
+        offline_maps._trip_archives = None
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Tests del proxy de teselas (utils.tile_proxy) y de la ruta
+/api/offline-maps/tile/{trip_id}/{z}/{x}/{y} contra un servidor de teselas
+local: almacén compartido y direccionado por contenido, escritura atómica,
+agrupación de peticiones simultáneas y modo solo offline.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+from aiohttp import web
+from fastapi import HTTPException
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import routes.offline_maps as offline_maps
+from utils.tile_proxy import ContentAddressedTileStore, TileProxy
+
+SEA_TILE = b'\x89PNG\r\n\x1a\n' + b'sea' * 100
+
+
+class StubTileServer:
+    """Servidor /{z}/{x}/{y}.png: x par -> tesela propia, x impar -> la misma tesela de mar"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.requests = []
+        self.runner = None
+        self.url_template = None
+
+    async def tile(self, request):
+        z, x, y = (int(request.match_info[k]) for k in ("z", "x", "y"))
+        self.requests.append((z, x, y))
+        await asyncio.sleep(self.delay)
+        if z > 18:
+            return web.Response(status=404)
+        if x % 2:
+            return web.Response(body=SEA_TILE, content_type="image/png")
+        return web.Response(body=b'\x89PNG\r\n\x1a\n' + f"{z}/{x}/{y}".encode(), content_type="image/png")
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/{z}/{x}/{y}.png", self.tile)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url_template = f"http://127.0.0.1:{port}/{{z}}/{{x}}/{{y}}.png"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+
+def test_miss_is_fetched_once_then_served_from_store():
+    async def run():
+        root = tempfile.mkdtemp()
+        async with StubTileServer() as server:
+            proxy = TileProxy(ContentAddressedTileStore(root), url_template=server.url_template)
+            digest, data = await proxy.get_tile(14, 8000, 6000)
+            assert data.endswith(b"14/8000/6000")
+            again = await proxy.get_tile(14, 8000, 6000)
+            await proxy.close()
+
+        assert again == (digest, data)
+        assert server.requests == [(14, 8000, 6000)]
+        assert proxy.stats["store_hits"] == 1 and proxy.stats["upstream_fetches"] == 1
+        # Sin temporales a medio escribir
+        leftovers = [n for _, _, files in os.walk(root) for n in files if n.startswith(".tmp-")]
+        assert leftovers == []
+        proxy.store.close()
+
+    asyncio.run(run())
+
+
+def test_concurrent_requests_are_coalesced():
+    async def run():
+        async with StubTileServer(delay=0.2) as server:
+            proxy = TileProxy(ContentAddressedTileStore(tempfile.mkdtemp()), url_template=server.url_template)
+            results = await asyncio.gather(*(proxy.get_tile(12, 2000, 1500) for _ in range(10)))
+            await proxy.close()
+
+        assert len(server.requests) == 1
+        assert len({r[0] for r in results}) == 1
+        assert proxy.stats["coalesced"] == 9
+        proxy.store.close()
+
+    asyncio.run(run())
+
+
+def test_identical_tiles_are_stored_once_and_shared_across_trips():
+    async def run():
+        root = tempfile.mkdtemp()
+        async with StubTileServer() as server:
+            proxy = TileProxy(ContentAddressedTileStore(root), url_template=server.url_template)
+            for x in (1, 3, 5, 7):
+                await proxy.get_tile(10, x, 400)
+            await proxy.close()
+
+        objects = [n for _, _, files in os.walk(os.path.join(root, "objects")) for n in files]
+        assert len(objects) == 1
+        assert proxy.store.get_stats() == {"indexed_tiles": 4, "unique_objects": 1}
+        proxy.store.close()
+
+        # Otro proceso (u otro viaje) reutiliza el mismo almacén sin red
+        reopened = TileProxy(ContentAddressedTileStore(root), url_template=server.url_template, offline_only=True)
+        assert (await reopened.get_tile(10, 5, 400))[1] == SEA_TILE
+        reopened.store.close()
+
+    asyncio.run(run())
+
+
+def test_offline_only_and_upstream_not_found():
+    async def run():
+        async with StubTileServer() as server:
+            offline = TileProxy(ContentAddressedTileStore(tempfile.mkdtemp()), url_template=server.url_template,
+                                offline_only=True)
+            assert await offline.get_tile(14, 8000, 6000) is None
+            assert offline.stats["offline_misses"] == 1
+
+            online = TileProxy(ContentAddressedTileStore(tempfile.mkdtemp()), url_template=server.url_template)
+            assert await online.get_tile(19, 2, 2) is None
+            assert await online.get_tile(19, 2, 2) is None
+            await online.close()
+
+        # El modo offline no sale a la red; los 404 no se guardan
+        assert server.requests == [(19, 2, 2), (19, 2, 2)]
+        assert online.stats["upstream_not_found"] == 2
+        assert online.store.get_stats()["indexed_tiles"] == 0
+        offline.store.close()
+        online.store.close()
+
+    asyncio.run(run())
+
+
+def test_route_serves_store_tiles_with_etag():
+    class FakeRequest:
+        def __init__(self, headers=None):
+            self.headers = headers or {}
+
+    async def run():
+        data_path = tempfile.mkdtemp()
+        async with StubTileServer() as server:
+            offline_maps.config = SimpleNamespace(data_path=data_path, map_tile_url=server.url_template,
+                                                  map_tiles_offline_only=False)
+            offline_maps._tile_proxy = None
+            response = await offline_maps.get_map_tile("trip-1", 13, 4000, 3000, FakeRequest())
+            assert response.status_code == 200 and response.media_type == "image/png"
+            etag = response.headers["etag"]
+
+            # Otro viaje reutiliza la tesela; con If-None-Match responde 304
+            cached = await offline_maps.get_map_tile("trip-2", 13, 4000, 3000, FakeRequest({"if-none-match": etag}))
+            assert cached.status_code == 304
+
+            try:
+                await offline_maps.get_map_tile("trip-1", 3, 9, 0, FakeRequest())
+                assert False, "tile outside the grid must be rejected"
+            except HTTPException as e:
+                assert e.status_code == 404
+
+            await offline_maps.close_tile_proxy()
+
+        assert server.requests == [(13, 4000, 3000)]
+        # Nada se escribe en el directorio del viaje
+        assert not os.path.exists(os.path.join(data_path, "offline_maps", "trip-1"))
+        offline_maps._tile_proxy.store.close()
+        offline_maps._tile_proxy = None
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Tests del registro en memoria de regiones por viaje
+(routes.organic_maps_utils.trip_registry) y del camino rápido de
+/api/organic-maps/tile/{trip_id}/{z}/{x}/{y}: sin releer trip_regions.json en
+cada tesela, invalidación por mtime y por descargas, y percentiles de latencia
+en /system-status.
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import routes.organic_maps as organic_maps
+import routes.organic_maps_utils.trip_registry as trip_registry
+from routes.organic_maps_utils import download
+from routes.organic_maps_utils.trip_registry import TileLatencyStats, TripRegionRegistry
+
+
+def write_trip(base_dir, trip_id, regions, coordinates=None):
+    trip_dir = os.path.join(base_dir, trip_id)
+    os.makedirs(trip_dir, exist_ok=True)
+    path = os.path.join(trip_dir, "trip_regions.json")
+    with open(path, "w") as f:
+        json.dump({"trip_id": trip_id, "coordinates": coordinates or [], "required_regions": regions}, f)
+    return path
+
+
+def write_mwm(base_dir, region_id):
+    os.makedirs(os.path.join(base_dir, region_id), exist_ok=True)
+    with open(os.path.join(base_dir, region_id, f"{region_id}.mwm"), "wb") as f:
+        f.write(b"MWM")
+
+
+def test_registry_revalidates_by_mtime_and_download_events():
+    base_dir = tempfile.mkdtemp()
+    path = write_trip(base_dir, "trip-1", ["Spain_Aragon"])
+    registry = TripRegionRegistry(base_dir)
+    trip = registry.get("trip-1")
+    assert trip.required_regions == ["Spain_Aragon"] and trip.mwm_paths == []
+    assert registry.get("trip-1") is trip and registry.stats["loads"] == 1
+    assert registry.get("missing") is None
+
+    # La región se descarga: los viajes que la necesitan recalculan sus archivos
+    write_mwm(base_dir, "Spain_Aragon")
+    registry.invalidate_region("Spain_Aragon")
+    trip = registry.get("trip-1")
+    assert trip.mwm_paths == [os.path.join(base_dir, "Spain_Aragon", "Spain_Aragon.mwm")]
+
+    # trip_regions.json reescrito: se detecta por mtime al pasar el intervalo de revalidación
+    write_trip(base_dir, "trip-1", ["Spain_Aragon", "Spain_Catalonia"])
+    os.utime(path, ns=(time.time_ns(), time.time_ns() + 10**9))
+    trip.checked_at -= trip_registry.REVALIDATE_SECONDS
+    assert registry.get("trip-1").required_regions == ["Spain_Aragon", "Spain_Catalonia"]
+
+    os.remove(path)
+    registry.invalidate("trip-1")
+    assert registry.get("trip-1") is None
+
+
+def test_latency_percentiles():
+    stats = TileLatencyStats(samples=100)
+    for ms in range(1, 201):
+        stats.record("hit", ms / 1000)
+    stats.record("render", 0.5)
+    summary = stats.summary()
+    # Solo las últimas 100 muestras (101..200 ms)
+    assert summary["hit"]["count"] == 200 and summary["hit"]["samples"] == 100
+    assert summary["hit"]["p50_ms"] == 150 and summary["hit"]["p90_ms"] == 190 and summary["hit"]["p99_ms"] == 199
+    assert summary["render"]["p99_ms"] == 500 and summary["render"]["max_ms"] == 500
+
+
+def test_cached_tile_fast_path_skips_metadata_and_stat():
+    async def run():
+        data_path = tempfile.mkdtemp()
+        base_dir = os.path.join(data_path, "organic_maps")
+        write_trip(base_dir, "trip-1", ["Spain_Aragon"])
+        organic_maps.config = SimpleNamespace(data_path=data_path)
+        organic_maps._trip_registry = None
+        organic_maps._tile_latency = TileLatencyStats()
+        if organic_maps._on_region_downloaded not in download.download_listeners:
+            download.download_listeners.append(organic_maps._on_region_downloaded)
+
+        rendered = []
+
+        async def fake_render(tile_path, z, x, y, trip_id, region_ids, priority=0, mwm_paths=None):
+            rendered.append((z, x, y, tuple(mwm_paths)))
+            os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+            with open(tile_path, "wb") as f:
+                f.write(b"\x89PNG-rendered")
+            return True
+
+        async def no_mirror():
+            return None
+
+        original_render = organic_maps.process_and_render_mwm_tile
+        original_mirror = organic_maps.server_connection.check_mirror_availability
+        organic_maps.process_and_render_mwm_tile = fake_render
+        organic_maps.server_connection.check_mirror_availability = no_mirror
+        original_stat = os.stat
+        try:
+            write_mwm(base_dir, "Spain_Aragon")
+            response = await organic_maps.get_mwm_tile("trip-1", 12, 2000, 1500)
+            assert response.path.endswith(os.path.join("12", "2000", "1500.png")) and response.stat_result
+            assert rendered == [(12, 2000, 1500, (os.path.join(base_dir, "Spain_Aragon", "Spain_Aragon.mwm"),))]
+
+            # Tesela ya en disco: ni json.load ni stat, solo el diccionario del registro
+            def forbidden(*args, **kwargs):
+                raise AssertionError("filesystem touched on the fast path")
+            os.stat = forbidden
+            json_load = trip_registry.json.load
+            trip_registry.json.load = forbidden
+            try:
+                for _ in range(50):
+                    response = await organic_maps.get_mwm_tile("trip-1", 12, 2000, 1500)
+            finally:
+                os.stat = original_stat
+                trip_registry.json.load = json_load
+            assert len(rendered) == 1 and response.stat_result.st_size == len(b"\x89PNG-rendered")
+
+            # Una descarga completada invalida los viajes que usan la región
+            registry = organic_maps._get_trip_registry()
+            download._notify_downloaded("Spain_Aragon")
+            assert registry.get("trip-1").mwm_paths
+            assert registry.stats["invalidations"] == 1
+
+            status = await organic_maps.get_organic_maps_system_status()
+            latency = status["tile_latency"]
+            assert latency["hit"]["count"] == 50 and latency["render"]["count"] == 1
+            assert latency["hit"]["p50_ms"] <= latency["hit"]["p99_ms"]
+            assert status["trip_registry"]["trips"] == 1
+        finally:
+            organic_maps.process_and_render_mwm_tile = original_render
+            organic_maps.server_connection.check_mirror_availability = original_mirror
+            os.stat = original_stat
+            organic_maps._trip_registry = None
+
+        try:
+            await organic_maps.get_mwm_tile("unknown-trip", 12, 0, 0)
+            assert False, "expected 404"
+        except organic_maps.HTTPException as e:
+            assert e.status_code == 404
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Tests del MBTiles por viaje de la descarga de mapas offline: escritura por
+lotes deduplicada (utils.mbtiles_writer), migración de los árboles PNG
+antiguos (tools/migrate_trip_tiles_to_mbtiles.py), lectura desde la ruta
+/api/offline-maps/tile/{trip_id}/{z}/{x}/{y} y copia de las teselas del
+almacén compartido al MBTiles del viaje (y a su exportación).
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import zipfile
+from types import SimpleNamespace
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import routes.offline_maps as offline_maps
+from tools.migrate_trip_tiles_to_mbtiles import migrate_trip
+from utils.mbtiles_service import MBTilesSource
+from utils.mbtiles_writer import MBTilesWriter, TRIP_MBTILES_NAME
+
+SEA_TILE = b'\x89PNG\r\n\x1a\n' + b'sea' * 100
+
+
+def tile_bytes(z, x, y):
+    return b'\x89PNG\r\n\x1a\n' + f"{z}/{x}/{y}".encode()
+
+
+def test_writer_deduplicates_and_reports_existing_tiles():
+    path = os.path.join(tempfile.mkdtemp(), TRIP_MBTILES_NAME)
+    writer = MBTilesWriter(path)
+    rows = [(12, x, 1500, SEA_TILE) for x in range(2000, 2010)] + [(12, 2000, 1501, tile_bytes(12, 2000, 1501))]
+    assert writer.write_batch(rows) == 11
+    assert writer.write_batch([]) == 0
+    assert writer.count() == (11, 2)
+    assert (2005, 1500) in writer.existing_tiles(12) and len(writer.existing_tiles(12)) == 11
+    assert writer.existing_tiles(13) == set()
+
+    # Legible como MBTiles normal mientras la descarga sigue escribiendo
+    source = MBTilesSource(path, immutable=False)
+    assert source.read_tile(12, 2000, 1501) == tile_bytes(12, 2000, 1501)
+    writer.write_batch([(13, 4000, 3000, tile_bytes(13, 4000, 3000))])
+    assert source.read_tile(13, 4000, 3000) == tile_bytes(13, 4000, 3000)
+    source.close()
+    writer.close()
+
+
+def test_migration_converts_png_tree():
+    trip_dir = os.path.join(tempfile.mkdtemp(), "trip-1")
+    for z, x, y in [(10, 500, 300), (10, 501, 300), (11, 1000, 600)]:
+        os.makedirs(os.path.join(trip_dir, str(z), str(x)), exist_ok=True)
+        with open(os.path.join(trip_dir, str(z), str(x), f"{y}.png"), "wb") as f:
+            f.write(SEA_TILE if x % 2 else tile_bytes(z, x, y))
+    with open(os.path.join(trip_dir, "metadata.json"), "w") as f:
+        json.dump({"trip_id": "trip-1", "bounds": {"north": 1, "south": 0, "east": 1, "west": 0}}, f)
+
+    assert migrate_trip(trip_dir, dry_run=True)["migrated"] == 0
+    result = migrate_trip(trip_dir, delete=True)
+    assert result["png_tiles"] == 3 and result["migrated"] == 3 and result.get("deleted")
+
+    assert sorted(os.listdir(trip_dir)) == ["metadata.json", TRIP_MBTILES_NAME]
+    with open(os.path.join(trip_dir, "metadata.json")) as f:
+        assert json.load(f)["storage"] == TRIP_MBTILES_NAME
+    source = MBTilesSource(os.path.join(trip_dir, TRIP_MBTILES_NAME))
+    assert source.read_tile(10, 501, 300) == SEA_TILE
+    assert source.metadata()["bounds"] == "0.0,0.0,1.0,1.0"
+    source.close()
+
+
+def test_route_serves_trip_mbtiles_before_proxy():
+    class FakeRequest:
+        def __init__(self, headers=None):
+            self.headers = headers or {}
+
+    async def run():
+        data_path = tempfile.mkdtemp()
+        writer = MBTilesWriter(os.path.join(data_path, "offline_maps", "trip-1", TRIP_MBTILES_NAME))
+        writer.write_batch([(14, 8000, 6000, tile_bytes(14, 8000, 6000))])
+
+        # Solo offline y almacén vacío: cualquier tesela servida sale del MBTiles del viaje
+        offline_maps.config = SimpleNamespace(data_path=data_path, map_tile_url="http://127.0.0.1:9/{z}/{x}/{y}.png",
+                                              map_tiles_offline_only=True)
+        offline_maps._tile_proxy = None
+        offline_maps._trip_archives = None
+        response = await offline_maps.get_map_tile("trip-1", 14, 8000, 6000, FakeRequest())
+        assert response.status_code == 200 and response.body == tile_bytes(14, 8000, 6000)
+        cached = await offline_maps.get_map_tile("trip-1", 14, 8000, 6000,
+                                                 FakeRequest({"if-none-match": response.headers["etag"]}))
+        assert cached.status_code == 304
+
+        # Las teselas que llegan después se ven sin reabrir el archivo
+        writer.write_batch([(14, 8001, 6000, SEA_TILE)])
+        response = await offline_maps.get_map_tile("trip-1", 14, 8001, 6000, FakeRequest())
+        assert response.body == SEA_TILE
+        writer.close()
+
+        await offline_maps.delete_offline_map("trip-1")
+        assert not os.path.exists(os.path.join(data_path, "offline_maps", "trip-1"))
+        assert offline_maps._trip_archives.get("trip-1") is None
+
+        # El proxy ni siquiera llegó a crearse
+        assert offline_maps._tile_proxy is None
+        await offline_maps.close_tile_proxy()
+        offline_maps._trip_archives = None
+
+    asyncio.run(run())
+
+
+def test_store_tiles_are_copied_into_trip_archive_and_export():
+    async def run():
+        data_path = tempfile.mkdtemp()
+        offline_maps.config = SimpleNamespace(data_path=data_path, map_tile_url="http://127.0.0.1:9/{z}/{x}/{y}.png",
+                                              map_tiles_offline_only=True)
+        offline_maps._tile_proxy = None
+        offline_maps._trip_archives = None
+        proxy = offline_maps._get_tile_proxy()
+        store_tiles = [{"z": 12, "x": 2000 + i, "y": 1500} for i in range(4)]
+        for tile in store_tiles:
+            proxy.store.put(proxy.source, tile["z"], tile["x"], tile["y"], tile_bytes(tile["z"], tile["x"], tile["y"]))
+        # Objeto perdido del almacén: se vuelve a descargar
+        lost = {"z": 12, "x": 2100, "y": 1500}
+        digest = proxy.store.put(proxy.source, 12, 2100, 1500, SEA_TILE)
+        os.remove(proxy.store._object_path(digest))
+
+        downloads = []
+
+        async def fake_download(session, url):
+            downloads.append(url)
+            z, x, y = (int(part) for part in url[:-len(".png")].rsplit("/", 3)[1:])
+            return tile_bytes(z, x, y)
+
+        trip_dir = os.path.join(data_path, "offline_maps", "trip-1")
+        os.makedirs(trip_dir)
+        metadata_path = os.path.join(trip_dir, "metadata.json")
+        with open(metadata_path, "w") as f:
+            json.dump({"trip_id": "trip-1", "zoom_levels": [12], "total_tiles": 6,
+                       "bounds": {"north": 1, "south": 0, "east": 1, "west": 0}}, f)
+
+        original_download = offline_maps.download_single_tile
+        offline_maps.download_single_tile = fake_download
+        try:
+            await offline_maps.download_tiles_background_task(
+                "trip-1", [{"z": 12, "x": 2200, "y": 1500}], trip_dir, metadata_path, store_tiles + [lost])
+        finally:
+            offline_maps.download_single_tile = original_download
+
+        # Solo se descargan la tesela nueva y la del objeto perdido
+        assert sorted(downloads) == ["http://127.0.0.1:9/12/2100/1500.png", "http://127.0.0.1:9/12/2200/1500.png"]
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        assert metadata["status"] == "completed" and metadata["downloaded_tiles"] == 6
+
+        response = await offline_maps.export_offline_map("trip-1")
+        export_dir = tempfile.mkdtemp()
+        with zipfile.ZipFile(response.path) as zipf:
+            zipf.extractall(export_dir)
+        source = MBTilesSource(os.path.join(export_dir, TRIP_MBTILES_NAME))
+        for tile in store_tiles + [lost, {"z": 12, "x": 2200, "y": 1500}]:
+            assert source.read_tile(tile["z"], tile["x"], tile["y"]) == tile_bytes(tile["z"], tile["x"], tile["y"])
+        source.close()
+
+        await offline_maps.close_tile_proxy()
+        proxy.store.close()
+        offline_maps._tile_proxy = None
+        offline_maps._trip_archives = None
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Tests del resumen diario (video_maker) con ffmpeg simulado: solo se extraen
+los clips nuevos al regenerar un día, se encuentran ambos esquemas de nombres,
+la extracción en paralelo está acotada, se codifica una sola vez al final y
+los intermedios obsoletos de .summary_cache se eliminan.
+"""
+import os
+import sys
+import asyncio
+import tempfile
+from datetime import date
+
+# Agregar el directorio backend al path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import video_maker
+from video_maker import VideoMaker, prune_summary_cache
+
+DAY = date(2024, 1, 1)
+
+
+class FakeFFmpeg:
+    """Sustituye a _run_ffmpeg: escribe la salida y registra concurrencia y orden"""
+
+    def __init__(self):
+        self.commands = []
+        self.running = 0
+        self.max_running = 0
+
+    async def __call__(self, cmd):
+        self.commands.append(cmd)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(0.01)
+            with open(cmd[-1], "wb") as f:
+                f.write(b"frames")
+        finally:
+            self.running -= 1
+        return 0, ""
+
+    def extracted(self):
+        return [os.path.basename(cmd[cmd.index("-i") + 1]) for cmd in self.commands if "concat" not in cmd]
+
+    def encodes(self):
+        return [cmd for cmd in self.commands if "concat" in cmd]
+
+
+def new_maker():
+    data_path = tempfile.mkdtemp()
+    # Sin config para que la música quede dentro del directorio temporal
+    original_config = video_maker.config
+    video_maker.config = None
+    try:
+        maker = VideoMaker(data_path=data_path)
+    finally:
+        video_maker.config = original_config
+    fake = FakeFFmpeg()
+    maker._run_ffmpeg = fake
+    return maker, fake
+
+
+def add_clips(directory, *names):
+    os.makedirs(directory, exist_ok=True)
+    for name in names:
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(name.encode())
+
+
+def test_second_run_only_extracts_new_clip():
+    maker, fake = new_maker()
+    day_dir = os.path.join(maker.base_data_dir, "videos", "2024-01-01")
+    add_clips(day_dir, "10-00-00_seq001_01_road.mp4", "10-01-00_seq002_01_road.mp4")
+
+    assert asyncio.run(maker.create_daily_summary(DAY)) == os.path.join(day_dir, "summary.mp4")
+    assert len(fake.extracted()) == 2 and len(fake.encodes()) == 1
+
+    add_clips(day_dir, "10-02-00_seq003_01_road.mp4")
+    fake.commands.clear()
+    assert asyncio.run(maker.create_daily_summary(DAY)) is not None
+    assert fake.extracted() == ["10-02-00_seq003_01_road.mp4"]
+    status = maker.get_summary_status("2024-01-01")
+    assert status["cached_clips"] == 2 and status["processed_clips"] == 3 and status["status"] == "completed"
+
+
+def test_both_clip_naming_schemes_are_found():
+    maker, _ = new_maker()
+    recorder_dir = os.path.join(maker.base_data_dir, "videos", "2024-01-01")
+    add_clips(recorder_dir, "10-00-00_seq001_01_road.mp4", "10-00-00_seq001_01_interior.mp4")
+    legacy_dir = os.path.join(maker.base_data_dir, "2024-01-02")
+    add_clips(legacy_dir, "09-15-road.mp4", "09-15-interior.mp4")
+
+    assert maker._find_day_videos("2024-01-01") == (
+        recorder_dir, [os.path.join(recorder_dir, "10-00-00_seq001_01_road.mp4")])
+    assert maker._find_day_videos("2024-01-02") == (legacy_dir, [os.path.join(legacy_dir, "09-15-road.mp4")])
+    assert maker._find_day_videos("2024-01-02", camera="interior")[1] == [
+        os.path.join(legacy_dir, "09-15-interior.mp4")]
+    assert maker._find_day_videos("2024-01-03")[1] == []
+
+
+def test_extraction_concurrency_is_bounded_and_encoded_once():
+    maker, fake = new_maker()
+    maker.max_summary_workers = 2
+    day_dir = os.path.join(maker.base_data_dir, "videos", "2024-01-01")
+    add_clips(day_dir, *[f"10-0{i}-00_seq00{i}_01_road.mp4" for i in range(6)])
+
+    assert asyncio.run(maker.create_daily_summary(DAY)) is not None
+    assert fake.max_running == 2
+    # Una única codificación, después de todas las extracciones
+    assert len(fake.encodes()) == 1 and "concat" in fake.commands[-1]
+    assert len(fake.extracted()) == 6
+
+
+def test_stale_intermediates_are_pruned():
+    maker, fake = new_maker()
+    day_dir = os.path.join(maker.base_data_dir, "videos", "2024-01-01")
+    cache_dir = os.path.join(day_dir, ".summary_cache")
+    add_clips(day_dir, "10-00-00_seq001_01_road.mp4", "10-01-00_seq002_01_road.mp4")
+    asyncio.run(maker.create_daily_summary(DAY))
+    assert len(os.listdir(cache_dir)) == 2
+
+    # Otros parámetros: los intermedios anteriores ya no sirven
+    asyncio.run(maker.create_daily_summary(DAY, mode="keyframes"))
+    assert sorted(name.split(".")[-2][:9] for name in os.listdir(cache_dir)) == ["keyframes"] * 2
+
+    # Clip borrado: su intermedio desaparece en la siguiente pasada
+    os.remove(os.path.join(day_dir, "10-00-00_seq001_01_road.mp4"))
+    assert prune_summary_cache(day_dir) == 1
+    assert [name.split(".")[0] for name in os.listdir(cache_dir)] == ["10-01-00_seq002_01_road"]
+
+    # Sin clips en el día se elimina la caché entera
+    os.remove(os.path.join(day_dir, "10-01-00_seq002_01_road.mp4"))
+    assert asyncio.run(maker.create_daily_summary(DAY, mode="keyframes")) is None
+    assert not os.path.exists(cache_dir)
+
+
+if __name__ == "__main__":
+    for name, func in list(globals().items()):
+        if name.startswith("test_") and callable(func):
+            func()
+            print(f"✅ {name}")
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Benchmark de teselas por segundo de /api/offline-maps/mbtiles/tile/{z}/{x}/{y}.
+
+Genera un MBTiles sintético y simula el paneo de un mapa (ventanas de
+teselas vecinas que se repiten en varios zooms) midiendo:
+  - el camino antiguo: listar el directorio + MBTilesReader nuevo por tesela
+  - MBTilesTileService con la LRU fría (lectura de la base de datos)
+  - MBTilesTileService con la LRU caliente
+  - la ruta HTTP completa (TestClient), con y sin If-None-Match (304)
+
+Uso:
+    python tools/benchmark_mbtiles_tiles.py --tiles 20000 --requests 5000
+"""
+
+import argparse
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import routes.offline_maps as offline_maps
+from utils.mbtiles_service import MBTilesTileService
+
+ZOOM = 14
+ORIGIN_X, ORIGIN_Y = 8000, 6000
+
+
+def build_mbtiles(path: str, count: int, tile_size: int):
+    side = int(count ** 0.5) + 1
+    payload = b'\x89PNG\r\n\x1a\n' + os.urandom(tile_size)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+    conn.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
+    conn.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+    conn.executemany("INSERT INTO metadata VALUES (?, ?)",
+                     [("name", "benchmark"), ("format", "png"), ("minzoom", str(ZOOM)), ("maxzoom", str(ZOOM))])
+    rows = (
+        (ZOOM, ORIGIN_X + i % side, (1 << ZOOM) - 1 - (ORIGIN_Y + i // side), payload[:-4] + i.to_bytes(4, "little"))
+        for i in range(count)
+    )
+    conn.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    return side
+
+
+def pan_requests(side: int, count: int, seed: int):
+    """Ventanas de 6x4 teselas alrededor de un centro que se desplaza poco a poco"""
+    rng = random.Random(seed)
+    cx, cy = side // 2, side // 2
+    requests = []
+    while len(requests) < count:
+        cx = min(side - 4, max(3, cx + rng.randint(-1, 1)))
+        cy = min(side - 3, max(2, cy + rng.randint(-1, 1)))
+        for dx in range(-3, 3):
+            for dy in range(-2, 2):
+                requests.append((ZOOM, ORIGIN_X + cx + dx, ORIGIN_Y + cy + dy))
+    return requests[:count]
+
+
+def legacy_tile(directory: str, z: int, x: int, y: int):
+    path = next(os.path.join(directory, n) for n in os.listdir(directory) if n.endswith(".mbtiles"))
+    with offline_maps.MBTilesReader(path) as reader:
+        return reader.get_tile(z, x, y)
+
+
+def rate(count: int, func) -> float:
+    start = time.perf_counter()
+    func()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MBTiles tile serving benchmark")
+    parser.add_argument("--tiles", type=int, default=20000)
+    parser.add_argument("--tile-size", type=int, default=12000, help="Bytes por tesela")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--legacy-requests", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    data_path = tempfile.mkdtemp()
+    directory = os.path.join(data_path, offline_maps.OFFLINE_MAPS_DIR)
+    os.makedirs(directory)
+    side = build_mbtiles(os.path.join(directory, "benchmark.mbtiles"), args.tiles, args.tile_size)
+    requests = pan_requests(side, args.requests, args.seed)
+    unique = len(set(requests))
+
+    legacy = requests[:args.legacy_requests]
+    print(f"{'legacy (listdir + reader)':<32} {rate(len(legacy), lambda: [legacy_tile(directory, *t) for t in legacy]):>10.0f} tiles/s")
+
+    service = MBTilesTileService(directory, cache_bytes=1)  # sin LRU: todo va a SQLite
+    print(f"{'service, LRU fría':<32} {rate(len(requests), lambda: [service.get_tile(*t) for t in requests]):>10.0f} tiles/s")
+
+    service = MBTilesTileService(directory)
+    for t in requests:
+        service.get_tile(*t)
+    print(f"{'service, LRU caliente':<32} {rate(len(requests), lambda: [service.get_tile(*t) for t in requests]):>10.0f} tiles/s"
+          f"  ({unique} teselas distintas)")
+
+    offline_maps.config = SimpleNamespace(data_path=data_path)
+    app = FastAPI()
+    app.include_router(offline_maps.router, prefix="/api/offline-maps")
+    with TestClient(app) as client:
+        urls = [f"/api/offline-maps/mbtiles/tile/{z}/{x}/{y}" for z, x, y in requests]
+        etags = {url: client.get(url).headers["etag"] for url in set(urls)}
+        print(f"{'HTTP 200':<32} {rate(len(urls), lambda: [client.get(u) for u in urls]):>10.0f} tiles/s")
+        print(f"{'HTTP 304 (If-None-Match)':<32} "
+              f"{rate(len(urls), lambda: [client.get(u, headers={'If-None-Match': etags[u]}) for u in urls]):>10.0f} tiles/s")
+        print(offline_maps._get_mbtiles_service().get_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Benchmark del geocoding offline: consulta antigua (bounding box sobre el índice
+B-tree lat/lon, ordenada por distancia Manhattan) frente a DBStorage con índice
+R*Tree y conexión persistente.
+
+Genera una base de datos sintética con el esquema de detailed_geocoding
+repartida sobre la extensión de un país (por defecto, la península ibérica).
+
+Uso:
+    python tools/benchmark_offline_geocoding.py --rows 3000000 --queries 2000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geocoding.utils.db_storage import DBStorage, DETAILED_GEOCODING_DDL
+
+# Extensión aproximada de la península ibérica
+BBOX = (36.0, -9.3, 43.8, 3.3)
+
+LEGACY_QUERY = """
+SELECT road, state, country, country_code,
+       ABS(lat - ?) + ABS(lon - ?) as distance_approx,
+       display_name, house_number, neighbourhood, suburb, county, province, postcode,
+       COALESCE(city, village, town, name) as city_name, village, town, city
+FROM detailed_geocoding
+WHERE lat BETWEEN ? AND ?
+AND lon BETWEEN ? AND ?
+ORDER BY distance_approx LIMIT 1
+"""
+
+
+def build_database(path: str, rows: int, seed: int):
+    rng = random.Random(seed)
+    min_lat, min_lon, max_lat, max_lon = BBOX
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute(DETAILED_GEOCODING_DDL)
+
+    batch = []
+    for i in range(rows):
+        batch.append((
+            rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon),
+            "bench", f"Calle {i}", f"Ciudad {i % 8000}", f"Provincia {i % 50}", "España", "es"
+        ))
+        if len(batch) == 50000:
+            conn.executemany(
+                "INSERT INTO detailed_geocoding (lat, lon, trip_id, road, city, state, country, country_code) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            batch.clear()
+    if batch:
+        conn.executemany(
+            "INSERT INTO detailed_geocoding (lat, lon, trip_id, road, city, state, country, country_code) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+    conn.commit()
+    conn.close()
+
+
+def query_points(count: int, seed: int):
+    rng = random.Random(seed + 1)
+    min_lat, min_lon, max_lat, max_lon = BBOX
+    return [(rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon)) for _ in range(count)]
+
+
+def bench_legacy(path: str, points, radius_km: float) -> float:
+    lat_range = radius_km / 111.32
+    start = time.perf_counter()
+    for lat, lon in points:
+        # La implementación antigua abría una conexión y listaba tablas en cada consulta
+        with sqlite3.connect(path) as conn:
+            conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+            lon_range = radius_km / (111.32 * abs(__import__('math').cos(__import__('math').radians(lat))))
+            conn.execute(LEGACY_QUERY, (lat, lon, lat - lat_range, lat + lat_range,
+                                        lon - lon_range, lon + lon_range)).fetchone()
+    return time.perf_counter() - start
+
+
+def bench_indexed(storage: DBStorage, points, radius_km: float) -> float:
+    start = time.perf_counter()
+    for lat, lon in points:
+        storage.lookup_nearest(lat, lon, radius_km)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline geocoding lookup benchmark")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--radius-km", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", help="Reutilizar/crear la base de datos en esta ruta")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="geobench_"), "geocoding_bench.db")
+    if not os.path.exists(db_path):
+        print(f"Generando {args.rows:,} filas en {db_path}...")
+        start = time.perf_counter()
+        build_database(db_path, args.rows, args.seed)
+        print(f"  {time.perf_counter() - start:.1f} s")
+
+    points = query_points(args.queries, args.seed)
+
+    legacy = bench_legacy(db_path, points, args.radius_km)
+
+    storage = DBStorage(geocoding_db_path=db_path)
+    start = time.perf_counter()
+    storage.prepare()
+    print(f"Resolución de esquema + construcción de índice R*Tree: {time.perf_counter() - start:.1f} s")
+    indexed = bench_indexed(storage, points, args.radius_km)
+    storage.close()
+
+    for name, elapsed in (("antigua (B-tree + sqlite_master)", legacy), ("R*Tree + conexión persistente", indexed)):
+        print(f"{name:36s} {elapsed * 1000 / len(points):8.3f} ms/consulta  "
+              f"{len(points) / elapsed:10.0f} consultas/s")
+    print(f"Mejora: x{legacy / indexed:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Benchmark del cálculo de radios adaptativos y del optimizador de radio sobre
+importaciones KML grandes.
+
+Genera un KML sintético con miles de placemarks agrupados a lo largo de una
+ruta (paradas densas en ciudades y dispersas entre ellas), lo importa con el
+parser de KML y mide:
+  - AdaptiveRadiusCalculator.calculate_optimized_radii (índice espacial)
+  - el cálculo antiguo por waypoint (calculate_density_factor +
+    calculate_overlap_reduction_factor, O(n²)), solo hasta --legacy-max
+  - RadiusOptimizer.optimize_coverage
+
+Uso:
+    python tools/benchmark_radius_optimizer.py --sizes 1000 5000 10000
+"""
+
+import argparse
+import io
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geocoding.utils.adaptive_radius_calculator import AdaptiveRadiusCalculator
+from landmarks.services.radius_optimizer import RadiusOptimizer, Waypoint
+from utils.kml_reader import read_kml
+
+# Ruta aproximada Lisboa - Madrid - Barcelona
+ROUTE = [(38.72, -9.14), (39.47, -6.37), (40.42, -3.70), (41.65, -0.88), (41.39, 2.17)]
+
+
+def build_kml(count: int, seed: int) -> str:
+    rng = random.Random(seed)
+    placemarks = []
+    for i in range(count):
+        start, end = rng.choice(list(zip(ROUTE[:-1], ROUTE[1:])))
+        t = rng.random()
+        # Dos tercios de los puntos se concentran cerca de las ciudades
+        spread = 0.05 if rng.random() < 0.66 else 0.4
+        if spread == 0.05:
+            t = round(t)
+        lat = start[0] + (end[0] - start[0]) * t + rng.gauss(0, spread)
+        lon = start[1] + (end[1] - start[1]) * t + rng.gauss(0, spread)
+        placemarks.append(
+            f"<Placemark><name>Parada {i}</name>"
+            f"<Point><coordinates>{lon:.6f},{lat:.6f},0</coordinates></Point></Placemark>"
+        )
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>'
+            + "".join(placemarks) +
+            "</Document></kml>")
+
+
+def legacy_radii(calculator: AdaptiveRadiusCalculator, waypoints):
+    radii = []
+    for waypoint in waypoints:
+        area_type = calculator.detect_area_type(waypoint['lat'], waypoint['lon'])
+        base = {"urban": 6.0, "suburban": 10.0}.get(area_type, 15.0)
+        radius = base * calculator.calculate_density_factor(waypoint, waypoints)
+        radius *= calculator.calculate_overlap_reduction_factor(waypoint, waypoints, radius)
+        radii.append(max(calculator.min_radius, min(calculator.max_radius, radius)))
+    return radii
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Adaptive radius / radius optimizer benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 2500, 5000, 10000])
+    parser.add_argument("--legacy-max", type=int, default=1000,
+                        help="Tamaño máximo para ejecutar el cálculo O(n²) antiguo")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    calculator = AdaptiveRadiusCalculator()
+
+    print(f"{'waypoints':>10} {'import KML':>11} {'radios':>9} {'radios O(n²)':>13} {'optimizer':>10}")
+    for size in args.sizes:
+        kml = build_kml(size, args.seed)
+        parsed, parse_time = timed(read_kml, io.BytesIO(kml.encode()))
+        waypoints = parsed['waypoints']
+
+        radii, radii_time = timed(calculator.calculate_optimized_radii, waypoints)
+
+        legacy_column = "-"
+        if size <= args.legacy_max:
+            legacy, legacy_time = timed(legacy_radii, calculator, waypoints)
+            max_diff = max(abs(a - b) for a, b in zip(radii, legacy))
+            legacy_column = f"{legacy_time:.2f} s"
+            if max_diff > 1e-6:
+                print(f"  aviso: diferencia máxima de radio {max_diff:.6f} km")
+
+        optimizer_waypoints = [Waypoint(wp['lat'], wp['lon'], wp['name']) for wp in waypoints]
+        _, optimizer_time = timed(RadiusOptimizer().optimize_coverage, optimizer_waypoints)
+
+        print(f"{len(waypoints):>10} {parse_time:>9.2f} s {radii_time:>7.2f} s {legacy_column:>13} "
+              f"{optimizer_time:>8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
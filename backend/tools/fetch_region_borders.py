@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Descarga las fronteras de las regiones MWM (archivos ``.poly`` de
+``data/borders`` de Organic Maps) al directorio que usa el índice de
+cobertura de regiones (``organic_maps/borders``).
+
+Sin argumentos descarga las fronteras de todas las regiones de
+``organic_maps/regions_cache.json``; las que ya existen no se vuelven a pedir.
+
+Uso:
+    python tools/fetch_region_borders.py                        # todas las regiones conocidas
+    python tools/fetch_region_borders.py Spain_Aragon Spain_Catalonia
+    python tools/fetch_region_borders.py --data-path /ruta/datos --force
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.region_index import POLY_SUFFIX, RegionIndex
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BORDERS_URL = "https://raw.githubusercontent.com/organicmaps/organicmaps/master/data/borders"
+
+
+def known_region_ids(organic_maps_dir: str):
+    with open(os.path.join(organic_maps_dir, "regions_cache.json"), "r") as f:
+        regions = json.load(f).get("regions", [])
+    # World/USA son añadidos locales, no tienen frontera
+    return sorted({r["id"] for r in regions if r.get("id") not in ("World", "planet", "USA")})
+
+
+def fetch_border(session: requests.Session, base_url: str, region_id: str, borders_dir: str, force: bool) -> str:
+    path = os.path.join(borders_dir, region_id + POLY_SUFFIX)
+    if os.path.exists(path) and not force:
+        return "exists"
+    response = session.get(f"{base_url}/{region_id}{POLY_SUFFIX}", timeout=30)
+    if response.status_code == 404:
+        return "missing"
+    response.raise_for_status()
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(response.content)
+    os.replace(temp_path, path)
+    return "downloaded"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Descargar las fronteras .poly de las regiones de Organic Maps")
+    parser.add_argument("regions", nargs="*", help="IDs de región (por defecto, todas las de regions_cache.json)")
+    parser.add_argument("--data-path", help="Directorio de datos (por defecto, el de la configuración)")
+    parser.add_argument("--base-url", default=BORDERS_URL)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--force", action="store_true", help="Volver a descargar las que ya existen")
+    args = parser.parse_args()
+
+    if args.data_path:
+        data_path = args.data_path
+    else:
+        from config import config
+        data_path = config.data_path
+    organic_maps_dir = os.path.join(data_path, "organic_maps")
+    borders_dir = os.path.join(organic_maps_dir, "borders")
+    os.makedirs(borders_dir, exist_ok=True)
+
+    region_ids = args.regions or known_region_ids(organic_maps_dir)
+    logger.info(f"Descargando fronteras de {len(region_ids)} regiones en {borders_dir}")
+
+    results = {}
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {region_id: pool.submit(fetch_border, session, args.base_url, region_id, borders_dir, args.force)
+                   for region_id in region_ids}
+        for region_id, future in futures.items():
+            try:
+                results[region_id] = future.result()
+            except Exception as e:
+                logger.error(f"Error descargando la frontera de {region_id}: {str(e)}")
+                results[region_id] = "error"
+
+    for status in ("downloaded", "exists", "missing", "error"):
+        ids = [region_id for region_id, result in results.items() if result == status]
+        if ids:
+            logger.info(f"{status}: {len(ids)}" + (f" ({', '.join(ids[:10])})" if status in ("missing", "error") else ""))
+
+    index = RegionIndex.from_directory(borders_dir)
+    logger.info(f"Índice de regiones: {index.get_stats()}")
+
+
+if __name__ == "__main__":
+    main()
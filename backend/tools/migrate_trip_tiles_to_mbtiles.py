@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Migra las descargas de teselas antiguas (árbol ``offline_maps/{trip_id}/{z}/{x}/{y}.png``)
+al MBTiles por viaje (``offline_maps/{trip_id}/tiles.mbtiles``) que usa ahora
+la descarga de mapas offline.
+
+Las teselas se insertan por lotes y el árbol PNG solo se borra (``--delete``)
+cuando todas sus teselas están en el MBTiles. Se puede repetir sin riesgo:
+las teselas ya migradas se sobrescriben con el mismo contenido.
+
+Uso:
+    python tools/migrate_trip_tiles_to_mbtiles.py                 # todos los viajes
+    python tools/migrate_trip_tiles_to_mbtiles.py TRIP_ID --delete
+    python tools/migrate_trip_tiles_to_mbtiles.py --dry-run
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.mbtiles_writer import MBTilesWriter, TRIP_MBTILES_NAME
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+
+def iter_png_tiles(trip_dir: str):
+    """(z, x, y, path) of every tile in a legacy trip tree"""
+    for z_name in sorted(os.listdir(trip_dir)):
+        z_dir = os.path.join(trip_dir, z_name)
+        if not z_name.isdigit() or not os.path.isdir(z_dir):
+            continue
+        for x_name in os.listdir(z_dir):
+            x_dir = os.path.join(z_dir, x_name)
+            if not x_name.isdigit() or not os.path.isdir(x_dir):
+                continue
+            for file_name in os.listdir(x_dir):
+                y_name, ext = os.path.splitext(file_name)
+                if ext == ".png" and y_name.isdigit():
+                    yield int(z_name), int(x_name), int(y_name), os.path.join(x_dir, file_name)
+
+
+def migrate_trip(trip_dir: str, delete: bool = False, dry_run: bool = False) -> dict:
+    tiles = list(iter_png_tiles(trip_dir))
+    result = {"trip": os.path.basename(trip_dir), "png_tiles": len(tiles), "migrated": 0, "unique": 0}
+    if not tiles or dry_run:
+        return result
+
+    writer = MBTilesWriter(os.path.join(trip_dir, TRIP_MBTILES_NAME))
+    try:
+        zooms = sorted({z for z, _, _, _ in tiles})
+        metadata = {"name": f"trip {result['trip']}", "format": "png", "type": "baselayer",
+                    "minzoom": zooms[0], "maxzoom": zooms[-1]}
+        metadata_path = os.path.join(trip_dir, "metadata.json")
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as f:
+                bounds = json.load(f).get("bounds") or {}
+            if all(k in bounds for k in ("west", "south", "east", "north")):
+                metadata["bounds"] = ",".join(str(float(bounds[k])) for k in ("west", "south", "east", "north"))
+        writer.set_metadata(metadata)
+
+        for i in range(0, len(tiles), BATCH_SIZE):
+            rows = []
+            for z, x, y, path in tiles[i:i + BATCH_SIZE]:
+                with open(path, "rb") as f:
+                    data = f.read()
+                if data:
+                    rows.append((z, x, y, data))
+            result["migrated"] += writer.write_batch(rows)
+
+        # Verificar antes de borrar nada: cada tesela del árbol debe estar en el MBTiles
+        stored = {z: writer.existing_tiles(z) for z in zooms}
+        missing = [t for t in tiles if (t[1], t[2]) not in stored[t[0]]]
+        result["unique"] = writer.count()[1]
+    finally:
+        writer.close()
+
+    if missing:
+        logger.warning(f"{result['trip']}: {len(missing)} tiles not migrated (empty files?); PNG tree kept")
+    elif delete:
+        for z in zooms:
+            shutil.rmtree(os.path.join(trip_dir, str(z)))
+        result["deleted"] = True
+
+    if os.path.exists(metadata_path):
+        with open(metadata_path) as f:
+            trip_metadata = json.load(f)
+        trip_metadata["storage"] = TRIP_MBTILES_NAME
+        with open(metadata_path, "w") as f:
+            json.dump(trip_metadata, f, indent=2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate per-trip PNG tile trees to per-trip MBTiles")
+    parser.add_argument("trip_ids", nargs="*", help="Trips to migrate (default: all)")
+    parser.add_argument("--maps-dir", help="offline_maps directory (default: <data_path>/offline_maps)")
+    parser.add_argument("--delete", action="store_true", help="Delete the PNG tree once migrated and verified")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the tiles to migrate")
+    args = parser.parse_args()
+
+    maps_dir = args.maps_dir
+    if not maps_dir:
+        from config import config
+        maps_dir = os.path.join(config.data_path, "offline_maps")
+    if not os.path.isdir(maps_dir):
+        logger.error(f"Offline maps directory not found: {maps_dir}")
+        sys.exit(1)
+
+    trip_ids = args.trip_ids or sorted(
+        name for name in os.listdir(maps_dir)
+        if os.path.isdir(os.path.join(maps_dir, name)) and not name.startswith(".") and name != "tile_store"
+    )
+    total = 0
+    for trip_id in trip_ids:
+        trip_dir = os.path.join(maps_dir, trip_id)
+        if not os.path.isdir(trip_dir):
+            logger.warning(f"Trip directory not found: {trip_dir}")
+            continue
+        result = migrate_trip(trip_dir, delete=args.delete, dry_run=args.dry_run)
+        if result["png_tiles"]:
+            logger.info(f"{trip_id}: {result['png_tiles']} PNG tiles, {result['migrated']} migrated, "
+                        f"{result['unique']} unique images{' (PNG tree deleted)' if result.get('deleted') else ''}")
+        total += result["png_tiles"]
+    logger.info(f"Done: {total} PNG tiles in {len(trip_ids)} trips{' (dry run)' if args.dry_run else ''}")
+
+
+if __name__ == "__main__":
+    main()
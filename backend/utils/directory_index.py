@@ -0,0 +1,289 @@
+"""
+Índice en memoria de listados de directorio para el explorador de archivos.
+
+Cada directorio se escanea una sola vez con ``os.scandir`` reutilizando los
+resultados de ``DirEntry.is_dir()`` y ``DirEntry.stat()``. El resultado se
+guarda en caché y se valida con el ``st_mtime_ns`` del propio directorio (que
+cambia al crear, borrar o renombrar entradas), más un TTL corto para acotar
+el tiempo que el tamaño de un archivo en crecimiento puede quedar desfasado.
+"""
+import base64
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.webm', '.mkv', '.insv', '.mts', '.m2ts')
+
+MIME_TYPES = {
+    '.mp4': 'video/mp4',
+    '.avi': 'video/x-msvideo',
+    '.mov': 'video/quicktime',
+    '.webm': 'video/webm',
+    '.mkv': 'video/x-matroska',
+    '.insv': 'video/mp4',  # Insta360 usa contenedores MP4
+    '.mts': 'video/mp2t',
+    '.m2ts': 'video/mp2t'
+}
+
+SORT_FIELDS = ('name', 'size', 'modified')
+
+
+def _isoformat(timestamp: float) -> str:
+    try:
+        return datetime.datetime.fromtimestamp(timestamp).isoformat()
+    except (ValueError, OverflowError, OSError):
+        return datetime.datetime.now().isoformat()
+
+
+class IndexedEntry:
+    """Entrada de directorio con la información ya serializable y sus claves de orden"""
+
+    __slots__ = ('name', 'is_dir', 'size', 'mtime', 'info')
+
+    def __init__(self, name: str, is_dir: bool, size: int, mtime: float, info: Dict[str, Any]):
+        self.name = name
+        self.is_dir = is_dir
+        self.size = size
+        self.mtime = mtime
+        self.info = info
+
+    @property
+    def is_video(self) -> bool:
+        return bool(self.info.get("is_video"))
+
+
+class DirectorySnapshot:
+    """Contenido de un directorio en un instante dado"""
+
+    def __init__(self, path: str, mtime_ns: int, entries: List[IndexedEntry]):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.entries = entries
+        self.created_at = time.monotonic()
+        # Órdenes ya calculados: {(sort_by, descending): [IndexedEntry]}
+        self._orders: Dict[Tuple[str, bool], List[IndexedEntry]] = {}
+
+    @property
+    def version(self) -> str:
+        return f"{self.mtime_ns:x}-{len(self.entries)}"
+
+    def ordered(self, sort_by: str = 'name', descending: bool = False) -> List[IndexedEntry]:
+        """Devuelve las entradas ordenadas (directorios siempre primero)"""
+        key = (sort_by, descending)
+        cached = self._orders.get(key)
+        if cached is not None:
+            return cached
+
+        if sort_by == 'size':
+            sort_key = lambda e: (e.size, e.name)
+        elif sort_by == 'modified':
+            sort_key = lambda e: (e.mtime, e.name)
+        else:
+            # Mismo orden que el listado original: sensible a mayúsculas
+            sort_key = lambda e: e.name
+
+        dirs = sorted((e for e in self.entries if e.is_dir), key=sort_key, reverse=descending)
+        files = sorted((e for e in self.entries if not e.is_dir), key=sort_key, reverse=descending)
+        ordered = dirs + files
+        self._orders[key] = ordered
+        return ordered
+
+
+def encode_cursor(version: str, offset: int, last_name: Optional[str]) -> str:
+    """Codifica un cursor opaco para la siguiente página"""
+    payload = json.dumps({"v": version, "o": offset, "n": last_name}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """Decodifica un cursor; lanza ValueError si no es válido"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        if not isinstance(data, dict) or not isinstance(data.get("o"), int):
+            raise ValueError("estructura inesperada")
+        return data
+    except Exception as e:
+        raise ValueError(f"Cursor inválido: {e}")
+
+
+class DirectoryIndex:
+    """
+    Caché LRU de listados de directorio validada por mtime.
+
+    Es seguro usarlo desde varios hilos: el escaneo de un directorio se hace
+    fuera del lock y el último resultado en llegar gana.
+    """
+
+    def __init__(self, max_directories: int = 64, max_age: float = 30.0):
+        self.max_directories = max_directories
+        self.max_age = max_age
+        self._snapshots: "OrderedDict[str, DirectorySnapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get_snapshot(self, path: str) -> DirectorySnapshot:
+        """Devuelve el contenido del directorio, escaneándolo solo si ha cambiado"""
+        path = os.path.normpath(path)
+        dir_mtime_ns = os.stat(path).st_mtime_ns
+        snapshot = self._cached(path, dir_mtime_ns)
+        if snapshot is not None:
+            return snapshot
+        return self._store(DirectorySnapshot(path, dir_mtime_ns, self._scan(path)))
+
+    def cached_snapshot(self, path: str) -> Optional[DirectorySnapshot]:
+        """Snapshot vigente del directorio si ya está en caché (sin escanear)"""
+        path = os.path.normpath(path)
+        return self._cached(path, os.stat(path).st_mtime_ns)
+
+    def iter_scan(self, path: str) -> Iterator[IndexedEntry]:
+        """
+        Escanea el directorio devolviendo cada entrada en cuanto se lee (orden
+        del sistema de archivos); al terminar guarda el snapshot en la caché.
+        """
+        path = os.path.normpath(path)
+        dir_mtime_ns = os.stat(path).st_mtime_ns
+        with self._lock:
+            self.stats["misses"] += 1
+        entries = []
+        for entry in self._iter_entries(path):
+            entries.append(entry)
+            yield entry
+        self._store(DirectorySnapshot(path, dir_mtime_ns, entries), count_miss=False)
+
+    def _cached(self, path: str, dir_mtime_ns: int) -> Optional[DirectorySnapshot]:
+        with self._lock:
+            snapshot = self._snapshots.get(path)
+            if (snapshot is not None and snapshot.mtime_ns == dir_mtime_ns
+                    and time.monotonic() - snapshot.created_at < self.max_age):
+                self._snapshots.move_to_end(path)
+                self.stats["hits"] += 1
+                return snapshot
+        return None
+
+    def _store(self, snapshot: DirectorySnapshot, count_miss: bool = True) -> DirectorySnapshot:
+        with self._lock:
+            if count_miss:
+                self.stats["misses"] += 1
+            self._snapshots[snapshot.path] = snapshot
+            self._snapshots.move_to_end(snapshot.path)
+            while len(self._snapshots) > self.max_directories:
+                self._snapshots.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, path: str) -> None:
+        """Descarta la entrada de un directorio (y de su padre) tras una modificación"""
+        path = os.path.normpath(path)
+        with self._lock:
+            for candidate in (path, os.path.dirname(path)):
+                if self._snapshots.pop(candidate, None) is not None:
+                    self.stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._snapshots.clear()
+
+    def _scan(self, path: str) -> List[IndexedEntry]:
+        return list(self._iter_entries(path))
+
+    def _iter_entries(self, path: str) -> Iterator[IndexedEntry]:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    yield self._build_entry(entry)
+                except OSError as e:
+                    # Entrada que desaparece durante el escaneo o enlace roto
+                    logger.debug(f"Error procesando entrada {entry.path}: {e}")
+                    yield IndexedEntry(entry.name, False, 0, 0.0, {
+                        "name": entry.name,
+                        "path": entry.path,
+                        "error": str(e)
+                    })
+
+    @staticmethod
+    def _build_entry(entry: os.DirEntry) -> IndexedEntry:
+        # is_dir() usa d_type de readdir y stat() se cachea en el DirEntry,
+        # así que cada entrada cuesta como mucho una llamada al sistema
+        is_dir = entry.is_dir()
+        stat_info = entry.stat()
+        size = 0 if is_dir else stat_info.st_size
+
+        info = {
+            "name": entry.name or "Unknown",
+            "path": entry.path,
+            "is_directory": is_dir,
+            "size": size,
+            "modified": _isoformat(stat_info.st_mtime),
+            "created": _isoformat(stat_info.st_ctime),
+        }
+
+        if not is_dir:
+            extension = os.path.splitext(entry.name)[1].lower()
+            if extension in VIDEO_EXTENSIONS:
+                info["is_video"] = True
+                info["mime_type"] = MIME_TYPES.get(extension, 'application/octet-stream')
+
+        return IndexedEntry(entry.name, is_dir, size, stat_info.st_mtime, info)
+
+
+def filter_entries(entries: Iterable[IndexedEntry], filter_video: bool = False,
+                   search: Optional[str] = None) -> Iterator[IndexedEntry]:
+    """Entradas que pasan el filtro de vídeo y la búsqueda por nombre (sin distinguir mayúsculas)"""
+    needle = search.lower() if search else None
+    for e in entries:
+        if (not filter_video or e.is_dir or e.is_video) and (needle is None or needle in e.name.lower()):
+            yield e
+
+
+def select_page(snapshot: DirectorySnapshot, sort_by: str = 'name', descending: bool = False,
+                filter_video: bool = False, search: Optional[str] = None,
+                cursor: Optional[str] = None, limit: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Aplica orden, filtros y paginación sobre un snapshot.
+
+    El cursor guarda la versión del snapshot, el desplazamiento y el nombre de la
+    última entrada devuelta. Si el directorio cambió entre páginas, la siguiente
+    página continúa justo después de esa entrada en el nuevo listado.
+    """
+    if sort_by not in SORT_FIELDS:
+        raise ValueError(f"Campo de orden no soportado: {sort_by}")
+
+    ordered = snapshot.ordered(sort_by, descending)
+
+    if filter_video or search:
+        ordered = list(filter_entries(ordered, filter_video, search))
+
+    start = 0
+    if cursor:
+        data = decode_cursor(cursor)
+        start = data["o"]
+        if data.get("v") != snapshot.version and data.get("n") is not None:
+            last_name = data["n"]
+            for index, entry in enumerate(ordered):
+                if entry.name == last_name:
+                    start = index + 1
+                    break
+        start = max(0, min(start, len(ordered)))
+
+    end = len(ordered) if limit is None else min(len(ordered), start + limit)
+    page = ordered[start:end]
+
+    next_cursor = None
+    if end < len(ordered):
+        next_cursor = encode_cursor(snapshot.version, end, page[-1].name if page else None)
+
+    return {
+        "entries": [e.info for e in page],
+        "total": len(ordered),
+        "next_cursor": next_cursor,
+    }
+
+
+# Instancia compartida por las rutas
+directory_index = DirectoryIndex()
@@ -0,0 +1,537 @@
+"""
+Gestor de descargas de archivos grandes (mapas MWM) reanudables.
+
+Los MWM de un país pesan cientos de MB y se descargan por el móvil del
+conductor, con cortes frecuentes. Cada descarga es un trabajo persistente en
+SQLite que guarda sus segmentos (inicio, fin, bytes escritos):
+
+- el archivo parcial se escribe en su posición (``os.pwrite``) y el progreso
+  de cada segmento se guarda tras un ``fsync``, así que después de un corte
+  de red, un reintento o un reinicio de la aplicación la descarga sigue desde
+  el último byte guardado con peticiones HTTP ``Range``;
+- si el servidor admite rangos, un archivo se puede bajar con varias
+  conexiones en paralelo (``connections``);
+- ``If-Range`` con el ETag/Last-Modified de la primera respuesta detecta que
+  el archivo ha cambiado en el servidor y entonces la descarga empieza de cero;
+- todas las conexiones comparten un límite de ancho de banda global;
+- al terminar se comprueba el tamaño (y el SHA-1 si se conoce) antes de
+  mover el parcial a su sitio con un rename atómico.
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass, field, replace
+from typing import Callable, Dict, List, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = ".part"
+DOWNLOAD_USER_AGENT = "DashCam Map Downloader/1.0 (https://dashcam.app)"
+
+# Tamaño de lectura de la respuesta
+CHUNK_SIZE = 64 * 1024
+# Los archivos más pequeños que esto no se trocean
+MIN_SEGMENT_SIZE = 4 * 1024 * 1024
+# Progreso escrito entre dos puntos de control (fsync + SQLite)
+CHECKPOINT_BYTES = 2 * 1024 * 1024
+# Reintentos antes de marcar una descarga como fallida (el parcial se conserva)
+MAX_ATTEMPTS = 8
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+# Intervalo mínimo entre avisos de progreso a los listeners
+PROGRESS_INTERVAL = 0.5
+
+STATUS_QUEUED = "queued"
+STATUS_DOWNLOADING = "downloading"
+STATUS_VERIFYING = "verifying"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+PENDING_STATUSES = (STATUS_QUEUED, STATUS_DOWNLOADING, STATUS_VERIFYING)
+
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class DownloadError(Exception):
+    """Recoverable download error (network, unexpected HTTP status); the job is retried"""
+
+
+class IntegrityError(DownloadError):
+    """The downloaded file does not match the expected size or hash; the partial file is discarded"""
+
+
+class _RemoteChanged(DownloadError):
+    """The file changed on the server since the partial download started"""
+
+
+@dataclass
+class DownloadJob:
+    job_id: str
+    url: str
+    dest: str
+    part_path: str
+    status: str = STATUS_QUEUED
+    total_size: Optional[int] = None
+    expected_size: Optional[int] = None
+    expected_sha1: Optional[str] = None
+    sha1: Optional[str] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    accept_ranges: bool = False
+    connections: int = 1
+    # [inicio, fin (exclusivo, None si no se conoce), bytes escritos]
+    segments: Optional[List[list]] = None
+    attempts: int = 0
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    @property
+    def downloaded_bytes(self) -> int:
+        return sum(segment[2] for segment in self.segments or [])
+
+    def to_dict(self) -> Dict:
+        info = asdict(self)
+        info.pop("segments")
+        info["downloaded_bytes"] = self.downloaded_bytes
+        return info
+
+
+def normalize_sha1(value: Optional[str]) -> Optional[str]:
+    """Hex SHA-1 from a hex or base64 (Organic Maps ``sha1_base64``) digest"""
+    if not value:
+        return None
+    if re.fullmatch(r"[0-9a-fA-F]{40}", value):
+        return value.lower()
+    try:
+        digest = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError(f"Invalid SHA-1 digest: {value}")
+    if len(digest) != 20:
+        raise ValueError(f"Invalid SHA-1 digest: {value}")
+    return digest.hex()
+
+
+def file_sha1(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BandwidthLimiter:
+    """Token bucket shared by every connection (bytes per second, 0 = unlimited; one second of burst)"""
+
+    def __init__(self, rate: int = 0):
+        self.rate = rate
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def consume(self, size: int):
+        if self.rate <= 0:
+            return
+        # Con el lock tomado los que esperan se sirven por orden de llegada
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(float(self.rate), self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= size
+            if self._tokens < 0:
+                await asyncio.sleep(-self._tokens / self.rate)
+
+
+class DownloadJobStore:
+    """Persistent download queue (one row per job)"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS downloads (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                job TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def save(self, job: DownloadJob):
+        job.updated_at = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO downloads (job_id, status, job, updated_at) VALUES (?, ?, ?, ?)",
+                               (job.job_id, job.status, json.dumps(asdict(job)), job.updated_at))
+            self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[DownloadJob]:
+        with self._lock:
+            row = self._conn.execute("SELECT job FROM downloads WHERE job_id = ?", (job_id,)).fetchone()
+        return DownloadJob(**json.loads(row[0])) if row else None
+
+    def list(self, statuses=None) -> List[DownloadJob]:
+        with self._lock:
+            if statuses:
+                rows = self._conn.execute(
+                    f"SELECT job FROM downloads WHERE status IN ({','.join('?' * len(statuses))}) ORDER BY updated_at",
+                    tuple(statuses)).fetchall()
+            else:
+                rows = self._conn.execute("SELECT job FROM downloads ORDER BY updated_at").fetchall()
+        return [DownloadJob(**json.loads(row[0])) for row in rows]
+
+    def delete(self, job_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM downloads WHERE job_id = ?", (job_id,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class DownloadManager:
+    """
+    Resumable downloads with a persistent queue. Jobs run in the event loop
+    that calls ``enqueue``/``resume_pending``; at most ``max_concurrent`` at a time.
+    """
+
+    def __init__(self, db_path: str, rate_limit: int = 0, connections: int = 1, max_concurrent: int = 1,
+                 max_attempts: int = MAX_ATTEMPTS, retry_delay: float = RETRY_BASE_DELAY,
+                 read_timeout: float = 60.0, user_agent: str = DOWNLOAD_USER_AGENT):
+        self.store = DownloadJobStore(db_path)
+        self.limiter = BandwidthLimiter(rate_limit)
+        self.connections = max(1, connections)
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.read_timeout = read_timeout
+        self.user_agent = user_agent
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._jobs: Dict[str, DownloadJob] = {}
+        self._speed: Dict[str, float] = {}
+        self._last_notify: Dict[str, float] = {}
+        self.listeners: List[Callable[[DownloadJob], None]] = []
+        self.stats = {"bytes": 0, "completed": 0, "failed": 0, "retries": 0, "restarts": 0, "resumed": 0}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers={"User-Agent": self.user_agent},
+                # Sin timeout total: un MWM puede tardar horas; sí por lectura
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=self.read_timeout)
+            )
+        return self._session
+
+    # API
+
+    def enqueue(self, job_id: str, url: str, dest: str, part_path: Optional[str] = None,
+                expected_size: Optional[int] = None, expected_sha1: Optional[str] = None,
+                connections: Optional[int] = None) -> DownloadJob:
+        """Queue a download (or resume the existing job for the same file) and start it"""
+        task = self._tasks.get(job_id)
+        if task is not None and not task.done():
+            return self._jobs[job_id]
+
+        part_path = part_path or dest + PART_SUFFIX
+        job = self.store.get(job_id)
+        if job is None or job.url != url or job.dest != dest or job.part_path != part_path:
+            job = DownloadJob(job_id=job_id, url=url, dest=dest, part_path=part_path)
+        job.expected_size = expected_size or job.expected_size
+        job.expected_sha1 = normalize_sha1(expected_sha1) or job.expected_sha1
+        job.connections = max(1, connections or self.connections)
+        job.status = STATUS_QUEUED
+        job.attempts = 0
+        job.error = None
+        self.store.save(job)
+        self._start(job)
+        return job
+
+    def resume_pending(self) -> List[str]:
+        """Restart the jobs left queued or in progress by a previous run"""
+        resumed = []
+        for job in self.store.list(PENDING_STATUSES):
+            if job.job_id not in self._tasks:
+                job.status = STATUS_QUEUED
+                self._start(job)
+                resumed.append(job.job_id)
+        self.stats["resumed"] += len(resumed)
+        if resumed:
+            logger.info(f"Resuming {len(resumed)} pending downloads: {', '.join(resumed)}")
+        return resumed
+
+    async def wait(self, job_id: str) -> Optional[DownloadJob]:
+        task = self._tasks.get(job_id)
+        if task is not None:
+            # shield: si quien espera se cancela, la descarga sigue
+            await asyncio.shield(task)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[DownloadJob]:
+        return self._jobs.get(job_id) or self.store.get(job_id)
+
+    def progress(self, job_id: str) -> Optional[Dict]:
+        job = self.get(job_id)
+        if job is None:
+            return None
+        info = job.to_dict()
+        total = job.total_size or job.expected_size
+        info["progress"] = min(100, int(job.downloaded_bytes * 100 / total)) if total else 0
+        info["speed_kbps"] = round(self._speed.get(job_id, 0.0) / 1024, 2)
+        return info
+
+    async def cancel(self, job_id: str, delete_partial: bool = True):
+        task = self._tasks.get(job_id)
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        job = self.get(job_id)
+        if job is None:
+            return
+        job.status = STATUS_CANCELLED
+        self.store.save(job)
+        if delete_partial and os.path.exists(job.part_path):
+            os.remove(job.part_path)
+        self._notify(job, force=True)
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            "active": sorted(job_id for job_id, task in self._tasks.items() if not task.done()),
+            "rate_limit": self.limiter.rate,
+            "connections": self.connections
+        }
+
+    async def close(self):
+        """Stop running downloads; they stay pending in the queue and resume on the next start"""
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self.store.close()
+
+    # Ejecución
+
+    def _start(self, job: DownloadJob):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._jobs[job.job_id] = job
+        task = asyncio.ensure_future(self._run(job))
+        self._tasks[job.job_id] = task
+        task.add_done_callback(lambda _: self._jobs.pop(job.job_id, None))
+
+    def _notify(self, job: DownloadJob, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_notify.get(job.job_id, 0) < PROGRESS_INTERVAL:
+            return
+        self._last_notify[job.job_id] = now
+        for listener in list(self.listeners):
+            try:
+                listener(job)
+            except Exception as e:
+                logger.warning(f"Download listener error for {job.job_id}: {e}")
+
+    def _set_status(self, job: DownloadJob, status: str, error: Optional[str] = None):
+        job.status = status
+        job.error = error
+        self.store.save(job)
+        self._notify(job, force=True)
+
+    async def _run(self, job: DownloadJob):
+        async with self._semaphore:
+            while True:
+                self._set_status(job, STATUS_DOWNLOADING)
+                try:
+                    await self._download(job)
+                    self._set_status(job, STATUS_VERIFYING)
+                    await asyncio.to_thread(self._verify_and_commit, job)
+                    self.stats["completed"] += 1
+                    self._set_status(job, STATUS_COMPLETED)
+                    logger.info(f"Download {job.job_id} completed ({job.total_size} bytes, sha1 {job.sha1})")
+                    return
+                except asyncio.CancelledError:
+                    # Cierre o cancelación: el trabajo sigue pendiente con su progreso guardado
+                    self.store.save(job)
+                    raise
+                except _RemoteChanged as e:
+                    logger.warning(f"Download {job.job_id}: {e}; starting over")
+                    self.stats["restarts"] += 1
+                    self._reset(job)
+                    continue
+                except (DownloadError, aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                    if isinstance(e, IntegrityError):
+                        self._reset(job)
+                    job.attempts += 1
+                    error = str(e) or e.__class__.__name__
+                    if job.attempts >= self.max_attempts:
+                        self.stats["failed"] += 1
+                        logger.error(f"Download {job.job_id} failed after {job.attempts} attempts: {error}")
+                        self._set_status(job, STATUS_FAILED, error)
+                        return
+                    self.stats["retries"] += 1
+                    delay = min(RETRY_MAX_DELAY, self.retry_delay * 2 ** (job.attempts - 1))
+                    logger.warning(f"Download {job.job_id} interrupted at {job.downloaded_bytes} bytes "
+                                   f"({error}); retry {job.attempts}/{self.max_attempts} in {delay:.0f}s")
+                    job.error = error
+                    self.store.save(job)
+                    await asyncio.sleep(delay)
+
+    def _reset(self, job: DownloadJob):
+        job.segments = None
+        job.total_size = None
+        job.etag = job.last_modified = None
+        if os.path.exists(job.part_path):
+            os.remove(job.part_path)
+        self.store.save(job)
+
+    async def _probe(self, job: DownloadJob):
+        """Size, range support and validators of the remote file (one byte GET: HEAD is not always allowed)"""
+        async with self._get_session().get(job.url, headers={"Range": "bytes=0-0"}) as response:
+            if response.status == 206:
+                match = _CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+                job.accept_ranges = True
+                job.total_size = int(match.group(3)) if match and match.group(3) != "*" else None
+            elif response.status == 200:
+                job.accept_ranges = False
+                length = response.headers.get("Content-Length")
+                job.total_size = int(length) if length else None
+            else:
+                raise DownloadError(f"HTTP {response.status}")
+            job.etag = response.headers.get("ETag")
+            job.last_modified = response.headers.get("Last-Modified")
+
+    def _plan_segments(self, job: DownloadJob) -> List[list]:
+        total = job.total_size
+        if total is None:
+            return [[0, None, 0]]
+        count = job.connections if job.accept_ranges else 1
+        count = max(1, min(count, total // MIN_SEGMENT_SIZE))
+        bounds = [total * i // count for i in range(count + 1)]
+        return [[bounds[i], bounds[i + 1], 0] for i in range(count)]
+
+    async def _download(self, job: DownloadJob):
+        if job.segments is not None and not os.path.exists(job.part_path):
+            # El parcial ha desaparecido: no se puede reanudar
+            job.segments = None
+        if job.segments is None:
+            await self._probe(job)
+            if job.expected_size and job.total_size and job.total_size != job.expected_size:
+                raise IntegrityError(f"Remote size {job.total_size} != expected {job.expected_size}")
+            job.segments = self._plan_segments(job)
+            os.makedirs(os.path.dirname(job.part_path) or ".", exist_ok=True)
+            with open(job.part_path, "wb") as f:
+                if job.total_size:
+                    f.truncate(job.total_size)
+            self.store.save(job)
+            logger.info(f"Download {job.job_id}: {job.total_size} bytes in {len(job.segments)} segment(s) "
+                        f"(ranges {'yes' if job.accept_ranges else 'no'})")
+        elif job.downloaded_bytes:
+            logger.info(f"Download {job.job_id}: resuming at {job.downloaded_bytes}/{job.total_size} bytes")
+
+        fd = os.open(job.part_path, os.O_RDWR)
+        state = {"unsaved": 0, "window_start": time.monotonic(), "window_bytes": 0}
+        tasks = [asyncio.ensure_future(self._fetch_segment(job, segment, fd, state))
+                 for segment in job.segments if segment[1] is None or segment[0] + segment[2] < segment[1]]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.to_thread(os.fsync, fd)
+            os.close(fd)
+            self.store.save(job)
+
+    async def _checkpoint(self, job: DownloadJob, fd: int, state: Dict):
+        # Primero a disco y luego el progreso: lo guardado nunca supera a lo escrito.
+        # Los otros segmentos siguen avanzando durante el fsync, así que se guarda
+        # una copia de los offsets tomada antes de sincronizar
+        state["unsaved"] = 0
+        snapshot = replace(job, segments=[list(segment) for segment in job.segments])
+        await asyncio.to_thread(os.fsync, fd)
+        self.store.save(snapshot)
+
+    async def _fetch_segment(self, job: DownloadJob, segment: list, fd: int, state: Dict):
+        start, end, done = segment
+        if done and not job.accept_ranges:
+            # Sin rangos no se puede reanudar a mitad
+            segment[2] = done = 0
+        position = start + done
+        headers = {}
+        if job.accept_ranges and (position > 0 or end is not None):
+            headers["Range"] = f"bytes={position}-{'' if end is None else end - 1}"
+            validator = job.etag or job.last_modified
+            if validator:
+                headers["If-Range"] = validator
+
+        async with self._get_session().get(job.url, headers=headers) as response:
+            if response.status == 206:
+                match = _CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+                if not match or int(match.group(1)) != position:
+                    raise DownloadError(f"Unexpected Content-Range {response.headers.get('Content-Range')}")
+            elif response.status == 200:
+                if position > 0 or len(job.segments) > 1:
+                    # If-Range no coincide (o el servidor ya no admite rangos): el archivo ha cambiado
+                    raise _RemoteChanged("remote file changed")
+            elif response.status == 416:
+                raise _RemoteChanged("requested range not satisfiable")
+            else:
+                raise DownloadError(f"HTTP {response.status}")
+
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                if end is not None:
+                    chunk = chunk[:end - position]
+                await self.limiter.consume(len(chunk))
+                os.pwrite(fd, chunk, position)
+                position += len(chunk)
+                segment[2] += len(chunk)
+                self.stats["bytes"] += len(chunk)
+                state["unsaved"] += len(chunk)
+                state["window_bytes"] += len(chunk)
+
+                now = time.monotonic()
+                if now - state["window_start"] >= 1.0:
+                    self._speed[job.job_id] = state["window_bytes"] / (now - state["window_start"])
+                    state["window_start"], state["window_bytes"] = now, 0
+                if state["unsaved"] >= CHECKPOINT_BYTES:
+                    await self._checkpoint(job, fd, state)
+                self._notify(job)
+                if end is not None and position >= end:
+                    break
+
+        if end is None:
+            # Tamaño desconocido: el segmento termina donde termina la respuesta
+            segment[1] = position
+            job.total_size = position
+        elif position < end:
+            raise DownloadError(f"Connection closed at byte {position} of segment {start}-{end}")
+
+    def _verify_and_commit(self, job: DownloadJob):
+        size = os.path.getsize(job.part_path)
+        if job.total_size is not None and size != job.total_size:
+            raise IntegrityError(f"Downloaded {size} bytes, expected {job.total_size}")
+        if job.expected_size and size != job.expected_size:
+            raise IntegrityError(f"Downloaded {size} bytes, expected {job.expected_size}")
+        job.sha1 = file_sha1(job.part_path)
+        if job.expected_sha1 and job.sha1 != job.expected_sha1:
+            raise IntegrityError(f"SHA-1 mismatch: {job.sha1} != {job.expected_sha1}")
+        os.replace(job.part_path, job.dest)
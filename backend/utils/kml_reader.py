@@ -0,0 +1,125 @@
+"""
+Lectura en streaming de archivos KML/KMZ (exportaciones de Google My Maps,
+Organic Maps, etc.).
+
+``iter_placemarks`` recorre el XML con ``iterparse`` y devuelve cada
+Placemark en cuanto se cierra su etiqueta; el elemento se quita después del
+árbol, así que la memoria no crece con el tamaño del archivo. Los KMZ se
+descomprimen también en streaming desde el ZIP, sin extraerlos a disco.
+Se aceptan KML con y sin espacio de nombres (2.0, 2.1, 2.2).
+"""
+import zipfile
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+KML_EXTENSIONS = ("kml", "kmz")
+
+
+def file_extension(filename: Optional[str]) -> str:
+    return (filename or "").rsplit(".", 1)[-1].lower()
+
+
+@contextmanager
+def open_kml(fileobj: BinaryIO, filename: str):
+    """Binary stream with the KML document of a .kml or .kmz file object (seekable for KMZ)"""
+    extension = file_extension(filename)
+    if extension == "kml":
+        yield fileobj
+    elif extension == "kmz":
+        with zipfile.ZipFile(fileobj) as kmz:
+            # Los KMZ suelen llevar doc.kml en la raíz; si no, el primer .kml
+            kml_files = [name for name in kmz.namelist() if name.lower().endswith(".kml")]
+            if not kml_files:
+                raise ValueError("No KML file found in the KMZ archive")
+            kml_files.sort(key=lambda name: (name.lower() != "doc.kml", name.count("/")))
+            with kmz.open(kml_files[0]) as stream:
+                yield stream
+    else:
+        raise ValueError(f"Unsupported file format: {extension or 'unknown'}")
+
+
+def _local_name(tag) -> str:
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def _parse_coordinates(text: Optional[str]) -> List[Tuple[float, float]]:
+    """(lat, lon) pairs of a KML ``coordinates`` text (``lon,lat[,alt]`` tuples separated by whitespace)"""
+    points = []
+    for pair in (text or "").split():
+        values = pair.split(",")
+        if len(values) < 2:
+            continue
+        try:
+            points.append((float(values[1]), float(values[0])))
+        except ValueError:
+            continue
+    return points
+
+
+def _read_placemark(elem) -> Dict:
+    name_elem = elem.find("{*}name")
+    desc_elem = elem.find("{*}description")
+    # Primer Point / LineString, también dentro de MultiGeometry
+    point = elem.find(".//{*}Point/{*}coordinates")
+    line = elem.find(".//{*}LineString/{*}coordinates")
+    point_coords = _parse_coordinates(point.text) if point is not None else []
+    return {
+        "name": (name_elem.text if name_elem is not None else None) or "Unnamed",
+        "description": desc_elem.text if desc_elem is not None else None,
+        "point": point_coords[0] if point_coords else None,
+        "line": _parse_coordinates(line.text) if line is not None else []
+    }
+
+
+def iter_placemarks(stream: BinaryIO) -> Iterator[Dict]:
+    """
+    Placemarks of a KML stream in document order, as dicts with ``name``,
+    ``description``, ``point`` ((lat, lon) or None) and ``line`` (list of
+    (lat, lon)). Raises ``xml.etree.ElementTree.ParseError`` on invalid XML.
+    """
+    parents = []
+    for event, elem in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            parents.append(elem)
+            continue
+        parents.pop()
+        if _local_name(elem.tag) != "Placemark":
+            continue
+        placemark = _read_placemark(elem)
+        # Soltar el Placemark ya leído para no acumular el documento entero
+        if parents:
+            parents[-1].remove(elem)
+        yield placemark
+
+
+def iter_point_placemarks(stream: BinaryIO) -> Iterator[Dict]:
+    """Placemarks with a Point as ``{name, lat, lon, description}`` (the landmark candidates)"""
+    for placemark in iter_placemarks(stream):
+        if placemark["point"] is not None:
+            lat, lon = placemark["point"]
+            yield {"name": placemark["name"], "lat": lat, "lon": lon, "description": placemark["description"]}
+
+
+def read_kml(stream: BinaryIO) -> Dict[str, List[Dict]]:
+    """
+    Waypoints and placemarks of a KML stream: every Point placemark is both
+    a placemark and a waypoint, and every LineString vertex is a waypoint.
+    """
+    waypoints = []
+    placemarks = []
+    for placemark in iter_placemarks(stream):
+        name = placemark["name"]
+        if placemark["point"] is not None:
+            lat, lon = placemark["point"]
+            data = {"name": name, "lat": lat, "lon": lon, "description": placemark["description"]}
+            waypoints.append(data)
+            placemarks.append(data)
+        for i, (lat, lon) in enumerate(placemark["line"]):
+            waypoints.append({
+                "name": f"{name} - Point {i + 1}",
+                "lat": lat,
+                "lon": lon,
+                "description": f"Part of route: {name}"
+            })
+    return {"waypoints": waypoints, "placemarks": placemarks}
@@ -0,0 +1,659 @@
+"""
+Servicio de teselas MBTiles de larga duración para /api/offline-maps/mbtiles.
+
+Sirve como un mosaico todos los ``.mbtiles`` del directorio de mapas
+offline (por ejemplo, un extracto por país en un viaje que cruza varios).
+En lugar de listar el directorio y abrir una conexión SQLite nueva por
+tesela, el servicio:
+  - resuelve los archivos una vez y solo vuelve a mirar el directorio
+    (``st_mtime_ns``) y los archivos (mtime, tamaño, inodo) cada
+    ``watch_interval`` segundos
+  - mantiene conexiones de solo lectura con ``immutable=1`` (una por hilo),
+    que SQLite no necesita bloquear ni comprobar en cada consulta
+  - indexa la cobertura de cada archivo por zoom en celdas de
+    ``COVERAGE_ZOOM`` (índice persistido en ``.mbtiles_coverage.json`` y
+    recalculado solo si cambia el archivo), de modo que cada tesela se
+    dirige con una búsqueda en diccionario al archivo que la contiene
+  - guarda las teselas más pedidas en una LRU limitada por bytes, con su
+    ETag y tipo de contenido ya calculados (también las que no existen)
+
+Cuando un archivo cambia (se reemplaza, aparece o desaparece) se reconstruye
+el mosaico y las conexiones antiguas se cierran cuando terminan las lecturas
+en curso. La reconstrucción (que puede indexar archivos nuevos) la hace un
+solo hilo sin bloquear al resto: mientras dura, las teselas se siguen
+sirviendo del mosaico anterior.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MBTILES_EXTENSION = ".mbtiles"
+
+DEFAULT_CACHE_BYTES = 32 * 1024 * 1024
+DEFAULT_WATCH_INTERVAL = 2.0
+
+COVERAGE_INDEX_FILE = ".mbtiles_coverage.json"
+COVERAGE_INDEX_VERSION = 1
+# Zoom de las celdas de cobertura: por encima, cada celda agrupa 4^(z-8) teselas
+COVERAGE_ZOOM = 8
+
+# Coste contable de una tesela inexistente en la LRU
+_MISSING_COST = 64
+
+TileKey = Tuple[int, int, int]
+
+
+def _cell_key(z: int, x: int, y: int) -> TileKey:
+    shift = max(z - COVERAGE_ZOOM, 0)
+    return (z, x >> shift, y >> shift)
+
+
+def tile_bounds(z: int, min_x: int, min_y: int, max_x: int, max_y: int) -> List[float]:
+    """[west, south, east, north] of an XYZ tile range"""
+    n = 1 << z
+
+    def lat(y: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+    return [min_x / n * 360.0 - 180.0, lat(max_y + 1), (max_x + 1) / n * 360.0 - 180.0, lat(min_y)]
+
+
+def _file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def detect_tile_format(data: bytes) -> Tuple[str, Optional[str]]:
+    """(content type, content encoding) of a tile blob"""
+    if data.startswith(b'\x89PNG'):
+        return "image/png", None
+    if data.startswith(b'\xff\xd8\xff'):
+        return "image/jpeg", None
+    if data.startswith(b'RIFF') and b'WEBP' in data[:12]:
+        return "image/webp", None
+    if data.startswith(b'\x1f\x8b'):
+        # Teselas vectoriales (pbf) guardadas comprimidas, como es habitual en MBTiles
+        return "application/x-protobuf", "gzip"
+    return "image/png", None
+
+
+class TileEntry:
+    """Tile ready to serve: body, ETag and content type computed once"""
+
+    __slots__ = ('data', 'etag', 'content_type', 'encoding')
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.etag = '"' + hashlib.blake2b(data, digest_size=12).hexdigest() + '"'
+        self.content_type, self.encoding = detect_tile_format(data)
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    def decoded(self) -> bytes:
+        """Body for clients that do not accept gzip"""
+        return gzip.decompress(self.data) if self.encoding == "gzip" else self.data
+
+
+class MBTilesSource:
+    """
+    One MBTiles file opened read-only and, unless told otherwise, immutable
+    (a file that is still being written, like a trip download, must be
+    opened with ``immutable=False`` so readers see new tiles).
+
+    Each thread gets its own connection (the route reads from the
+    asyncio.to_thread pool). After ``retire()`` the connections are closed
+    once the last in-flight read finishes.
+    """
+
+    def __init__(self, path: str, immutable: bool = True):
+        self.path = path
+        self.signature = _file_signature(path)
+        self._uri = "file:" + urllib.request.pathname2url(os.path.abspath(path)) + "?mode=ro"
+        if immutable:
+            self._uri += "&immutable=1"
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._readers = 0
+        self._retired = False
+        self._metadata: Optional[Dict[str, Any]] = None
+
+        conn = self._connection()
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+        missing = [table for table in ('metadata', 'tiles') if table not in tables]
+        if missing:
+            self.close()
+            raise ValueError(f"Invalid MBTiles file - missing tables: {missing}")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _enter(self) -> bool:
+        with self._lock:
+            if self._retired:
+                return False
+            self._readers += 1
+            return True
+
+    def _leave(self):
+        with self._lock:
+            self._readers -= 1
+            close = self._retired and self._readers == 0
+        if close:
+            self.close()
+
+    def read_tile(self, z: int, x: int, y: int) -> Optional[bytes]:
+        """Tile in XYZ coordinates (MBTiles stores rows in TMS)"""
+        if not self._enter():
+            return None
+        try:
+            row = self._connection().execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (z, x, (1 << z) - 1 - y)
+            ).fetchone()
+            return bytes(row[0]) if row else None
+        finally:
+            self._leave()
+
+    def metadata(self) -> Dict[str, Any]:
+        if self._metadata is None and self._enter():
+            try:
+                self._metadata = dict(self._connection().execute("SELECT name, value FROM metadata").fetchall())
+            finally:
+                self._leave()
+        return dict(self._metadata or {})
+
+    def compute_coverage(self) -> Dict[str, Any]:
+        """
+        Coverage of the file: tile count and XYZ bounds per zoom, plus the
+        coverage cells (``COVERAGE_ZOOM`` tiles) holding at least one tile.
+        Scans the whole tiles table, so the result is persisted by the service.
+        """
+        if not self._enter():
+            return {"zooms": {}, "cells": {}}
+        try:
+            rows = self._connection().execute(
+                "SELECT zoom_level AS z, tile_column >> max(zoom_level - ?, 0) AS cx, "
+                "tile_row >> max(zoom_level - ?, 0) AS cy, COUNT(*) "
+                "FROM tiles GROUP BY z, cx, cy",
+                (COVERAGE_ZOOM, COVERAGE_ZOOM)
+            ).fetchall()
+        finally:
+            self._leave()
+
+        zooms: Dict[str, Dict[str, Any]] = {}
+        cells: Dict[str, List[List[int]]] = {}
+        for z, cx, cy, count in rows:
+            shift = max(z - COVERAGE_ZOOM, 0)
+            # Fila TMS -> XYZ: el complemento de bits se conserva al desplazar
+            cy = (1 << (z - shift)) - 1 - cy
+            cells.setdefault(str(z), []).append([cx, cy, count])
+            zoom = zooms.setdefault(str(z), {"tiles": 0, "range": [cx, cy, cx, cy]})
+            zoom["tiles"] += count
+            r = zoom["range"]
+            r[0], r[1], r[2], r[3] = min(r[0], cx), min(r[1], cy), max(r[2], cx), max(r[3], cy)
+
+        for z, zoom in zooms.items():
+            shift = max(int(z) - COVERAGE_ZOOM, 0)
+            min_x, min_y, max_x, max_y = zoom.pop("range")
+            # Rango de teselas cubierto por las celdas (aproximado por arriba)
+            zoom["range"] = [min_x << shift, min_y << shift,
+                             ((max_x + 1) << shift) - 1, ((max_y + 1) << shift) - 1]
+            zoom["bounds"] = [round(v, 6) for v in tile_bounds(int(z), *zoom["range"])]
+        return {"zooms": zooms, "cells": cells}
+
+    def retire(self):
+        with self._lock:
+            self._retired = True
+            close = self._readers == 0
+        if close:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+
+class CoverageIndex:
+    """Per-file coverage persisted as JSON, keyed by file name and validated by (mtime, size)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._dirty = False
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("version") == COVERAGE_INDEX_VERSION and data.get("coverage_zoom") == COVERAGE_ZOOM:
+                self._files = data.get("files", {})
+        except (OSError, ValueError):
+            pass
+
+    def coverage(self, source: MBTilesSource) -> Dict[str, Any]:
+        name = os.path.basename(source.path)
+        signature = list(source.signature[:2]) if source.signature else None
+        entry = self._files.get(name)
+        if entry is None or entry.get("signature") != signature:
+            started = time.monotonic()
+            entry = {"signature": signature, **source.compute_coverage()}
+            self._files[name] = entry
+            self._dirty = True
+            logger.info(f"Cobertura indexada para {name}: {len(entry['zooms'])} zooms "
+                        f"en {time.monotonic() - started:.2f}s")
+        return entry
+
+    def save(self, keep: List[str]):
+        """Write the index, dropping files that no longer exist (atomic replace)"""
+        for name in [n for n in self._files if n not in keep]:
+            del self._files[name]
+            self._dirty = True
+        if not self._dirty:
+            return
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({"version": COVERAGE_INDEX_VERSION, "coverage_zoom": COVERAGE_ZOOM,
+                           "files": self._files}, f)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except OSError as e:
+            logger.warning(f"No se pudo guardar el índice de cobertura MBTiles: {e}")
+
+
+def merge_metadata(layers: List[Tuple[str, Dict[str, Any], Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    Metadata of the mosaic from (path, metadata, coverage) of each file.
+
+    A single file keeps its own metadata; several files get the union of
+    bounds and zoom range, the joined names and attributions, and a center
+    in the middle of the merged bounds.
+    """
+    if not layers:
+        return {}
+    if len(layers) == 1:
+        return dict(layers[0][1])
+
+    names, formats, attributions = [], set(), []
+    min_zooms, max_zooms, all_bounds = [], [], []
+    for path, metadata, coverage in layers:
+        names.append(metadata.get("name") or os.path.splitext(os.path.basename(path))[0])
+        if metadata.get("format"):
+            formats.add(metadata["format"])
+        attribution = metadata.get("attribution")
+        if attribution and attribution not in attributions:
+            attributions.append(attribution)
+
+        zooms = sorted(int(z) for z in coverage.get("zooms", {}))
+        try:
+            min_zooms.append(int(metadata["minzoom"]))
+            max_zooms.append(int(metadata["maxzoom"]))
+        except (KeyError, ValueError):
+            if zooms:
+                min_zooms.append(zooms[0])
+                max_zooms.append(zooms[-1])
+        try:
+            all_bounds.append([float(v) for v in metadata["bounds"].split(",")])
+        except (KeyError, ValueError, AttributeError):
+            if zooms:
+                all_bounds.append(coverage["zooms"][str(zooms[-1])]["bounds"])
+
+    merged: Dict[str, Any] = {"name": " + ".join(names), "type": "baselayer"}
+    merged["format"] = formats.pop() if len(formats) == 1 else ("mixed" if formats else "png")
+    if attributions:
+        merged["attribution"] = " | ".join(attributions)
+    if min_zooms:
+        merged["minzoom"] = str(min(min_zooms))
+        merged["maxzoom"] = str(max(max_zooms))
+    if all_bounds:
+        bounds = [min(b[0] for b in all_bounds), min(b[1] for b in all_bounds),
+                  max(b[2] for b in all_bounds), max(b[3] for b in all_bounds)]
+        merged["bounds"] = ",".join(f"{v:.6f}" for v in bounds)
+        center_zoom = min(min_zooms) if min_zooms else 0
+        merged["center"] = f"{(bounds[0] + bounds[2]) / 2:.6f},{(bounds[1] + bounds[3]) / 2:.6f},{center_zoom}"
+    return merged
+
+
+class MBTilesTileService:
+    """Serves the MBTiles files in ``directory`` as one mosaic with a hot-tile LRU"""
+
+    def __init__(self, directory: str, cache_bytes: int = DEFAULT_CACHE_BYTES,
+                 watch_interval: float = DEFAULT_WATCH_INTERVAL):
+        self.directory = directory
+        self.cache_bytes = cache_bytes
+        self.watch_interval = watch_interval
+
+        # _lock protege el estado y la LRU (se toma desde el event loop);
+        # _refresh_lock protege la comprobación de cambios (breve). La
+        # reconstrucción, que puede indexar archivos, se hace fuera del lock
+        # y solo en el hilo que la empezó (_rebuilding)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._rebuilding = False
+        self._recheck = False
+        self._sources: List[MBTilesSource] = []
+        self._coverage: Dict[str, Dict[str, Any]] = {}
+        self._routes: Dict[TileKey, Tuple[MBTilesSource, ...]] = {}
+        self._metadata: Optional[Dict[str, Any]] = None
+        self._dir_signature: Optional[int] = None
+        self._checked_at = 0.0
+        self._cache: "OrderedDict[TileKey, Optional[TileEntry]]" = OrderedDict()
+        self._cache_used = 0
+        self.stats = {"hits": 0, "misses": 0, "db_reads": 0, "not_found": 0, "reloads": 0, "evictions": 0}
+
+    # -- archivos del mosaico --------------------------------------------
+
+    def _scan(self) -> Dict[str, Optional[Tuple[int, int, int]]]:
+        try:
+            names = sorted(name for name in os.listdir(self.directory) if name.endswith(MBTILES_EXTENSION))
+        except OSError:
+            return {}
+        paths = {}
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path):
+                paths[path] = _file_signature(path)
+        return paths
+
+    def _refresh(self, force: bool = False):
+        """
+        Rebuild the mosaic if the directory or any of its files changed
+        (blocking). While another thread rebuilds it, returns at once and
+        the current mosaic keeps serving; a forced check is then repeated
+        by that thread when it finishes.
+        """
+        if not force and time.monotonic() - self._checked_at < self.watch_interval:
+            return
+        with self._refresh_lock:
+            if not force and time.monotonic() - self._checked_at < self.watch_interval:
+                return
+            if self._rebuilding:
+                self._recheck = self._recheck or force
+                return
+            changes = self._check_changes(force)
+            if changes is None:
+                return
+            self._rebuilding = True
+
+        try:
+            while changes is not None:
+                self._rebuild(*changes)
+                with self._refresh_lock:
+                    changes = self._check_changes(True) if self._recheck else None
+                    self._recheck = False
+                    if changes is None:
+                        self._rebuilding = False
+        except BaseException:
+            with self._refresh_lock:
+                self._rebuilding = False
+            raise
+
+    def _check_changes(self, force: bool) -> Optional[Tuple[Dict[str, Optional[Tuple[int, int, int]]],
+                                                             Dict[str, MBTilesSource]]]:
+        """(scanned files, current sources) when the mosaic must be rebuilt, else None"""
+        try:
+            dir_signature = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            dir_signature = None
+
+        current = {source.path: source for source in self._sources}
+        if not force and dir_signature == self._dir_signature:
+            # Mismo listado: solo comprobar que los archivos no se han reescrito
+            scanned = {path: _file_signature(path) for path in current}
+        else:
+            scanned = self._scan()
+        self._dir_signature = dir_signature
+        self._checked_at = time.monotonic()
+
+        if scanned == {path: source.signature for path, source in current.items()}:
+            return None
+        return scanned, current
+
+    def _rebuild(self, scanned: Dict[str, Optional[Tuple[int, int, int]]],
+                 current: Dict[str, MBTilesSource]):
+        index = CoverageIndex(os.path.join(self.directory, COVERAGE_INDEX_FILE))
+        sources: List[MBTilesSource] = []
+        coverage: Dict[str, Dict[str, Any]] = {}
+        for path, signature in scanned.items():
+            source = current.get(path)
+            if source is None or source.signature != signature:
+                try:
+                    source = MBTilesSource(path)
+                except (sqlite3.Error, ValueError) as e:
+                    logger.error(f"No se pudo abrir el MBTiles {path}: {e}")
+                    continue
+            try:
+                coverage[path] = index.coverage(source)
+            except sqlite3.Error as e:
+                logger.error(f"No se pudo indexar la cobertura de {path}: {e}")
+                source.retire()
+                continue
+            sources.append(source)
+        index.save([os.path.basename(source.path) for source in sources])
+
+        # Por celda, los archivos con más teselas primero (el extracto detallado antes que el general)
+        candidates: Dict[TileKey, List[Tuple[int, int, MBTilesSource]]] = {}
+        for order, source in enumerate(sources):
+            for z, cells in coverage[source.path]["cells"].items():
+                z = int(z)
+                for cx, cy, count in cells:
+                    candidates.setdefault((z, cx, cy), []).append((-count, order, source))
+        routes = {key: tuple(item[2] for item in sorted(items)) for key, items in candidates.items()}
+
+        with self._lock:
+            retired = [source for source in self._sources if source not in sources]
+            self._sources = sources
+            self._coverage = coverage
+            self._routes = routes
+            self._metadata = None
+            self._cache.clear()
+            self._cache_used = 0
+            self.stats["reloads"] += 1
+        for source in retired:
+            source.retire()
+        logger.info(f"Mosaico MBTiles: {len(sources)} archivo(s), {len(routes)} celdas de cobertura")
+
+    def active_sources(self) -> List[MBTilesSource]:
+        self._refresh()
+        return list(self._sources)
+
+    def active_path(self) -> Optional[str]:
+        sources = self.active_sources()
+        return sources[0].path if sources else None
+
+    # -- teselas ---------------------------------------------------------
+
+    def cached_tile(self, z: int, x: int, y: int) -> Tuple[bool, Optional[TileEntry]]:
+        """
+        (found in the LRU, entry) without touching the disk. When the mosaic
+        is due for a change check it reports a miss, so that get_tile does
+        the check from a worker thread.
+        """
+        if time.monotonic() - self._checked_at >= self.watch_interval:
+            return False, None
+        key = (z, x, y)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.stats["hits"] += 1
+                return True, self._cache[key]
+        return False, None
+
+    def get_tile(self, z: int, x: int, y: int) -> Optional[TileEntry]:
+        """Tile from the LRU or from the file that covers it; None when it does not exist (blocking)"""
+        self._refresh()
+        found, entry = self.cached_tile(z, x, y)
+        if found:
+            return entry
+
+        with self._lock:
+            routes = self._routes
+            candidates = routes.get(_cell_key(z, x, y), ())
+        data = None
+        reads = 0
+        for source in candidates:
+            reads += 1
+            data = source.read_tile(z, x, y)
+            if data is not None:
+                break
+        entry = TileEntry(data) if data is not None else None
+
+        with self._lock:
+            self.stats["misses"] += 1
+            self.stats["db_reads"] += reads
+            if entry is None:
+                self.stats["not_found"] += 1
+            # Si el mosaico cambió durante la lectura, no mezclar teselas en la caché
+            if routes is self._routes:
+                self._store((z, x, y), entry)
+        return entry
+
+    def _store(self, key: TileKey, entry: Optional[TileEntry]):
+        cost = entry.size if entry is not None else _MISSING_COST
+        if cost > self.cache_bytes:
+            return
+        if key in self._cache:
+            old = self._cache.pop(key)
+            self._cache_used -= old.size if old is not None else _MISSING_COST
+        self._cache[key] = entry
+        self._cache_used += cost
+        while self._cache_used > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_used -= evicted.size if evicted is not None else _MISSING_COST
+            self.stats["evictions"] += 1
+
+    # -- metadatos -------------------------------------------------------
+
+    def get_metadata(self) -> Optional[Dict[str, Any]]:
+        """Merged metadata of the mosaic, None without files (blocking)"""
+        sources = self.active_sources()
+        if not sources:
+            return None
+        metadata = self._metadata
+        if metadata is None:
+            metadata = merge_metadata([(source.path, source.metadata(), self._coverage.get(source.path, {}))
+                                       for source in sources])
+            self._metadata = metadata
+        return dict(metadata)
+
+    def get_files(self) -> List[Dict[str, Any]]:
+        """Coverage summary of every file in the mosaic (blocking)"""
+        files = []
+        for source in self.active_sources():
+            zooms = self._coverage.get(source.path, {}).get("zooms", {})
+            levels = sorted(int(z) for z in zooms)
+            files.append({
+                "filename": os.path.basename(source.path),
+                "path": source.path,
+                "minzoom": levels[0] if levels else None,
+                "maxzoom": levels[-1] if levels else None,
+                "total_tiles": sum(zoom["tiles"] for zoom in zooms.values()),
+                "zooms": {int(z): zoom for z, zoom in zooms.items()}
+            })
+        return files
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "files": [source.path for source in self._sources],
+                "coverage_cells": len(self._routes),
+                "cached_tiles": len(self._cache),
+                "cached_bytes": self._cache_used,
+                "cache_budget_bytes": self.cache_bytes,
+                "hit_rate": round(self.stats["hits"] / lookups * 100, 2) if lookups else 0.0
+            }
+
+    def invalidate(self):
+        """Force a rescan now (e.g. after copying a new file)"""
+        self._refresh(force=True)
+
+    def close(self):
+        with self._lock:
+            sources, self._sources = self._sources, []
+            self._routes = {}
+            self._cache.clear()
+            self._cache_used = 0
+        for source in sources:
+            source.retire()
+
+
+class TripTileArchives:
+    """
+    Per-trip MBTiles written by the tile downloader
+    (``<directory>/<trip_id>/<filename>``), opened on first use and kept open.
+    They are not immutable: a download may still be adding tiles.
+    """
+
+    def __init__(self, directory: str, filename: str):
+        self.directory = directory
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._sources: Dict[str, MBTilesSource] = {}
+
+    def path(self, trip_id: str) -> str:
+        return os.path.join(self.directory, trip_id, self.filename)
+
+    def get(self, trip_id: str) -> Optional[MBTilesSource]:
+        path = self.path(trip_id)
+        if not os.path.exists(path):
+            self.discard(trip_id)
+            return None
+        with self._lock:
+            source = self._sources.get(trip_id)
+            if source is None:
+                try:
+                    source = MBTilesSource(path, immutable=False)
+                except (sqlite3.Error, ValueError) as e:
+                    # Archivo recién creado por la descarga, aún sin esquema
+                    logger.debug(f"Trip MBTiles {path} not readable yet: {e}")
+                    return None
+                self._sources[trip_id] = source
+        return source
+
+    def read_tile(self, trip_id: str, z: int, x: int, y: int) -> Optional[TileEntry]:
+        source = self.get(trip_id)
+        if source is None:
+            return None
+        data = source.read_tile(z, x, y)
+        return TileEntry(data) if data is not None else None
+
+    def discard(self, trip_id: str):
+        """Close the archive of a trip (before deleting or replacing it)"""
+        with self._lock:
+            source = self._sources.pop(trip_id, None)
+        if source is not None:
+            source.retire()
+
+    def close(self):
+        with self._lock:
+            sources, self._sources = list(self._sources.values()), {}
+        for source in sources:
+            source.retire()
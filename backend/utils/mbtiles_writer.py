@@ -0,0 +1,103 @@
+"""
+Escritura de teselas descargadas en un MBTiles por viaje.
+
+Sustituye al árbol ``offline_maps/{trip_id}/{z}/{x}/{y}.png``: un viaje largo
+a z16+ eran cientos de miles de archivos pequeños (inodos agotados,
+``os.path.exists`` lentos, copias de seguridad eternas). El archivo usa la
+variante deduplicada de MBTiles (tablas ``map`` e ``images`` y la vista
+``tiles``), así que las teselas idénticas (mar, zonas vacías) se guardan una
+sola vez, y las teselas se insertan por lotes en una sola transacción.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+TRIP_MBTILES_NAME = "tiles.mbtiles"
+
+# (z, x, y, datos) en coordenadas XYZ
+TileRow = Tuple[int, int, int, bytes]
+
+
+class MBTilesWriter:
+    """Deduplicated MBTiles written in batches (thread-safe; blocking calls)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS map (
+                zoom_level INTEGER NOT NULL,
+                tile_column INTEGER NOT NULL,
+                tile_row INTEGER NOT NULL,
+                tile_id TEXT NOT NULL,
+                PRIMARY KEY (zoom_level, tile_column, tile_row)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS images (tile_id TEXT PRIMARY KEY, tile_data BLOB NOT NULL);
+            CREATE VIEW IF NOT EXISTS tiles AS
+                SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column,
+                       map.tile_row AS tile_row, images.tile_data AS tile_data
+                FROM map JOIN images ON images.tile_id = map.tile_id;
+        """)
+        self._conn.commit()
+
+    def set_metadata(self, values: Dict[str, Any]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
+                [(name, str(value)) for name, value in values.items()]
+            )
+            self._conn.commit()
+
+    def existing_tiles(self, z: int) -> Set[Tuple[int, int]]:
+        """(x, y) in XYZ of the tiles already stored at zoom ``z`` (to resume downloads)"""
+        top = (1 << z) - 1
+        with self._lock:
+            return {(x, top - row) for x, row in self._conn.execute(
+                "SELECT tile_column, tile_row FROM map WHERE zoom_level = ?", (z,)
+            )}
+
+    def write_batch(self, tiles: Iterable[TileRow]) -> int:
+        """Insert tiles in one transaction; returns how many were written"""
+        images = {}
+        rows = []
+        for z, x, y, data in tiles:
+            tile_id = hashlib.sha1(data).hexdigest()
+            images[tile_id] = data
+            rows.append((z, x, (1 << z) - 1 - y, tile_id))
+        if not rows:
+            return 0
+        with self._lock:
+            with self._conn:
+                self._conn.executemany("INSERT OR IGNORE INTO images (tile_id, tile_data) VALUES (?, ?)",
+                                       list(images.items()))
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO map (zoom_level, tile_column, tile_row, tile_id) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+        return len(rows)
+
+    def count(self) -> Tuple[int, int]:
+        """(tiles, distinct images)"""
+        with self._lock:
+            tiles = self._conn.execute("SELECT COUNT(*) FROM map").fetchone()[0]
+            images = self._conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        return tiles, images
+
+    def close(self):
+        with self._lock:
+            try:
+                # Volcar el WAL para dejar un único archivo (exportación, copias)
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error as e:
+                logger.debug(f"WAL checkpoint failed for {self.path}: {e}")
+            self._conn.close()
@@ -0,0 +1,459 @@
+"""
+Servicio de renderizado de teselas a partir de archivos MWM (Organic Maps)
+para /api/organic-maps/tile/{trip_id}/{z}/{x}/{y}.
+
+Antes cada tesela sin caché volvía a importar ``mwm_extractor``, creaba un
+``MWMReader`` nuevo (que relee la cabecera y toda la tabla de secciones del
+disco) y renderizaba con PIL dentro de la propia petición. Ahora:
+  - cada proceso de renderizado mantiene abiertos los MWM con ``mmap``; al
+    abrirlos solo se comprueba la cabecera, y la tabla de secciones (que el
+    renderizado no usa) se lee solo si se pide una sección
+  - el renderizado va a un pool de procesos, alimentado por una cola acotada
+    y ordenada por prioridad: las teselas que el usuario está viendo pasan
+    por delante del precalentamiento del corredor del viaje, y si la cola se
+    llena se descartan primero las de menor prioridad
+  - las peticiones simultáneas de la misma tesela se agrupan en un único
+    renderizado
+"""
+import asyncio
+import concurrent.futures
+import heapq
+import io
+import itertools
+import logging
+import mmap
+import multiprocessing
+import os
+import subprocess
+import tempfile
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from tools.mwm_extractor import MWMReader
+
+logger = logging.getLogger(__name__)
+
+# Índice de secciones que se guardaba junto a cada MWM; se borra al abrirlo
+LEGACY_SECTION_INDEX_SUFFIX = ".sections.json"
+
+# Prioridades de la cola de renderizado (menor = antes)
+PRIORITY_VIEWPORT = 0
+PRIORITY_WARM = 10
+
+DEFAULT_MAX_QUEUE = 256
+
+_SECTION_RECORD = np.dtype([('tag', 'S8'), ('offset', '<u8'), ('size', '<u8')])
+
+
+class RendererBusy(Exception):
+    """The render queue is full of tiles with the same or higher priority"""
+
+
+class MappedMWMReader(MWMReader):
+    """
+    MWMReader over a read-only mmap. Opening a file only checks its header;
+    the section table is parsed the first time a section is requested
+    (extract_tile does not need it) and kept in memory.
+    """
+
+    def __init__(self, mwm_path: str):
+        self.mwm_path = mwm_path
+        self.file = None
+        self.header = None
+        self._sections: Optional[Dict[str, Dict[str, int]]] = None
+
+        stat = os.stat(mwm_path)
+        self.signature = [stat.st_size, stat.st_mtime_ns]
+        if stat.st_size < 5:
+            raise ValueError(f"Not a valid MWM file (only {stat.st_size} bytes)")
+        with open(mwm_path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._read_header()
+        self._remove_legacy_index()
+
+    @property
+    def sections(self) -> Dict[str, Dict[str, int]]:
+        if self._sections is None:
+            self._sections = {}
+            self._read_sections()
+        return self._sections
+
+    @sections.setter
+    def sections(self, value: Dict[str, Dict[str, int]]):
+        self._sections = value
+
+    def _remove_legacy_index(self):
+        # Versiones anteriores persistían la tabla entera (decenas de MB por mapa)
+        try:
+            os.remove(self.mwm_path + LEGACY_SECTION_INDEX_SUFFIX)
+        except OSError:
+            pass
+
+    def _read_header(self):
+        magic = self._map[0:3]
+        if magic != b'MWM':
+            self.close()
+            raise ValueError(f"Not a valid MWM file (got {magic} instead of 'MWM')")
+        self.header = {'magic': magic, 'version': self._map[3], 'format': self._map[4]}
+
+    def _read_sections(self):
+        # Misma disposición que MWMReader: registros (tag de 8 bytes, offset, tamaño) desde el byte 5
+        count = (len(self._map) - 5) // _SECTION_RECORD.itemsize
+        records = np.frombuffer(self._map, dtype=_SECTION_RECORD, count=count, offset=5)
+        # Si un tag se repite gana el último registro, como en el dict de MWMReader
+        _, first_reversed = np.unique(records['tag'][::-1], return_index=True)
+        for position in np.sort(count - 1 - first_reversed).tolist():
+            tag = bytes(records['tag'][position]).decode('utf-8', errors='ignore').strip('\x00')
+            self._sections[tag] = {
+                'offset': int(records['offset'][position]),
+                'size': int(records['size'][position])
+            }
+        # Liberar la vista sobre el mmap (si no, close() no puede cerrarlo)
+        del records
+
+    def get_section_data(self, section_tag: str) -> Optional[bytes]:
+        section = self.sections.get(section_tag)
+        if section is None:
+            logger.warning(f"Section '{section_tag}' not found in MWM file")
+            return None
+        return self._map[section['offset']:section['offset'] + section['size']]
+
+    def close(self):
+        try:
+            self._map.close()
+        except (BufferError, ValueError):
+            pass
+
+
+def render_vector_tile(vector_data, width=256, height=256):
+    """
+    Render vector tile data to a PNG image
+
+    Args:
+        vector_data: Vector tile data in MVT format
+        width, height: Dimensions of the output image
+
+    Returns:
+        PIL.Image: The rendered tile
+    """
+    try:
+        import mapbox_vector_tile
+        from PIL import Image, ImageDraw
+
+        # Create a blank image
+        img = Image.new('RGBA', (width, height), (255, 255, 255, 0))
+        draw = ImageDraw.Draw(img)
+
+        try:
+            # Parse MVT data
+            tile_data = mapbox_vector_tile.decode(vector_data)
+
+            # Process each layer in the vector tile
+            for layer_name, layer in tile_data.items():
+                # Choose color based on layer type
+                if layer_name == 'road' or layer_name == 'roads':
+                    color = (120, 120, 120, 255)  # Gray for roads
+                elif layer_name == 'building' or layer_name == 'buildings':
+                    color = (200, 200, 200, 255)  # Light gray for buildings
+                elif layer_name == 'water':
+                    color = (100, 149, 237, 255)  # Cornflower blue for water
+                elif layer_name == 'landuse':
+                    color = (173, 216, 140, 255)  # Light green for landuse
+                else:
+                    color = (0, 0, 0, 255)  # Black for other features
+
+                # Draw each feature in the layer
+                for feature in layer['features']:
+                    geometry_type = feature['type']
+                    geometry = feature['geometry']
+
+                    if geometry_type == 'LineString':
+                        for line in geometry:
+                            points = [(p[0], p[1]) for p in line]
+                            draw.line(points, fill=color, width=1)
+                    elif geometry_type == 'Polygon':
+                        for polygon in geometry:
+                            points = [(p[0], p[1]) for p in polygon]
+                            draw.polygon(points, outline=color, fill=color[:3] + (100,))
+                    elif geometry_type == 'Point':
+                        for point in geometry:
+                            draw.ellipse((point[0]-2, point[1]-2, point[0]+2, point[1]+2), fill=color)
+
+        except Exception as e:
+            logger.error(f"Error rendering vector tile: {str(e)}")
+            # Draw a message in the image indicating an error
+            draw.text((10, 10), "Error rendering tile", fill=(255, 0, 0, 255))
+
+        return img
+    except ImportError as e:
+        logger.error(f"Required module not found: {str(e)}")
+        # Create a simple error image
+        from PIL import Image, ImageDraw
+        img = Image.new('RGB', (width, height), (255, 200, 200))
+        draw = ImageDraw.Draw(img)
+        draw.text((10, 10), f"Module error: {str(e)}", fill=(255, 0, 0))
+        return img
+    except Exception as e:
+        logger.error(f"Unexpected error in render_vector_tile: {str(e)}")
+        # Create a simple error image
+        from PIL import Image, ImageDraw
+        img = Image.new('RGB', (width, height), (255, 200, 200))
+        draw = ImageDraw.Draw(img)
+        draw.text((10, 10), "Error", fill=(255, 0, 0))
+        return img
+
+
+# --- Lado del proceso de renderizado -------------------------------------
+
+# Lectores abiertos en este proceso, por ruta del MWM
+_worker_readers: Dict[str, MappedMWMReader] = {}
+_worker_readers_lock = threading.Lock()
+
+
+def _get_reader(path: str) -> MappedMWMReader:
+    stat = os.stat(path)
+    with _worker_readers_lock:
+        reader = _worker_readers.get(path)
+        if reader is None or reader.signature != [stat.st_size, stat.st_mtime_ns]:
+            if reader is not None:
+                reader.close()
+            reader = _worker_readers[path] = MappedMWMReader(path)
+        return reader
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def render_mwm_tile(mwm_paths: List[str], z: int, x: int, y: int, output_path: str,
+                    mwm_tool: Optional[str] = None) -> Optional[bytes]:
+    """
+    Render a tile from the first MWM file that has data for it and store the
+    PNG at ``output_path``. Runs in the render processes.
+    """
+    for path in mwm_paths:
+        try:
+            vector_data = _get_reader(path).extract_tile(z, x, y)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error opening MWM file {path}: {e}")
+            continue
+        if vector_data:
+            buffer = io.BytesIO()
+            render_vector_tile(vector_data, 256, 256).save(buffer, format="PNG")
+            data = buffer.getvalue()
+            _write_atomic(output_path, data)
+            return data
+
+        # Alternativa: herramienta externa, si está instalada
+        if mwm_tool and os.path.exists(mwm_tool):
+            cmd = [mwm_tool, "extract", "--input", path, "--z", str(z), "--x", str(x), "--y", str(y),
+                   "--output", output_path]
+            process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            if process.returncode == 0 and os.path.exists(output_path):
+                with open(output_path, 'rb') as f:
+                    return f.read()
+            logger.error(f"mwm_tool failed: {process.stderr.decode('utf-8', errors='ignore')}")
+
+    logger.warning(f"No data found in any region for tile {z}/{x}/{y}")
+    return None
+
+
+# --- Lado del servidor ---------------------------------------------------
+
+class _RenderJob:
+    __slots__ = ('key', 'args', 'priority', 'future', 'started')
+
+    def __init__(self, key: str, args: Tuple, priority: int, future: asyncio.Future):
+        self.key = key
+        self.args = args
+        self.priority = priority
+        self.future = future
+        self.started = False
+
+
+class MWMTileRenderer:
+    """
+    Renders MWM tiles on a process pool behind a bounded priority queue,
+    coalescing concurrent requests for the same output tile. Meant to be
+    used from one event loop.
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_queue: int = DEFAULT_MAX_QUEUE,
+                 use_processes: bool = True, mwm_tool: Optional[str] = None):
+        self.workers = workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.max_queue = max_queue
+        self.use_processes = use_processes
+        self.mwm_tool = mwm_tool
+
+        self._executor: Optional[concurrent.futures.Executor] = None
+        self._dispatchers: List[asyncio.Task] = []
+        self._heap: List[Tuple[int, int, _RenderJob]] = []
+        self._ready: Optional[asyncio.Semaphore] = None
+        self._seq = itertools.count()
+        self._jobs: Dict[str, _RenderJob] = {}
+        self._queued = 0
+        self.stats = {
+            "rendered": 0,
+            "empty": 0,
+            "errors": 0,
+            "coalesced": 0,
+            "promoted": 0,
+            "evicted": 0,
+            "rejected": 0
+        }
+
+    def _start(self):
+        if self._executor is None:
+            if self.use_processes:
+                # spawn: el servidor tiene hilos (cámaras, GPS) y fork los copiaría a medias
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="MWMRender")
+        if not self._dispatchers:
+            self._ready = asyncio.Semaphore(0)
+            self._dispatchers = [asyncio.ensure_future(self._dispatch()) for _ in range(self.workers)]
+
+    def _push(self, job: _RenderJob):
+        heapq.heappush(self._heap, (job.priority, next(self._seq), job))
+        self._ready.release()
+
+    def _evict_for(self, priority: int) -> bool:
+        """Drop the newest queued job with a lower priority than ``priority``"""
+        queued = [(p, seq, job) for p, seq, job in self._heap if not job.started and p == job.priority]
+        if not queued:
+            return False
+        p, seq, victim = max(queued, key=lambda entry: (entry[0], entry[1]))
+        if p <= priority:
+            return False
+        victim.started = True
+        self._queued -= 1
+        self._jobs.pop(victim.key, None)
+        if not victim.future.done():
+            victim.future.set_result(None)
+        self.stats["evicted"] += 1
+        return True
+
+    async def render(self, mwm_paths: List[str], z: int, x: int, y: int, output_path: str,
+                     priority: int = PRIORITY_VIEWPORT) -> Optional[bytes]:
+        """PNG bytes of the tile (also written to ``output_path``), or None if there is no data"""
+        self._start()
+        job = self._jobs.get(output_path)
+        if job is not None:
+            self.stats["coalesced"] += 1
+            if priority < job.priority and not job.started:
+                # Una tesela del precalentamiento que ahora se está viendo pasa delante
+                job.priority = priority
+                self._push(job)
+                self.stats["promoted"] += 1
+            return await asyncio.shield(job.future)
+
+        if self._queued >= self.max_queue and not self._evict_for(priority):
+            self.stats["rejected"] += 1
+            raise RendererBusy(f"Render queue full ({self.max_queue} tiles)")
+
+        job = _RenderJob(output_path, (list(mwm_paths), z, x, y, output_path, self.mwm_tool), priority,
+                         asyncio.get_running_loop().create_future())
+        self._jobs[output_path] = job
+        self._queued += 1
+        self._push(job)
+        return await asyncio.shield(job.future)
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._ready.acquire()
+            priority, _, job = heapq.heappop(self._heap)
+            # Entradas obsoletas: trabajo ya empezado, descartado o promovido
+            if job.started or priority != job.priority:
+                continue
+            job.started = True
+            self._queued -= 1
+            try:
+                data = await loop.run_in_executor(self._executor, render_mwm_tile, *job.args)
+                self.stats["rendered" if data else "empty"] += 1
+                if not job.future.done():
+                    job.future.set_result(data)
+            except asyncio.CancelledError:
+                if not job.future.done():
+                    job.future.cancel()
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Error rendering MWM tile {job.args[1]}/{job.args[2]}/{job.args[3]}: {e}")
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                self._jobs.pop(job.key, None)
+
+    async def warm(self, mwm_paths: List[str], tiles: Iterable[Tuple[int, int, int, str]]) -> int:
+        """
+        Render ``(z, x, y, output_path)`` tiles that are not on disk yet, at the
+        lowest priority and a few at a time, so viewport tiles always go first.
+        """
+        in_flight = asyncio.Semaphore(self.workers * 2)
+        pending = set()
+        warmed = 0
+
+        async def warm_one(z, x, y, output_path):
+            nonlocal warmed
+            try:
+                if await self.render(mwm_paths, z, x, y, output_path, priority=PRIORITY_WARM):
+                    warmed += 1
+            except RendererBusy:
+                pass
+            except Exception as e:
+                logger.debug(f"Warm render of {z}/{x}/{y} failed: {e}")
+            finally:
+                in_flight.release()
+
+        for z, x, y, output_path in tiles:
+            if os.path.exists(output_path):
+                continue
+            await in_flight.acquire()
+            task = asyncio.ensure_future(warm_one(z, x, y, output_path))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.gather(*pending)
+        return warmed
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "workers": self.workers,
+            "processes": self.use_processes,
+            "queued": self._queued,
+            "in_flight": len(self._jobs) - self._queued,
+            "max_queue": self.max_queue
+        }
+
+    async def close(self):
+        for task in self._dispatchers:
+            task.cancel()
+        if self._dispatchers:
+            await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        self._dispatchers = []
+        for job in list(self._jobs.values()):
+            if not job.future.done():
+                job.future.cancel()
+        self._jobs.clear()
+        self._heap.clear()
+        self._queued = 0
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
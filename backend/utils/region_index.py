@@ -0,0 +1,266 @@
+"""
+Índice de cobertura de las regiones MWM de Organic Maps.
+
+Las fronteras de cada región (archivos ``<region_id>.poly`` de
+``data/borders`` de Organic Maps, formato Osmosis) se cargan una vez y se
+reparten en una rejilla de ``GRID_DEG`` grados. Para cada celda y región se
+guardan los lados de la frontera que la tocan y si el centro de la celda está
+dentro; las celdas sin lados que quedan dentro de la región se guardan sin
+lados (cobertura completa) y las de fuera no se guardan.
+
+Así las consultas son exactas y solo miran geometría local:
+
+- un punto está dentro si el número de lados que cruza el camino hasta el
+  centro de su celda (un tramo horizontal y otro vertical) cambia o no el
+  estado del centro;
+- un tramo de ruta atraviesa una región si, recortado a cada celda que cruza,
+  su inicio está dentro o corta algún lado de la frontera en esa celda.
+
+Los vértices de las fronteras se ajustan antes a ``QUANTIZE_DEG`` (unos 50 m) y
+se eliminan los repetidos: la costa de las fronteras tiene un detalle que no
+cambia qué MWM cubre una ruta y multiplicaría la memoria en la Raspberry.
+"""
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+POLY_SUFFIX = ".poly"
+
+# Tamaño de celda de la rejilla, en grados
+GRID_DEG = 0.5
+# Resolución a la que se simplifican las fronteras, en grados
+QUANTIZE_DEG = 0.0005
+# Tamaño máximo (tramos × lados) de las matrices de una comprobación
+MAX_PAIRS = 1 << 22
+
+_NO_EDGES = np.zeros((0, 4))
+
+CellEntry = Tuple[int, bool, np.ndarray]
+
+
+def parse_poly(path: str) -> List[np.ndarray]:
+    """Rings (arrays of lon, lat) of an Osmosis .poly file; holes ("!" sections) included, even-odd rule"""
+    rings = []
+    with open(path, "r") as f:
+        lines = [line.strip() for line in f]
+    i = 1  # la primera línea es el nombre
+    while i < len(lines):
+        if not lines[i]:
+            i += 1
+            continue
+        if lines[i] == "END":
+            break
+        # Cabecera de sección; las coordenadas llegan hasta su END
+        end = lines.index("END", i + 1)
+        values = " ".join(lines[i + 1:end]).split()
+        if len(values) >= 6:
+            rings.append(np.array(values, dtype=np.float64).reshape(-1, 2))
+        i = end + 1
+    return rings
+
+
+def _ring_edges(ring: np.ndarray) -> np.ndarray:
+    """(x1, y1, x2, y2) of the closed ring, dropping consecutive vertices that fall in the
+    same QUANTIZE_DEG cell (the kept vertices keep their original coordinates)"""
+    snapped = np.round(ring / QUANTIZE_DEG)
+    keep = np.ones(len(ring), dtype=bool)
+    keep[1:] = np.any(snapped[1:] != snapped[:-1], axis=1)
+    ring = ring[keep]
+    if len(ring) > 1 and np.array_equal(snapped[keep][0], snapped[keep][-1]):
+        ring = ring[:-1]
+    if len(ring) < 3:
+        return _NO_EDGES
+    return np.hstack([ring, np.roll(ring, -1, axis=0)])
+
+
+class RegionIndex:
+    """Grid index of region borders; regions_at / regions_for_route return exact region ids"""
+
+    def __init__(self, cell_deg: float = GRID_DEG):
+        self.cell_deg = cell_deg
+        self.cols = int(np.ceil(360.0 / cell_deg))
+        self.rows = int(np.ceil(180.0 / cell_deg))
+        self.region_ids: List[str] = []
+        self._cells: Dict[int, List[CellEntry]] = {}
+        self.edges = 0
+
+    def __len__(self):
+        return len(self.region_ids)
+
+    @classmethod
+    def from_directory(cls, directory: str, cell_deg: float = GRID_DEG) -> "RegionIndex":
+        index = cls(cell_deg)
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(POLY_SUFFIX):
+                continue
+            try:
+                index.add_region(name[:-len(POLY_SUFFIX)], parse_poly(os.path.join(directory, name)))
+            except Exception as e:
+                logger.warning(f"Error loading region border {name}: {str(e)}")
+        logger.info(f"Region index: {len(index)} regions, {index.edges} edges, {len(index._cells)} cells")
+        return index
+
+    def _col(self, lon):
+        return np.clip(np.floor((np.asarray(lon) + 180.0) / self.cell_deg), 0, self.cols - 1).astype(np.int64)
+
+    def _row(self, lat):
+        return np.clip(np.floor((np.asarray(lat) + 90.0) / self.cell_deg), 0, self.rows - 1).astype(np.int64)
+
+    def _cell_bounds(self, keys: np.ndarray):
+        rows, cols = np.divmod(keys, self.cols)
+        x0 = -180.0 + cols * self.cell_deg
+        y0 = -90.0 + rows * self.cell_deg
+        return x0, y0, x0 + self.cell_deg, y0 + self.cell_deg
+
+    def add_region(self, region_id: str, rings: Iterable[np.ndarray]):
+        """Add a region given its rings as arrays of (lon, lat)"""
+        edges = [_ring_edges(np.asarray(ring, dtype=np.float64)) for ring in rings]
+        edges = np.vstack(edges) if edges else _NO_EDGES
+        if not len(edges):
+            return
+        ridx = len(self.region_ids)
+        self.region_ids.append(region_id)
+        self.edges += len(edges)
+        x1, y1, x2, y2 = edges.T
+
+        # Lados por celda (todas las celdas que toca su rectángulo)
+        c0, c1 = self._col(np.minimum(x1, x2)), self._col(np.maximum(x1, x2))
+        r0, r1 = self._row(np.minimum(y1, y2)), self._row(np.maximum(y1, y2))
+        w = c1 - c0 + 1
+        counts = w * (r1 - r0 + 1)
+        edge = np.repeat(np.arange(len(edges)), counts)
+        offset = np.arange(len(edge)) - np.repeat(np.cumsum(counts) - counts, counts)
+        keys = (r0[edge] + offset // w[edge]) * self.cols + c0[edge] + offset % w[edge]
+        order = np.argsort(keys, kind="stable")
+        keys, edge = keys[order], edge[order]
+        cell_keys, starts = np.unique(keys, return_index=True)
+        boundary = dict(zip(cell_keys.tolist(), np.split(edge, starts[1:])))
+
+        # Estado del centro de cada celda: barrido horizontal por filas (regla par-impar)
+        for row in range(int(r0.min()), int(r1.max()) + 1):
+            yc = -90.0 + (row + 0.5) * self.cell_deg
+            crossing = (y1 <= yc) != (y2 <= yc)
+            xs = np.sort(x1[crossing] + (yc - y1[crossing]) * (x2[crossing] - x1[crossing]) /
+                         (y2[crossing] - y1[crossing]))
+            cols = np.arange(int(c0.min()), int(c1.max()) + 1)
+            inside = np.searchsorted(xs, -180.0 + (cols + 0.5) * self.cell_deg) % 2 == 1
+            for col, centre_inside in zip(cols.tolist(), inside.tolist()):
+                key = row * self.cols + col
+                cell_edges = boundary.get(key)
+                if cell_edges is not None:
+                    self._cells.setdefault(key, []).append((ridx, centre_inside, edges[cell_edges]))
+                elif centre_inside:
+                    self._cells.setdefault(key, []).append((ridx, True, _NO_EDGES))
+
+    def _inside(self, px: np.ndarray, py: np.ndarray, keys: np.ndarray, centre_inside: bool,
+                edges: np.ndarray) -> np.ndarray:
+        """Even-odd status of points (all in the cells ``keys``) from the status of their cell centre"""
+        x0, y0, _, _ = self._cell_bounds(keys)
+        cx, cy = (x0 + self.cell_deg / 2)[:, None], (y0 + self.cell_deg / 2)[:, None]
+        px, py = px[:, None], py[:, None]
+        x1, y1, x2, y2 = (edges[:, k][None, :] for k in range(4))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Tramo horizontal (px, py) -> (cx, py)
+            h = (y1 <= py) != (y2 <= py)
+            xi = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+            h &= (xi >= np.minimum(px, cx)) & (xi < np.maximum(px, cx))
+            # Tramo vertical (cx, py) -> (cx, cy)
+            v = (x1 <= cx) != (x2 <= cx)
+            yi = y1 + (cx - x1) * (y2 - y1) / (x2 - x1)
+            v &= (yi >= np.minimum(py, cy)) & (yi < np.maximum(py, cy))
+        flips = (h.sum(axis=1) + v.sum(axis=1)) % 2 == 1
+        return flips != centre_inside
+
+    @staticmethod
+    def _crosses(ax, ay, bx, by, edges: np.ndarray) -> np.ndarray:
+        """Whether each segment A-B intersects any of the edges"""
+        x1, y1, x2, y2 = (edges[:, k][None, :] for k in range(4))
+        ax, ay, bx, by = ax[:, None], ay[:, None], bx[:, None], by[:, None]
+        d1 = (bx - ax) * (y1 - ay) - (by - ay) * (x1 - ax)
+        d2 = (bx - ax) * (y2 - ay) - (by - ay) * (x2 - ax)
+        d3 = (x2 - x1) * (ay - y1) - (y2 - y1) * (ax - x1)
+        d4 = (x2 - x1) * (by - y1) - (y2 - y1) * (bx - x1)
+        hit = (d1 * d2 <= 0) & (d3 * d4 <= 0) & ~((d1 == 0) & (d2 == 0))
+        return hit.any(axis=1)
+
+    def regions_at(self, lat: float, lon: float) -> List[str]:
+        return self.regions_for_route([(lat, lon)])
+
+    def regions_for_route(self, points: Sequence[Tuple[float, float]]) -> List[str]:
+        """Ids of the regions that a route of (lat, lon) points crosses, in the order the route enters them"""
+        if not points or not self._cells:
+            return []
+        lat = np.array([p[0] for p in points], dtype=np.float64)
+        lon = np.array([p[1] for p in points], dtype=np.float64)
+        if len(lat) == 1:
+            lat, lon = np.repeat(lat, 2), np.repeat(lon, 2)
+
+        # Tramos de como mucho una celda (las rutas planificadas tienen pocos puntos muy separados)
+        ax, ay, bx, by = lon[:-1], lat[:-1], lon[1:], lat[1:]
+        pieces = np.maximum(1, np.ceil(np.hypot(bx - ax, by - ay) / self.cell_deg)).astype(np.int64)
+        seg = np.repeat(np.arange(len(ax)), pieces)
+        k = np.arange(len(seg)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        t0, t1 = k / pieces[seg], (k + 1) / pieces[seg]
+        dx, dy = (bx - ax)[seg], (by - ay)[seg]
+        ax, ay = ax[seg] + dx * t0, ay[seg] + dy * t0
+        bx, by = ax + dx * (t1 - t0), ay + dy * (t1 - t0)
+
+        # Pares (tramo, celda) de todas las celdas del rectángulo de cada tramo
+        c0, c1 = self._col(np.minimum(ax, bx)), self._col(np.maximum(ax, bx))
+        r0, r1 = self._row(np.minimum(ay, by)), self._row(np.maximum(ay, by))
+        w = c1 - c0 + 1
+        counts = w * (r1 - r0 + 1)
+        piece = np.repeat(np.arange(len(ax)), counts)
+        offset = np.arange(len(piece)) - np.repeat(np.cumsum(counts) - counts, counts)
+        keys = (r0[piece] + offset // w[piece]) * self.cols + c0[piece] + offset % w[piece]
+        stored = np.fromiter((key in self._cells for key in keys.tolist()), dtype=bool, count=len(keys))
+        piece, keys = piece[stored], keys[stored]
+
+        # Recorte de cada tramo a su celda (Liang-Barsky); fuera los que no la cruzan
+        x0, y0, xmax, ymax = self._cell_bounds(keys)
+        px, py = ax[piece], ay[piece]
+        vx, vy = bx[piece] - px, by[piece] - py
+        lo, hi = np.zeros(len(piece)), np.ones(len(piece))
+        keep = np.ones(len(piece), dtype=bool)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for p, q in ((-vx, px - x0), (vx, xmax - px), (-vy, py - y0), (vy, ymax - py)):
+                ratio = q / p
+                lo = np.where(p < 0, np.maximum(lo, ratio), lo)
+                hi = np.where(p > 0, np.minimum(hi, ratio), hi)
+                keep &= ~((p == 0) & (q < 0))
+        keep &= lo <= hi
+        piece, keys, lo, hi = piece[keep], keys[keep], lo[keep], hi[keep]
+        sx, sy = ax[piece] + vx[keep] * lo, ay[piece] + vy[keep] * lo
+        ex, ey = ax[piece] + vx[keep] * hi, ay[piece] + vy[keep] * hi
+        # El inicio recortado puede caer justo en el borde de la celda siguiente
+        sx = np.clip(sx, x0[keep], np.nextafter(xmax[keep], x0[keep]))
+        sy = np.clip(sy, y0[keep], np.nextafter(ymax[keep], y0[keep]))
+
+        first: Dict[int, int] = {}
+        order = np.argsort(keys, kind="stable")
+        cell_keys, starts = np.unique(keys[order], return_index=True)
+        for key, idx in zip(cell_keys.tolist(), np.split(order, starts[1:])):
+            for ridx, centre_inside, edges in self._cells[key]:
+                if ridx in first and first[ridx] <= piece[idx[0]]:
+                    continue
+                if not len(edges):
+                    hits = idx
+                else:
+                    chunk = max(1, MAX_PAIRS // len(edges))
+                    hit = np.zeros(len(idx), dtype=bool)
+                    for start in range(0, len(idx), chunk):
+                        part = idx[start:start + chunk]
+                        hit[start:start + chunk] = (
+                            self._inside(sx[part], sy[part], keys[part], centre_inside, edges) |
+                            self._crosses(sx[part], sy[part], ex[part], ey[part], edges))
+                    hits = idx[hit]
+                if len(hits):
+                    first[ridx] = min(first.get(ridx, len(ax)), int(piece[hits].min()))
+        return [self.region_ids[ridx] for ridx, _ in sorted(first.items(), key=lambda item: (item[1], item[0]))]
+
+    def get_stats(self) -> Dict:
+        return {"regions": len(self), "edges": self.edges, "cells": len(self._cells), "cell_deg": self.cell_deg}
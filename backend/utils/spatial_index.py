@@ -0,0 +1,212 @@
+"""
+Grid-bucket spatial index over geographic points, shared by the geocoding
+coverage calculator and the waypoint radius optimizers.
+
+Points are stored as unit vectors on the sphere and bucketed in a 3D grid
+whose cell size is the chord length of the query radius, so every neighbour
+within the radius is in one of the 27 buckets around a query point. Buckets
+are kept as a sorted array of integer keys; queries are vectorized with
+``np.searchsorted`` and work anywhere on the globe (no projection, no
+antimeridian special case). Index distances are spherical; ``geodesic_km``
+gives WGS84 distances (as geopy's ``geodesic``) for many pairs at once.
+"""
+
+import math
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+_WGS84_A = 6378.137
+_WGS84_F = 1 / 298.257223563
+_WGS84_B = (1 - _WGS84_F) * _WGS84_A
+_KEY_BITS = 21
+_KEY_OFFSET = 1 << (_KEY_BITS - 1)
+_KEY_MASK = (1 << _KEY_BITS) - 1
+_NEIGHBOUR_OFFSETS = np.array([(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)],
+                              dtype=np.int64)
+
+
+def to_unit_vectors(lats, lons) -> np.ndarray:
+    """(n, 3) unit vectors of coordinates in degrees"""
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lon = np.radians(np.asarray(lons, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)), axis=-1)
+
+
+def chord_for_km(distance_km: float) -> float:
+    """Chord length on the unit sphere of a great-circle distance"""
+    return 2.0 * math.sin(min(distance_km / EARTH_RADIUS_KM, math.pi) / 2.0)
+
+
+def km_for_chord(chord) -> np.ndarray:
+    """Great-circle distance of chord lengths on the unit sphere"""
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2.0, 0.0, 1.0))
+
+
+def geodesic_km(lats1, lons1, lats2, lons2, max_iterations: int = 200) -> np.ndarray:
+    """
+    WGS84 ellipsoidal distances between point pairs (Vincenty's inverse
+    formula, vectorized). Agrees with geopy's ``geodesic`` to well under a
+    millimetre except for nearly antipodal pairs, where it may not converge.
+    """
+    f = _WGS84_F
+    lat1 = np.radians(np.asarray(lats1, dtype=np.float64))
+    lat2 = np.radians(np.asarray(lats2, dtype=np.float64))
+    big_l = np.radians(np.asarray(lons2, dtype=np.float64) - np.asarray(lons1, dtype=np.float64))
+    u1 = np.arctan((1 - f) * np.tan(lat1))
+    u2 = np.arctan((1 - f) * np.tan(lat2))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+
+    lam = big_l.copy()
+    for _ in range(max_iterations):
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+        cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        sin_alpha = np.divide(cos_u1 * cos_u2 * sin_lam, sin_sigma,
+                              out=np.zeros_like(sin_sigma), where=sin_sigma != 0)
+        cos_sq_alpha = 1 - sin_alpha ** 2
+        # Líneas ecuatoriales: cos²α = 0
+        equatorial = cos_sq_alpha == 0
+        cos_2sigma_m = np.where(equatorial, 0.0, cos_sigma - np.divide(
+            2 * sin_u1 * sin_u2, cos_sq_alpha, out=np.zeros_like(cos_sq_alpha), where=~equatorial))
+        c = f / 16 * cos_sq_alpha * (4 + f * (4 - 3 * cos_sq_alpha))
+        new_lam = big_l + (1 - c) * f * sin_alpha * (
+            sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+        converged = np.all(np.abs(new_lam - lam) <= 1e-12)
+        lam = new_lam
+        if converged:
+            break
+
+    u_sq = cos_sq_alpha * (_WGS84_A ** 2 - _WGS84_B ** 2) / _WGS84_B ** 2
+    big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) -
+        big_b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+    return _WGS84_B * big_a * (sigma - delta_sigma)
+
+
+class GeoPointIndex:
+    """
+    Static index for neighbour queries within ``radius_km``: "is there a
+    point nearby" for many queries at once, the neighbours of one point, and
+    all neighbour pairs (in chunks). Build once per point set and radius;
+    queries may use a smaller radius but not a larger one.
+    """
+
+    def __init__(self, lats, lons, radius_km: float):
+        self.radius_km = float(radius_km)
+        self.chord = chord_for_km(self.radius_km)
+        # Celdas demasiado pequeñas desbordarían las claves de 21 bits por eje
+        self.cell_size = max(self.chord, 2.0 / (_KEY_MASK - 2))
+
+        vectors = to_unit_vectors(lats, lons).reshape(-1, 3)
+        keys = self._keys(self._cells(vectors))
+        order = np.argsort(keys, kind="stable")
+        self.order = order
+        self.vectors = vectors[order]
+        self.keys = keys[order]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _cells(self, vectors: np.ndarray) -> np.ndarray:
+        return np.floor(vectors / self.cell_size).astype(np.int64)
+
+    @staticmethod
+    def _keys(cells: np.ndarray) -> np.ndarray:
+        shifted = (cells + _KEY_OFFSET) & _KEY_MASK
+        return (shifted[..., 0] << (2 * _KEY_BITS)) | (shifted[..., 1] << _KEY_BITS) | shifted[..., 2]
+
+    def _candidate_ranges(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(starts, ends) into the sorted points for the 27 buckets around each query"""
+        cells = self._cells(vectors)
+        keys = self._keys(cells[:, None, :] + _NEIGHBOUR_OFFSETS[None, :, :])
+        return np.searchsorted(self.keys, keys, side="left"), np.searchsorted(self.keys, keys, side="right")
+
+    def any_within(self, lats, lons) -> np.ndarray:
+        """Boolean array: whether each query point has an indexed point within the radius"""
+        queries = to_unit_vectors(lats, lons).reshape(-1, 3)
+        found = np.zeros(len(queries), dtype=bool)
+        if len(self.keys) == 0 or len(queries) == 0:
+            return found
+
+        starts, ends = self._candidate_ranges(queries)
+        counts = ends - starts
+        chord_sq = self.chord * self.chord
+
+        # Recorrer los candidatos por posición dentro de su cubeta; en cada paso
+        # solo siguen activas las consultas que aún no tienen vecino y tienen candidatos
+        step = 0
+        while True:
+            active = (counts > step) & ~found[:, None]
+            if not active.any():
+                break
+            rows, buckets = np.nonzero(active)
+            candidates = self.vectors[starts[rows, buckets] + step]
+            diff = candidates - queries[rows]
+            hit = np.einsum("ij,ij->i", diff, diff) <= chord_sq
+            found[rows[hit]] = True
+            step += 1
+        return found
+
+    def _query_radius_chord(self, radius_km: Optional[float]) -> float:
+        if radius_km is None:
+            return self.chord
+        if radius_km > self.radius_km:
+            raise ValueError(f"Query radius {radius_km} km exceeds index radius {self.radius_km} km")
+        return chord_for_km(radius_km)
+
+    def within(self, lat: float, lon: float, radius_km: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Indexed points within ``radius_km`` of one point.
+
+        Returns (indices, distances_km) with indices into the original point
+        order, sorted ascending.
+        """
+        query = to_unit_vectors([lat], [lon]).reshape(-1, 3)
+        if len(self.keys) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        starts, ends = self._candidate_ranges(query)
+        candidates = np.concatenate([np.arange(a, b) for a, b in zip(starts[0], ends[0]) if b > a] or
+                                    [np.zeros(0, dtype=np.int64)])
+        diff = self.vectors[candidates] - query[0]
+        chord = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+        hit = chord <= self._query_radius_chord(radius_km)
+        indices = self.order[candidates[hit]]
+        order = np.argsort(indices)
+        return indices[order], km_for_chord(chord[hit][order])
+
+    def pairs(self, lats, lons, chunk_size: int = 2048) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        All (query_index, point_index, distance_km) pairs within the radius,
+        yielded in chunks of queries so memory stays bounded for dense sets.
+        Querying the indexed points themselves includes each point paired
+        with itself at distance 0.
+        """
+        queries = to_unit_vectors(lats, lons).reshape(-1, 3)
+        if len(self.keys) == 0:
+            return
+        chord_sq = self.chord * self.chord
+
+        for offset in range(0, len(queries), chunk_size):
+            chunk = queries[offset:offset + chunk_size]
+            starts, ends = self._candidate_ranges(chunk)
+            counts = (ends - starts).ravel()
+            total = int(counts.sum())
+            if total == 0:
+                continue
+
+            # Expandir (consulta, cubeta) a cada candidato sin bucles de Python
+            rows = np.repeat(np.repeat(np.arange(len(chunk)), starts.shape[1]), counts)
+            run_starts = np.repeat(np.cumsum(counts) - counts, counts)
+            candidates = np.repeat(starts.ravel(), counts) + (np.arange(total) - run_starts)
+
+            diff = self.vectors[candidates] - chunk[rows]
+            dist_sq = np.einsum("ij,ij->i", diff, diff)
+            hit = dist_sq <= chord_sq
+            yield rows[hit] + offset, self.order[candidates[hit]], km_for_chord(np.sqrt(dist_sq[hit]))
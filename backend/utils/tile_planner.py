@@ -0,0 +1,209 @@
+"""
+Planificador de teselas por corredor para la descarga de mapas offline.
+
+En lugar de descargar el rectángulo que envuelve el viaje (en una ruta en
+diagonal casi todo es terreno por el que nunca se pasa), se amplía la
+polilínea de la ruta con un ancho de corredor por zoom (amplio en zooms
+bajos, donde importa el contexto, y estrecho en los altos, donde solo
+importa la carretera) y se rasteriza a teselas XYZ.
+
+El cálculo se hace en coordenadas de tesela (Mercator es conforme, así que
+una distancia en metros es un radio en teselas a esa latitud) y es exacto:
+una tesela entra si la distancia entre su cuadrado y algún segmento de la
+ruta es menor o igual que el semiancho del corredor. Antes se eliminan los
+puntos a menos de ``SIMPLIFY_TILES`` del último punto conservado (las trazas
+GPS tienen un punto por segundo) y ese margen se suma al radio, así que el
+corredor nunca es más estrecho que el pedido.
+"""
+import math
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+EARTH_CIRCUMFERENCE_M = 40075016.686
+MAX_MERCATOR_LAT = 85.0511
+
+# Ancho total del corredor (metros) por zoom
+CORRIDOR_WIDTH_M = {
+    8: 40000, 9: 30000, 10: 20000, 11: 12000, 12: 6000,
+    13: 3000, 14: 1500, 15: 800, 16: 500, 17: 300, 18: 200
+}
+
+# Tamaño medio de una tesela ráster (el mismo que usan las estimaciones del router)
+AVG_TILE_KB = 5
+
+# Tolerancia de simplificación de la ruta, en teselas
+SIMPLIFY_TILES = 0.25
+# Longitud máxima de segmento rasterizado de una vez, en teselas (acota la memoria)
+MAX_SEGMENT_TILES = 64
+# Teselas candidatas evaluadas por lote de segmentos
+MAX_CANDIDATES = 1 << 20
+
+TileSet = Set[Tuple[int, int]]
+
+
+def corridor_width_m(z: int) -> float:
+    if z in CORRIDOR_WIDTH_M:
+        return CORRIDOR_WIDTH_M[z]
+    # Fuera de la tabla: el ancho se reduce a la mitad cada dos zooms
+    nearest = min(CORRIDOR_WIDTH_M, key=lambda k: abs(k - z))
+    return CORRIDOR_WIDTH_M[nearest] * 2 ** ((nearest - z) / 2)
+
+
+def route_points(points: Iterable) -> List[Tuple[float, float]]:
+    """(lat, lon) of route points given as dicts with lat and lng/lon, or as pairs"""
+    result = []
+    for point in points:
+        if isinstance(point, dict):
+            lon = point.get("lng", point.get("lon"))
+            lat = point.get("lat")
+        else:
+            lat, lon = point[0], point[1]
+        if lat is None or lon is None:
+            continue
+        result.append((float(lat), float(lon)))
+    return result
+
+
+def to_tile_coords(lat: float, lon: float, z: int) -> Tuple[float, float]:
+    """Fractional XYZ tile coordinates"""
+    lat = max(min(lat, MAX_MERCATOR_LAT), -MAX_MERCATOR_LAT)
+    n = float(1 << z)
+    lat_rad = math.radians(lat)
+    x = (lon + 180.0) / 360.0 * n
+    y = (1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * n
+    return min(max(x, 0.0), n - 1e-9), min(max(y, 0.0), n - 1e-9)
+
+
+def _project(points: Sequence[Tuple[float, float]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Web Mercator coordinates at zoom 0 (multiply by 2^z for tile units) and latitudes"""
+    lat = np.clip(np.array([p[0] for p in points], dtype=np.float64), -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT)
+    lon = np.array([p[1] for p in points], dtype=np.float64)
+    lat_rad = np.radians(lat)
+    x = (lon + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / np.pi) / 2.0
+    return x, y, lat
+
+
+def _segments_tiles(ax, ay, bx, by, r, n: int) -> TileSet:
+    """Tiles whose square is within ``r`` (tile units) of any segment A-B (arrays, one row per segment)"""
+    x0 = np.clip(np.floor(np.minimum(ax, bx) - r), 0, n - 1).astype(np.int64)
+    x1 = np.clip(np.floor(np.maximum(ax, bx) + r), 0, n - 1).astype(np.int64)
+    y0 = np.clip(np.floor(np.minimum(ay, by) - r), 0, n - 1).astype(np.int64)
+    y1 = np.clip(np.floor(np.maximum(ay, by) + r), 0, n - 1).astype(np.int64)
+    w, h = x1 - x0 + 1, y1 - y0 + 1
+    counts = w * h
+
+    tiles: TileSet = set()
+    start = 0
+    while start < len(counts):
+        # Lotes de segmentos con un número acotado de teselas candidatas
+        end = start + max(1, int(np.searchsorted(np.cumsum(counts[start:]), MAX_CANDIDATES, side="right")))
+        seg = np.repeat(np.arange(start, end), counts[start:end])
+        offset = np.arange(len(seg)) - np.repeat(np.cumsum(counts[start:end]) - counts[start:end], counts[start:end])
+        xs = (x0[seg] + offset % w[seg]).astype(np.float64)
+        ys = (y0[seg] + offset // w[seg]).astype(np.float64)
+        sax, say, sbx, sby = ax[seg], ay[seg], bx[seg], by[seg]
+        vx, vy = sbx - sax, sby - say
+        length2 = vx * vx + vy * vy
+        safe_length2 = np.where(length2 > 0, length2, 1.0)
+
+        def point_to_boxes(px, py):
+            dx = np.maximum(np.maximum(xs - px, px - (xs + 1.0)), 0.0)
+            dy = np.maximum(np.maximum(ys - py, py - (ys + 1.0)), 0.0)
+            return np.hypot(dx, dy)
+
+        distance = np.minimum(point_to_boxes(sax, say), point_to_boxes(sbx, sby))
+        # Esquinas de cada tesela contra el segmento
+        for cx, cy in ((xs, ys), (xs + 1.0, ys), (xs, ys + 1.0), (xs + 1.0, ys + 1.0)):
+            t = np.clip(((cx - sax) * vx + (cy - say) * vy) / safe_length2, 0.0, 1.0)
+            distance = np.minimum(distance, np.hypot(cx - (sax + t * vx), cy - (say + t * vy)))
+        # Segmento que atraviesa la tesela (teorema del eje separador)
+        crosses = np.abs(-vy * (xs + 0.5 - sax) + vx * (ys + 0.5 - say)) <= 0.5 * (np.abs(vx) + np.abs(vy))
+        crosses &= (np.maximum(sax, sbx) >= xs) & (np.minimum(sax, sbx) <= xs + 1.0)
+        crosses &= (np.maximum(say, sby) >= ys) & (np.minimum(say, sby) <= ys + 1.0)
+
+        mask = (distance <= r[seg]) | crosses
+        tiles.update(zip(xs[mask].astype(np.int64).tolist(), ys[mask].astype(np.int64).tolist()))
+        start = end
+    return tiles
+
+
+def corridor_tiles(points: Sequence[Tuple[float, float]], z: int,
+                   width_m: Optional[float] = None) -> TileSet:
+    """Tiles at zoom ``z`` covering a corridor of ``width_m`` around the route"""
+    if not points:
+        return set()
+    half_width = (width_m if width_m is not None else corridor_width_m(z)) / 2.0
+    n = 1 << z
+    x, y, lat = _project(points)
+    x = np.clip(x * n, 0.0, n - 1e-9)
+    y = np.clip(y * n, 0.0, n - 1e-9)
+
+    # Simplificación: fuera los puntos pegados al último conservado (el último siempre se queda)
+    xl, yl = x.tolist(), y.tolist()
+    kept = [0]
+    kx, ky = xl[0], yl[0]
+    for i in range(1, len(xl)):
+        if math.hypot(xl[i] - kx, yl[i] - ky) >= SIMPLIFY_TILES or i == len(xl) - 1:
+            kept.append(i)
+            kx, ky = xl[i], yl[i]
+    if len(kept) == 1:
+        kept.append(0)
+    kept = np.array(kept)
+    ax, ay, bx, by = x[kept[:-1]], y[kept[:-1]], x[kept[1:]], y[kept[1:]]
+    # Radio con la latitud más alejada del ecuador del segmento (la escala mayor)
+    seg_lat = np.minimum(np.maximum(np.abs(lat[kept[:-1]]), np.abs(lat[kept[1:]])), MAX_MERCATOR_LAT)
+    tile_m = EARTH_CIRCUMFERENCE_M * np.cos(np.radians(seg_lat)) / n
+    r = half_width / tile_m + SIMPLIFY_TILES
+
+    # Trocear los segmentos largos (rutas planificadas: pocos puntos muy separados)
+    pieces = np.maximum(1, np.ceil(np.hypot(bx - ax, by - ay) / MAX_SEGMENT_TILES)).astype(np.int64)
+    seg = np.repeat(np.arange(len(ax)), pieces)
+    k = np.arange(len(seg)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    t0, t1 = k / pieces[seg], (k + 1) / pieces[seg]
+    dx, dy = (bx - ax)[seg], (by - ay)[seg]
+    return _segments_tiles(ax[seg] + dx * t0, ay[seg] + dy * t0, ax[seg] + dx * t1, ay[seg] + dy * t1, r[seg], n)
+
+
+def plan_corridor(points: Sequence[Tuple[float, float]], zoom_levels: Iterable[int]) -> Dict[int, TileSet]:
+    return {z: corridor_tiles(points, z) for z in sorted(set(zoom_levels))}
+
+
+def bbox_tile_count(points: Sequence[Tuple[float, float]], z: int) -> int:
+    """Tiles of the rectangle around the route (what a bounding-box download would fetch)"""
+    if not points:
+        return 0
+    n = 1 << z
+    x, y, _ = _project(points)
+    x = np.clip(x * n, 0, n - 1e-9).astype(np.int64)
+    y = np.clip(y * n, 0, n - 1e-9).astype(np.int64)
+    return int((x.max() - x.min() + 1) * (y.max() - y.min() + 1))
+
+
+def plan_summary(points: Sequence[Tuple[float, float]], plan: Dict[int, TileSet],
+                 stored: Optional[Dict[int, TileSet]] = None) -> Dict:
+    """Per-zoom counts and size estimates of a corridor plan (``stored``: tiles already available)"""
+    stored = stored or {}
+    zooms = {}
+    for z, tiles in plan.items():
+        in_store = len(tiles & stored[z]) if z in stored else 0
+        zooms[str(z)] = {
+            "corridor_width_m": corridor_width_m(z),
+            "tiles": len(tiles),
+            "in_store": in_store,
+            "to_download": len(tiles) - in_store,
+            "bbox_tiles": bbox_tile_count(points, z),
+            "estimated_mb": round((len(tiles) - in_store) * AVG_TILE_KB / 1024, 2)
+        }
+    total = sum(zoom["tiles"] for zoom in zooms.values())
+    to_download = sum(zoom["to_download"] for zoom in zooms.values())
+    bbox_total = sum(zoom["bbox_tiles"] for zoom in zooms.values())
+    return {
+        "zoom_levels": zooms,
+        "total_tiles": total,
+        "in_store": total - to_download,
+        "to_download": to_download,
+        "bbox_tiles": bbox_total,
+        "estimated_size_mb": round(to_download * AVG_TILE_KB / 1024, 2)
+    }
@@ -0,0 +1,228 @@
+"""
+Proxy de teselas de mapa para /api/offline-maps/tile/{trip_id}/{z}/{x}/{y}.
+
+Las teselas que no están en local se piden al servidor de origen con una
+sesión aiohttp compartida (keep-alive) sin bloquear el event loop, y las
+peticiones simultáneas de la misma tesela se agrupan en una sola descarga.
+
+Todas las teselas descargadas van a un almacén compartido por todos los
+viajes y direccionado por contenido: cada tesela se guarda una sola vez
+como ``objects/<aa>/<sha256>`` (el mar o las zonas vacías son la misma
+imagen en miles de coordenadas) y un índice SQLite relaciona
+(origen, z, x, y) con su hash. Los objetos se escriben en un temporal y se
+renombran, así que un corte de luz nunca deja una tesela a medias.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from typing import Dict, Optional, Set, Tuple
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TILE_URL = "https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png"
+TILE_USER_AGENT = "DashCam Offline Map Downloader/1.0 (https://dashcam.app)"
+
+MAX_ZOOM = 22
+
+# (digest, bytes) de una tesela
+StoredTile = Tuple[str, bytes]
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)
+
+
+def source_id(url_template: str) -> str:
+    """Short id of a tile source, so that different styles never share index entries"""
+    return hashlib.sha1(url_template.encode()).hexdigest()[:12]
+
+
+class ContentAddressedTileStore:
+    """Tiles shared by every trip: blobs named by SHA-256 plus a (source, z, x, y) index"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(root, "index.db"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS tiles (
+                source TEXT NOT NULL,
+                z INTEGER NOT NULL,
+                x INTEGER NOT NULL,
+                y INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                PRIMARY KEY (source, z, x, y)
+            ) WITHOUT ROWID
+        """)
+        self._conn.commit()
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def get(self, source: str, z: int, x: int, y: int) -> Optional[StoredTile]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT digest FROM tiles WHERE source = ? AND z = ? AND x = ? AND y = ?",
+                (source, z, x, y)
+            ).fetchone()
+        if row is None:
+            return None
+        try:
+            with open(self._object_path(row[0]), "rb") as f:
+                return row[0], f.read()
+        except OSError:
+            # Objeto perdido (borrado a mano): se tratará como no descargada
+            logger.warning(f"Missing tile object {row[0]} for {z}/{x}/{y}")
+            return None
+
+    def put(self, source: str, z: int, x: int, y: int, data: bytes) -> str:
+        """Store a tile (atomic write, deduplicated by content); returns its digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+                raise
+        # El índice se actualiza después del objeto: nunca apunta a un archivo inexistente
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tiles (source, z, x, y, digest) VALUES (?, ?, ?, ?, ?)",
+                (source, z, x, y, digest)
+            )
+            self._conn.commit()
+        return digest
+
+    def existing_tiles(self, source: str, z: int) -> Set[Tuple[int, int]]:
+        """(x, y) of the tiles of ``source`` already stored at zoom ``z``"""
+        with self._lock:
+            return set(self._conn.execute("SELECT x, y FROM tiles WHERE source = ? AND z = ?", (source, z)))
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            tiles, objects = self._conn.execute("SELECT COUNT(*), COUNT(DISTINCT digest) FROM tiles").fetchone()
+        return {"indexed_tiles": tiles, "unique_objects": objects}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TileProxy:
+    """
+    Serves tiles from the shared store, fetching misses from the upstream
+    server (unless ``offline_only``). Meant to be used from one event loop.
+    """
+
+    def __init__(self, store: ContentAddressedTileStore, url_template: str = DEFAULT_TILE_URL,
+                 offline_only: bool = False, user_agent: str = TILE_USER_AGENT,
+                 max_connections: int = 8, timeout: float = 15.0, subdomains: str = "abc"):
+        self.store = store
+        self.url_template = url_template
+        self.source = source_id(url_template)
+        self.offline_only = offline_only
+        self.user_agent = user_agent
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.subdomains = subdomains or "a"
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._inflight: Dict[Tuple[int, int, int], asyncio.Future] = {}
+        self.stats = {
+            "store_hits": 0,
+            "upstream_fetches": 0,
+            "upstream_errors": 0,
+            "upstream_not_found": 0,
+            "coalesced": 0,
+            "offline_misses": 0
+        }
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers={"User-Agent": self.user_agent, "Accept": "image/png,image/*;q=0.9,*/*;q=0.8"},
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.max_connections)
+            )
+        return self._session
+
+    def tile_url(self, z: int, x: int, y: int) -> str:
+        subdomain = self.subdomains[(x + y) % len(self.subdomains)]
+        return self.url_template.format(s=subdomain, z=z, x=x, y=y)
+
+    async def get_tile(self, z: int, x: int, y: int) -> Optional[StoredTile]:
+        """(digest, bytes) of the tile, or None when it is not available"""
+        stored = await asyncio.to_thread(self.store.get, self.source, z, x, y)
+        if stored is not None:
+            self.stats["store_hits"] += 1
+            return stored
+        if self.offline_only:
+            self.stats["offline_misses"] += 1
+            return None
+
+        key = (z, x, y)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(z, x, y))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.stats["coalesced"] += 1
+        # shield: si un cliente cancela, la descarga sigue para los demás
+        return await asyncio.shield(task)
+
+    async def _fetch(self, z: int, x: int, y: int) -> Optional[StoredTile]:
+        url = self.tile_url(z, x, y)
+        self.stats["upstream_fetches"] += 1
+        try:
+            async with self._get_session().get(url) as response:
+                if response.status == 404:
+                    self.stats["upstream_not_found"] += 1
+                    return None
+                if response.status != 200:
+                    self.stats["upstream_errors"] += 1
+                    logger.warning(f"Tile server returned {response.status} for {url}")
+                    return None
+                data = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.stats["upstream_errors"] += 1
+            logger.warning(f"Error fetching tile {url}: {e}")
+            return None
+
+        try:
+            digest = await asyncio.to_thread(self.store.put, self.source, z, x, y, data)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Could not store tile {z}/{x}/{y}: {e}")
+            digest = hashlib.sha256(data).hexdigest()
+        return digest, data
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            "offline_only": self.offline_only,
+            "inflight": len(self._inflight),
+            "source": self.url_template
+        }
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
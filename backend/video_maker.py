@@ -19,6 +19,39 @@ except ImportError:
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Per-day folder holding the summary intermediates (<date_dir>/.summary_cache)
+SUMMARY_CACHE_DIR = '.summary_cache'
+
+def prune_summary_cache(date_dir):
+    """
+    Drop the summary intermediates of clips that no longer exist in date_dir,
+    and the cache folder itself once it is empty. Returns the files removed.
+    """
+    cache_dir = os.path.join(date_dir, SUMMARY_CACHE_DIR)
+    if not os.path.isdir(cache_dir):
+        return 0
+    
+    removed = 0
+    for entry in os.listdir(cache_dir):
+        if not entry.endswith('.mkv'):
+            continue
+        # <clip>.<size>-<mtime>.<mode>-<fps>.mkv
+        clip = entry.split('.', 1)[0] + '.mp4'
+        if os.path.exists(os.path.join(date_dir, clip)):
+            continue
+        try:
+            os.remove(os.path.join(cache_dir, entry))
+            removed += 1
+        except OSError as e:
+            logger.debug(f"Could not remove summary intermediate {entry}: {str(e)}")
+    
+    try:
+        if not os.listdir(cache_dir):
+            os.rmdir(cache_dir)
+    except OSError:
+        pass
+    return removed
+
 class VideoMaker:
     def __init__(self, data_path=None):
         # Base directory for video data - prioritize parameter, then config, then fallback
@@ -49,6 +82,10 @@ class VideoMaker:
         self.active_processes = []
         self._process_lock = asyncio.Lock()
         
+        # Daily summary pipeline: parallel per-clip frame extraction
+        self.max_summary_workers = max(1, min(4, (os.cpu_count() or 2) // 2))
+        self.summary_status = {}
+        
         # Check for ffmpeg availability
         self._check_ffmpeg()
         
@@ -66,20 +103,133 @@ class VideoMaker:
         except Exception as e:
             logger.error(f"Error checking ffmpeg: {str(e)}")
             
-    async def create_daily_summary(self, target_date):
-        """Create a summary video for the given date"""
+    def _find_day_videos(self, date_str, camera='road'):
+        """
+        Locate the folder and clips recorded on a date.
+        
+        The recorder writes HH-MM-SS_seqNNN_XX_<camera>.mp4 under videos/<date>;
+        older recordings used HH-MM-<camera>.mp4 directly under <date>.
+        """
+        candidates = [
+            os.path.join(self.base_data_dir, 'videos', date_str),
+            os.path.join(self.base_data_dir, date_str)
+        ]
+        for date_dir in candidates:
+            videos = sorted(
+                glob.glob(os.path.join(date_dir, f'*_{camera}.mp4')) +
+                glob.glob(os.path.join(date_dir, f'*-{camera}.mp4'))
+            )
+            if videos:
+                return date_dir, videos
+        
+        existing = next((d for d in candidates if os.path.isdir(d)), candidates[0])
+        return existing, []
+    
+    async def _run_ffmpeg(self, cmd):
+        """Run an ffmpeg command, tracking the process for cleanup. Returns (returncode, stderr)"""
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        
+        async with self._process_lock:
+            self.active_processes.append(process)
+        
+        try:
+            _, stderr = await process.communicate()
+        finally:
+            async with self._process_lock:
+                if process in self.active_processes:
+                    self.active_processes.remove(process)
+        
+        return process.returncode, stderr.decode(errors='replace')
+    
+    def _summary_cache_path(self, cache_dir, video, sample_fps, mode):
+        """Cache file for a clip's intermediate; the name changes if the clip or settings change"""
+        stat_info = os.stat(video)
+        name = os.path.splitext(os.path.basename(video))[0]
+        return os.path.join(
+            cache_dir,
+            f"{name}.{stat_info.st_size:x}-{stat_info.st_mtime_ns:x}.{mode}-{sample_fps:g}.mkv"
+        )
+    
+    async def _extract_clip_frames(self, video, cache_file, sample_fps, mode):
+        """
+        Decode one clip and keep only the frames that end up in the timelapse,
+        stored as a cheap MJPEG intermediate at the output resolution.
+        """
+        cmd = [self.ffmpeg_path]
+        if mode == 'keyframes':
+            # Decodificar solo los keyframes es mucho más rápido en la Pi
+            cmd.extend(['-skip_frame', 'nokey'])
+        cmd.extend([
+            '-i', video,
+            '-an',
+            '-vf', f'fps={sample_fps:g},scale={self.default_width}:{self.default_height}',
+            '-c:v', 'mjpeg',
+            '-q:v', '3',
+            '-y', cache_file + '.part.mkv'
+        ])
+        
+        returncode, stderr = await self._run_ffmpeg(cmd)
+        if returncode != 0:
+            if os.path.exists(cache_file + '.part.mkv'):
+                os.remove(cache_file + '.part.mkv')
+            logger.error(f"Error extracting frames from {video}: {stderr[-500:]}")
+            return False
+        
+        os.replace(cache_file + '.part.mkv', cache_file)
+        return True
+    
+    def get_summary_status(self, date_str):
+        """Progress of the last summary generation for a date"""
+        return self.summary_status.get(date_str)
+    
+    async def create_daily_summary(self, target_date, speed_factor=10, mode='decimate', progress_callback=None):
+        """
+        Create a summary video for the given date.
+        
+        Each road clip is reduced in parallel (bounded by max_summary_workers) to
+        the frames the timelapse keeps, and cached next to the clips. The day is
+        then encoded once from those intermediates, so regenerating a day after
+        a new clip is recorded only decodes the new clip.
+        """
+        date_str = target_date.strftime("%Y-%m-%d")
+        status = {
+            "date": date_str,
+            "status": "preparing",
+            "progress": 0,
+            "total_clips": 0,
+            "processed_clips": 0,
+            "cached_clips": 0,
+            "failed_clips": 0,
+            "output_file": None,
+            "error": None
+        }
+        self.summary_status[date_str] = status
+        
+        def report(**changes):
+            status.update(changes)
+            if progress_callback:
+                try:
+                    progress_callback(dict(status))
+                except Exception as e:
+                    logger.debug(f"Error in summary progress callback: {str(e)}")
+        
         try:
-            date_str = target_date.strftime("%Y-%m-%d")
             logger.info(f"Starting to create summary video for {date_str}")
             
-            # Output directory is the date folder
-            output_dir = os.path.join(self.base_data_dir, date_str)
+            output_dir, road_videos = self._find_day_videos(date_str)
+            
+            # Check if we have any videos to process
+            if not road_videos:
+                # The day's clips are gone: so are the intermediates built from them
+                prune_summary_cache(output_dir)
+                logger.warning(f"No road videos found for date {date_str}, cannot create summary")
+                report(status="error", error="No road videos found")
+                return None
             
-            # Create output directory if it doesn't exist
-            if not os.path.exists(output_dir):
-                logger.warning(f"No directory found for date {date_str}, creating it")
-                os.makedirs(output_dir)
-                
             # Output file path
             output_file = os.path.join(output_dir, 'summary.mp4')
             
@@ -87,63 +237,101 @@ class VideoMaker:
             if os.path.exists(output_file):
                 timestamp = datetime.now().strftime("%H%M%S")
                 output_file = os.path.join(output_dir, f'summary-{timestamp}.mp4')
-                
-            # Find all video files for this date
-            road_videos = sorted(glob.glob(os.path.join(output_dir, '*-road.mp4')))
-            interior_videos = sorted(glob.glob(os.path.join(output_dir, '*-interior.mp4')))
             
-            # Check if we have any videos to process
-            if not road_videos and not interior_videos:
-                logger.warning(f"No videos found for date {date_str}")
+            # Frames kept per second of footage: output framerate / speed-up
+            sample_fps = self.default_framerate / speed_factor
+            cache_dir = os.path.join(output_dir, SUMMARY_CACHE_DIR)
+            os.makedirs(cache_dir, exist_ok=True)
+            
+            cache_files = [self._summary_cache_path(cache_dir, v, sample_fps, mode) for v in road_videos]
+            pending = [(v, c) for v, c in zip(road_videos, cache_files) if not os.path.exists(c)]
+            cached = len(road_videos) - len(pending)
+            
+            report(status="extracting", total_clips=len(road_videos),
+                   cached_clips=cached, processed_clips=cached,
+                   progress=int(cached * 80 / len(road_videos)))
+            
+            # Extract frames from new clips in parallel
+            semaphore = asyncio.Semaphore(self.max_summary_workers)
+            
+            async def extract(video, cache_file):
+                async with semaphore:
+                    ok = await self._extract_clip_frames(video, cache_file, sample_fps, mode)
+                if not ok:
+                    status["failed_clips"] += 1
+                processed = status["processed_clips"] + 1
+                report(processed_clips=processed, progress=int(processed * 80 / len(road_videos)))
+                return ok
+            
+            await asyncio.gather(*(extract(v, c) for v, c in pending))
+            
+            # Drop intermediates of clips that were deleted or re-recorded
+            current = set(cache_files)
+            for stale in glob.glob(os.path.join(cache_dir, '*.mkv')):
+                if stale not in current:
+                    os.remove(stale)
+            
+            ready = [c for c in cache_files if os.path.exists(c)]
+            if not ready:
+                report(status="error", error="Frame extraction failed for every clip")
                 return None
-                
-            # Create a time-lapse from the road videos
-            if road_videos:
-                # Create a temporary file list for ffmpeg
-                file_list_path = os.path.join(output_dir, 'filelist.txt')
-                with open(file_list_path, 'w') as f:
-                    for video in road_videos:
-                        f.write(f"file '{video}'\n")
-                
-                # Choose a random background music file if available
-                music_files = glob.glob(os.path.join(self.music_dir, '*.mp3'))
-                music_file = random.choice(music_files) if music_files else None
-                
-                # Create the summary video
-                await self._create_summary_video(file_list_path, output_file, music_file)
-                
-                # Clean up the temporary file list
-                os.remove(file_list_path)
-                
-                logger.info(f"Created summary video: {output_file}")
-                return output_file
-            else:
-                logger.warning("No road videos found, cannot create summary")
+            
+            # Create a temporary file list for ffmpeg
+            file_list_path = os.path.join(cache_dir, 'filelist.txt')
+            with open(file_list_path, 'w') as f:
+                for intermediate in ready:
+                    f.write(f"file '{intermediate}'\n")
+            
+            # Choose a random background music file if available
+            music_files = glob.glob(os.path.join(self.music_dir, '*.mp3'))
+            music_file = random.choice(music_files) if music_files else None
+            
+            report(status="encoding", progress=80)
+            success = await self._create_summary_video(file_list_path, output_file, music_file)
+            os.remove(file_list_path)
+            
+            if not success:
+                report(status="error", error="Summary encoding failed")
                 return None
+            
+            logger.info(f"Created summary video: {output_file}")
+            report(status="completed", progress=100, output_file=output_file)
+            return output_file
                 
         except Exception as e:
             logger.error(f"Error creating daily summary: {str(e)}")
+            report(status="error", error=str(e))
             return None
             
-    async def _create_summary_video(self, file_list, output_file, music_file=None, speed_factor=10):
-        """Create a summary video from the file list with optional music"""
+    async def _create_summary_video(self, file_list, output_file, music_file=None):
+        """Encode the concatenated per-clip intermediates once, with optional music"""
         try:
-            # Base ffmpeg command for concatenating videos and speeding them up
             cmd = [
                 self.ffmpeg_path,
                 '-f', 'concat',
                 '-safe', '0',
-                '-i', file_list,
-                '-c:v', 'libx264',
-                '-preset', 'medium',
-                '-b:v', self.default_bitrate,
-                '-filter_complex', f'setpts=PTS/{speed_factor}'  # Speed up video
+                '-i', file_list
             ]
             
-            # Add music if specified
-            if music_file and os.path.exists(music_file):
+            has_music = music_file and os.path.exists(music_file)
+            if has_music:
+                cmd.extend(['-i', music_file])
+            
+            # Intermediates already hold only the timelapse frames: retime them to
+            # play back-to-back at the output framerate
+            cmd.extend([
+                '-vf', f'setpts=N/({self.default_framerate}*TB)',
+                '-r', str(self.default_framerate),
+                '-c:v', 'libx264',
+                '-preset', 'veryfast',
+                '-pix_fmt', 'yuv420p',
+                '-b:v', self.default_bitrate
+            ])
+            
+            if has_music:
                 cmd.extend([
-                    '-i', music_file,
+                    '-map', '0:v',
+                    '-map', '1:a',
                     '-c:a', 'aac',
                     '-b:a', '192k',
                     '-shortest'  # End when video or audio ends, whichever is shorter
@@ -155,34 +343,14 @@ class VideoMaker:
             # Output file
             cmd.extend(['-y', output_file])
             
-            # Run ffmpeg command asynchronously
             logger.info(f"Running ffmpeg command: {' '.join(cmd)}")
+            returncode, stderr = await self._run_ffmpeg(cmd)
             
-            # Create subprocess
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            # Track the process for cleanup
-            async with self._process_lock:
-                self.active_processes.append(process)
-            
-            try:
-                # Wait for the process to complete
-                stdout, stderr = await process.communicate()
-            finally:
-                # Remove from tracking once completed
-                async with self._process_lock:
-                    if process in self.active_processes:
-                        self.active_processes.remove(process)
-            
-            if process.returncode == 0:
+            if returncode == 0:
                 logger.info(f"Successfully created summary video: {output_file}")
                 return True
             else:
-                logger.error(f"Error creating summary video: {stderr.decode()}")
+                logger.error(f"Error creating summary video: {stderr}")
                 return False
                 
         except Exception as e:
@@ -192,15 +360,8 @@ class VideoMaker:
     async def create_timelapse(self, date_str, output_file, interval_frames=10):
         """Create a time-lapse by selecting frames at intervals"""
         try:
-            # Directory for this date
-            date_dir = os.path.join(self.base_data_dir, date_str)
-            
-            if not os.path.exists(date_dir):
-                logger.error(f"No directory found for date {date_str}")
-                return None
-                
-            # Find all road videos
-            road_videos = sorted(glob.glob(os.path.join(date_dir, '*-road.mp4')))
+            # Directory and road videos for this date
+            date_dir, road_videos = self._find_day_videos(date_str)
             
             if not road_videos:
                 logger.warning(f"No road videos found for date {date_str}")
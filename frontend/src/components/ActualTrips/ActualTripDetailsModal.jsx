@@ -127,8 +127,11 @@ const ActualTripDetailsModal = ({ opened, onClose, trip, plannedTripId }) => {
     if (clip.road_video_file) {
       // Create download link
       const link = document.createElement('a');
-      link.href = `/api/videos/${clip.road_video_file}`;
-      link.download = clip.road_video_file;
+      // Los clips archivados ya llegan con su URL (/api/videos/archive/...)
+      link.href = clip.road_video_file.startsWith('/api/videos/')
+        ? clip.road_video_file
+        : `/api/videos/${clip.road_video_file}`;
+      link.download = clip.road_video_file.split('/').pop();
       document.body.appendChild(link);
       link.click();
       document.body.removeChild(link);
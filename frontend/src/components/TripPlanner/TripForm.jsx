@@ -7,6 +7,7 @@ import axios from 'axios';
 // Importamos el nuevo componente y servicio
 import KmlPreview from './KmlPreview';
 import { uploadKmlFile } from '../../services/kmlService';
+import organicMapManager from '../../services/organicMapService';
 
 const TripForm = ({ initialData, onSubmit, onCancel, hideHeader = false }) => {
   const [tripName, setTripName] = useState('');
@@ -36,6 +37,8 @@ const TripForm = ({ initialData, onSubmit, onCancel, hideHeader = false }) => {
   const [lastSearchType, setLastSearchType] = useState(null);
   const [originName, setOriginName] = useState('');
   const [destinationName, setDestinationName] = useState('');
+  // Regiones MWM que cruza la ruta (null si no se conocen los bordes)
+  const [routeRegions, setRouteRegions] = useState(null);
 
   useEffect(() => {
     // If there's initial data (editing mode), populate the form
@@ -71,6 +74,40 @@ const TripForm = ({ initialData, onSubmit, onCancel, hideHeader = false }) => {
     }
   }, [initialData]);
 
+  // Al cambiar origen, destino o waypoints, recalcular las regiones de mapas offline
+  // (índice de bordes local: barato, pero se espera a que el usuario deje de teclear)
+  useEffect(() => {
+    const coordinates = [
+      [startLat, startLon],
+      ...waypoints.map(wp => [wp.lat, wp.lon]),
+      [endLat, endLon]
+    ]
+      .map(([lat, lon]) => [parseFloat(lat), parseFloat(lon)])
+      .filter(([lat, lon]) => Number.isFinite(lat) && Number.isFinite(lon));
+
+    if (coordinates.length === 0) {
+      setRouteRegions(null);
+      return undefined;
+    }
+
+    let cancelled = false;
+    const timer = setTimeout(() => {
+      organicMapManager.getRouteRegions(coordinates)
+        .then(regions => {
+          if (!cancelled) setRouteRegions(regions);
+        })
+        .catch(error => {
+          console.warn('Could not identify route regions:', error);
+          if (!cancelled) setRouteRegions(null);
+        });
+    }, 400);
+
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [startLat, startLon, endLat, endLon, waypoints]);
+
   const handleSubmit = (e) => {
     e.preventDefault();
     
@@ -687,6 +724,19 @@ const TripForm = ({ initialData, onSubmit, onCancel, hideHeader = false }) => {
             </div>
           </div>
 
+          {/* Offline map regions crossed by the route */}
+          {routeRegions && routeRegions.length > 0 && (
+            <div className="mb-4 text-sm text-gray-600">
+              Mapas offline de la ruta:{' '}
+              {routeRegions.map((region, index) => (
+                <span key={region.id} className={region.downloaded ? 'text-green-700' : 'text-gray-700'}>
+                  {index > 0 && ', '}
+                  {region.name}{region.downloaded ? ' ✓' : region.size_mb ? ` (${region.size_mb} MB)` : ''}
+                </span>
+              ))}
+            </div>
+          )}
+
           {/* Existing Waypoints List */}
           {waypoints.length > 0 && (
             <div className="space-y-3 mb-4 max-h-60 overflow-y-auto">
@@ -327,7 +327,9 @@ class OfflineMapManager {
             east,
             west
           },
-          zoom_levels: zoomLevels
+          zoom_levels: zoomLevels,
+          // El backend descarga solo el corredor alrededor de la ruta
+          route: coordinates
         })
       });
       
@@ -177,6 +177,31 @@ class OrganicMapManager {
     }
   }
   
+  /**
+   * MWM regions crossed by a route (region border index, fast enough for every waypoint edit)
+   * @param {Array<Array<number>>} coordinates - Route as [[lat, lon], ...]
+   * @returns {Promise<Array|null>} - Regions in route order, or null if the borders are not available
+   */
+  async getRouteRegions(coordinates) {
+    const response = await fetch(`${this.ORGANIC_MAPS_API}/route-regions`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json'
+      },
+      body: JSON.stringify({ coordinates })
+    });
+
+    if (response.status === 503) {
+      return null;
+    }
+    if (!response.ok) {
+      throw new Error(`Error identificando regiones: ${await response.text()}`);
+    }
+
+    const data = await response.json();
+    return data.regions || [];
+  }
+
   /**
    * Download MWM files for a trip (covers all regions along the trip)
    * @param {Object} trip - Trip object with route information